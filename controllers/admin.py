@@ -700,6 +700,44 @@ def ticket():
             "layer": e.layer,
             }
 
+# =============================================================================
+# SQL profiler
+# =============================================================================
+@auth.s3_requires_membership(1)
+def sql_profile():
+    """
+        View the rolling slow query log and the SQL profiles of the
+        most recent requests (requires settings.log.sql_profile)
+    """
+
+    from s3log import S3SQLProfiler
+
+    if not settings.get_log_sql_profile():
+        session.error = T("SQL profiler not enabled")
+        redirect(URL(f="index"))
+
+    # Clearing the logs requires a POST with form key
+    form = FORM(INPUT(_type = "submit",
+                      _value = T("Clear"),
+                      _class = "action-btn",
+                      ))
+    if form.accepts(request.post_vars, session, formname="sql_profile_clear"):
+        S3SQLProfiler.slow_queries.clear()
+        S3SQLProfiler.recent.clear()
+        redirect(URL(vars={}))
+
+    current_profile = current.sql_profile
+    profiles = [profile.html()
+                for profile in reversed(S3SQLProfiler.recent)
+                if profile is not current_profile
+                ]
+
+    response.title = T("SQL Profile")
+    return {"form": form,
+            "slow_queries": S3SQLProfiler.slow_html(),
+            "profiles": profiles,
+            }
+
 # =============================================================================
 # Create portable app
 # =============================================================================
@@ -8,6 +8,7 @@ if not settings.has_module(module):
 
 ClimateDataPortal = local_import("ClimateDataPortal")
 SampleTable = ClimateDataPortal.SampleTable
+open_cached_file = ClimateDataPortal.open_cached_file
 DSL = local_import("ClimateDataPortal.DSL")
 
 def _map_plugin(**client_config):
@@ -122,7 +123,7 @@ def climate_overlay_data():
             }))
         else:
             return response.stream(
-                open(data_path, "rb"),
+                open_cached_file(data_path),
                 chunk_size=4096
             )
 
@@ -155,7 +156,7 @@ def climate_csv_location_data():
         data_path = _map_plugin().get_csv_location_data(**arguments)
         # only DSL exception types should be raised here
         return response.stream(
-            open(data_path, "rb"),
+            open_cached_file(data_path),
             chunk_size=4096
         )
 
@@ -164,7 +165,7 @@ def climate_chart():
     import gluon.contenttype
     data_image_file_path = _climate_chart(gluon.contenttype.contenttype(".png"))
     return response.stream(
-        open(data_image_file_path, "rb"),
+        open_cached_file(data_image_file_path),
         chunk_size=4096
     )
 
@@ -222,7 +223,7 @@ def climate_chart_download():
         os.path.basename(data_image_file_path)
     )
     return response.stream(
-        open(data_image_file_path, "rb"),
+        open_cached_file(data_image_file_path),
         chunk_size=4096
     )
 
@@ -280,7 +281,7 @@ def places():
         datetime.now() + timedelta(days = 7)
     ).strftime("%a, %d %b %Y %H:%M:%S GMT") # not GMT, but can't find a way
     return response.stream(
-        open(_map_plugin().place_data(), "rb"),
+        open_cached_file(_map_plugin().place_data()),
         chunk_size=4096
     )
 
@@ -390,7 +391,7 @@ def request_image():
     )
     vars = request.vars
     return response.stream(
-        open(
+        open_cached_file(
             _map_plugin().printable_map_image_file(
                 command = (
                     request.env.applications_parent + "/applications/" +
@@ -406,8 +407,7 @@ def request_image():
                 query_string = request.env.query_string,
                 width = int(vars["width"]),
                 height = int(vars["height"])
-            ),
-            "rb"
+            )
         ),
         chunk_size=4096
     )
@@ -466,7 +466,7 @@ def get_years():
         datetime.now() + timedelta(days = 7)
     ).strftime("%a, %d %b %Y %H:%M:%S GMT") # not GMT, but can't find a way
     return response.stream(
-        open(_map_plugin().get_available_years(request.vars["dataset_name"]), "rb"),
+        open_cached_file(_map_plugin().get_available_years(request.vars["dataset_name"])),
         chunk_size=4096
     )
 
@@ -39,6 +39,38 @@ def download():
 
     return response.download(request, db)
 
+# =============================================================================
+def export_job():
+    """
+        Status page of a background export job (see S3ExportJob)
+            - default/export_job/<uuid>             status page
+            - default/export_job/<uuid>.json        status as JSON
+            - default/export_job/<uuid>/download    download the file
+    """
+
+    try:
+        job_uuid = request.args[0]
+    except IndexError:
+        raise HTTP(400, "No job specified")
+
+    job = s3base.S3ExportJob(job_uuid)
+    if len(request.args) > 1 and request.args[1] == "download":
+        return job.download()
+
+    status = job.status()
+    if request.extension == "json":
+        response.headers["Content-Type"] = "application/json"
+        return json.dumps(status)
+
+    if status["status"] in ("QUEUED", "RUNNING"):
+        # Reload the page until the job is completed
+        response.headers["Refresh"] = "5"
+
+    response.title = T("Export")
+    return {"title": T("Export"),
+            "status": status,
+            }
+
 # =============================================================================
 def register_validation(form):
     """ Validate the fields in registration form """
@@ -706,6 +706,23 @@ def ldata():
     else:
         translate = settings.get_L10n_translate_gis_location()
 
+    if settings.get_gis_location_bundles():
+        # Serve from the prebuilt location hierarchy bundle
+        bundle = s3base.S3LocationBundle.lookup(location_id)
+        version = bundle.version if bundle else None
+        if version:
+            etag = '"%s-%s"' % (version, language if translate else "")
+            if request.env.http_if_none_match == etag:
+                raise HTTP(304)
+            location_dict = bundle.ldata(int(location_id),
+                                         output_level,
+                                         language if translate else None,
+                                         )
+            if location_dict is not None:
+                response.headers["ETag"] = etag
+                response.headers["Cache-Control"] = "private, max-age=0, must-revalidate"
+                return json.dumps(location_dict, separators=SEPARATORS)
+
     table = s3db.gis_location
     query = (table.deleted == False) & \
             (table.end_date == None) & \
@@ -824,6 +841,55 @@ def ldata():
 
     return json.dumps(location_dict, separators=SEPARATORS)
 
+# -----------------------------------------------------------------------------
+def lbundle():
+    """
+        Return the prebuilt location hierarchy bundle (gzipped JSON) for
+        a country, to allow clients to cache the whole hierarchy:
+            GET '/eden/gis/lbundle/' + L0 id [+ '?v=' + version]
+            GET '/eden/gis/lbundle/countries' [+ '?v=' + version]
+
+        Versioned requests can be cached indefinitely, as the version
+        changes whenever the bundle contents change.
+    """
+
+    if not settings.get_gis_location_bundles():
+        raise HTTP(404)
+
+    try:
+        name = request.args[0]
+    except IndexError:
+        raise HTTP(400)
+
+    if name == s3base.S3LocationBundle.COUNTRIES:
+        bundle = s3base.S3LocationBundle(name)
+    elif name.isdigit():
+        bundle = s3base.S3LocationBundle.lookup(name)
+        if bundle is None or bundle.name != name:
+            raise HTTP(404)
+    else:
+        raise HTTP(400)
+
+    version = bundle.version
+    if not version:
+        raise HTTP(404)
+
+    etag = '"%s"' % version
+    if request.env.http_if_none_match == etag:
+        raise HTTP(304)
+
+    headers = response.headers
+    headers["Content-Type"] = "application/json"
+    headers["Content-Encoding"] = "gzip"
+    headers["ETag"] = etag
+    if get_vars.get("v") == version:
+        headers["Cache-Control"] = "public, max-age=31536000"
+    else:
+        headers["Cache-Control"] = "private, max-age=0, must-revalidate"
+
+    with open(bundle.path, "rb") as f:
+        return f.read()
+
 # -----------------------------------------------------------------------------
 def hdata():
     """
@@ -3829,6 +3895,25 @@ def proxy():
         if allowedHosts and not host in allowedHosts:
             raise HTTP(403, "Host not permitted: %s" % host)
 
+        elif method == "GET" and settings.get_gis_proxy_cache() and \
+             (url.startswith("http://") or url.startswith("https://")):
+            # Serve from cache if possible
+            try:
+                ct, msg = s3base.S3ProxyCache().get(url)
+            except (URLError, IOError) as e:
+                raise HTTP(s3base.S3ProxyCache.error_status(e),
+                           "Unable to reach host %s" % url)
+            if allowed_content_types:
+                # Check for allowed content types
+                if not ct:
+                    raise HTTP(406, "Unknown Content")
+                elif not ct.split(";")[0] in allowed_content_types:
+                    raise HTTP(403, "Content-Type not permitted")
+            if ct:
+                # Maintain the incoming Content-Type
+                response.headers["Content-Type"] = ct
+            return msg
+
         elif url.startswith("http://") or url.startswith("https://"):
             if method == "POST":
                 length = int(request["wsgi"].environ["CONTENT_LENGTH"])
@@ -3837,14 +3922,16 @@ def proxy():
                 r = urllib2.Request(url, body, headers)
                 try:
                     y = urlopen(r)
-                except URLError:
-                    raise HTTP(504, "Unable to reach host %s" % r)
+                except URLError as e:
+                    raise HTTP(s3base.S3ProxyCache.error_status(e),
+                               "Unable to reach host %s" % r)
             else:
                 # GET
                 try:
                     y = urlopen(url)
-                except URLError:
-                    raise HTTP(504, "Unable to reach host %s" % url)
+                except URLError as e:
+                    raise HTTP(s3base.S3ProxyCache.error_status(e),
+                               "Unable to reach host %s" % url)
 
             i = y.info()
             if "Content-Type" in i:
@@ -3872,9 +3959,69 @@ def proxy():
             # Bad Request
             raise HTTP(400)
 
+    except HTTP:
+        raise
     except Exception as e:
         raise HTTP(500, "Some unexpected error occurred. Error text was: %s" % str(e))
 
+# -----------------------------------------------------------------------------
+def tile():
+    """
+        Caching proxy for the tiles of TMS, XYZ and WMS layers
+        - used instead of the layer URL if settings.gis.proxy_cache is set
+
+        TMS: GET '/eden/gis/tile/' + layer_id + '/1.0.0/' + layername + '/z/x/y.' + format
+        XYZ: GET '/eden/gis/tile/' + layer_id + '?z=..&x=..&y=..'
+        WMS: GET '/eden/gis/tile/' + layer_id + '?' + WMS parameters
+    """
+
+    if not settings.get_gis_proxy_cache():
+        raise HTTP(404)
+
+    args = request.args
+    try:
+        layer_id = int(args[0])
+    except (IndexError, ValueError):
+        raise HTTP(400)
+
+    layer = s3base.S3ProxyCache.layer(layer_id)
+    if not layer:
+        raise HTTP(404)
+
+    layer_type = layer.type
+    try:
+        if layer_type == "tms":
+            z, x, y = args[-3:]
+            y = y.split(".", 1)[0]
+            url = s3base.S3ProxyCache.tile_url(layer, int(z), int(x), int(y))
+        elif layer_type == "xyz":
+            url = s3base.S3ProxyCache.tile_url(layer,
+                                               int(get_vars.z),
+                                               int(get_vars.x),
+                                               int(get_vars.y),
+                                               )
+        else:
+            # WMS: pass through the query string
+            url = layer.url
+            query = request.env.query_string
+            if query:
+                url = "%s%s%s" % (url, "&" if "?" in url else "?", query)
+    except (ValueError, TypeError):
+        raise HTTP(400)
+
+    try:
+        ct, body = s3base.S3ProxyCache().get(url)
+    except IOError as e:
+        # NB URLError/HTTPError are subclasses of IOError
+        raise HTTP(s3base.S3ProxyCache.error_status(e),
+                   "Unable to reach host for layer %s" % layer_id)
+
+    if ct:
+        response.headers["Content-Type"] = ct
+    # Allow browsers to cache tiles for a day
+    response.headers["Cache-Control"] = "max-age=86400"
+    return body
+
 # =============================================================================
 def screenshot():
     """
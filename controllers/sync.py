@@ -288,9 +288,9 @@ def sync():
         get_vars_new = Storage(include_deleted=True)
 
         # Copy URL variables from peer:
-        # repository ID, msince and sync filters
+        # repository ID, msince, paging cursor and sync filters
         for k, v in get_vars.items():
-            if k in ("repository", "msince") or \
+            if k in ("repository", "msince", "mcursor") or \
                k[0] == "[" and "]" in k:
                 get_vars_new[k] = v
 
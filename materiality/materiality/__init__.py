@@ -1,4 +1,5 @@
 __version__ = '0.0.1'
 
 from .tracking import Author, Change
-from .manager import DependencyFinder
\ No newline at end of file
+from .manager import DependencyFinder
+from .git_store import GitStore
\ No newline at end of file
@@ -1,7 +1,7 @@
 import ast
 
 from importlib.util import find_spec
-from importlib.machinery import BuiltinImporter
+from importlib.machinery import BuiltinImporter, ModuleSpec
 from copy import deepcopy, copy
 from typing import Set, List, Optional, Dict, Any
 
@@ -294,6 +294,13 @@ class ImportReference(Logger):
     def __repr__(self):
         return str(self)
 
+    def __getstate__(self):
+        # loaders can't always be pickled and are only needed while resolving
+        state = self.__dict__.copy()
+        if self.spec is not None:
+            state['spec'] = ModuleSpec(self.spec.name, None, origin=self.spec.origin)
+        return state
+
 
 # todo: Make a 2nd Import helper object that wraps the _act_ of importing a library
 # todo: instead of the Import <x> statement in the AST. One Import statement can generate
@@ -495,7 +502,7 @@ class ASTWrapper(Logger):
                 if container:
                     for element in container:
                         self.children.append(self._make_child_wrapper(element))
-                    output = '\n\t' + '\n\t'.join([str(c) for c in self.children])
+                    # output = '\n\t' + '\n\t'.join([str(c) for c in self.children])
                     # log.w(f'{self.node.__class__.__name__}[{key}] = {output}')
 
         # self._handle_node_symbol()
@@ -1296,6 +1303,25 @@ class StatNode(Logger):
             name = self.symbol
         return f'St[{name}][{self.length}] -> [{len(self.links)}]'
 
+class ASTSummary(object):
+    """
+    Stand-in for the ManagedASTWrapper of a symbol, with only what the SymbolManager uses.
+    Unlike the full AST tree it is small and can be pickled.
+    """
+
+    def __init__(self, wrapper: ASTWrapper):
+        self.path = wrapper.path
+        self.first_line = wrapper.first_line
+        self.last_line = wrapper.last_line
+        self._str = str(wrapper)
+
+    def __str__(self):
+        return self._str
+
+    def __repr__(self):
+        return self._str
+
+
 class SymbolManager(Logger):
     """
     Tracks the imports in a symbol and store the AST tree
@@ -1325,6 +1351,18 @@ class SymbolManager(Logger):
         # log.d(f"{self.name}: {self.scope_imports} += {statement}")
         self.scope_imports.append(statement)
 
+    def summary(self) -> 'SymbolManager':
+        """
+        Copy of this manager (and its symbols) with the AST tree replaced by ASTSummary objects, so that it can be
+        cached or sent between processes
+        :return: SymbolManager
+        """
+        summary = copy(self)
+        summary.ast = ASTSummary(self.ast)
+        summary.symbols = {k: v.summary() for k, v in self.symbols.items()}
+        summary._symbol_refs = {}
+        return summary
+
     def stats(self, symbol = None):
         """
         Get the stats for this manager
@@ -1441,7 +1479,11 @@ class ModuleManager(Logger):
 
     _NAME = "ModuleManager"
 
-    def __init__(self, path, **kwargs):
+    def __init__(self, path, symbols: SymbolManager = None, **kwargs):
+        """
+        :param path: path of the python file
+        :param symbols: already parsed symbols of the file (i.e. from the ParseCache), parses the file if not given
+        """
         super().__init__(**kwargs)
 
         self.path = PythonPathWrapper(path)
@@ -1449,13 +1491,16 @@ class ModuleManager(Logger):
         if not self.path.is_py_file:
             raise ValueError(f"Path '{self.path}' does not appear to by a python file!")
 
-        wrapper = ManagedASTWrapper(
-            self.path.str(),
-            ast.parse(self.path.read(), filename=self.path.str())
-        )
+        if symbols is None:
+            wrapper = ManagedASTWrapper(
+                self.path.str(),
+                ast.parse(self.path.read(), filename=self.path.str())
+            )
 
-        self.symbols = SymbolManager(self.module, wrapper)
-        wrapper.set_manager(self.symbols)
+            symbols = SymbolManager(self.module, wrapper)
+            wrapper.set_manager(symbols)
+
+        self.symbols = symbols
 
     def get_stat(self, symbol = None):
         return self.symbols.stats(symbol)
@@ -1475,4 +1520,14 @@ class ModuleManager(Logger):
 
     @property
     def module(self):
-        return self.path.module_guess
\ No newline at end of file
+        return self.path.module_guess
+
+
+def parse_module(path: str) -> SymbolManager:
+    """
+    Parse a python file and resolve its imports
+    Module level so it can be used in a process pool.
+    :param path: path of the python file
+    :return: summary of the module's symbols
+    """
+    return ModuleManager(path).symbols.summary()
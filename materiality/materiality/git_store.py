@@ -0,0 +1,203 @@
+import datetime
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+from typing import List, Optional
+
+from pydriller import RepositoryMining
+
+from .utils import Logger
+from .tracking import ChangeStats
+
+FileChange = namedtuple("FileChange", ["hash", "date", "author_name", "author_email", "path", "added", "removed"])
+AuthorStats = namedtuple("AuthorStats", ["name", "email", "changes", "added", "removed", "first", "last"])
+
+
+class GitStore(Logger):
+    """
+    Local SQLite store of the commits and modifications mined from a git repository.
+
+    Remembers the last mined commit (the high-water mark), so that update() only traverses the commits added
+    since. File histories and author statistics are queried from the store.
+    """
+
+    _NAME = "GitStore"
+
+    # commits per transaction while mining
+    _BATCH_SIZE = 100
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS commits (
+            hash TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            author_name TEXT,
+            author_email TEXT,
+            author_timestamp REAL NOT NULL,
+            author_utcoffset INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS modifications (
+            commit_hash TEXT NOT NULL REFERENCES commits (hash),
+            path TEXT NOT NULL,
+            old_path TEXT,
+            new_path TEXT,
+            change_type TEXT,
+            added INTEGER NOT NULL,
+            removed INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS modifications_path ON modifications (path);
+        CREATE INDEX IF NOT EXISTS modifications_commit ON modifications (commit_hash);
+        CREATE INDEX IF NOT EXISTS commits_author ON commits (author_email);
+        CREATE TABLE IF NOT EXISTS state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    _HIGH_WATER = "high_water"
+
+    def __init__(self, repo_directory: str, database: Optional[str] = None, **kwargs):
+        """
+        :param repo_directory: the git repository to mine
+        :param database: path of the SQLite database, defaults to a file in the current directory named after the
+                         repository (like the GitHelper pickles)
+        """
+        super().__init__(**kwargs)
+        self.repo_directory = str(repo_directory)
+        if database is None:
+            database = str(Path("./", self.repo_directory.replace("/", "_") + "_commits.sqlite"))
+        self.database = database
+        self.db = sqlite3.connect(database)
+        self.db.executescript(self._SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @property
+    def high_water(self) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM state WHERE key = ?", (self._HIGH_WATER,)).fetchone()
+        return row[0] if row else None
+
+    def _set_high_water(self, commit_hash: str) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+            (self._HIGH_WATER, commit_hash)
+        )
+
+    def _commits(self):
+        high_water = self.high_water
+        if high_water:
+            try:
+                # includes the high water commit itself, which is skipped as known
+                return list(RepositoryMining(self.repo_directory, from_commit=high_water).traverse_commits())
+            except Exception as e:
+                # i.e. history was rewritten, walk everything (known commits are still skipped)
+                self.logger("_commits").w(f"Could not start from {high_water}: {e}")
+        return RepositoryMining(self.repo_directory).traverse_commits()
+
+    def update(self) -> int:
+        """
+        Mine the commits added since the last update
+        :return: the number of new commits
+        """
+        log = self.logger("update")
+        db = self.db
+        seq = db.execute("SELECT COALESCE(MAX(seq), 0) FROM commits").fetchone()[0]
+        new_commits = 0
+        last_hash = None
+        for commit in self._commits():
+            last_hash = commit.hash
+            if db.execute("SELECT 1 FROM commits WHERE hash = ?", (commit.hash,)).fetchone():
+                continue
+
+            seq += 1
+            author_date = commit.author_date
+            db.execute(
+                "INSERT INTO commits VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    commit.hash, seq, commit.author.name, commit.author.email,
+                    author_date.timestamp(), int(author_date.utcoffset().total_seconds())
+                )
+            )
+            db.executemany(
+                "INSERT INTO modifications VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        commit.hash,
+                        m.new_path if m.new_path is not None else m.old_path,  # file deleted, use old path
+                        m.old_path, m.new_path, m.change_type.name, m.added, m.removed
+                    ) for m in commit.modifications
+                ]
+            )
+            new_commits += 1
+            if new_commits % self._BATCH_SIZE == 0:
+                db.commit()
+
+        if last_hash:
+            self._set_high_water(last_hash)
+        db.commit()
+        log.d(f"{self.repo_directory}: {new_commits} new commits")
+        return new_commits
+
+    @staticmethod
+    def _date(timestamp: float, utcoffset: int) -> datetime.datetime:
+        tz = datetime.timezone(datetime.timedelta(seconds=utcoffset))
+        return datetime.datetime.fromtimestamp(timestamp, tz)
+
+    def paths(self) -> List[str]:
+        return [row[0] for row in self.db.execute("SELECT DISTINCT path FROM modifications ORDER BY path")]
+
+    def file_history(self, path: str) -> List[FileChange]:
+        """
+        The changes to a file, oldest first
+        :param path: path of the file in the repository
+        :return:
+        """
+        rows = self.db.execute(
+            "SELECT c.hash, c.author_timestamp, c.author_utcoffset, c.author_name, c.author_email,"
+            " m.path, m.added, m.removed"
+            " FROM modifications m JOIN commits c ON c.hash = m.commit_hash"
+            " WHERE m.path = ? ORDER BY c.seq",
+            (path.strip("/"),)
+        )
+        return [
+            FileChange(commit_hash, self._date(timestamp, utcoffset), name, email, path, added, removed)
+            for commit_hash, timestamp, utcoffset, name, email, path, added, removed in rows
+        ]
+
+    def file_stats(self, path: str) -> ChangeStats:
+        count, added, removed = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(added), 0), COALESCE(SUM(removed), 0)"
+            " FROM modifications WHERE path = ?",
+            (path.strip("/"),)
+        ).fetchone()
+        stats = ChangeStats(added, removed)
+        stats.count = count
+        return stats
+
+    def author_stats(self, path: Optional[str] = None) -> List[AuthorStats]:
+        """
+        Changes per author (by email), most changes first
+        :param path: only count changes to this file
+        :return:
+        """
+        query = (
+            "SELECT MAX(c.author_name), c.author_email, COUNT(*), SUM(m.added), SUM(m.removed),"
+            " MIN(c.author_timestamp), MAX(c.author_timestamp)"
+            " FROM modifications m JOIN commits c ON c.hash = m.commit_hash"
+        )
+        args = ()
+        if path is not None:
+            query += " WHERE m.path = ?"
+            args = (path.strip("/"),)
+        query += " GROUP BY c.author_email ORDER BY COUNT(*) DESC, c.author_email"
+
+        utc = datetime.timezone.utc
+        return [
+            AuthorStats(
+                name, email, changes, added, removed,
+                datetime.datetime.fromtimestamp(first, utc), datetime.datetime.fromtimestamp(last, utc)
+            ) for name, email, changes, added, removed, first, last in self.db.execute(query, args)
+        ]
+
+    def __str__(self):
+        return f'GitStore[{self.repo_directory}]'
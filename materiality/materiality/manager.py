@@ -1,31 +1,38 @@
 from os.path import join
-
-from pydriller import RepositoryMining
-
+from typing import List, Optional
 
 from .utils import Logger
 from .module_crawler import ModuleCrawler
-from .tracking import File, Change, Author
+from .git_store import GitStore, FileChange, AuthorStats
 
 
 class DependencyFinder(Logger):
-    def __init__(self, base, **kwargs):
+    def __init__(self, base, database: Optional[str] = None, cache_directory: Optional[str] = None, **kwargs):
+        """
+        :param base: the git repository
+        :param database: SQLite database for the mined commits (see GitStore)
+        :param cache_directory: where to cache parsed files between crawls (see ModuleCrawler), None to not cache
+        """
         super().__init__(**kwargs)
         self.base = base
         self.mc = None
+        self.database = database
+        self.cache_directory = cache_directory
+        self._store = None
+
+    @property
+    def store(self) -> GitStore:
+        if self._store is None:
+            self._store = GitStore(self.base, self.database)
+        return self._store
 
-    def crawl_file(self, file_name):
-        for commit in RepositoryMining(self.base, filepath=file_name).traverse_commits():
-            # author = Author.find_author(commit.author)
-            for m in commit.modifications:
-                f = File.get_file(m)
-                # if m.new_path == file_name:
-                f.add_change(Change.from_commit_and_mod(commit, m))
-                    # author.add_change(change)
+    def crawl_file(self, file_name) -> List[FileChange]:
+        self.store.update()
+        return self.store.file_history(file_name)
 
     def crawl_file_modules(self, file_name):
         full_path = join(self.base, file_name)
-        self.mc = ModuleCrawler(full_path)
+        self.mc = ModuleCrawler(full_path, cache_directory=self.cache_directory)
 
         while not self.mc.done:
             self.mc.step()
@@ -35,16 +42,13 @@ class DependencyFinder(Logger):
         stats = self.mc.get_import_tree_for_file(full_path)
         stats.report()
 
-    def crawl_repo(self):
-        for commit in RepositoryMining(self.base).traverse_commits():
-            for m in commit.modifications:
-                f = File.get_file(m)
-                f.add_change(Change.from_commit_and_mod(commit, m))
+    def crawl_repo(self) -> int:
+        return self.store.update()
 
     @property
-    def file_list(self):
-        return File.files.values()
+    def file_list(self) -> List[str]:
+        return self.store.paths()
 
     @property
-    def author_list(self):
-        return Author.authors
+    def author_list(self) -> List[AuthorStats]:
+        return self.store.author_stats()
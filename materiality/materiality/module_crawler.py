@@ -9,6 +9,7 @@ from .utils import Logger, td_str
 from .tracking import ChangeStats
 from .ast_crawler import ImportReference, ModuleManager
 from .path_manager import PathManager
+from .parse_cache import ParseCache
 
 class StatTree(Logger):
 
@@ -290,7 +291,14 @@ class ModuleCrawler(Logger):
         lambda x: x.startswith('_dummy') and x.endswith('.py')
     ]
 
-    def __init__(self, target: str, **kwargs):
+    def __init__(self, target: str, cache_directory: Optional[str] = None,
+                 processes: Optional[int] = None, **kwargs):
+        """
+        :param target: path of the file to start crawling from
+        :param cache_directory: where to cache parsed files between runs (e.g. ParseCache.default_directory()),
+                                None to not cache (or parse in parallel)
+        :param processes: number of processes to parse files with, defaults to the number of CPUs
+        """
         super().__init__(**kwargs)
 
         self.has_new_results: bool = False
@@ -301,7 +309,10 @@ class ModuleCrawler(Logger):
         self.next_paths: Set[str] = {target}
         self.has_results = False
 
-        self.pm = PathManager()
+        self.cache = None
+        if cache_directory:
+            self.cache = ParseCache(cache_directory, processes)
+        self.pm = PathManager(self.cache)
 
     @property
     def done(self):
@@ -309,9 +320,13 @@ class ModuleCrawler(Logger):
 
     def step(self):
         if not self.has_new_results:
-            # do the thing
-            target = self.next_paths.pop()
-            self._check_modules_for_target(target)
+            # do the thing - for all the paths found so far at once, so they can be parsed in parallel
+            targets = self.next_paths
+            self.next_paths = set()
+            self.paths_checked.update(targets)
+            self.pm.modules_for_paths(targets)
+            for target in targets:
+                self._check_modules_for_target(target)
             # print(self.pm)
             # cleanup
             self._cleanup()
@@ -326,7 +341,10 @@ class ModuleCrawler(Logger):
         return st
 
     def report(self):
-        return str(self.pm)
+        report = str(self.pm)
+        if self.cache:
+            report = f'{report}\n{self.cache}'
+        return report
 
     def _check_modules_for_target(self, target):
         log = self.logger("_check_modules_for_target")
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from .utils import Logger
+from .ast_crawler import SymbolManager, parse_module
+
+
+class ParseCache(Logger):
+    """
+    On-disk cache of parsed python files.
+
+    Stores the symbols of each file, with its import statements and their resolved references, in one pickle per
+    file. An entry is valid while the file's mtime and size are unchanged, or - if they changed - while the hash of
+    its contents still matches. Files that are not in the cache are parsed in a process pool.
+    """
+
+    _NAME = "ParseCache"
+
+    # bump when the cached objects change
+    _VERSION = 1
+
+    def __init__(self, directory: Optional[str] = None, processes: Optional[int] = None, **kwargs):
+        """
+        :param directory: where to store the cache entries, defaults to default_directory()
+        :param processes: size of the process pool, defaults to the number of CPUs. 1 parses in this process.
+        """
+        super().__init__(**kwargs)
+        self.directory = Path(directory or self.default_directory())
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.processes = processes or os.cpu_count() or 1
+
+        # import resolution depends on the interpreter and its path
+        self._environment = hashlib.sha1(
+            "\n".join([str(self._VERSION), sys.version] + sys.path).encode("utf-8")
+        ).hexdigest()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def default_directory() -> str:
+        """
+        :return: the materiality directory in the user's cache directory ($XDG_CACHE_HOME, or ~/.cache)
+        """
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(base, "materiality")
+
+    def _entry_path(self, path: str) -> Path:
+        return self.directory / f'{hashlib.sha1(path.encode("utf-8")).hexdigest()}.pickle'
+
+    @staticmethod
+    def _file_key(path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        with open(path, "rb") as file:
+            return hashlib.sha1(file.read()).hexdigest()
+
+    def _load(self, path: str) -> Optional[dict]:
+        entry_path = self._entry_path(path)
+        if not entry_path.exists():
+            return None
+        try:
+            with entry_path.open("rb") as file:
+                entry = pickle.load(file)
+        except Exception as e:
+            self.logger("_load").w(f"Ignoring unreadable cache entry for {path}: {e}")
+            return None
+        if entry.get("path") != path or entry.get("environment") != self._environment:
+            return None
+        return entry
+
+    def _store(self, path: str, file_key: Tuple[int, int], file_hash: str, symbols: SymbolManager) -> None:
+        entry = {
+            "path": path,
+            "environment": self._environment,
+            "file_key": file_key,
+            "hash": file_hash,
+            "symbols": symbols,
+        }
+        entry_path = self._entry_path(path)
+        # write + rename so that a concurrent reader never sees half an entry
+        temp_path = entry_path.with_name(f'{entry_path.name}.{os.getpid()}.tmp')
+        with temp_path.open("wb") as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(temp_path), str(entry_path))
+
+    def _lookup(self, path: str) -> Tuple[Optional[SymbolManager], Tuple[int, int], Optional[str]]:
+        """
+        :return: (cached symbols or None, file key, file hash if it was computed)
+        """
+        file_key = self._file_key(path)
+        entry = self._load(path)
+        if entry is None:
+            return None, file_key, None
+        if entry["file_key"] == file_key:
+            return entry["symbols"], file_key, None
+
+        # touched, but maybe not changed
+        file_hash = self._file_hash(path)
+        if entry["hash"] == file_hash:
+            self._store(path, file_key, file_hash, entry["symbols"])
+            return entry["symbols"], file_key, file_hash
+
+        return None, file_key, file_hash
+
+    def parse(self, paths: Iterable[str]) -> Dict[str, SymbolManager]:
+        """
+        Get the parsed symbols for python files, from the cache where possible
+        :param paths: paths of the python files
+        :return: dict of path -> symbols
+        """
+        log = self.logger("parse")
+        results: Dict[str, SymbolManager] = {}
+        missing = []
+        for path in paths:
+            symbols, file_key, file_hash = self._lookup(path)
+            if symbols is not None:
+                results[path] = symbols
+                self.hits += 1
+            else:
+                missing.append((path, file_key, file_hash or self._file_hash(path)))
+                self.misses += 1
+
+        if not missing:
+            return results
+
+        log.v(f"{len(results)} cached, parsing {len(missing)}")
+        missing_paths = [path for path, _, _ in missing]
+        if self.processes > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(missing))) as pool:
+                parsed = list(pool.map(parse_module, missing_paths))
+        else:
+            parsed = [parse_module(path) for path in missing_paths]
+
+        for (path, file_key, file_hash), symbols in zip(missing, parsed):
+            self._store(path, file_key, file_hash, symbols)
+            results[path] = symbols
+
+        return results
+
+    def __str__(self):
+        return f'ParseCache[{self.directory}]({self.hits} hits, {self.misses} misses)'
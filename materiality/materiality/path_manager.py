@@ -1,10 +1,11 @@
 from pathlib import  Path
-from typing import Set, List, Optional, Dict, Any
+from typing import Set, List, Optional, Dict, Any, Iterable
 from collections import namedtuple
 
 from .utils import Logger, PythonPathWrapper
 from .ast_crawler import ModuleManager, ImportReference, StatNode
 from .git_helper import GitHelper, File
+from .parse_cache import ParseCache
 
 ModPaths = namedtuple("ModPaths",["common_root", "module_path", "git_path"])
 
@@ -27,9 +28,10 @@ class PathManager(Logger):
         'bcgs': ModPaths('/Users/ddrexler/src/python/breitbart_comment_grabbing_server/', 'bcgs/server.py', '')
     }
 
-    def __init__(self, **kwargs):
+    def __init__(self, cache: Optional[ParseCache] = None, **kwargs):
         super().__init__(**kwargs)
 
+        self.cache = cache
         self.path_to_module: Dict[str, ModuleManager] = {}
         # self.module_name_to_module: Dict[str, ModuleManager] = {}
         self.git_helpers: Dict[str, GitHelper] = {k:GitHelper(k, str(Path(v.common_root, v.git_path))) for k, v in self._module_map.items()}
@@ -60,10 +62,33 @@ class PathManager(Logger):
 
     def _get_create_mm(self, path: str) -> ModuleManager:
         if path not in self.path_to_module:
-            self.path_to_module[path] = ModuleManager(path)
+            self.load_modules([path])
 
         return self.path_to_module[path]
 
+    def load_modules(self, paths: Iterable[str]) -> None:
+        """
+        Create the ModuleManagers for several (real) paths at once, so the cache can parse them in parallel
+        :param paths:
+        :return:
+        """
+        paths = [p for p in paths if p not in self.path_to_module]
+        if not paths:
+            return
+
+        if self.cache is None:
+            for path in paths:
+                self.path_to_module[path] = ModuleManager(path)
+            return
+
+        for path in paths:
+            # check before parsing, like ModuleManager would
+            if not PythonPathWrapper(path).is_py_file:
+                raise ValueError(f"Path '{path}' does not appear to by a python file!")
+
+        for path, symbols in self.cache.parse(paths).items():
+            self.path_to_module[path] = ModuleManager(path, symbols)
+
     def module_path(self, module_name: str) -> Optional[str]:
         map_entry = self._search_for_module(module_name)
         if map_entry:
@@ -114,8 +139,13 @@ class PathManager(Logger):
 
         return None
 
-    def module_for_path(self, path: str) -> ModuleManager:
-        log = self.logger("module_for_path")
+    def real_path(self, path: str) -> str:
+        """
+        Path of the file to use for a path, which is in the external repository if there is one for the module
+        :param path:
+        :return:
+        """
+        log = self.logger("real_path")
 
         path_wrapper = PythonPathWrapper(path)
         ext_path = self.module_path(path_wrapper.module_guess)
@@ -124,7 +154,18 @@ class PathManager(Logger):
             log.v(f"Swapping path {path_wrapper} -> {ext_path} ")
             path = path_wrapper.swap_root(ext_path).str()
 
-        return self._get_create_mm(path)
+        return path
+
+    def module_for_path(self, path: str) -> ModuleManager:
+        return self._get_create_mm(self.real_path(path))
+
+    def modules_for_paths(self, paths: Iterable[str]) -> None:
+        """
+        Load the modules for several paths at once (see load_modules)
+        :param paths:
+        :return:
+        """
+        self.load_modules({self.real_path(p) for p in paths})
 
     # def resolve_import(self, imp_ref: ImportReference):
     #     log = self.logger("resolve_import")
@@ -0,0 +1,70 @@
+import subprocess
+
+from materiality import DependencyFinder
+from materiality.git_store import GitStore
+
+
+def _git(repo, *args, author=("Ann", "ann@example.com"), date="2020-01-01T12:00:00+02:00"):
+    env = {
+        "GIT_AUTHOR_NAME": author[0], "GIT_AUTHOR_EMAIL": author[1], "GIT_AUTHOR_DATE": date,
+        "GIT_COMMITTER_NAME": author[0], "GIT_COMMITTER_EMAIL": author[1], "GIT_COMMITTER_DATE": date,
+        "HOME": str(repo), "PATH": "/usr/bin:/bin:/usr/local/bin",
+    }
+    return subprocess.run(["git", *args], cwd=str(repo), env=env, check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+def _commit(repo, files, message, **kwargs):
+    for name, content in files.items():
+        (repo / name).write_text(content)
+    _git(repo, "add", "-A", **kwargs)
+    _git(repo, "commit", "-q", "-m", message, **kwargs)
+    return _git(repo, "rev-parse", "HEAD")
+
+
+def test_git_store(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    bob = ("Bob", "bob@example.com")
+    _commit(repo, {"a.py": "a = 1\n", "b.py": "b = 1\n"}, "first")
+    _commit(repo, {"a.py": "a = 2\nb = 3\n"}, "second", author=bob, date="2020-02-01T12:00:00+00:00")
+    head = _commit(repo, {"b.py": "b = 2\n"}, "third")
+
+    database = str(tmp_path / "commits.sqlite")
+    finder = DependencyFinder(str(repo), database)
+    assert finder.crawl_repo() == 3
+    assert finder.store.high_water == head
+    assert finder.file_list == ["a.py", "b.py"]
+
+    history = finder.crawl_file("a.py")
+    assert [(c.author_email, c.added, c.removed) for c in history] == [
+        ("ann@example.com", 1, 0),
+        ("bob@example.com", 2, 1),
+    ]
+    assert history[0].date.utcoffset().total_seconds() == 2 * 3600
+
+    stats = finder.store.file_stats("a.py")
+    assert (stats.count, stats.added, stats.removed) == (2, 3, 1)
+
+    authors = finder.author_list
+    assert [(a.email, a.changes, a.added, a.removed) for a in authors] == [
+        ("ann@example.com", 3, 3, 1),
+        ("bob@example.com", 1, 2, 1),
+    ]
+    assert [(a.name, a.changes) for a in finder.store.author_stats("b.py")] == [("Ann", 2)]
+    finder.store.close()
+
+    # a later run only mines the new commits
+    head = _commit(repo, {"c.py": "c = 1\n"}, "fourth", author=bob, date="2020-03-01T12:00:00+00:00")
+    store = GitStore(str(repo), database)
+    assert store.update() == 1
+    assert store.high_water == head
+    assert store.update() == 0
+    assert store.paths() == ["a.py", "b.py", "c.py"]
+    assert [(a.email, a.changes) for a in store.author_stats()] == [
+        ("ann@example.com", 3),
+        ("bob@example.com", 2),
+    ]
+    assert store.db.execute("SELECT COUNT(*) FROM commits").fetchone()[0] == 4
+    store.close()
@@ -0,0 +1,75 @@
+from materiality.module_crawler import ModuleCrawler
+from materiality.path_manager import PathManager
+from materiality.parse_cache import ParseCache
+
+
+def _make_package(base):
+    package = base / "pkg"
+    package.mkdir()
+    (package / "__init__.py").write_text("from .a import A\nfrom . import b\n")
+    (package / "a.py").write_text("from .c import C\n\nclass A(C):\n    pass\n")
+    (package / "b.py").write_text("from .c import C\n\ndef b():\n    return C()\n")
+    (package / "c.py").write_text("class C:\n    pass\n")
+    return package
+
+
+def _crawl(package, cache_directory, processes=2):
+    mc = ModuleCrawler(str(package / "__init__.py"), cache_directory=cache_directory, processes=processes)
+    while not mc.done:
+        mc.step()
+    return mc
+
+
+def test_parse_cache(tmp_path, monkeypatch):
+    # no external repositories
+    monkeypatch.setattr(PathManager, "_module_map", {})
+    package = _make_package(tmp_path)
+    cache_directory = str(tmp_path / "cache")
+
+    mc = _crawl(package, None)
+    expected = {p: [str(i) for i in m.imports] for p, m in mc.pm.path_to_module.items()}
+    assert len(expected) == 4
+    expected_length = mc.pm.module_for_path(str(package / "a.py")).get_stat("A").length
+
+    # first run parses everything (in a process pool)
+    mc = _crawl(package, cache_directory)
+    assert (mc.cache.hits, mc.cache.misses) == (0, 4)
+    assert {p: [str(i) for i in m.imports] for p, m in mc.pm.path_to_module.items()} == expected
+
+    # second run parses nothing
+    mc = _crawl(package, cache_directory)
+    assert (mc.cache.hits, mc.cache.misses) == (4, 0)
+    assert {p: [str(i) for i in m.imports] for p, m in mc.pm.path_to_module.items()} == expected
+    assert mc.pm.module_for_path(str(package / "a.py")).get_stat("A").length == expected_length
+
+    # touching a file doesn't change its contents
+    (package / "c.py").touch()
+    mc = _crawl(package, cache_directory)
+    assert (mc.cache.hits, mc.cache.misses) == (4, 0)
+
+    # only the edited file is parsed again
+    (package / "b.py").write_text("def b():\n    return None\n")
+    mc = _crawl(package, cache_directory, processes=1)
+    assert (mc.cache.hits, mc.cache.misses) == (3, 1)
+    assert mc.pm.module_for_path(str(package / "b.py")).imports == []
+    assert len(mc.pm.path_to_module) == 4
+
+
+def test_parse_cache_opt_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(PathManager, "_module_map", {})
+    package = _make_package(tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    # no cache unless a directory is given
+    mc = ModuleCrawler(str(package / "__init__.py"))
+    while not mc.done:
+        mc.step()
+    assert mc.cache is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["pkg"]
+
+    # the default directory is in the user's cache directory
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "user_cache"))
+    assert ParseCache.default_directory() == str(tmp_path / "user_cache" / "materiality")
+    mc = _crawl(package, ParseCache.default_directory())
+    assert (mc.cache.hits, mc.cache.misses) == (0, 4)
+    assert len(list((tmp_path / "user_cache" / "materiality").glob("*.pickle"))) == 4
@@ -89,6 +89,9 @@ import s3 as s3base
 import s3log
 s3log.S3Log.setup()
 
+# SQL profiler (if enabled)
+s3log.S3SQLProfiler.setup(db)
+
 # AAA
 current.auth = auth = s3base.AuthS3()
 
@@ -83,6 +83,12 @@ def maintenance(period = "daily"):
             result = maintenance.Daily()()
         db.commit()
 
+    if period == "daily":
+        # Core maintenance tasks, independent of the template
+        from s3 import S3ExportJob
+        S3ExportJob.cleanup(days=1)
+        db.commit()
+
     return result
 
 # -----------------------------------------------------------------------------
@@ -108,6 +114,24 @@ def gis_download_kml(record_id, filename, session_id_name, session_id,
     db.commit()
     return result
 
+# -----------------------------------------------------------------------------
+def gis_seed_proxy_cache(layer_id, bbox, zoom_min, zoom_max, user_id=None):
+    """
+        Seed the proxy cache with the tiles of a TMS/XYZ layer
+            - for offline/low-bandwidth use of base layers
+
+        @param layer_id: the layer ID (gis_layer_entity)
+        @param bbox: the area [lon_min, lat_min, lon_max, lat_max]
+        @param zoom_min: the minimum zoom level
+        @param zoom_max: the maximum zoom level
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    return s3base.S3ProxyCache().seed(layer_id, bbox, zoom_min, zoom_max)
+
 # -----------------------------------------------------------------------------
 def gis_update_location_tree(feature, user_id=None):
     """
@@ -124,8 +148,23 @@ def gis_update_location_tree(feature, user_id=None):
     feature = json.loads(feature)
     path = gis.update_location_tree(feature)
     db.commit()
+    # Invalidate the location hierarchy bundle (paths/bounds have changed)
+    s3base.S3LocationBundle.invalidate_location(feature["id"])
     return path
 
+# -----------------------------------------------------------------------------
+def gis_invalidate_location_bundles(names, user_id=None):
+    """
+        Invalidate location hierarchy bundles
+            - queued when locations get changed, so that the bundles are
+              only removed after the change has been committed
+
+        @param names: the bundle names (in JSON format)
+        @param user_id: calling request's auth.user.id or None
+    """
+    # Run the Task
+    s3base.S3LocationBundle.invalidate_bundles(json.loads(names))
+
 # -----------------------------------------------------------------------------
 # Org: always-enabled
 # -----------------------------------------------------------------------------
@@ -142,13 +181,30 @@ def org_site_check(site_id, user_id=None):
         customise(site_id)
         db.commit()
 
+# -----------------------------------------------------------------------------
+def s3_export_job(job_id, user_id=None):
+    """
+        Run a background export job
+
+        @param job_id: the s3_export_job record ID
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+    # Run the Task & return the result
+    return s3base.S3ExportJob.run(job_id)
+
 # -----------------------------------------------------------------------------
 tasks = {"dummy": dummy,
          "s3db_task": s3db_task,
          "settings_task": settings_task,
          "maintenance": maintenance,
+         "s3_export_job": s3_export_job,
          "gis_download_kml": gis_download_kml,
+         "gis_seed_proxy_cache": gis_seed_proxy_cache,
          "gis_update_location_tree": gis_update_location_tree,
+         "gis_invalidate_location_bundles": gis_invalidate_location_bundles,
          "org_site_check": org_site_check,
          }
 
@@ -344,15 +400,32 @@ if has_module("msg"):
     tasks["msg_poll"] = msg_poll
 
     # -----------------------------------------------------------------------------
-    def msg_parse(channel_id, function_name, user_id=None):
+    def msg_poll_channels(tablename, user_id=None):
+        """
+            Poll all due inbound channels of a type concurrently
+        """
+        if user_id:
+            auth.s3_impersonate(user_id)
+
+        # Run the Task & return the result
+        result = msg.poll_channels(tablename)
+        db.commit()
+        return result
+
+    tasks["msg_poll_channels"] = msg_poll_channels
+
+    # -----------------------------------------------------------------------------
+    def msg_parse(channel_id, function_name, worker=0, workers=1, user_id=None):
         """
             Parse Messages coming in from a Source Channel
+            - several tasks for the same channel can run concurrently
+              if each has a different worker index (0..workers-1)
         """
         if user_id:
             auth.s3_impersonate(user_id)
 
         # Run the Task & return the result
-        result = msg.parse(channel_id, function_name)
+        result = msg.parse(channel_id, function_name, worker, workers)
         db.commit()
         return result
 
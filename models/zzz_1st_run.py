@@ -19,6 +19,25 @@ else:
         if demo_pop_list:
             pop_list += demo_pop_list
 
+# Restore the database from a snapshot of a previous first run
+# with the same template data, configuration and database schema?
+snapshot = None
+if pop_list:
+    snapshot_folder = settings.get_base_prepopulate_snapshot()
+    if snapshot_folder:
+        start = datetime.datetime.now()
+        s3db.load_all_models()
+        snapshot = s3base.S3BulkImportSnapshot(pop_list,
+                                               None if snapshot_folder is True else snapshot_folder,
+                                               )
+        if snapshot.restore():
+            delta = datetime.datetime.now() - start
+            import sys
+            sys.stderr.write("\n*** FIRST RUN - DATABASE RESTORED FROM SNAPSHOT %s (%s sec) ***\n" %
+                             (snapshot.key, "{:.2f}".format(delta.total_seconds())))
+            pop_list = []
+            snapshot = None
+
 if len(pop_list) > 0:
 
     import sys
@@ -295,6 +314,9 @@ if len(pop_list) > 0:
     if not request.env.request_method:
         request.env.request_method = "GET"
 
+    # Run independent import tasks in parallel?
+    workers = settings.get_base_prepopulate_workers()
+
     grandTotalStart = datetime.datetime.now()
     for pop_setting in pop_list:
 
@@ -319,12 +341,18 @@ if len(pop_list) > 0:
                 info("Unable to install data %s no valid directory found" % task)
                 continue
 
-        bi.perform_tasks(path)
+        bi.perform_tasks(path, workers=workers)
 
         duration("Imports for %s complete" % task, start)
 
         bi.resultList = []
 
+    if bi.timings:
+        info("\nSlowest import tasks:")
+        timings = sorted(bi.timings, key=lambda t: t[1], reverse=True)
+        for name, seconds in timings[:10]:
+            info("%s (%s sec)" % (name, "{:.2f}".format(seconds)))
+
     if bi.errorList:
         info("\nImport Warnings (some data could not be imported):")
         for error in bi.errorList:
@@ -395,23 +423,12 @@ if len(pop_list) > 0:
     #
     info("\nCreating indexes...")
 
-    # Person Registry
-    tablename = "pr_person"
-    # Add extra indexes on search fields
+    # Indexes declared by the models (see S3Indexes)
     # Should work for our 3 supported databases: sqlite, MySQL & PostgreSQL
-    field = "first_name"
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
-    field = "middle_name"
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
-    field = "last_name"
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
+    s3base.S3Indexes(db).update()
 
     # GIS
-    # Add extra index on search field
-    # Should work for our 3 supported databases: sqlite, MySQL & PostgreSQL
     tablename = "gis_location"
-    field = "name"
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
     if settings.get_gis_spatialdb():
         # Add Spatial Index (PostgreSQL-only currently)
         db.executesql("CREATE INDEX gis_location_gist on %s USING GIST (the_geom);" % tablename)
@@ -420,6 +437,16 @@ if len(pop_list) > 0:
         # autovacuum should be on anyway so will run ANALYZE after 50 rows inserted/updated/deleted
         #db.executesql("VACUUM ANALYZE;")
 
+    # =========================================================================
+    # Snapshot
+    #
+    if snapshot:
+        start = datetime.datetime.now()
+        if snapshot.save():
+            duration("\nDatabase snapshot %s saved" % snapshot.key, start)
+        else:
+            info("\nDatabase snapshot could not be saved")
+
     # =========================================================================
     info("\n*** FIRST RUN COMPLETE ***\n")
 
@@ -1,25 +1,46 @@
 
+"""
+    Two-stage cache for generated files (map overlays, charts, CSV data)
+
+    - a small in-memory LRU tier holding the contents of recently served
+      small files
+    - a disk tier with a byte budget, evicting the least recently accessed
+      files when the budget is exceeded
+
+    Files are generated under per-key locks (striped lock files, so that
+    concurrent requests in other threads or processes wait rather than
+    generate the same file again), and written to a temporary file first,
+    so that a partially written file is never served.
+"""
+
 import errno
 import os
-from os.path import join, exists
-from os import stat, makedirs
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+from os.path import join, exists, basename
+
+from s3dal import portalocker
 
-# create folder for cache:
-# mkdir -p /tmp/climate_data_portal/images/recent/
-# mkdir -p /tmp/climate_data_portal/images/older/
+# this needs to become a setting
+CACHE_FOLDER = join("/tmp", "climate_data_portal", "images")
 
 MAX_CACHE_FOLDER_SIZE = 2**24 # 16 MiB
 
-class TwoStageCache(object):
-    def __init__(self, folder, max_size):
-        self.folder = folder
-        self.max_size
-    
-    def purge(self):
-        pass
-    
-    def retrieve(self, file_name, generate_if_not_found):
-        pass
+MAX_MEMORY_SIZE = 2**22 # 4 MiB
+MAX_MEMORY_ITEM_SIZE = 2**18 # 256 KiB
+
+# Number of lock files the keys are distributed over
+LOCK_STRIPES = 64
+
+# Temporary files older than this (seconds) are leftovers of failed
+# generators and get removed during eviction
+TEMP_FILE_MAX_AGE = 3600
+
+TEMP_PREFIX = ".tmp-"
 
 def mkdir_p(path):
     try:
@@ -29,43 +50,335 @@ def mkdir_p(path):
             pass
         else: raise
 
-def get_cached_or_generated_file(cache_file_name, generate):
-    # this needs to become a setting
-    climate_data_image_cache_path = join(
-        "/tmp","climate_data_portal","images"
-    )
-    recent_cache = join(climate_data_image_cache_path, "recent")
-    mkdir_p(recent_cache)
-    older_cache = join(climate_data_image_cache_path, "older")
-    mkdir_p(older_cache)
-    recent_cache_path = join(recent_cache, cache_file_name)
-    if not exists(recent_cache_path):
-        older_cache_path = join(older_cache, cache_file_name)
-        if exists(older_cache_path):
-            # move the older cache to the recent folder
-            rename(older_cache_path, recent_cache_path)
+def rename(source, target):
+    """ Rename a file, replacing the target if it exists """
+    try:
+        os.rename(source, target)
+    except OSError:
+        # Windows does not replace existing files
+        if exists(target):
+            os.remove(target)
+            os.rename(source, target)
         else:
-            generate(recent_cache_path)
-        file_path = recent_cache_path
-            
-        # update the folder size file (race condition?)
-        folder_size_file_path = join(climate_data_image_cache_path, "size")
-        folder_size_file = open(folder_size_file_path, "w+")
-        folder_size_file_contents = folder_size_file.read()
+            raise
+
+class MemoryCache(object):
+    """
+        LRU cache for file contents, bounded by the total number of bytes
+    """
+
+    def __init__(self, max_size, max_item_size):
+        self.max_size = max_size
+        self.max_item_size = max_item_size
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.items.pop(key, None)
+            if data is not None:
+                # Re-insert as most recently used
+                self.items[key] = data
+            return data
+
+    def put(self, key, data):
+        """
+            Add data to the cache, evicting the least recently used items
+            if necessary
+
+            @returns: the number of evicted items
+        """
+        size = len(data)
+        if size > self.max_item_size:
+            return 0
+        evicted = 0
+        with self.lock:
+            previous = self.items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            items = self.items
+            while items and self.size + size > self.max_size:
+                _, oldest = items.popitem(last=False)
+                self.size -= len(oldest)
+                evicted += 1
+            items[key] = data
+            self.size += size
+        return evicted
+
+    def keys(self):
+        with self.lock:
+            return set(self.items)
+
+    def remove(self, key):
+        with self.lock:
+            data = self.items.pop(key, None)
+            if data is not None:
+                self.size -= len(data)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+class TwoStageCache(object):
+    """
+        Cache for generated files, with an in-memory tier in front of a
+        size-bounded disk tier
+    """
+
+    def __init__(self,
+                 folder,
+                 max_size,
+                 max_memory_size = MAX_MEMORY_SIZE,
+                 max_memory_item_size = MAX_MEMORY_ITEM_SIZE,
+                 ):
+        """
+            @param folder: the folder for the disk tier
+            @param max_size: the byte budget for the disk tier
+            @param max_memory_size: the byte budget for the memory tier
+            @param max_memory_item_size: the maximum size of files to
+                                         keep in memory
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.memory = MemoryCache(max_memory_size, max_memory_item_size)
+
+        self.lock_folder = join(folder, "locks")
+        mkdir_p(self.lock_folder)
+        self.thread_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+        # Counters, in this process
+        self.counter_lock = threading.Lock()
+        self.counters = dict(
+            memory_hits = 0,
+            disk_hits = 0,
+            misses = 0,
+            memory_evictions = 0,
+            disk_evictions = 0,
+        )
+
+        # Size of the disk tier, as of the last scan + files added since
+        self.size_lock = threading.Lock()
+        self.size = self.scan()[0]
+
+    def count(self, name, value=1):
+        with self.counter_lock:
+            self.counters[name] += value
+
+    def stats(self):
+        """
+            Get the cache counters (of this process)
+
+            @returns: dict of counters
+        """
+        with self.counter_lock:
+            stats = dict(self.counters)
+        stats["memory_size"] = self.memory.size
+        stats["disk_size"] = self.size
+        return stats
+
+    def path(self, file_name):
+        return join(self.folder, file_name)
+
+    def scan(self):
+        """
+            Scan the disk tier, remove stale temporary files
+
+            @returns: tuple (total size, [(last access, size, file_name), ...])
+        """
+        files = []
+        total = 0
+        now = time.time()
+        for file_name in os.listdir(self.folder):
+            path = join(self.folder, file_name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                # Removed concurrently
+                continue
+            if not os.path.isfile(path):
+                continue
+            if file_name.startswith(TEMP_PREFIX):
+                if now - status.st_mtime > TEMP_FILE_MAX_AGE:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            files.append((status.st_mtime, status.st_size, file_name))
+            total += status.st_size
+        return total, files
+
+    def touch(self, path):
+        """
+            Record an access to a file (mtime is used as last access time,
+            as atime is often not maintained)
+        """
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+            Remove the least recently accessed files from the disk tier
+            until it fits into the byte budget; files in the memory tier
+            are served without touching the disk, so they are considered
+            more recent than all others
+        """
+        with self.size_lock:
+            total, files = self.scan()
+            if total > self.max_size:
+                in_memory = self.memory.keys()
+                files.sort(key=lambda f: (f[2] in in_memory, f[0]))
+                for last_access, size, file_name in files:
+                    if total <= self.max_size:
+                        break
+                    try:
+                        os.remove(self.path(file_name))
+                    except OSError:
+                        continue
+                    self.memory.remove(file_name)
+                    total -= size
+                    self.count("disk_evictions")
+            self.size = total
+
+    def lock(self, file_name):
+        """
+            Acquire the lock for a key
+
+            @returns: the lock handle, to pass to unlock()
+        """
+        stripe = (zlib.crc32(file_name.encode("utf-8")) & 0xffffffff) % LOCK_STRIPES
+        thread_lock = self.thread_locks[stripe]
+        thread_lock.acquire()
+        try:
+            lock_file = open(join(self.lock_folder, "%02d.lock" % stripe), "a")
+            portalocker.lock(lock_file, portalocker.LOCK_EX)
+        except:
+            thread_lock.release()
+            raise
+        return thread_lock, lock_file
+
+    def unlock(self, handle):
+        thread_lock, lock_file = handle
+        try:
+            portalocker.unlock(lock_file)
+            lock_file.close()
+        finally:
+            thread_lock.release()
+
+    def retrieve(self, file_name, generate_if_not_found):
+        """
+            Get the path of a cached file, generate the file if it is not
+            in the cache
+
+            @param file_name: the file name (cache key)
+            @param generate_if_not_found: function to generate the file,
+                                          called with the file path to
+                                          write to
+
+            @returns: the file path
+        """
+        path = self.path(file_name)
+        if self.memory.get(file_name) is not None:
+            # Served from memory by open(), no disk access needed
+            self.count("memory_hits")
+            return path
+        if exists(path):
+            self.count("disk_hits")
+            self.touch(path)
+            return path
+
+        handle = self.lock(file_name)
         try:
-            folder_size = int(folder_size_file_contents)
-        except ValueError:
-            folder_size = 0
-        folder_size_file.seek(0)
-        folder_size_file.truncate()
-        folder_size += stat(file_path).st_size
-        if folder_size > MAX_CACHE_FOLDER_SIZE:
-            rmdir(older_cache)
-
-        folder_size_file.write(str(folder_size))
-        folder_size_file.close()
-    else:
-        # use the existing cached image
-        file_path = recent_cache_path
-    return file_path
+            if exists(path):
+                # Generated by a concurrent request while we were waiting
+                self.count("disk_hits")
+                self.touch(path)
+                return path
+
+            self.count("misses")
+
+            # Generate into a temporary file (keeping the extension, which
+            # some generators use to determine the file format)
+            temp_path = self.path("%s%s-%s" % (TEMP_PREFIX,
+                                               uuid.uuid4().hex,
+                                               file_name,
+                                               ))
+            try:
+                generate_if_not_found(temp_path)
+                if exists(temp_path):
+                    rename(temp_path, path)
+            finally:
+                if exists(temp_path):
+                    os.remove(temp_path)
+        finally:
+            self.unlock(handle)
+
+        if exists(path):
+            size = os.stat(path).st_size
+            with self.size_lock:
+                self.size += size
+                exceeded = self.size > self.max_size
+            if exceeded:
+                self.evict()
+        return path
+
+    def open(self, file_path):
+        """
+            Open a file retrieved from the cache, serving the contents of
+            small files from memory
+
+            @param file_path: the file path as returned from retrieve()
+
+            @returns: a file-like object
+        """
+        file_name = basename(file_path)
+        data = self.memory.get(file_name)
+        if data is not None:
+            # Hit already counted in retrieve()
+            return BytesIO(data)
+
+        cached_file = open(file_path, "rb")
+        if os.fstat(cached_file.fileno()).st_size <= self.memory.max_item_size:
+            data = cached_file.read()
+            cached_file.close()
+            evicted = self.memory.put(file_name, data)
+            if evicted:
+                self.count("memory_evictions", evicted)
+            return BytesIO(data)
+        return cached_file
+
+    def purge(self):
+        """
+            Remove all files from the cache
+        """
+        self.memory.clear()
+        with self.size_lock:
+            total, files = self.scan()
+            for last_access, size, file_name in files:
+                try:
+                    os.remove(self.path(file_name))
+                except OSError:
+                    pass
+            self.size = 0
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                mkdir_p(CACHE_FOLDER)
+                _cache = TwoStageCache(CACHE_FOLDER, MAX_CACHE_FOLDER_SIZE)
+    return _cache
+
+def get_cached_or_generated_file(cache_file_name, generate):
+    return get_cache().retrieve(cache_file_name, generate)
 
+def open_cached_file(file_path):
+    return get_cache().open(file_path)
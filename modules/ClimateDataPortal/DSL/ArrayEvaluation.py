@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+
+"""Array evaluation of expressions
+
+An alternative to generating SQL and R code: the monthly sample tables
+used by an expression are loaded once as dense place x time period arrays,
+which are kept in memory between requests, and the whole expression tree
+is evaluated with array arithmetic.
+
+Results are (keys, values) pairs of arrays, like the data frames returned
+by the R code, keyed by place_id, by time_period or by year (time_period
+of the first month of the year).
+
+Requires NumPy.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+import numpy
+
+from . import *
+from .. import start_month_0_indexed
+
+# Number of sample tables to keep loaded
+MAX_LOADED_TABLES = 8
+
+# Number of rows to fetch at a time when loading a sample table
+FETCH_SIZE = 100000
+
+class DuplicateSamples(Exception):
+    """A sample table has more than one row for a place and time period.
+    SQL aggregates all of them, which a dense array can not represent, so
+    expressions using such a table have to be evaluated with SQL.
+    """
+    def __init__(exception, table_name, count):
+        Exception.__init__(
+            exception,
+            "%s has %i duplicate (place_id, time_period) rows" % (
+                table_name,
+                count
+            )
+        )
+        exception.loaded_on = time.time()
+
+class SampleArray(object):
+    """A sample table as a dense array of values, with one row per place
+    and one column per time period (NaN where there is no value).
+    """
+    def __init__(sample_array, place_ids, time_periods, values):
+        sample_array.place_ids = place_ids
+        sample_array.time_periods = time_periods
+        sample_array.values = values
+        sample_array.loaded_on = time.time()
+
+    @staticmethod
+    def load(sample_table):
+        cursor = sample_table.db._adapter.cursor
+        cursor.execute(
+            "SELECT place_id, time_period, value FROM %s;" % (
+                sample_table.table_name
+            )
+        )
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(
+                numpy.fromiter(
+                    chain.from_iterable(rows),
+                    numpy.float64,
+                    3 * len(rows)
+                ).reshape(-1, 3)
+            )
+        if chunks:
+            data = numpy.concatenate(chunks)
+        else:
+            data = numpy.empty((0, 3))
+        del chunks
+
+        place_ids, rows = numpy.unique(
+            data[:, 0].astype(numpy.int64),
+            return_inverse = True
+        )
+        time_periods = data[:, 1].astype(numpy.int64)
+        if len(time_periods):
+            first = time_periods.min()
+            time_periods -= first
+            all_time_periods = numpy.arange(
+                first,
+                first + time_periods.max() + 1
+            )
+        else:
+            all_time_periods = numpy.empty(0, dtype=numpy.int64)
+
+        # Reject duplicate rows rather than keeping only the last of them
+        duplicates = numpy.count_nonzero(
+            numpy.bincount(rows * len(all_time_periods) + time_periods) > 1
+        )
+        if duplicates:
+            raise DuplicateSamples(sample_table.table_name, duplicates)
+
+        values = numpy.empty((len(place_ids), len(all_time_periods)))
+        values.fill(numpy.nan)
+        values[rows, time_periods] = data[:, 2]
+        return SampleArray(place_ids, all_time_periods, values)
+
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+_loading_locks = {}
+
+def loaded_sample_array(sample_table, max_age):
+    """Get the sample array for a sample table, loading it if it is not
+    loaded yet or was loaded more than max_age seconds ago.
+
+    Each table is loaded by one thread at a time, the least recently used
+    tables are dropped when more than MAX_LOADED_TABLES are loaded.
+
+    Raises DuplicateSamples if the table has duplicate rows (which is
+    remembered for max_age seconds, so that the table is not reloaded for
+    every request).
+    """
+    table_name = sample_table.table_name
+    def recently_loaded():
+        sample_array = _loaded.get(table_name)
+        if sample_array is not None and \
+           time.time() - sample_array.loaded_on < max_age:
+            # mark as most recently used
+            del _loaded[table_name]
+            _loaded[table_name] = sample_array
+            if isinstance(sample_array, DuplicateSamples):
+                raise sample_array
+            return sample_array
+
+    with _loaded_lock:
+        sample_array = recently_loaded()
+        if sample_array is not None:
+            return sample_array
+        loading_lock = _loading_locks.setdefault(table_name, threading.Lock())
+
+    with loading_lock:
+        with _loaded_lock:
+            # may have been loaded by another thread in the meantime
+            sample_array = recently_loaded()
+            if sample_array is not None:
+                return sample_array
+        try:
+            sample_array = SampleArray.load(sample_table)
+        except DuplicateSamples as exception:
+            sample_array = exception
+        with _loaded_lock:
+            _loaded.pop(table_name, None)
+            _loaded[table_name] = sample_array
+            while len(_loaded) > MAX_LOADED_TABLES:
+                _loaded.popitem(last = False)
+    if isinstance(sample_array, DuplicateSamples):
+        raise sample_array
+    return sample_array
+
+def clear_loaded_sample_arrays():
+    with _loaded_lock:
+        _loaded.clear()
+
+
+can_be_evaluated_as_arrays = Method("can_be_evaluated_as_arrays")
+
+@can_be_evaluated_as_arrays.implementation(Number)
+def Number_can_be_evaluated_as_arrays(number):
+    return True
+
+@can_be_evaluated_as_arrays.implementation(
+    Addition, Subtraction, Multiplication, Division
+)
+def Binop_can_be_evaluated_as_arrays(binop):
+    return (
+        can_be_evaluated_as_arrays(binop.left) and
+        can_be_evaluated_as_arrays(binop.right)
+    )
+
+@can_be_evaluated_as_arrays.implementation(Pow)
+def Pow_can_be_evaluated_as_arrays(binop):
+    return can_be_evaluated_as_arrays(binop.left)
+
+@can_be_evaluated_as_arrays.implementation(*aggregations)
+def Aggregation_can_be_evaluated_as_arrays(aggregation):
+    # time_period columns only make sense for monthly data
+    return aggregation.sample_table.date_mapping_name == "monthly"
+
+
+class Context(object):
+    def __init__(context, key, place_ids, previous_december, max_age):
+        context.key = key
+        context.place_ids = place_ids
+        context.previous_december = previous_december
+        context.max_age = max_age
+
+    def sample_array(context, sample_table):
+        return loaded_sample_array(sample_table, context.max_age)
+
+
+# Aggregation of grouped rows: matrix rows are grouped by starts (index of
+# the first row of each group), values are aggregated over all columns of
+# the rows in each group. NaN is missing data.
+aggregate = Method("aggregate")
+
+@aggregate.implementation(Sum)
+def Sum_aggregate(aggregation, matrix, starts, counts):
+    return numpy.add.reduceat(numpy.nansum(matrix, axis=1), starts)
+
+@aggregate.implementation(Average)
+def Average_aggregate(aggregation, matrix, starts, counts):
+    return Sum_aggregate(aggregation, matrix, starts, counts) / counts
+
+@aggregate.implementation(StandardDeviation)
+def StandardDeviation_aggregate(aggregation, matrix, starts, counts):
+    # sample standard deviation, like SQL STDDEV
+    means = Average_aggregate(aggregation, matrix, starts, counts)
+    group_sizes = numpy.diff(numpy.append(starts, len(matrix)))
+    deviations = matrix - numpy.repeat(means, group_sizes)[:, numpy.newaxis]
+    squares = numpy.add.reduceat(
+        numpy.nansum(deviations * deviations, axis=1),
+        starts
+    )
+    return numpy.sqrt(squares / (counts - 1))
+
+@aggregate.implementation(Minimum)
+def Minimum_aggregate(aggregation, matrix, starts, counts):
+    # fmin ignores NaN
+    return numpy.fmin.reduceat(numpy.fmin.reduce(matrix, axis=1), starts)
+
+@aggregate.implementation(Maximum)
+def Maximum_aggregate(aggregation, matrix, starts, counts):
+    return numpy.fmax.reduceat(numpy.fmax.reduce(matrix, axis=1), starts)
+
+@aggregate.implementation(Count)
+def Count_aggregate(aggregation, matrix, starts, counts):
+    return counts.astype(numpy.float64)
+
+
+def empty_result():
+    return (
+        numpy.empty(0, dtype=numpy.int64),
+        numpy.empty(0, dtype=numpy.float64)
+    )
+
+evaluate = Method("evaluate")
+
+@evaluate.implementation(Number)
+def Number_evaluate(number, context):
+    return number.value
+
+@evaluate.implementation(*aggregations)
+def Aggregation_evaluate(aggregation, context):
+    """Same filtering and grouping as the SQL for aggregations
+    (see CodeGeneration.DSLAggregationNode_SQL).
+    """
+    sample_table = aggregation.sample_table
+    sample_array = context.sample_array(sample_table)
+    time_periods = sample_array.time_periods
+
+    month_numbers = aggregation.month_numbers
+    if month_numbers is not None and -1 in month_numbers:
+        # PreviousDecember handling:
+        # shift the month numbers forward by one month and compare against
+        # month filter numbers also shifted forward one month.
+        shifted_time_periods = time_periods + 1
+        month_numbers = [month_number + 1 for month_number in month_numbers]
+    else:
+        shifted_time_periods = time_periods
+
+    columns = numpy.ones(len(time_periods), dtype=bool)
+    date_to_time_period = sample_table.date_mapper.date_to_time_period
+    if aggregation.from_date is not None:
+        columns &= shifted_time_periods >= date_to_time_period(
+            aggregation.from_date
+        )
+    if aggregation.to_date is not None:
+        columns &= shifted_time_periods <= date_to_time_period(
+            aggregation.to_date
+        )
+    if month_numbers is not None and month_numbers != list(range(0,12)):
+        columns &= numpy.isin(
+            (shifted_time_periods + start_month_0_indexed) % 12,
+            month_numbers
+        )
+
+    place_ids = sample_array.place_ids
+    values = sample_array.values
+    if context.place_ids is not None:
+        rows = numpy.isin(place_ids, context.place_ids)
+        place_ids = place_ids[rows]
+        values = values[rows]
+    values = values[:, columns]
+    if values.size == 0:
+        return empty_result()
+
+    if context.key == "place_id":
+        matrix = values
+        keys = place_ids
+        starts = numpy.arange(len(keys))
+    else:
+        matrix = values.T
+        keys = time_periods[columns]
+        if context.key == "year":
+            keys = keys - (
+                (keys + start_month_0_indexed + context.previous_december) % 12
+            )
+            # time periods are in order, so the years are consecutive rows
+            starts = numpy.flatnonzero(
+                numpy.concatenate(([True], keys[1:] != keys[:-1]))
+            )
+            keys = keys[starts]
+        else:
+            starts = numpy.arange(len(keys))
+
+    counts = numpy.add.reduceat(
+        (~numpy.isnan(matrix)).sum(axis=1),
+        starts
+    )
+    aggregated = aggregate(aggregation, matrix, starts, counts)
+    # no row in the SQL result where there is no data
+    # (nor where STDDEV is NULL)
+    present = (counts > 0) & ~numpy.isnan(aggregated)
+    return keys[present], aggregated[present]
+
+Addition.array_operation = numpy.add
+Subtraction.array_operation = numpy.subtract
+Multiplication.array_operation = numpy.multiply
+Division.array_operation = numpy.divide
+
+@evaluate.implementation(Addition, Subtraction, Multiplication, Division)
+def BinaryOperator_evaluate(binop, context):
+    # Numbers are applied to all values, results are joined by key
+    # (like the R functions in CodeGeneration.init_R_interpreter)
+    operation = binop.array_operation
+    left = evaluate(binop.left, context)
+    right = evaluate(binop.right, context)
+    if isinstance(left, float):
+        if isinstance(right, float):
+            return operation(left, right)
+        right_keys, right_values = right
+        return right_keys, operation(left, right_values)
+    left_keys, left_values = left
+    if isinstance(right, float):
+        return left_keys, operation(left_values, right)
+    right_keys, right_values = right
+    keys, left_indices, right_indices = numpy.intersect1d(
+        left_keys,
+        right_keys,
+        assume_unique = True,
+        return_indices = True
+    )
+    return keys, operation(
+        left_values[left_indices],
+        right_values[right_indices]
+    )
+
+@evaluate.implementation(Pow)
+def Pow_evaluate(binop, context):
+    left = evaluate(binop.left, context)
+    exponent = binop.right
+    if isinstance(exponent, Number):
+        exponent = exponent.value
+    if isinstance(left, float):
+        return left ** exponent
+    keys, values = left
+    return keys, numpy.power(values, exponent)
+
+
+def values_for(
+    expression,
+    key,
+    place_ids = None,
+    previous_december = False,
+    max_age = 3600
+):
+    """Evaluate an expression.
+
+    key: "place_id", "time_period" or "year"
+    place_ids: only use values for these places
+    previous_december: years start with the previous December
+    max_age: reload sample tables loaded longer ago (seconds)
+
+    Returns a tuple (keys, values, units) with keys and values as arrays.
+    Keys for which the value is not a finite number are left out.
+
+    Raises DuplicateSamples if a sample table can not be evaluated as array.
+    """
+    expression_units = units(expression)
+    if expression_units is None:
+        analysis_strings = []
+        def analysis_out(*things):
+            analysis_strings.append("".join(map(str, things)))
+        analysis(expression, analysis_out)
+        raise MeaninglessUnitsException(
+            "\n".join(analysis_strings)
+        )
+    if key not in ("place_id", "time_period", "year"):
+        raise ValueError("Cannot group values by %s" % key)
+    if place_ids is not None:
+        place_ids = numpy.array(place_ids, dtype=numpy.int64)
+
+    context = Context(key, place_ids, int(bool(previous_december)), max_age)
+    with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        result = evaluate(expression, context)
+    if isinstance(result, float):
+        # no data involved
+        keys, values = empty_result()
+    else:
+        keys, values = result
+        finite = numpy.isfinite(values)
+        if not finite.all():
+            keys = keys[finite]
+            values = values[finite]
+    return keys, values, expression_units
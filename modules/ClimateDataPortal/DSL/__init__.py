@@ -435,4 +435,13 @@ from CodeGeneration import (
     init_R_interpreter
 )
 from GridSizing import grid_sizes
+try:
+    from ArrayEvaluation import (
+        DuplicateSamples,
+        can_be_evaluated_as_arrays,
+        values_for as array_values_for
+    )
+except ImportError:
+    # NumPy not installed
+    DuplicateSamples = can_be_evaluated_as_arrays = array_values_for = None
 import Stringification
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the array evaluation backend against SQL
+
+Evaluates expressions with the array backend and with the SQL which the
+DSL generates for each aggregation (joined by key like the R functions
+do), on the sample tables in the database, and compares the results.
+
+To run this script use:
+python web2py.py -S eden -M -R applications/eden/modules/ClimateDataPortal/DSL/benchmark.py -A ["expression" [place_id,...]]
+"""
+
+import sys
+import time
+
+ClimateDataPortal = local_import("ClimateDataPortal")
+Climate_DSL = local_import("ClimateDataPortal.DSL")
+ArrayEvaluation = local_import("ClimateDataPortal.DSL.ArrayEvaluation")
+CodeGeneration = local_import("ClimateDataPortal.DSL.CodeGeneration")
+
+# Map overlay: difference of summer averages of two 20 year periods
+DEFAULT_EXPRESSION = """
+    Average(
+        "Observed Temp Max",
+        From(1990),
+        To(2009),
+        Months(June, July, August)
+    ) - Average(
+        "Observed Temp Max",
+        From(1970),
+        To(1989),
+        Months(June, July, August)
+    )
+"""
+
+# Number of places for the yearly chart
+CHART_PLACES = 5
+
+# Number of runs, the best time is reported
+RUNS = 3
+
+operators = {
+    Climate_DSL.Addition: lambda left, right: left + right,
+    Climate_DSL.Subtraction: lambda left, right: left - right,
+    Climate_DSL.Multiplication: lambda left, right: left * right,
+    Climate_DSL.Division: lambda left, right: left / right,
+}
+
+def grouping_key(key, previous_december):
+    # same as MapPlugin.values_for
+    if key == "year":
+        return "(time_period - ((time_period + 1000008 + %i%s) %% 12))" % (
+            ClimateDataPortal.start_month_0_indexed,
+            " +1" if previous_december else "",
+        )
+    return key
+
+def sql_values_for(expression, key, extra_filter):
+    """Evaluate an expression with SQL for each aggregation,
+    returns a dict {key: value}
+    """
+    if isinstance(expression, Climate_DSL.Number):
+        return expression.value
+    if isinstance(expression, Climate_DSL.aggregations):
+        output = []
+        CodeGeneration.SQL(
+            expression,
+            key,
+            lambda *strings: output.extend(strings),
+            extra_filter
+        )
+        # the generated SQL is quoted for R strings
+        sql = "".join(map(str, output)).replace('\\"', '"')
+        return dict(
+            (row_key, value)
+            for row_key, value in db.executesql(sql)
+            if value is not None
+        )
+    left = sql_values_for(expression.left, key, extra_filter)
+    if isinstance(expression, Climate_DSL.Pow):
+        exponent = expression.right
+        if isinstance(exponent, Climate_DSL.Number):
+            exponent = exponent.value
+        if isinstance(left, float):
+            return left ** exponent
+        return dict((k, v ** exponent) for k, v in left.items())
+    right = sql_values_for(expression.right, key, extra_filter)
+    operator = operators[type(expression)]
+    if isinstance(left, float):
+        if isinstance(right, float):
+            return operator(left, right)
+        left = dict((k, left) for k in right)
+    elif isinstance(right, float):
+        right = dict((k, right) for k in left)
+    result = {}
+    for k in left:
+        if k in right:
+            try:
+                result[k] = operator(float(left[k]), float(right[k]))
+            except ZeroDivisionError:
+                # not finite => left out by the array backend
+                pass
+    return result
+
+def best_time(function):
+    best = None
+    for run in range(RUNS):
+        start = time.time()
+        result = function()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best, result
+
+def compare(sql_result, keys, values):
+    """Returns the number of keys with different results"""
+    array_result = dict(zip(keys.tolist(), values.tolist()))
+    differences = len(set(sql_result) ^ set(array_result))
+    for k in set(sql_result) & set(array_result):
+        expected = float(sql_result[k])
+        if abs(array_result[k] - expected) > 1e-6 * max(1, abs(expected)):
+            differences += 1
+    return differences
+
+def benchmark(title, expression, key, place_ids = None):
+    previous_december = False
+    extra_filter = None
+    if place_ids is not None:
+        extra_filter = "place_id IN (%s)" % ",".join(map(str, place_ids))
+
+    sql_time, sql_result = best_time(
+        lambda: sql_values_for(
+            expression,
+            grouping_key(key, previous_december),
+            extra_filter
+        )
+    )
+
+    ArrayEvaluation.clear_loaded_sample_arrays()
+    start = time.time()
+    ArrayEvaluation.values_for(expression, key, place_ids = place_ids)
+    cold_time = time.time() - start
+
+    warm_time, (keys, values, units) = best_time(
+        lambda: ArrayEvaluation.values_for(expression, key, place_ids = place_ids)
+    )
+
+    print "%s: %i keys" % (title, len(keys))
+    print "    SQL:          %.4fs" % sql_time
+    print "    array (cold): %.4fs (including loading the tables)" % cold_time
+    print "    array (warm): %.4fs" % warm_time
+    print "    different results: %i" % compare(sql_result, keys, values)
+
+args = request.args
+if args:
+    expression_string = args[0]
+else:
+    expression_string = DEFAULT_EXPRESSION
+expression = Climate_DSL.parse(expression_string)
+if not Climate_DSL.can_be_evaluated_as_arrays(expression):
+    print "Expression uses sample tables which are not monthly"
+    sys.exit(1)
+
+if len(args) > 1:
+    place_ids = map(int, args[1].split(","))
+else:
+    place_table = s3db.climate_place
+    place_ids = [
+        row.id for row in db().select(
+            place_table.id,
+            orderby = place_table.id,
+            limitby = (0, CHART_PLACES)
+        )
+    ]
+
+benchmark("Map overlay (all places)", expression, "place_id")
+benchmark(
+    "Yearly chart (%i places)" % len(place_ids),
+    expression,
+    "year",
+    place_ids = place_ids
+)
@@ -299,6 +299,73 @@ def test_december_data():
     # December 1956 values for station 101, (place #1)
     assert values[0] == (2.5 + 15.2 + 3.8)
 
+def test_december_data_arrays():
+    expression = Climate_DSL.parse("""
+        Sum(
+            "Observed Temp Max",
+            From(1957),
+            To(1957),
+            Months(PreviousDecember)
+        )
+    """)
+    keys, values, units = Climate_DSL.array_values_for(
+        expression,
+        "time_period",
+        place_ids = [1]
+    )
+    assert len(keys) == 1, "No data"
+    assert ClimateDataPortal.month_number_to_year_month(keys[0]) == (1956, 12)
+    # December 1956 values for station 101, (place #1)
+    assert values[0] == (2.5 + 15.2 + 3.8)
+
+def test_duplicate_samples_arrays():
+    # SQL aggregates all rows for a (place_id, time_period), which
+    # the dense arrays can not represent => must be rejected
+    import sqlite3
+    import numpy
+    ArrayEvaluation = local_import("ClimateDataPortal.DSL.ArrayEvaluation")
+    connection = sqlite3.connect(":memory:")
+    connection.execute(
+        "CREATE TABLE duplicate_samples "
+        "(place_id integer, time_period integer, value real)"
+    )
+    class SampleTable(object):
+        table_name = "duplicate_samples"
+        class db(object):
+            class _adapter(object):
+                cursor = connection.cursor()
+
+    rows = [(1, 10, 2.5), (1, 11, 3.0), (2, 10, 1.0)]
+    connection.executemany("INSERT INTO duplicate_samples VALUES (?,?,?)", rows)
+    sample_array = ArrayEvaluation.SampleArray.load(SampleTable)
+    values = sample_array.values
+    assert sample_array.place_ids.tolist() == [1, 2]
+    assert sample_array.time_periods.tolist() == [10, 11]
+    assert values[0].tolist() == [2.5, 3.0]
+    assert values[1][0] == 1.0 and numpy.isnan(values[1][1])
+
+    connection.execute("INSERT INTO duplicate_samples VALUES (1, 11, 4.0)")
+    try:
+        ArrayEvaluation.SampleArray.load(SampleTable)
+    except ArrayEvaluation.DuplicateSamples:
+        pass
+    else:
+        assert False, "Duplicate samples not rejected"
+
+    # Failure is remembered, the table is not reloaded for every request
+    ArrayEvaluation.clear_loaded_sample_arrays()
+    for attempt in range(2):
+        try:
+            ArrayEvaluation.loaded_sample_array(SampleTable, 3600)
+        except ArrayEvaluation.DuplicateSamples as exception:
+            if attempt == 0:
+                first = exception
+            else:
+                assert exception is first
+        else:
+            assert False, "Duplicate samples not rejected"
+    ArrayEvaluation.clear_loaded_sample_arrays()
+
 """Maximum("Observed Temp Max", From(1950), To(2100 ))"""
 
 failures = 0
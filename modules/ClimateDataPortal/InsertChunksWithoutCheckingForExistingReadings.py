@@ -1,40 +1,79 @@
 
+from io import StringIO
+
 class InsertChunksWithoutCheckingForExistingReadings(object):
-    """Insert chunks of 1000 records at a time, bypassing web2py's OR/M.
-    
-    This is much faster but not as safe, depending on the constraint 
+    """Insert chunks of records at a time, bypassing web2py's OR/M.
+
+    This is much faster but not as safe, depending on the constraint
     checking of the database.
-    
-    * should take names of fields
+
+    On PostgreSQL the chunks are streamed in with COPY, other databases
+    get one multi-row INSERT per chunk.
     """
+    chunk_size = 10000
+
     def __init__(self, sample_table):
         self.chunk = []
         self.sample_table = sample_table
-    
+        self.count = 0
+
+        db = sample_table.db
+        adapter = db._adapter
+        self.use_copy = (
+            adapter.dbengine == "postgres" and
+            hasattr(adapter.cursor, "copy_from")
+        )
+
     def write_chunk(self):
-        #self.sample_table.insert_values(self.chunk)
-        print "\n".join(self.chunk)
+        chunk = self.chunk
+        if not chunk:
+            return
+        sample_table = self.sample_table
+        if self.use_copy:
+            data = StringIO(u"".join(
+                u"%i\t%i\t%r\n" % reading for reading in chunk
+            ))
+            sample_table.db._adapter.cursor.copy_from(
+                data,
+                sample_table.table_name,
+                columns = ("time_period", "place_id", "value")
+            )
+        else:
+            sample_table.insert_values(
+                ["(%i,%i,%r)" % reading for reading in chunk]
+            )
+        self.count += len(chunk)
         self.chunk = []
-    
+
     def __call__(
         self,
         time_period,
         place_id,
         value
     ):
-#        self.chunk.append("".join((
-#            "(",
-#                str(time_period),",",
-#                str(place_id),",",
-#                str(value),
-#            ")"
-#        )))
-        self.chunk.append(
-            "%i,%i,%f" % (place_id, time_period, value)
+        self.chunk.append((time_period, place_id, float(value)))
+        if len(self.chunk) >= self.chunk_size:
+            self.write_chunk()
+
+    def add_readings(
+        self,
+        time_period,
+        place_ids,
+        values
+    ):
+        """Add readings for many places in the same time period
+
+        place_ids and values are sequences (or arrays) of the same length
+        """
+        if not isinstance(place_ids, list):
+            place_ids = place_ids.tolist()
+        if not isinstance(values, list):
+            values = values.tolist()
+        self.chunk.extend(
+            zip([time_period] * len(place_ids), place_ids, values)
         )
-        if len(self.chunk) >= 1000:
+        if len(self.chunk) >= self.chunk_size:
             self.write_chunk()
-            
+
     def done(self):
-        if len(self.chunk) > 0:    
-            self.write_chunk()
+        self.write_chunk()
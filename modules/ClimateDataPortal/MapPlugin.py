@@ -77,9 +77,78 @@ class MapPlugin(object):
         self.place_table = place_table
         self.robjects = robjects
         R = self.R = robjects.r
-        env.DSL.init_R_interpreter(R, current.deployment_settings.database)
+        settings = current.deployment_settings
+        env.DSL.init_R_interpreter(R, settings.database)
         self.client_config = client_config
 
+        self.array_backend = settings.get_climate_array_backend()
+        if self.array_backend and env.DSL.array_values_for is None:
+            import logging
+            logging.getLogger().error(
+        """NumPy is required by the array backend of the climate data portal,
+        falling back to evaluation by R.""")
+            self.array_backend = False
+        self.array_cache_time = settings.get_climate_array_cache_time()
+
+    def values_for(self,
+                   expression,
+                   key,
+                   place_ids = None,
+                   previous_december = False
+                   ):
+        """
+            Evaluate an expression
+
+            @param expression: the parsed expression
+            @param key: group values by "place_id", "time_period" or "year"
+            @param place_ids: only use the values for these places
+            @param previous_december: years start with the previous December
+
+            @return: tuple (keys, values)
+        """
+
+        DSL = self.env.DSL
+        if self.array_backend and DSL.can_be_evaluated_as_arrays(expression):
+            try:
+                keys, values, units = DSL.array_values_for(
+                    expression,
+                    key,
+                    place_ids = place_ids,
+                    previous_december = previous_december,
+                    max_age = self.array_cache_time,
+                )
+            except DSL.DuplicateSamples as exception:
+                # Only SQL aggregates duplicate rows correctly
+                import logging
+                logging.getLogger().warning(
+                    "%s, falling back to evaluation by R." % exception
+                )
+            else:
+                return keys.tolist(), values.tolist()
+
+        if key == "year":
+            grouping_key = "(time_period - ((time_period + 1000008 + %i%s) %% 12))" % (
+                start_month_0_indexed,
+                " +1" if previous_december else "",
+            )
+        else:
+            grouping_key = key
+        if place_ids is not None:
+            extra_filter = "place_id IN (%s)" % ",".join(map(str, place_ids))
+        else:
+            extra_filter = None
+
+        code = DSL.R_Code_for_values(expression, grouping_key, extra_filter)
+        data_frame = self.R(code)()
+        # R willfully removes empty data frame columns
+        # which is ridiculous behaviour
+        if isinstance(data_frame, self.robjects.vectors.StrVector):
+            raise Exception(str(data_frame))
+        elif data_frame.ncol == 0:
+            return [], []
+        else:
+            return list(data_frame.rx2("key")), list(data_frame.rx2("value"))
+
     def extend_gis_map(self, map):
 
         T = current.T
@@ -132,22 +201,7 @@ S3.gis.maps['%s'].registerPlugin(plugin);''' % map.id)
             )
 
         def generate_map_overlay_data(file_path):
-            R = self.R
-            code = DSL.R_Code_for_values(expression, "place_id")
-            values_by_place_data_frame = R(code)()
-            # R willfully removes empty data frame columns
-            # which is ridiculous behaviour
-            if isinstance(
-                values_by_place_data_frame,
-                self.robjects.vectors.StrVector
-            ):
-                raise Exception(str(values_by_place_data_frame))
-            elif values_by_place_data_frame.ncol == 0:
-                keys = []
-                values = []
-            else:
-                keys = values_by_place_data_frame.rx2("key")
-                values = values_by_place_data_frame.rx2("value")
+            keys, values = self.values_for(expression, "place_id")
 
             overlay_data_file = None
             try:
@@ -207,22 +261,7 @@ S3.gis.maps['%s'].registerPlugin(plugin);''' % map.id)
             )
 
         def generate_map_csv_data(file_path):
-            R = self.R
-            code = DSL.R_Code_for_values(expression, "place_id")
-            values_by_place_data_frame = R(code)()
-            # R willfully removes empty data frame columns
-            # which is ridiculous behaviour
-            if isinstance(
-                values_by_place_data_frame,
-                self.robjects.vectors.StrVector
-            ):
-                raise Exception(str(values_by_place_data_frame))
-            elif values_by_place_data_frame.ncol == 0:
-                keys = []
-                values = []
-            else:
-                keys = values_by_place_data_frame.rx2("key")
-                values = values_by_place_data_frame.rx2("value")
+            keys, values = self.values_for(expression, "place_id")
             db = current.db
             try:
                 csv_data_file = open(file_path, "w")
@@ -329,32 +368,15 @@ S3.gis.maps['%s'].registerPlugin(plugin);''' % map.id)
                     )
                 is_yearly_values = "Months(" in query_expression
                 yearly.append(is_yearly_values)
-                if is_yearly_values:
-                    if "Prev" in query_expression:
-                        # PreviousDecember handling:
-                        grouping_key = "(time_period - ((time_period + 1000008 + %i +1) %% 12))" % start_month_0_indexed
-                    else:
-                        grouping_key = "(time_period - ((time_period + 1000008 + %i) %% 12))" % start_month_0_indexed
-                else:
-                    grouping_key = "time_period"
-                code = DSL.R_Code_for_values(
+                keys, values = self.values_for(
                     expression,
-                    grouping_key,
-                    "place_id IN (%s)" % ",".join(map(str, spec["place_ids"]))
+                    "year" if is_yearly_values else "time_period",
+                    place_ids = spec["place_ids"],
+                    # PreviousDecember handling:
+                    previous_december = is_yearly_values and "Prev" in query_expression,
                 )
-                #print code
-                values_by_time_period_data_frame = R(code)()
                 data = {}
-                if isinstance(
-                    values_by_time_period_data_frame,
-                    self.robjects.vectors.StrVector
-                ):
-                    raise Exception(str(values_by_time_period_data_frame))
-                elif values_by_time_period_data_frame.ncol == 0:
-                    pass
-                else:
-                    keys = values_by_time_period_data_frame.rx2("key")
-                    values = values_by_time_period_data_frame.rx2("value")
+                if keys:
                     try:
                         display_units = {
                             "Kelvin": "Celsius",
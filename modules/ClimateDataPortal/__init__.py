@@ -493,6 +493,64 @@ class SampleTable(object):
             years.append(year)
         return years
 
+def undefined_values(values):
+    "Mask of the values which are undefined (missing data markers)"
+    import numpy
+    mask = (
+        ((values > -99.900003) & (values < -99.9)) |
+        (values < -1e8) |
+        (values > 1e8) |
+        numpy.isnan(values)
+    )
+    return mask
+
+def get_or_create_places(latitudes, longitudes, create = True):
+    """Look up the places for all points of a lat/lon grid in one query,
+    and create the missing ones in one batch.
+
+    Returns a 2D array of place IDs, indexed [latitude, longitude],
+    with 0 for places which don't exist (if create is False)
+    """
+    import numpy
+    def key(latitude, longitude):
+        return (round(latitude, 6), round(longitude, 6))
+
+    climate_place = current.s3db.climate_place
+    latitudes = numpy.asarray(latitudes).tolist()
+    longitudes = numpy.asarray(longitudes).tolist()
+
+    place_ids = {}
+    for place in db(
+        (climate_place.latitude >= min(latitudes) - 1e-6) &
+        (climate_place.latitude <= max(latitudes) + 1e-6) &
+        (climate_place.longitude >= min(longitudes) - 1e-6) &
+        (climate_place.longitude <= max(longitudes) + 1e-6)
+    ).select(
+        climate_place.id,
+        climate_place.latitude,
+        climate_place.longitude,
+    ):
+        place_ids[key(place.latitude, place.longitude)] = place.id
+
+    if create:
+        missing = []
+        for latitude in latitudes:
+            for longitude in longitudes:
+                if key(latitude, longitude) not in place_ids:
+                    missing.append(
+                        dict(latitude = latitude, longitude = longitude)
+                    )
+        if missing:
+            new_ids = climate_place.bulk_insert(missing)
+            for place, place_id in zip(missing, new_ids):
+                place_ids[key(place["latitude"], place["longitude"])] = place_id
+            db.commit()
+
+    return numpy.array([
+        [place_ids.get(key(latitude, longitude), 0) for longitude in longitudes]
+        for latitude in latitudes
+    ], dtype = numpy.int64)
+
 def init_SampleTable():
     """
     """
@@ -518,4 +576,5 @@ def init_SampleTable():
             )
 init_SampleTable()
 
+from Cache import open_cached_file
 from MapPlugin import MapPlugin
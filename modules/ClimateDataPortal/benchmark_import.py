@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the NetCDF readings import
+
+Measures the bulk resolution of grid places, and the rate at which the
+chunked writer stores readings (rows/s) with COPY (PostgreSQL only) and
+with multi-row INSERTs, compared to one INSERT per reading, on a
+synthetic grid in the database.
+
+The places and the readings table are removed afterwards.
+
+To run this script use:
+python web2py.py -S eden -M -R applications/eden/modules/ClimateDataPortal/benchmark_import.py -A [time_steps [latitudes [longitudes]]]
+"""
+
+import time
+
+import numpy
+
+ClimateDataPortal = local_import("ClimateDataPortal")
+InsertChunksWithoutCheckingForExistingReadings = local_import(
+    "ClimateDataPortal.InsertChunksWithoutCheckingForExistingReadings"
+).InsertChunksWithoutCheckingForExistingReadings
+
+# Grid size (time steps x latitudes x longitudes)
+DEFAULT_GRID = (24, 100, 100)
+
+# Share of the readings which are missing data markers
+UNDEFINED_RATIO = 0.1
+
+# The synthetic grid is placed where no data is imported
+SOUTH_WEST = (-89.9, -179.9)
+
+class BenchmarkTable(object):
+    """Readings table with the layout of a sample table"""
+
+    table_name = "climate_benchmark_readings"
+
+    def __init__(self, db):
+        self.db = db
+
+    def create(self):
+        self.db.executesql(
+            """
+            CREATE TABLE %s
+            (
+              place_id integer NOT NULL,
+              time_period smallint NOT NULL,
+              value double precision NOT NULL,
+              PRIMARY KEY (place_id, time_period)
+            );
+            """ % self.table_name
+        )
+        self.db.commit()
+
+    def drop(self):
+        self.db.executesql("DROP TABLE IF EXISTS %s;" % self.table_name)
+        self.db.commit()
+
+    def insert_values(self, values):
+        self.db.executesql(
+            "INSERT INTO %s (time_period, place_id, value) VALUES %s;" % (
+                self.table_name,
+                ",".join(values)
+            )
+        )
+
+def synthetic_grid(time_steps, number_of_latitudes, number_of_longitudes):
+    "float32 values like in a NetCDF file, with missing data markers"
+    random = numpy.random.RandomState(1)
+    values = (random.random_sample(
+        (time_steps, number_of_latitudes, number_of_longitudes)
+    ) * 30).astype(numpy.float32)
+    values[random.random_sample(values.shape) < UNDEFINED_RATIO] = -99.9
+    south, west = SOUTH_WEST
+    latitudes = (
+        south + numpy.arange(number_of_latitudes) * 0.01
+    ).astype(numpy.float32)
+    longitudes = (
+        west + numpy.arange(number_of_longitudes) * 0.01
+    ).astype(numpy.float32)
+    return values, latitudes, longitudes
+
+def remove_places(latitudes, longitudes):
+    table = s3db.climate_place
+    db(
+        (table.latitude >= float(latitudes.min()) - 1e-6) &
+        (table.latitude <= float(latitudes.max()) + 1e-6) &
+        (table.longitude >= float(longitudes.min()) - 1e-6) &
+        (table.longitude <= float(longitudes.max()) + 1e-6)
+    ).delete()
+    db.commit()
+
+def write_readings(table, values, place_ids, use_copy):
+    "Write the defined readings with the chunked writer, returns the count"
+    writer = InsertChunksWithoutCheckingForExistingReadings(table)
+    writer.use_copy = use_copy
+    for time_period, time_step_values in enumerate(values):
+        time_step_values = numpy.asarray(time_step_values, dtype = numpy.float64)
+        defined = ~ClimateDataPortal.undefined_values(time_step_values)
+        writer.add_readings(
+            time_period,
+            place_ids[defined],
+            time_step_values[defined] + 273.15
+        )
+    writer.done()
+    db.commit()
+    return writer.count
+
+def write_single_readings(table, values, place_ids):
+    "Write the defined readings of the first time step one at a time"
+    time_step_values = numpy.asarray(values[0], dtype = numpy.float64)
+    defined = ~ClimateDataPortal.undefined_values(time_step_values)
+    count = 0
+    for place_id, value in zip(
+        place_ids[defined].tolist(),
+        (time_step_values[defined] + 273.15).tolist()
+    ):
+        table.insert_values(["(%i,%i,%r)" % (0, place_id, value)])
+        count += 1
+    db.commit()
+    return count
+
+def report(title, count, duration):
+    print "    %s: %i rows in %.2fs, %i rows/s" % (
+        title,
+        count,
+        duration,
+        count / duration
+    )
+
+def benchmark(time_steps, number_of_latitudes, number_of_longitudes):
+    values, latitudes, longitudes = synthetic_grid(
+        time_steps,
+        number_of_latitudes,
+        number_of_longitudes
+    )
+    print "Grid: %i time steps x %i x %i places" % values.shape
+
+    table = BenchmarkTable(db)
+    table.drop()
+    remove_places(latitudes, longitudes)
+    try:
+        print "Place resolution:"
+        start = time.time()
+        place_ids = ClimateDataPortal.get_or_create_places(latitudes, longitudes)
+        duration = time.time() - start
+        print "    create: %i places in %.2fs" % (place_ids.size, duration)
+        start = time.time()
+        ClimateDataPortal.get_or_create_places(latitudes, longitudes)
+        duration = time.time() - start
+        print "    look up: %i places in %.2fs" % (place_ids.size, duration)
+
+        print "Readings:"
+        modes = [("multi-row INSERT", False)]
+        if InsertChunksWithoutCheckingForExistingReadings(table).use_copy:
+            modes.insert(0, ("COPY", True))
+        else:
+            print "    COPY: not available (requires PostgreSQL with psycopg2)"
+        for title, use_copy in modes:
+            table.create()
+            start = time.time()
+            count = write_readings(table, values, place_ids, use_copy)
+            report(title, count, time.time() - start)
+            table.drop()
+
+        table.create()
+        start = time.time()
+        count = write_single_readings(table, values, place_ids)
+        report("single-row INSERT (first time step)", count, time.time() - start)
+    finally:
+        db.rollback()
+        table.drop()
+        remove_places(latitudes, longitudes)
+
+grid = list(DEFAULT_GRID)
+for position, arg in enumerate(request.args[:3]):
+    grid[position] = int(arg)
+benchmark(*grid)
@@ -41,24 +41,6 @@ def get_or_create(dict, key, creator):
         value = dict[key] = creator()
     return value
 
-def get_or_create_record(table, query):
-    query_terms = []
-    for key, value in query.iteritems():
-        query_terms.append(getattr(table, key) == value)
-    reduced_query = reduce(
-        (lambda left, right: left & right),
-        query_terms
-    )
-    records = db(reduced_query).select()
-    count = len(records)
-    assert count <= 1, "Multiple records for %s" % query
-    if count == 0:
-        record = table.insert(**query)
-        db.commit()
-    else:
-        record = records.first()
-    return record.id
-
 def nearly(expected_float, actual_float):
     difference_ratio = actual_float / expected_float
     return 0.999 < abs(difference_ratio) < 1.001
@@ -96,41 +78,38 @@ def nearly(expected_float, actual_float):
     
 import datetime
 
+import numpy
+
 def import_climate_readings(
     netcdf_file,
     field_name,
     add_reading,
     converter,
     start_date_time_string = None,
-    is_undefined = (lambda x: (-99.900003 < x < -99.9) or (x < -1e8) or (x > 1e8)),
+    is_undefined = None,
     time_step_string = None,
     month_mapping_string = None,
     skip_places = False
 ):
     """
     Assumptions:
-        * there are no places
-        * the data is in order of places
+        * the data is a time x lat x lon grid (optionally with a level
+          dimension of size 1 after time)
+
+    Variables are read as arrays one time step at a time, undefined values
+    are masked in bulk, and converter is applied to whole arrays.
+
+    is_undefined may be given to override the default missing data test,
+    either as array function returning a mask, or as function of a single
+    value (slower).
     """
-    
+
     variables = netcdf_file.variables
-    if field_name is "?":
-        print ("field_name could be one of %s" % variables.keys())
+    if field_name == "?":
+        print ("field_name could be one of %s" % list(variables.keys()))
     else:
-        month_mapping_string
-    
-        def to_list(variable):
-            result = []
-            for i in range(len(variable)):
-                result.append(variable[i])
-            return result
-        
-        def iter_pairs(list):
-            for index in range(len(list)):
-                yield index, list[index]
-        
         time = variables["time"]
-        times = to_list(time)
+        times = numpy.asarray(time[:])
         try:
             time_units_string = time.units
         except AttributeError:
@@ -154,101 +133,90 @@ def import_climate_readings(
                 assert time_step_string == parsed_time_step_string
             else:
                 time_step_string = parsed_time_step_string
-        
+
         time_step = datetime.timedelta(**{time_step_string: 1})
-        
+
         try:
             lat_variable = variables["lat"]
         except KeyError:
             lat_variable = variables["latitude"]
-        lat = to_list(lat_variable)
-        
+        lat = numpy.asarray(lat_variable[:])
+
         try:
             lon_variable = variables["lon"]
         except KeyError:
             lon_variable = variables["longitude"]
-            
+        lon = numpy.asarray(lon_variable[:])
+
         month_mapping = {
             "rounded": ClimateDataPortal.rounded_date_to_month_number,
             "twelfths": ClimateDataPortal.floored_twelfth_of_a_360_day_year,
-            "calendar": ClimateDataPortal.date_to_month_number 
+            "calendar": ClimateDataPortal.date_to_month_number
         }[month_mapping_string]
+
+        if is_undefined is None:
+            undefined = ClimateDataPortal.undefined_values
+        else:
+            def undefined(values):
+                mask = is_undefined(values)
+                if numpy.shape(mask) != values.shape:
+                    mask = numpy.vectorize(is_undefined, otypes = [bool])(values)
+                return mask
+
         try:
             tt = variables[field_name]
         except KeyError:
             raise Exception(
                 "Can't find %s in %s" % (
                     field_name,
-                    variables.keys()
+                    list(variables.keys())
                 )
             )
         else:
-            # create grid of places
-            place_ids = {}
-            
-            lon = to_list(lon_variable)
-            if skip_places:
-                for place in db(climate_place.id > 0).select(
-                    climate_place.latitude,
-                    climate_place.longitude,
-                    climate_place.id
-                ):
-                    place_ids[(
-                        round(place.latitude, 6),
-                        round(place.longitude, 6)
-                    )] = place.id
-            else:
-                for latitude in lat:
-                    for longitude in lon:
-                        record = get_or_create_record(
-                            climate_place,
-                            dict(
-                                longitude = longitude,
-                                latitude = latitude
-                            )
-                        )
-                        place_ids[(
-                            round(latitude, 6), 
-                            round(longitude, 6)
-                        )] = record
-                        #print longitude, latitude, record
-
-            #print "up to:", len(times)
-            print "place_id, time_period, value"
-            for time_index, time_step_count in iter_pairs(times):
+            # resolve (or create) the grid of places
+            place_ids = ClimateDataPortal.get_or_create_places(
+                lat,
+                lon,
+                create = not skip_places
+            )
+
+            start_month_number = ClimateDataPortal.date_to_month_number(start_date_time)
+            number_of_times = len(times)
+            for time_index, time_step_count in enumerate(times.tolist()):
                 sys.stderr.write(
                     "%s %s\n" % (
                         time_index,
-                        "%i%%" % int((time_index * 100) / len(times))
+                        "%i%%" % int((time_index * 100) / number_of_times)
                     )
                 )
-                #print time_period
                 if month_mapping_string == "twelfths":
                     year_offset = ((time_step * int(time_step_count)).days) / 360.0
                     month_number = int(
-                        ClimateDataPortal.date_to_month_number(start_date_time)
-                        + (year_offset * 12.0)
+                        start_month_number + (year_offset * 12.0)
                     )
-                    #print month_number, year_offset
                 else:
                     time_period = start_date_time + (time_step * int(time_step_count))
                     month_number = month_mapping(time_period)
-                    #print month_number, time_period
-                values_by_time = tt[time_index]
-                if len(tt[time_index]) == 1:
-                    values_by_time = values_by_time[0]
-                for latitude_index, latitude in iter_pairs(lat):
-                    values_by_latitude = values_by_time[latitude_index]
-                    for longitude_index, longitude in iter_pairs(lon):
-                        value = values_by_latitude[longitude_index]
-                        if not is_undefined(value):
-                            place_id = place_ids[(round(latitude, 6), round(longitude, 6))]
-                            converted_value = converter(value)
-                            add_reading(
-                                time_period = month_number,
-                                place_id = place_id,
-                                value = converted_value
-                            )
+
+                values = tt[time_index]
+                if numpy.ndim(values) == 3 and len(values) == 1:
+                    values = values[0]
+                if numpy.ma.isMaskedArray(values):
+                    defined = ~numpy.ma.getmaskarray(values)
+                    values = numpy.ma.getdata(values)
+                else:
+                    defined = True
+                values = numpy.asarray(values, dtype = numpy.float64)
+                defined = defined & ~undefined(values)
+                if skip_places:
+                    # don't import readings for unknown places
+                    defined &= (place_ids != 0)
+
+                add_reading.add_readings(
+                    month_number,
+                    place_ids[defined],
+                    converter(values[defined])
+                )
         add_reading.done()
         db.commit()
 
@@ -70,10 +70,12 @@ from .s3hierarchy import *
 
 # Model Extensions
 from .s3model import DYNAMIC_PREFIX, S3Model
+from .s3index import *
 
 # Resource Framework
 from .s3query import *
 from .s3resource import *
+from .s3export import *
 
 # Authentication, Authorization, Accounting
 from .s3aaa import *
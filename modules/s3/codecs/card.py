@@ -31,6 +31,15 @@
 __all__ = ("S3PDFCard",
            )
 
+import hashlib
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+
+from uuid import uuid4
+
 try:
     from reportlab.lib.pagesizes import A4, LETTER, landscape, portrait
     from reportlab.platypus import BaseDocTemplate, PageTemplate, Flowable, \
@@ -45,6 +54,18 @@ except ImportError:
     Flowable = object
     REPORTLAB = False
 
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    try:
+        from PyPDF2 import PdfReader, PdfWriter
+    except ImportError:
+        PDFMERGE = False
+    else:
+        PDFMERGE = True
+else:
+    PDFMERGE = True
+
 from gluon import current, HTTP
 
 from s3compat import BytesIO
@@ -53,6 +74,12 @@ from ..s3resource import S3Resource
 from ..s3utils import s3_str
 
 CREDITCARD = (153, 243) # Default format for cards (in points)
+
+# Render jobs for worker processes, {job_id: job}
+# - inherited by the workers when forked, so that the resource
+#   and layout do not need to be pickled
+_JOBS = {}
+
 # =============================================================================
 class S3PDFCard(S3Codec):
     """
@@ -90,6 +117,9 @@ class S3PDFCard(S3Codec):
                               - defaults to 18 points in both directions
             @keyword title: the document title,
                             - defaults to title_list crud string of the resource
+            @keyword workers: number of processes to render the cards in
+                              parallel, overrides the pdf_card_workers
+                              setting
 
             @return: a handle to the output
         """
@@ -169,6 +199,20 @@ class S3PDFCard(S3Codec):
                                 title = title,
                                 )
 
+        # Render in parallel?
+        workers = attr.get("workers")
+        if workers is None:
+            workers = current.deployment_settings.get_pdf_card_workers()
+        if workers and workers > 1 and PDFMERGE and hasattr(os, "fork") and \
+           len(items) > doc.cards_per_page:
+            return self.render_parallel(doc,
+                                        layout,
+                                        resource,
+                                        items,
+                                        labels = labels,
+                                        workers = workers,
+                                        )
+
         # Produce the flowables
         flowables = self.get_flowables(layout,
                                        resource,
@@ -212,9 +256,102 @@ class S3PDFCard(S3Codec):
                                orderby = orderby,
                                )
 
+    # -------------------------------------------------------------------------
+    def render_parallel(self,
+                        doc,
+                        layout,
+                        resource,
+                        items,
+                        labels = None,
+                        workers = 2,
+                        ):
+        """
+            Render the cards in page-aligned chunks in a pool of worker
+            processes, and concatenate the resulting PDF documents
+
+            @param doc: the S3PDFCardTemplate
+            @param layout: the S3PDFCardLayout subclass implementing the
+                           card layout
+            @param resource: the resource
+            @param items: the data items
+            @param labels: the field labels
+            @param workers: the number of worker processes
+
+            @returns: a BytesIO with the PDF document
+
+            NB workers are forked from the current process, so layouts
+               must not access the database during draw() - common data
+               for all cards should be looked up in lookup() instead,
+               which is called only once (here) before forking
+        """
+
+        # Look up common data
+        common = layout.lookup(resource, items)
+
+        # Split the items into page-aligned chunks, several per worker
+        # so that the workload is balanced even if pages vary in cost
+        cards_per_page = doc.cards_per_page
+        number_of_items = len(items)
+        number_of_pages = int(math.ceil(float(number_of_items) / cards_per_page))
+        pages_per_chunk = int(math.ceil(float(number_of_pages) / (workers * 4)))
+        chunksize = max(pages_per_chunk, 1) * cards_per_page
+        chunks = [(start, min(start + chunksize, number_of_items))
+                  for start in range(0, number_of_items, chunksize)
+                  ]
+
+        job_id = uuid4().hex
+        _JOBS[job_id] = {"doc": doc,
+                         "layout": layout,
+                         "resource": resource,
+                         "items": items,
+                         "labels": labels,
+                         "common": common,
+                         }
+        try:
+            if hasattr(multiprocessing, "get_context"):
+                context = multiprocessing.get_context("fork")
+            else:
+                # Python 2 forks anyway
+                context = multiprocessing
+            pool = context.Pool(processes = min(workers, len(chunks)))
+            try:
+                documents = pool.map(render_chunk,
+                                     [(job_id, start, end) for start, end in chunks],
+                                     chunksize = 1,
+                                     )
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        finally:
+            del _JOBS[job_id]
+
+        # Concatenate the documents
+        writer = PdfWriter()
+        for document in documents:
+            reader = PdfReader(BytesIO(document))
+            for page in reader.pages:
+                writer.add_page(page)
+        if doc.title:
+            writer.add_metadata({"/Title": doc.title})
+
+        output_stream = BytesIO()
+        writer.write(output_stream)
+
+        output_stream.seek(0)
+        return output_stream
+
     # -------------------------------------------------------------------------
     @staticmethod
-    def get_flowables(layout, resource, items, labels=None, cards_per_page=1):
+    def get_flowables(layout,
+                      resource,
+                      items,
+                      labels = None,
+                      cards_per_page = 1,
+                      common = None,
+                      ):
         """
             Get the Flowable-instances for the data items
 
@@ -224,6 +361,7 @@ class S3PDFCard(S3Codec):
             @param items: the data items
             @param labels: the field labels
             @param cards_per_page: the number of cards per page
+            @param common: common data for all cards (if already looked up)
         """
 
         if not len(items):
@@ -235,7 +373,8 @@ class S3PDFCard(S3Codec):
         multiple = cards_per_page > 1
 
         # Look up common data
-        common = layout.lookup(resource, items)
+        if common is None:
+            common = layout.lookup(resource, items)
 
         # Generate the pages
         flowables = []
@@ -274,6 +413,34 @@ class S3PDFCard(S3Codec):
 
         return flowables
 
+# =============================================================================
+def render_chunk(args):
+    """
+        Render a chunk of cards as separate PDF document, used by
+        worker processes (see S3PDFCard.render_parallel)
+
+        @param args: tuple (job_id, start, end)
+
+        @returns: the PDF document (bytes)
+    """
+
+    job_id, start, end = args
+    job = _JOBS[job_id]
+
+    doc = job["doc"]
+    flowables = S3PDFCard.get_flowables(job["layout"],
+                                        job["resource"],
+                                        job["items"][start:end],
+                                        labels = job["labels"],
+                                        cards_per_page = doc.cards_per_page,
+                                        common = job["common"],
+                                        )
+
+    output_stream = BytesIO()
+    doc.build(flowables, output_stream)
+
+    return output_stream.getvalue()
+
 # =============================================================================
 class S3PDFCardTemplate(BaseDocTemplate):
     """
@@ -477,6 +644,11 @@ class S3PDFCardLayout(Flowable):
     orientation = "Portrait"
     doublesided = True
 
+    # Resolution (dpi) for images (photos, QR codes) in the card, images
+    # are downscaled to this resolution and cached on disk for re-use;
+    # None to embed images as-is and render QR codes as vector graphics
+    image_resolution = None
+
     def __init__(self,
                  resource,
                  item,
@@ -659,7 +831,15 @@ class S3PDFCardLayout(Flowable):
         return True
 
     # -------------------------------------------------------------------------
-    def draw_qrcode(self, value, x, y, size=40, halign=None, valign=None):
+    def draw_qrcode(self,
+                    value,
+                    x,
+                    y,
+                    size=40,
+                    halign=None,
+                    valign=None,
+                    key=None,
+                    ):
         """
             Helper function to draw a QR code
 
@@ -669,8 +849,32 @@ class S3PDFCardLayout(Flowable):
             @param size: the size (edge length) of the QR code
             @param halign: horizontal alignment ("left"|"center"|"right"), default left
             @param valign: vertical alignment ("top"|"middle"|"bottom"), default bottom
+            @param key: a record key (e.g. the record ID) to name the cached
+                        image with (for re-prints)
         """
 
+        hshift = vshift = 0
+        if halign == "right":
+            hshift = size
+        elif halign == "center":
+            hshift = float(size) / 2.0
+
+        if valign == "top":
+            vshift = size
+        elif valign == "middle":
+            vshift = float(size) / 2.0
+
+        # Use a cached image if possible
+        qr_image = self.qrcode_image(value, size, key=key)
+        if qr_image:
+            self.canv.drawImage(qr_image,
+                                x - hshift,
+                                y - vshift,
+                                width = size,
+                                height = size,
+                                )
+            return
+
         qr_code = qr.QrCodeWidget(value)
 
         try:
@@ -686,18 +890,68 @@ class S3PDFCardLayout(Flowable):
         d = Drawing(size, size, transform=transform)
         d.add(qr_code)
 
-        hshift = vshift = 0
-        if halign == "right":
-            hshift = size
-        elif halign == "center":
-            hshift = float(size) / 2.0
+        renderPDF.draw(d, self.canv, x - hshift, y - vshift)
 
-        if valign == "top":
-            vshift = size
-        elif valign == "middle":
-            vshift = float(size) / 2.0
+    # -------------------------------------------------------------------------
+    def qrcode_image(self, value, size, key=None):
+        """
+            Get a cached bitmap image of a QR code, generate it if it does
+            not exist yet
+            - requires PIL
 
-        renderPDF.draw(d, self.canv, x - hshift, y - vshift)
+            @param value: the string to encode
+            @param size: the size (edge length) of the QR code (in points)
+            @param key: a record key to name the image with
+
+            @returns: the file path of the image, or None if caching
+                      is disabled or not possible
+        """
+
+        resolution = self.image_resolution
+        folder = self.cache_folder() if resolution else None
+        if not folder:
+            return None
+
+        try:
+            from PIL import Image as pImage
+        except ImportError:
+            return None
+
+        # Module size (in pixels) for the target resolution
+        pixels = int(math.ceil(float(size) * resolution / 72))
+
+        digest = hashlib.md5(s3_str(value).encode("utf-8")).hexdigest()
+        path = self.cache_path(folder, "qr", key, digest, pixels, "png")
+        if os.path.exists(path):
+            return path
+
+        qr_code = qr.QrCodeWidget(value)
+        encoder = qr_code.qr
+        try:
+            encoder.make()
+        except ValueError:
+            # Value contains invalid characters
+            return None
+
+        # Render the modules (including the quiet zone) as bitmap,
+        # using a whole number of pixels per module to keep edges sharp
+        border = qr_code.barBorder
+        count = encoder.getModuleCount()
+        edge = count + 2 * border
+        scale = max(int(math.ceil(float(pixels) / edge)), 1)
+
+        white = [1] * edge
+        data = [white] * border
+        for row in encoder.modules:
+            data.append([1] * border + [0 if dark else 1 for dark in row] + [1] * border)
+        data.extend([white] * border)
+
+        bitmap = pImage.new("1", (edge, edge), 1)
+        bitmap.putdata([pixel for row in data for pixel in row])
+        if scale > 1:
+            bitmap = bitmap.resize((edge * scale, edge * scale), pImage.NEAREST)
+
+        return self.cache_store(bitmap, path, "PNG")
 
     # -------------------------------------------------------------------------
     def draw_image(self,
@@ -710,6 +964,7 @@ class S3PDFCardLayout(Flowable):
                    scale=None,
                    halign=None,
                    valign=None,
+                   key=None,
                    ):
         """
             Helper function to draw an image
@@ -724,6 +979,8 @@ class S3PDFCardLayout(Flowable):
             @param scale: scale the image by this factor (overrides width/height)
             @param halign: horizontal alignment ("left"|"center"|"right"), default left
             @param valign: vertical alignment ("top"|"middle"|"bottom"), default bottom
+            @param key: a record key (e.g. the record ID) to name the cached
+                        downscaled image with (for re-prints)
         """
 
         if hasattr(img, "seek"):
@@ -774,6 +1031,15 @@ class S3PDFCardLayout(Flowable):
         elif valign == "middle":
             vshift = height / 2.0
 
+        # Use a downscaled copy of the image if possible
+        downscaled = self.downscaled_image(img, pimg, width, height,
+                                           proportional = proportional,
+                                           key = key,
+                                           )
+        if downscaled:
+            img = downscaled
+            is_buffer = False
+
         # Draw the image
         if is_buffer:
             img.seek(0)
@@ -789,6 +1055,184 @@ class S3PDFCardLayout(Flowable):
                     mask = "auto",
                     )
 
+    # -------------------------------------------------------------------------
+    def downscaled_image(self,
+                         img,
+                         pimg,
+                         width,
+                         height,
+                         proportional=True,
+                         key=None,
+                         ):
+        """
+            Get a cached copy of an image, downscaled to the target size
+            at the image resolution of this layout, generate it if it does
+            not exist yet
+
+            @param img: the image (filename or BytesIO buffer)
+            @param pimg: the image opened with PIL
+            @param width: the target width (in points)
+            @param height: the target height (in points)
+            @param proportional: keep image proportions
+            @param key: a record key to name the image with
+
+            @returns: the file path of the downscaled image, or None
+                      if the image is small enough or caching is not
+                      possible
+        """
+
+        resolution = self.image_resolution
+        if not resolution:
+            return None
+
+        # Target size in pixels
+        factor = float(resolution) / 72
+        size = (int(math.ceil(width * factor)), int(math.ceil(height * factor)))
+        if size[0] >= pimg.size[0] and size[1] >= pimg.size[1]:
+            # No downscaling needed
+            return None
+
+        folder = self.cache_folder()
+        if not folder:
+            return None
+
+        # Hash the image content
+        if hasattr(img, "seek"):
+            img.seek(0)
+            content = img.read()
+        else:
+            try:
+                with open(img, "rb") as image_file:
+                    content = image_file.read()
+            except IOError:
+                return None
+        digest = hashlib.md5(content).hexdigest()
+
+        # PNG for images with transparency, JPEG otherwise
+        if pimg.mode in ("RGBA", "LA", "P") or "transparency" in pimg.info:
+            fmt, extension = "PNG", "png"
+        else:
+            fmt, extension = "JPEG", "jpg"
+
+        path = self.cache_path(folder, "img", key, digest, "%sx%s" % size, extension)
+        if os.path.exists(path):
+            return path
+
+        try:
+            from PIL import Image as pImage
+            resample = getattr(pImage, "LANCZOS", None) or pImage.ANTIALIAS
+            if proportional:
+                pimg.thumbnail(size, resample)
+            else:
+                pimg = pimg.resize(size, resample)
+            if fmt == "JPEG" and pimg.mode != "RGB":
+                pimg = pimg.convert("RGB")
+        except (IOError, ValueError):
+            return None
+
+        return self.cache_store(pimg, path, fmt)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cache_folder():
+        """
+            Get the folder for cached card images, create it if necessary
+
+            @returns: the folder path, or None if it is not writable
+        """
+
+        folder = os.path.join(current.request.folder, "cache", "cards")
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created concurrently, or not writable
+                pass
+        if not os.access(folder, os.W_OK):
+            return None
+        return folder
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cache_cleanup(days=28):
+        """
+            Remove cached card images older than a number of days
+
+            @param days: the number of days
+
+            @returns: the number of removed images
+        """
+
+        folder = os.path.join(current.request.folder, "cache", "cards")
+        if not os.path.isdir(folder):
+            return 0
+
+        earliest = time.time() - days * 86400
+        removed = 0
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            try:
+                if os.path.isfile(path) and os.stat(path).st_mtime < earliest:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                # Removed concurrently, or not writable
+                continue
+        return removed
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cache_path(folder, prefix, key, digest, size, extension):
+        """
+            Get the file path for a cached card image
+
+            @param folder: the cache folder
+            @param prefix: the file name prefix (image type)
+            @param key: the record key (can be None)
+            @param digest: the content hash
+            @param size: the image size
+            @param extension: the file extension
+
+            @returns: the file path
+        """
+
+        if key is not None:
+            name = "%s_%s_%s_%s.%s" % (prefix, key, digest, size, extension)
+        else:
+            name = "%s_%s_%s.%s" % (prefix, digest, size, extension)
+
+        return os.path.join(folder, name)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cache_store(image, path, fmt):
+        """
+            Store a card image in the cache; writes to a temporary file
+            first, so concurrent workers never read incomplete files
+
+            @param image: the PIL image
+            @param path: the target file path
+            @param fmt: the image format
+
+            @returns: the file path, or None if the image could not be stored
+        """
+
+        handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(handle)
+        try:
+            if fmt == "JPEG":
+                image.save(tmp, fmt, quality=90)
+            else:
+                image.save(tmp, fmt)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if not os.path.exists(path):
+                current.log.error("Could not store card image %s" % path)
+                return None
+        return path
+
     # -------------------------------------------------------------------------
     def draw_outline(self):
         """
@@ -109,6 +109,8 @@ class S3SHP(S3Codec):
             @param attr: dictionary of parameters:
                  * title:          The export filename
                  * list_fields:    Fields to include in list views
+                 * as_stream:      return the file rather than streaming
+                                   it to the client
         """
 
         # Get the attributes
@@ -224,13 +226,16 @@ class S3SHP(S3Codec):
         # Restore path
         os.chdir(web2py_path)
 
+        stream = open(os.path.join(TEMP, filename), "rb")
+        if attr.get("as_stream", False):
+            return stream
+
         # Response headers
         disposition = "attachment; filename=\"%s\"" % filename
         response = current.response
         response.headers["Content-Type"] = contenttype(".zip")
         response.headers["Content-disposition"] = disposition
 
-        stream = open(os.path.join(TEMP, filename), "rb")
         return response.stream(stream, chunk_size=DEFAULT_CHUNK_SIZE,
                                request=request)
 
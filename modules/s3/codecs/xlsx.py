@@ -0,0 +1,651 @@
+# -*- coding: utf-8 -*-
+
+"""
+    S3 Microsoft Excel 2007+ (XLSX) codec
+
+    @copyright: 2019 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3XLSX",
+           )
+
+import datetime
+import tempfile
+
+from gluon import HTTP, current
+from gluon.contenttype import contenttype
+from gluon.storage import Storage
+from gluon.streamer import DEFAULT_CHUNK_SIZE
+
+from s3compat import basestring
+from s3dal import Expression, Field, S3DAL
+from ..s3datetime import S3DateTime
+from ..s3utils import s3_str, s3_strip_markup, s3_unicode
+from .xls import S3XLS
+
+# =============================================================================
+class S3XLSX(S3XLS):
+    """
+        Microsoft Excel 2007+ format codec
+
+        - writes the workbook in write-only mode, i.e. rows are flushed
+          to disk as they are written, and extracts the data from the
+          resource in batches, so that memory consumption is independent
+          of the number of rows
+        - not subject to the row limit of the legacy XLS format
+    """
+
+    # Maximum number of characters in a single cell
+    MAX_CELL_SIZE = 32767
+
+    # Maximum number of rows per sheet
+    MAX_ROWS = 1048576
+
+    # Number of records to extract from the resource at a time
+    BATCH_SIZE = 2000
+
+    # Database engines which sort NULL after all other values
+    NULLS_LAST = ("postgres", "oracle")
+
+    # RGB equivalents of the xlwt palette colours used by S3XLS
+    PALETTE = {0x00: "000000", # black
+               0x18: "9999FF", # periwinkle
+               0x2A: "CCFFCC", # light_green
+               0x2B: "FFFF99", # light_yellow
+               0x2C: "99CCFF", # pale_blue
+               }
+
+    ERROR = Storage(S3XLS.ERROR,
+        OPENPYXL_ERROR = "XLSX export requires python-openpyxl module to be installed on server",
+    )
+
+    # -------------------------------------------------------------------------
+    def extract(self, resource, list_fields):
+        """
+            Extract the rows from the resource, in batches
+
+            @param resource: the resource
+            @param list_fields: fields to include in list views
+
+            @return: tuple (title, types, lfields, heading, rows), where
+                     rows is a generator
+        """
+
+        title = self.crud_string(resource.tablename, "title_list")
+
+        get_vars = dict(current.request.vars)
+        get_vars["iColumns"] = len(list_fields)
+        query, orderby, left = resource.datatable_filter(list_fields,
+                                                         get_vars,
+                                                         )
+        resource.add_filter(query)
+
+        if orderby is None:
+            orderby = resource.get_config("orderby")
+
+        # Order by primary key last, so that batches do not overlap
+        table = resource.table
+        if not orderby:
+            orderby = []
+        elif isinstance(orderby, basestring):
+            orderby = orderby.split(",")
+        elif not isinstance(orderby, (list, tuple)):
+            orderby = [orderby]
+        orderby = list(orderby) + [table._id]
+
+        # Keyset pagination (i.e. continue after the last record of the
+        # previous batch rather than skipping all previous rows with an
+        # OFFSET) requires all orderby fields in the master table
+        keys = self.keyset(table, orderby)
+
+        # Include the record ID in the extraction to continue from
+        pkey = str(table._id)
+        fields = list(list_fields)
+        rfields = resource.resolve_selectors(fields)[0]
+        show_pkey = any(rfield.colname == pkey for rfield in rfields)
+        if keys and not show_pkey:
+            fields.append(table._id.name)
+
+        # Hierarchical FK Expansion:
+        # setting = {field_selector: [LevelLabel, LevelLabel, ...]}
+        expand_hierarchy = resource.get_config("xls_expand_hierarchy")
+
+        batch_size = self.BATCH_SIZE
+        def select(start=0, after=None):
+            if after is not None:
+                resource.add_filter(after)
+            try:
+                data = resource.select(fields,
+                                       left = left,
+                                       start = start,
+                                       limit = batch_size,
+                                       orderby = orderby,
+                                       represent = True,
+                                       show_links = False,
+                                       raw_data = True,
+                                       )
+            finally:
+                if after is not None:
+                    # Remove the cursor query again
+                    self.remove_filter(resource, after)
+            return data
+        data = select()
+        rfields = data.rfields
+
+        types = []
+        lfields = []
+        heading = {}
+        expand = []
+        for rfield in rfields:
+            if rfield.colname == pkey and not show_pkey:
+                continue
+            if rfield.show:
+                if expand_hierarchy:
+                    levels = expand_hierarchy.get(rfield.selector)
+                else:
+                    levels = None
+                if levels:
+                    num_levels = len(levels)
+                    colnames = self.expand_hierarchy(rfield, num_levels, data.rows)
+                    if colnames:
+                        expand.append((rfield, num_levels))
+                    lfields.extend(colnames)
+                    types.extend(["string"] * num_levels)
+                    T = current.T
+                    for i, colname in enumerate(colnames):
+                        heading[colname] = T(levels[i])
+                else:
+                    lfields.append(rfield.colname)
+                    heading[rfield.colname] = rfield.label or \
+                                rfield.field.name.capitalize().replace("_", " ")
+                    if rfield.ftype == "virtual":
+                        types.append("string")
+                    else:
+                        types.append(rfield.ftype)
+
+        def rows(data):
+            start = 0
+            while True:
+                batch = data.rows
+                if start:
+                    for rfield, num_levels in expand:
+                        self.expand_hierarchy(rfield, num_levels, batch)
+                for row in batch:
+                    yield row
+                if len(batch) < batch_size:
+                    break
+                start += batch_size
+                if keys:
+                    last_id = batch[-1]["_row"][pkey]
+                    data = select(after=self.cursor(table, keys, last_id))
+                else:
+                    data = select(start=start)
+
+        return (title, types, lfields, heading, rows(data))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def keyset(table, orderby):
+        """
+            Resolve the orderby-expression into a list of keys for
+            keyset pagination
+
+            @param table: the master table
+            @param orderby: the orderby-expression, a list of Fields,
+                            inverted Fields or "tablename.fieldname [desc]"
+                            strings
+
+            @return: list of tuples (Field, descending), or None if any
+                     of the orderby-fields is not in the master table (in
+                     which case the rows have to be paginated with OFFSET)
+        """
+
+        tablename = table._tablename
+        adapter = S3DAL()
+
+        keys = []
+        seen = set()
+        for item in orderby:
+
+            if type(item) is Expression:
+                field = item.first
+                if not isinstance(field, Field) or item.op != adapter.INVERT:
+                    return None
+                descending = True
+            elif isinstance(item, Field):
+                field = item
+                descending = False
+            elif isinstance(item, basestring):
+                fn, direction = (item.strip().split() + ["asc"])[:2]
+                tn, fn = ([tablename] + fn.split(".", 1))[-2:]
+                if tn != tablename or fn not in table.fields:
+                    return None
+                field = table[fn]
+                descending = direction.lower() == "desc"
+            else:
+                return None
+
+            if field.tablename != tablename:
+                return None
+
+            # Skip repeated fields (the first occurrence determines the order)
+            if field.name not in seen:
+                seen.add(field.name)
+                keys.append((field, descending))
+
+        return keys
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def cursor(cls, table, keys, record_id):
+        """
+            Construct a query for all records which come after a particular
+            record in the order of the keyset
+
+            @param table: the master table
+            @param keys: the keyset, as returned from keyset()
+            @param record_id: the record ID
+
+            @return: the Query
+        """
+
+        db = current.db
+        nulls_last = db._adapter.dbengine in cls.NULLS_LAST
+
+        fields = [field for field, _ in keys]
+        record = db(table._id == record_id).select(limitby = (0, 1),
+                                                   *fields).first()
+
+        # (k1 > v1) | (k1 == v1) & ((k2 > v2) | (k2 == v2) & (...))
+        query = None
+        for field, descending in reversed(keys):
+
+            value = record[field.name]
+            if field.name == table._id.name:
+                after = field < value if descending else field > value
+                query = after
+                continue
+
+            # Do NULLs come first in this direction?
+            nulls_first = nulls_last == descending
+
+            if value is None:
+                after = (field != None) if nulls_first else None
+                equal = (field == None)
+            else:
+                after = field < value if descending else field > value
+                if not nulls_first:
+                    after |= (field == None)
+                equal = (field == value)
+
+            if query is not None:
+                equal &= query
+            query = equal if after is None else after | equal
+
+        return query
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def remove_filter(resource, query):
+        """
+            Remove a query previously added with resource.add_filter
+
+            @param resource: the S3Resource
+            @param query: the Query
+        """
+
+        rfilter = resource.rfilter
+        if rfilter is not None:
+            # Compare by identity (Query.__eq__ constructs a new Query)
+            rfilter.queries = [q for q in rfilter.queries if q is not query]
+            rfilter.query = None
+        resource.clear()
+
+    # -------------------------------------------------------------------------
+    def encode(self, resource, **attr):
+        """
+            Export data as a Microsoft Excel 2007+ spreadsheet
+
+            @param resource: the source of the data that is to be encoded
+                             as a spreadsheet, can be either of:
+                                1) an S3Resource
+                                2) an array of value dicts (dict of
+                                   column labels as first item, list of
+                                   field types as second item)
+                                3) a dict like:
+                                   {columns: [key, ...],
+                                    headers: {key: label},
+                                    types: {key: type},
+                                    rows: [{key:value}],
+                                    }
+                             (rows can be any iterable)
+
+            @param attr: keyword arguments (see below)
+
+            @keyword as_stream: return the buffer (temporary file) rather
+                                than streaming it to the client
+            @keyword title: the main title of the report
+            @keyword list_fields: fields to include in list views
+            @keyword use_colour: True to add colour to the cells, default False
+            @keyword evenodd: render different background colours
+                              for even/odd rows ("stripes")
+        """
+
+        # Do not redirect from here!
+        # ...but raise proper status code, which can be caught by caller
+        try:
+            from openpyxl import Workbook
+            from openpyxl.cell import WriteOnlyCell
+        except ImportError:
+            error = self.ERROR.OPENPYXL_ERROR
+            current.log.error(error)
+            raise HTTP(503, body=error)
+
+        # Get the attributes
+        title = attr.get("title")
+        if title is None:
+            title = current.T("Report")
+        list_fields = attr.get("list_fields")
+        group = attr.get("dt_group")
+        use_colour = attr.get("use_colour", False)
+        evenodd = attr.get("evenodd", True)
+
+        # Extract the data from the resource
+        if isinstance(resource, dict):
+            headers = resource.get("headers", {})
+            lfields = resource.get("columns", list_fields)
+            column_types = resource.get("types")
+            types = [column_types[col] for col in lfields]
+            rows = resource.get("rows")
+        elif isinstance(resource, (list, tuple)):
+            headers = resource[0]
+            types = resource[1]
+            rows = resource[2:]
+            lfields = list_fields
+        else:
+            if not list_fields:
+                list_fields = resource.list_fields()
+            (title, types, lfields, headers, rows) = self.extract(resource,
+                                                                  list_fields,
+                                                                  )
+
+        # Grouping
+        report_groupby = lfields[group] if group else None
+
+        # Columns to write: (index in lfields, selector, type)
+        columns = []
+        for index, selector in enumerate(lfields):
+            if selector == report_groupby:
+                continue
+            label = headers[selector]
+            if label in ("Id", "Sort") or types[index] == "sort":
+                continue
+            columns.append((index, selector, types[index]))
+        total_cols = len(columns)
+
+        # Date/Time formats from L10N deployment settings
+        settings = current.deployment_settings
+        dt_format_translate = self.dt_format_translate
+        formats = {"date": dt_format_translate(settings.get_L10n_date_format()),
+                   "datetime": dt_format_translate(settings.get_L10n_datetime_format()),
+                   "time": dt_format_translate(settings.get_L10n_time_format()),
+                   "integer": "0",
+                   "double": "0.00",
+                   }
+
+        title_row = settings.get_xls_title_row()
+
+        # Get styles
+        styles = self._styles(use_colour = use_colour,
+                              evenodd = evenodd,
+                              datetime_format = formats["datetime"],
+                              )
+
+        # Create the workbook
+        book = Workbook(write_only=True)
+
+        # Can't have a / in the sheet_name, so replace any with a space
+        title = s3_str(title)
+        sheet_name = title.replace("/", " ")[:28]
+
+        request = current.request
+        T = current.T
+
+        # The current sheet and row count
+        state = {}
+
+        def cell(value, style, numfmt=None):
+            # Write-only cells must be styled before they are appended
+            c = WriteOnlyCell(state["sheet"], value=value)
+            c.font, c.fill = style
+            if numfmt:
+                c.number_format = numfmt
+            return c
+
+        def add_sheet():
+            # Add a new sheet with title and header rows
+            number = state.get("number", 0) + 1
+            sheet = book.create_sheet("%s-%s" % (sheet_name, number))
+            state.update(sheet=sheet, number=number)
+
+            # Column widths can only be set before writing any rows
+            for i, (index, selector, coltype) in enumerate(columns):
+                width = max(len(s3_str(headers[selector])) * 1.2, 8)
+                if coltype in ("date", "datetime", "time"):
+                    width = max(width, 16)
+                sheet.column_dimensions[self.column_letter(i + 1)].width = width
+
+            # Freeze the header row (must be set before writing any rows)
+            written = 2 if title_row and not callable(title_row) else 0
+            sheet.freeze_panes = "A%s" % (written + 2)
+
+            if written:
+                # Custom title rows (callable) are specific to xlwt
+                sheet.append([cell(title, styles["large_header"])])
+                sheet.append([cell("%s:" % T("Date Exported"), styles["notes"]),
+                              cell(request.now, styles["notes"], formats["datetime"]),
+                              ])
+            sheet.append([cell(s3_str(headers[selector]), styles["header"])
+                          for index, selector, coltype in columns])
+            state["rows"] = written + 1
+
+        def append(values):
+            # Append a row, starting a new sheet if the current one is full
+            if state["rows"] >= self.MAX_ROWS:
+                add_sheet()
+            state["sheet"].append(values)
+            state["rows"] += 1
+
+        add_sheet()
+
+        # Write the table contents
+        subheading = None
+        subheader_style = styles["subheader"]
+        MAX_CELL_SIZE = self.MAX_CELL_SIZE
+        value_of = self.value
+        counter = 0
+        for row in rows:
+
+            counter += 1
+            style = styles["even"] if counter % 2 == 0 else styles["odd"]
+
+            # Group headers
+            if report_groupby:
+                represent = s3_strip_markup(s3_unicode(row[report_groupby]))
+                if subheading != represent:
+                    # Start of new group - write group header
+                    subheading = represent
+                    append([cell(subheading, subheader_style)] +
+                           [cell(None, subheader_style)] * (total_cols - 1))
+
+            # Custom row style?
+            row_style = styles.get(row.get("_style")) if "_style" in row else None
+
+            values = []
+            remaining = columns
+
+            # Group header/footer row?
+            if "_group" in row:
+                group_info = row["_group"]
+                label = group_info.get("label")
+                totals = group_info.get("totals")
+                if label:
+                    label = s3_strip_markup(s3_unicode(label))
+                    group_style = row_style or subheader_style
+                    span = group_info.get("span")
+                    if span == 0:
+                        append([cell(label, group_style)] +
+                               [cell(None, group_style)] * (total_cols - 1))
+                    else:
+                        values = [cell(label, group_style)] + \
+                                 [cell(None, group_style)] * (span - 1)
+                        remaining = [column for column in columns
+                                     if column[0] >= span]
+                if not totals:
+                    continue
+
+            raw = row.get("_row")
+            for index, selector, coltype in remaining:
+                if selector not in row:
+                    represent = ""
+                else:
+                    represent = s3_strip_markup(s3_unicode(row[selector]))
+                if len(represent) > MAX_CELL_SIZE:
+                    represent = represent[:MAX_CELL_SIZE]
+                rawvalue = raw.get(selector) if raw else None
+                value = value_of(coltype, represent, rawvalue)
+                numfmt = None if isinstance(value, basestring) else formats.get(coltype)
+                values.append(cell(value, row_style or style, numfmt))
+
+            append(values)
+
+        # Write output
+        output = tempfile.TemporaryFile()
+        book.save(output)
+        output.seek(0)
+
+        if attr.get("as_stream", False):
+            return output
+
+        # Response headers
+        filename = "%s_%s.xlsx" % (request.env.server_name, title)
+        disposition = "attachment; filename=\"%s\"" % filename
+        response = current.response
+        response.headers["Content-Type"] = contenttype(".xlsx")
+        response.headers["Content-disposition"] = disposition
+
+        return response.stream(output, chunk_size=DEFAULT_CHUNK_SIZE,
+                               request=request)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def value(coltype, represent, raw):
+        """
+            Convert a cell value into the type of its column
+
+            @param coltype: the column type
+            @param represent: the represented value (string)
+            @param raw: the raw value (if available)
+
+            @return: the converted value, or the represented value
+                     if it cannot be converted
+        """
+
+        if coltype in ("date", "datetime", "time"):
+            if coltype == "datetime" and isinstance(raw, datetime.datetime):
+                return S3DateTime.to_local(raw)
+            elif coltype == "date" and isinstance(raw, datetime.date):
+                return raw
+            elif coltype == "time" and isinstance(raw, datetime.time):
+                return raw
+        elif coltype == "integer":
+            try:
+                return int(represent)
+            except ValueError:
+                pass
+        elif coltype == "double":
+            try:
+                return float(represent)
+            except ValueError:
+                pass
+        return represent
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def column_letter(index):
+        """
+            Get the letter(s) of a spreadsheet column
+
+            @param index: the column index (starting with 1)
+        """
+
+        letters = ""
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            letters = chr(65 + remainder) + letters
+        return letters
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _styles(cls,
+                use_colour=False,
+                evenodd=True,
+                datetime_format=None,
+                ):
+        """
+            XLSX encoder standard cell styles, equivalent to S3XLS
+
+            @param use_colour: use background colour in cells
+            @param evenodd: render different background colours
+                            for even/odd rows ("stripes")
+            @param datetime_format: the date/time format (unused, number
+                                    formats are set per cell)
+
+            @return: dict of tuples (Font, PatternFill)
+        """
+
+        from openpyxl.styles import Font, PatternFill
+
+        def fill(colour):
+            if not use_colour or colour is None:
+                return PatternFill()
+            rgb = cls.PALETTE.get(colour, "C0C0C0")
+            return PatternFill(fill_type="solid", start_color=rgb, end_color=rgb)
+
+        plain = Font()
+        bold = Font(bold=True)
+        stripes = cls.ROW_ALTERNATING_COLOURS if evenodd else (None, None)
+
+        return {"large_header": (Font(bold=True, size=20), fill(cls.LARGE_HEADER_COLOUR)),
+                "notes": (Font(italic=True, size=8), fill(None)),
+                "header": (bold, fill(cls.HEADER_COLOUR)),
+                "subheader": (bold, fill(cls.SUB_HEADER_COLOUR)),
+                "subtotals": (bold, fill(cls.SUB_TOTALS_COLOUR)),
+                "totals": (bold, fill(cls.TOTALS_COLOUR)),
+                "odd": (plain, fill(stripes[0])),
+                "even": (plain, fill(stripes[1])),
+                }
+
+# END =========================================================================
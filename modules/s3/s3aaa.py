@@ -5917,6 +5917,9 @@ class S3Permission(object):
         s3 = current.response.s3
         if "restricted_tables" in s3:
             del s3["restricted_tables"]
+        if "menu_cache" in s3:
+            # Force the menu cache to re-check the ACL version
+            del s3["menu_cache"]
         self.clear_cache()
 
         if c is None and f is None and t is None:
@@ -51,6 +51,7 @@ class S3Codec(object):
               "shp": "S3SHP",
               "svg": "S3SVG",
               "xls": "S3XLS",
+              "xlsx": "S3XLSX",
               "card": "S3PDFCard",
               }
 
@@ -806,6 +806,11 @@ class S3CRUD(S3Method):
             exporter = S3Exporter().xls
             output = exporter(resource, list_fields=list_fields)
 
+        elif representation == "xlsx":
+            list_fields = resource.list_fields()
+            exporter = S3Exporter().xlsx
+            output = exporter(resource, list_fields=list_fields)
+
         elif representation == "json":
             exporter = S3Exporter().json
 
@@ -1399,6 +1404,12 @@ class S3CRUD(S3Method):
                             report_groupby = report_groupby,
                             **attr)
 
+        elif representation == "xlsx":
+            exporter = S3Exporter().xlsx
+            return exporter(resource,
+                            list_fields = list_fields,
+                            **attr)
+
         elif representation == "msg":
             if r.http == "POST":
                 from .s3notify import S3Notifications
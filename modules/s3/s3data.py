@@ -484,7 +484,7 @@ class S3DataTable(object):
                 if any(rfield.fname in kml_fields for rfield in rfields):
                     formats["kml"] = default_url
 
-            default_formats = ("xml", "rss", "xls", "pdf")
+            default_formats = ("xml", "rss", "xls", "xlsx", "pdf")
             EXPORT = T("Export in %(format)s format")
 
             append_icon = icons.append
@@ -657,14 +657,10 @@ class S3Delete(object):
             Introspect the resource to set process properties
         """
 
-        # Must load all models to detect dependencies
-        current.s3db.load_all_models()
+        # Must load all referencing tables to detect dependencies
+        current.s3db.load_references(self.tablename)
 
         db = current.db
-        if db._lazy_tables:
-            # Must roll out all lazy tables to detect dependencies
-            for tn in list(db._LAZY_TABLES.keys()):
-                db[tn]
 
         references = self.table._referenced_by
         try:
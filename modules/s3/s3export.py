@@ -31,11 +31,22 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
-__all__ = ("S3Exporter",)
+__all__ = ("S3Exporter",
+           "S3ExportJob",
+           )
 
-from gluon import current
+import datetime
+import sys
 
+from gluon import current, redirect, HTTP, URL
+from gluon.contenttype import contenttype
+from gluon.storage import Storage
+from gluon.streamer import DEFAULT_CHUNK_SIZE
+
+from s3compat import BytesIO, INTEGER_TYPES, basestring, unicodeT
 from .s3codec import S3Codec
+from .s3query import S3FieldSelector
+from .s3utils import s3_str
 
 # =============================================================================
 class S3Exporter(object):
@@ -243,4 +254,446 @@ class S3Exporter(object):
         codec = S3Codec.get_codec("xls").encode
         return codec(*args, **kwargs)
 
+    # -------------------------------------------------------------------------
+    def xlsx(self, *args, **kwargs):
+
+        codec = S3Codec.get_codec("xlsx").encode
+        return codec(*args, **kwargs)
+
+# =============================================================================
+class S3ExportJob(object):
+    """
+        Exports run as background jobs in the scheduler, so that large
+        exports do not tie up a web worker:
+
+            - S3Request hands an export over to a job if the number of
+              records exceeds settings.base.export_job_threshold (or if
+              requested with the URL variable export_job=1), and redirects
+              the client to the status page of the job
+            - the job re-constructs the request from a snapshot of its URL,
+              filters and list fields, runs the codec, and stores the output
+            - the client polls default/export_job/<uuid> (or its .json
+              version) until the file can be downloaded from
+              default/export_job/<uuid>/download
+
+        @note: requests with DAL filters (e.g. from prep or s3.filter) cannot
+               be re-constructed in the scheduler, and are therefore always
+               exported inside the request
+    """
+
+    FORMATS = ("xls", "xlsx", "pdf", "xml", "shp")
+
+    # -------------------------------------------------------------------------
+    def __init__(self, job_uuid):
+        """
+            Constructor
+
+            @param job_uuid: the UUID of the job
+        """
+
+        auth = current.auth
+
+        table = current.s3db.s3_export_job
+        query = (table.uuid == job_uuid) & \
+                (table.deleted == False)
+        job = current.db(query).select(table.id,
+                                       table.status,
+                                       table.file,
+                                       table.filename,
+                                       table.created_by,
+                                       limitby = (0, 1),
+                                       ).first()
+
+        # Only the user who started the job can access it
+        if not job or \
+           not auth.s3_has_role("ADMIN") and \
+           (not auth.user or job.created_by != auth.user.id):
+            raise HTTP(404, current.ERROR.BAD_RECORD)
+
+        self.uuid = job_uuid
+        self.job = job
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def applicable(cls, r):
+        """
+            Check whether an export request shall be run as background job
+
+            @param r: the S3Request
+
+            @return: True|False
+        """
+
+        if r.http != "GET" or r.method or \
+           r.representation not in cls.FORMATS or \
+           r.id and not r.component:
+            return False
+
+        mode = r.get_vars.get("export_job")
+        if mode == "0":
+            return False
+        threshold = current.deployment_settings.get_base_export_job_threshold()
+        if mode != "1" and not threshold:
+            return False
+
+        if not current.auth.is_logged_in() or \
+           cls.snapshot_vars(r) is None or \
+           not current.s3task._is_alive():
+            return False
+
+        if mode != "1":
+            resource = r.component if r.component else r.resource
+            if resource.count() <= threshold:
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def snapshot_vars(r):
+        """
+            Get the URL variables to re-construct the request in the
+            scheduler, including filters added during prep
+
+            @param r: the S3Request
+
+            @return: the URL variables (Storage), or None if the filters
+                     of the request cannot be re-constructed
+        """
+
+        get_vars = Storage(r.get_vars)
+        get_vars.pop("export_job", None)
+
+        for resource in (r.resource, r.component):
+            if resource is None or resource.rfilter is None:
+                continue
+            rfilter = resource.rfilter
+
+            # DAL filters can not be serialized, except for the BBox
+            # filter which is re-constructed from the URL
+            bbox = 1 if resource is r.resource and "bbox" in get_vars else 0
+            if len(rfilter.queries) > bbox or any(rfilter.cqueries.values()):
+                return None
+
+            # Filters from prep which can not be expressed as URL
+            # filters can not be re-constructed either
+            url_vars = S3ExportJob.serialize_filters(resource, rfilter.filters)
+            if url_vars is None:
+                return None
+
+            # Add filters from prep (URL filters are already included),
+            # filters with the same key are combined (AND) as lists
+            for key, value in url_vars:
+                values = get_vars.get(key)
+                if values is None:
+                    get_vars[key] = value
+                    continue
+                if type(values) is not list:
+                    values = [values]
+                if value not in values:
+                    get_vars[key] = values + [value]
+
+        return get_vars
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def serialize_filters(resource, filters):
+        """
+            Serialize resource filters as URL variables, keeping each
+            AND-subquery separate (S3ResourceQuery.serialize_url would
+            overwrite subqueries with the same key)
+
+            @param resource: the S3Resource
+            @param filters: list of S3ResourceQuery
+
+            @return: list of tuples (key, value), or None if any of the
+                     filters can not be serialized completely
+        """
+
+        url_vars = []
+        for f in filters:
+            if f.op == f.AND:
+                subvars = S3ExportJob.serialize_filters(resource,
+                                                        [f.left, f.right],
+                                                        )
+            elif S3ExportJob.url_serializable(f):
+                subvars = list(f.serialize_url(resource=resource).items())
+                if not subvars:
+                    # Value could not be converted
+                    subvars = None
+            else:
+                subvars = None
+            if subvars is None:
+                return None
+            url_vars.extend(subvars)
+        return url_vars
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def url_serializable(query):
+        """
+            Check whether S3ResourceQuery.serialize_url can express a
+            query (other than an AND) completely, which is not the case
+            for e.g. ORs with different fields and different operators,
+            negated ANDs, or comparisons between fields
+
+            @param query: the S3ResourceQuery
+
+            @return: True|False
+        """
+
+        op = query.op
+        left = query.left
+
+        if op == query.AND:
+            return False
+        elif op == query.OR:
+            return S3ExportJob.url_serializable(left) and \
+                   S3ExportJob.url_serializable(query.right) and \
+                   query._or() is not None
+        elif op == query.NOT:
+            return left.op not in (left.AND, left.NOT) and \
+                   S3ExportJob.url_serializable(left)
+        else:
+            return isinstance(left, S3FieldSelector) and \
+                   not isinstance(query.right, S3FieldSelector)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def snapshot_fields(resource):
+        """
+            Get the list fields of the resource as configured after prep
+
+            @param resource: the S3Resource
+
+            @return: list of field selectors (or tuples (label, selector)),
+                     or None if they cannot be serialized
+        """
+
+        list_fields = []
+        for selector in resource.list_fields():
+            if isinstance(selector, tuple) and len(selector) == 2 and \
+               isinstance(selector[1], basestring):
+                list_fields.append((s3_str(selector[0]), selector[1]))
+            elif isinstance(selector, basestring):
+                list_fields.append(selector)
+            else:
+                return None
+        return list_fields
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def submit(cls, r, **attr):
+        """
+            Start an export job for a request, and redirect to its status
+            page
+
+            @param r: the S3Request
+            @param attr: controller attributes
+
+            @return: None if the job could not be started (the export
+                     must then be run inside the request)
+        """
+
+        db = current.db
+
+        resource = r.component if r.component else r.resource
+
+        # Only serializable attributes can be handed over
+        types = (basestring, bool, float) + INTEGER_TYPES
+        snapshot = {"prefix": r.prefix,
+                    "name": r.name,
+                    "controller": r.controller,
+                    "function": r.function,
+                    "args": list(r.args),
+                    "vars": cls.snapshot_vars(r),
+                    "list_fields": cls.snapshot_fields(resource),
+                    "attr": dict((k, v) for k, v in attr.items()
+                                 if v is None or isinstance(v, types)),
+                    }
+
+        table = current.s3db.s3_export_job
+        job = {"tablename": resource.tablename,
+               "representation": r.representation,
+               "request": snapshot,
+               }
+        job_id = table.insert(**job)
+
+        task_id = current.s3task.run_async("s3_export_job", args=[job_id])
+        if not task_id:
+            db(table.id == job_id).update(status = "FAILED")
+            return None
+        db(table.id == job_id).update(task_id = task_id)
+
+        job_uuid = db(table.id == job_id).select(table.uuid,
+                                                 limitby = (0, 1),
+                                                 ).first().uuid
+        redirect(URL(c="default", f="export_job", args=[job_uuid]))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def run(cls, job_id):
+        """
+            Run an export job (in the scheduler)
+
+            @param job_id: the s3_export_job record ID
+
+            @return: the job status
+        """
+
+        db = current.db
+
+        table = current.s3db.s3_export_job
+        job = db(table.id == job_id).select(table.id,
+                                            table.tablename,
+                                            table.representation,
+                                            table.request,
+                                            limitby = (0, 1),
+                                            ).first()
+        if not job:
+            return "FAILED"
+
+        job.update_record(status = "RUNNING")
+        db.commit()
+
+        fmt = job.representation
+        try:
+            output = cls.export(job.request, fmt)
+            if not hasattr(output, "read"):
+                if isinstance(output, unicodeT):
+                    output = output.encode("utf-8")
+                output = BytesIO(output)
+            filename = "%s_%s.%s" % (job.tablename,
+                                     current.request.utcnow.strftime("%Y%m%d%H%M%S"),
+                                     "zip" if fmt == "shp" else fmt,
+                                     )
+            stored = table.file.store(output, filename)
+        except Exception:
+            error = sys.exc_info()[1]
+            current.log.error("Export job %s failed: %s" % (job_id, error))
+            db.rollback()
+            job.update_record(status = "FAILED",
+                              error = s3_str(error),
+                              )
+        else:
+            job.update_record(status = "COMPLETED",
+                              file = stored,
+                              filename = filename,
+                              )
+        db.commit()
+
+        return job.status
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def export(snapshot, fmt):
+        """
+            Re-construct the request from a snapshot and run the export
+
+            @param snapshot: the request snapshot (dict)
+            @param fmt: the export format
+
+            @return: the output (bytes, string or file-like object)
+        """
+
+        from .s3rest import S3Request
+
+        # The codecs read datatable options from the current request
+        get_vars = Storage(snapshot["vars"])
+        request = current.request
+        request.get_vars = get_vars
+        request.vars = Storage(get_vars)
+
+        r = S3Request(snapshot["prefix"],
+                      snapshot["name"],
+                      c = snapshot["controller"],
+                      f = snapshot["function"],
+                      args = snapshot["args"],
+                      get_vars = get_vars,
+                      extension = fmt,
+                      http = "GET",
+                      )
+        r.customise_resource()
+        resource = r.component if r.component else r.resource
+
+        attr = dict(snapshot["attr"])
+        list_fields = snapshot["list_fields"]
+        if list_fields is None:
+            list_fields = resource.list_fields()
+        else:
+            list_fields = [tuple(f) if isinstance(f, list) else f
+                           for f in list_fields]
+
+        exporter = S3Exporter()
+        if fmt == "xml":
+            output = S3Request.get_tree(r, **attr)
+        elif fmt == "pdf":
+            output = exporter.pdf(resource,
+                                  request = r,
+                                  list_fields = list_fields,
+                                  **attr)
+        else:
+            attr["as_stream"] = True
+            output = getattr(exporter, fmt)(resource,
+                                            list_fields = list_fields,
+                                            **attr)
+        return output
+
+    # -------------------------------------------------------------------------
+    def status(self):
+        """
+            Get the status of this job
+
+            @return: dict {status, filename, url}, url being the download
+                     URL once the job is completed
+        """
+
+        job = self.job
+
+        status = {"status": job.status,
+                  "filename": job.filename,
+                  "url": None,
+                  }
+        if job.status == "COMPLETED" and job.file:
+            status["url"] = URL(c="default", f="export_job",
+                                args = [self.uuid, "download"],
+                                extension = "",
+                                )
+        return status
+
+    # -------------------------------------------------------------------------
+    def download(self):
+        """
+            Stream the output file of this job to the client
+        """
+
+        job = self.job
+        if job.status != "COMPLETED" or not job.file:
+            raise HTTP(404, current.ERROR.BAD_RECORD)
+
+        table = current.s3db.s3_export_job
+        filename, stream = table.file.retrieve(job.file)
+
+        response = current.response
+        response.headers["Content-Type"] = contenttype(filename)
+        response.headers["Content-disposition"] = "attachment; filename=\"%s\"" % filename
+
+        return response.stream(stream,
+                               chunk_size = DEFAULT_CHUNK_SIZE,
+                               request = current.request,
+                               )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def cleanup(days=1):
+        """
+            Remove export jobs (and their files) older than a number of days
+
+            @param days: the number of days
+        """
+
+        table = current.s3db.s3_export_job
+        earliest = current.request.utcnow - datetime.timedelta(days=days)
+        current.db(table.created_on < earliest).delete()
+
 # End =========================================================================
@@ -41,6 +41,7 @@ __all__ = ("S3FilterWidget",
            "S3TextFilter",
            "S3NotEmptyFilter",
            "S3FilterForm",
+           "S3FilterFacets",
            "S3Filter",
            "S3FilterString",
            "s3_get_filter_opts",
@@ -48,6 +49,7 @@ __all__ = ("S3FilterWidget",
            )
 
 import datetime
+import hashlib
 import json
 import re
 
@@ -2198,6 +2200,8 @@ class S3OptionsFilter(S3FilterWidget):
                             (looked-up option sets will use the
                             field representation method instead)
         @keyword none: label for explicit None-option in many-to-many fields
+        @keyword counts: show the number of matching records with each
+                         option (where available from the facet lookup)
 
         ** multiselect-specific options:
 
@@ -2375,6 +2379,118 @@ class S3OptionsFilter(S3FilterWidget):
 
         return options
 
+    # -------------------------------------------------------------------------
+    def facet_query(self, resource):
+        """
+            Construct the query to look up the available options for
+            this widget in the resource (facet lookup, see S3FilterFacets)
+
+            @param resource: the S3Resource
+
+            @return: Storage with the query, the key field to group by,
+                     the inner and left joins required for the query, and
+                     the names of all tables involved in the lookup;
+                     or None if the options can not be looked up this way
+        """
+
+        opts = self.opts
+        if resource is None or opts.options is not None:
+            return None
+
+        selector = self.field
+        if isinstance(selector, (tuple, list)):
+            selector = selector[0]
+
+        rfield = S3ResourceField(resource, selector)
+        field = rfield.field
+        if not field:
+            return None
+
+        ktablename, key = s3_get_foreign_key(field, m2m=False)[:2]
+        if not ktablename and \
+           (rfield.tname != resource.tablename or \
+            rfield.ftype not in ("string", "integer")):
+            # Forward lookup only for plain fields in the master table,
+            # otherwise needs left joins => fall back to resource.select
+            return None
+
+        # Find only values linked to records the user is permitted to read,
+        # and apply any resource filters (= use the resource query)
+        query = resource.get_query()
+
+        # Must include rfilter joins when using the resource
+        # query (both inner and left):
+        tables = set([resource.tablename])
+        rfilter = resource.rfilter
+        if rfilter:
+            ijoins = rfilter.get_joins(as_list=False)
+            ljoins = rfilter.get_joins(left=True, as_list=False)
+            join = [j for tn in ijoins for j in ijoins[tn]]
+            left = [j for tn in ljoins for j in ljoins[tn]]
+            tables.update(ijoins)
+            tables.update(ljoins)
+        else:
+            join = left = None
+
+        if ktablename:
+            # If the search field is a foreign key, then perform a reverse
+            # lookup of primary IDs in the lookup table which are linked to
+            # at least one record in the resource => better scalability
+            # => only if the number of lookup options is much (!) smaller than
+            #    the number of records in the resource to filter, otherwise
+            #    this can have the opposite effect (e.g. person_id being the
+            #    search field); however, counting records in both tables before
+            #    deciding this would be even less scalable, hence:
+            # @todo: implement a widget option to enforce forward-lookup if
+            #        the look-up table is the big table
+            ktable = current.s3db.table(ktablename)
+            key_field = ktable[key]
+
+            # The actual query for the look-up table
+            # @note: the inner join here is required even if rfilter
+            #        already left-joins the look-up table, because we
+            #        must make sure look-up values are indeed linked
+            #        to the resource => not redundant!
+            query &= (key_field == field) & \
+                     current.auth.s3_accessible_query("read", ktable)
+
+            # If the filter field is in a joined table itself,
+            # then we also need the join for that table (this
+            # could be redundant, but checking that will likely
+            # take more effort than we can save by avoiding it)
+            joins = rfield.join
+            for tname in joins:
+                query &= joins[tname]
+            tables.update(joins)
+            tables.add(ktablename)
+
+            # Filter options by location?
+            location_filter = opts.get("location_filter")
+            if location_filter and "location_id" in ktable:
+                location = current.session.s3.location_filter
+                if location:
+                    query &= (ktable.location_id == location)
+
+            # Filter options by organisation?
+            org_filter = opts.get("org_filter")
+            if org_filter and "organisation_id" in ktable:
+                root_org = current.auth.root_org()
+                if root_org:
+                    query &= ((ktable.organisation_id == root_org) | \
+                              (ktable.organisation_id == None))
+                #else:
+                #    query &= (ktable.organisation_id == None)
+        else:
+            # Group by the field itself
+            key_field = field
+
+        return Storage(query = query,
+                       key = key_field,
+                       join = join,
+                       left = left,
+                       tables = tables,
+                       )
+
     # -------------------------------------------------------------------------
     def _options(self, resource, values=None):
         """
@@ -2412,6 +2528,7 @@ class S3OptionsFilter(S3FilterWidget):
 
         # Find the options
         opt_keys = []
+        counts = None
 
         multiple = ftype[:5] == "list:"
         if opts.options is not None:
@@ -2430,90 +2547,26 @@ class S3OptionsFilter(S3FilterWidget):
 
             elif field or rfield.virtual:
 
-                groupby = field if field and not multiple else None
-                virtual = field is None
-
-                # If the search field is a foreign key, then try to perform
-                # a reverse lookup of primary IDs in the lookup table which
-                # are linked to at least one record in the resource => better
-                # scalability
-                # => only if the number of lookup options is much (!) smaller than
-                #    the number of records in the resource to filter, otherwise
-                #    this can have the opposite effect (e.g. person_id being the
-                #    search field); however, counting records in both tables before
-                #    deciding this would be even less scalable, hence:
-                # @todo: implement a widget option to enforce forward-lookup if
-                #        the look-up table is the big table
-                rows = None
+                # Try to look up the options (and the number of records
+                # per option) with a grouped query => the facet engine
+                # performs a reverse lookup of foreign keys, and caches
+                # the results per filter state
+                facet = None
                 if field:
-                    ktablename, key, m = s3_get_foreign_key(field, m2m=False)
-                    if ktablename:
-
-                        multiple = m
-
-                        ktable = current.s3db.table(ktablename)
-                        key_field = ktable[key]
-                        colname = str(key_field)
-
-                        # Find only values linked to records the user is
-                        # permitted to read, and apply any resource filters
-                        # (= use the resource query)
-                        query = resource.get_query()
-
-                        # Must include rfilter joins when using the resource
-                        # query (both inner and left):
-                        rfilter = resource.rfilter
-                        if rfilter:
-                            join = rfilter.get_joins()
-                            left = rfilter.get_joins(left=True)
-                        else:
-                            join = left = None
-
-                        # The actual query for the look-up table
-                        # @note: the inner join here is required even if rfilter
-                        #        already left-joins the look-up table, because we
-                        #        must make sure look-up values are indeed linked
-                        #        to the resource => not redundant!
-                        query &= (key_field == field) & \
-                                 current.auth.s3_accessible_query("read", ktable)
-
-                        # If the filter field is in a joined table itself,
-                        # then we also need the join for that table (this
-                        # could be redundant, but checking that will likely
-                        # take more effort than we can save by avoiding it)
-                        joins = rfield.join
-                        for tname in joins:
-                            query &= joins[tname]
-
-                        # Filter options by location?
-                        location_filter = opts.get("location_filter")
-                        if location_filter and "location_id" in ktable:
-                            location = current.session.s3.location_filter
-                            if location:
-                                query &= (ktable.location_id == location)
-
-                        # Filter options by organisation?
-                        org_filter = opts.get("org_filter")
-                        if org_filter and "organisation_id" in ktable:
-                            root_org = current.auth.root_org()
-                            if root_org:
-                                query &= ((ktable.organisation_id == root_org) | \
-                                          (ktable.organisation_id == None))
-                            #else:
-                            #    query &= (ktable.organisation_id == None)
-
-                        rows = current.db(query).select(key_field,
-                                                        resource._id.min(),
-                                                        groupby = key_field,
-                                                        join = join,
-                                                        left = left,
-                                                        )
-
-                # If we can not perform a reverse lookup, then we need
-                # to do a forward lookup of all unique values of the
-                # search field from all records in the table :/ still ok,
-                # but not endlessly scalable:
-                if rows is None:
+                    facet = S3FilterFacets(resource, [self]).get(self)
+
+                if facet is not None:
+                    keys, counts = facet
+                    opt_keys = list(keys)
+                    multiple = False
+                else:
+                    # If we can not perform a grouped lookup, then we need
+                    # to do a forward lookup of all unique values of the
+                    # search field from all records in the table :/ still ok,
+                    # but not endlessly scalable:
+                    groupby = field if field and not multiple else None
+                    virtual = field is None
+
                     rows = resource.select([selector],
                                            limit = None,
                                            orderby = field,
@@ -2522,20 +2575,20 @@ class S3OptionsFilter(S3FilterWidget):
                                            as_rows = True,
                                            )
 
-                opt_keys = [] # Can't use set => would make orderby pointless
-                if rows:
-                    kappend = opt_keys.append
-                    kextend = opt_keys.extend
-                    for row in rows:
-                        val = row[colname]
-                        if virtual and callable(val):
-                            val = val()
-                        if (multiple or \
-                            virtual) and isinstance(val, (list, tuple, set)):
-                            kextend([v for v in val
-                                       if v not in opt_keys])
-                        elif val not in opt_keys:
-                            kappend(val)
+                    opt_keys = [] # Can't use set => would make orderby pointless
+                    if rows:
+                        kappend = opt_keys.append
+                        kextend = opt_keys.extend
+                        for row in rows:
+                            val = row[colname]
+                            if virtual and callable(val):
+                                val = val()
+                            if (multiple or \
+                                virtual) and isinstance(val, (list, tuple, set)):
+                                kextend([v for v in val
+                                           if v not in opt_keys])
+                            elif val not in opt_keys:
+                                kappend(val)
 
         # Make sure the selected options are in the available options
         # (not possible if we have a fixed options dict)
@@ -2671,6 +2724,13 @@ class S3OptionsFilter(S3FilterWidget):
                 none = current.messages["NONE"]
             options.append((None, none))
 
+        if counts and opts.get("counts"):
+            # Append the number of matching records to the option labels
+            options = [(k, "%s (%s)" % (s3_unicode(v), counts[k]))
+                       if k in counts else (k, v)
+                       for k, v in options
+                       ]
+
         if not opts.get("multiple", True) and not self.values:
             # Browsers automatically select the first option in single-selects,
             # but that doesn't filter the data, so the first option must be
@@ -2706,6 +2766,240 @@ class S3OptionsFilter(S3FilterWidget):
 
         return []
 
+# =============================================================================
+class S3FilterFacets(object):
+    """
+        Facet engine for filter forms: looks up the available options,
+        and the number of matching records per option, for all options
+        filter widgets of a form at once (one UNION query per key type
+        rather than one grouped query per widget), and caches the results
+        per filter state.
+
+        The cache key is a hash of the actual SQL of the facet lookup
+        (which includes the resource filters and the permission filters
+        of the current user, i.e. the normalized filter state) and the
+        data versions of all tables involved in the lookup - so filter
+        forms with the same effective filters can share the cached options.
+    """
+
+    def __init__(self, resource, widgets):
+        """
+            Constructor
+
+            @param resource: the S3Resource
+            @param widgets: the filter widgets (S3FilterWidget instances,
+                            any other than S3OptionsFilter will be ignored)
+        """
+
+        self.resource = resource
+        self.widgets = [w for w in widgets if isinstance(w, S3OptionsFilter)]
+
+        self._facets = None
+
+    # -------------------------------------------------------------------------
+    def __call__(self):
+        """
+            Look up the facets for all widgets
+
+            @return: dict {widget: (keys, counts)}, where keys is a tuple
+                     of the available option keys, and counts a dict
+                     {key: number of matching records}; widgets which
+                     can not be looked up by the facet engine are omitted
+        """
+
+        facets = self._facets
+        if facets is not None:
+            return facets
+
+        facets = self._facets = {}
+
+        resource = self.resource
+        if resource is None or not self.widgets:
+            return facets
+
+        # Per-request store
+        s3 = current.response.s3
+        store = s3.filter_facets
+        if store is None:
+            store = s3.filter_facets = {}
+
+        expire = current.deployment_settings.get_search_filter_facets_cache()
+
+        # Construct the lookup queries
+        pending = {}
+        for widget in self.widgets:
+            spec = widget.facet_query(resource)
+            if spec is None:
+                continue
+            sql = s3_unicode(self.sql(resource, spec))
+            if expire:
+                # Cache key includes the data version
+                version = "%s|%s" % (self.version(spec.tables, store), sql)
+                key = "filter_facets_%s" % \
+                      hashlib.md5(version.encode("utf-8")).hexdigest()
+            else:
+                key = sql
+            if key in store:
+                facets[widget] = store[key]
+            else:
+                pending[key] = (widget, spec.key, sql)
+
+        if not pending:
+            return facets
+
+        if expire:
+            # Look up all pending facets at once upon the first cache miss
+            results = {}
+            def lookup(key):
+                if not results:
+                    results.update(self.lookup(pending))
+                return results[key]
+
+            cache = current.cache.ram
+            for key, item in pending.items():
+                facet = cache(key,
+                              lambda key=key: lookup(key),
+                              time_expire = expire,
+                              )
+                store[key] = facets[item[0]] = facet
+        else:
+            results = self.lookup(pending)
+            for key, item in pending.items():
+                store[key] = facets[item[0]] = results[key]
+
+        return facets
+
+    # -------------------------------------------------------------------------
+    def get(self, widget):
+        """
+            Get the facet for a particular widget
+
+            @param widget: the filter widget
+
+            @return: tuple (keys, counts), or None if the options of
+                     this widget can not be looked up by the facet engine
+        """
+
+        return self().get(widget)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def version(tablenames, store):
+        """
+            Get the data version of the tables involved in a facet lookup
+            (=latest modification date and number of records per table),
+            so that cached facets expire when records are added, updated
+            or deleted in any of these tables (including hard deletes)
+
+            @param tablenames: the names of the tables
+            @param store: the per-request facet store
+
+            @return: the version (string)
+        """
+
+        versions = store.get("versions")
+        if versions is None:
+            versions = store["versions"] = {}
+
+        db = current.db
+        get_table = current.s3db.table
+
+        version = []
+        for tablename in sorted(tablenames):
+
+            if tablename in versions:
+                version.append(versions[tablename])
+                continue
+
+            table = get_table(tablename)
+            if table is None:
+                # Aliased join => covered by the original table
+                continue
+
+            number = table._id.count()
+            if "modified_on" in table.fields:
+                latest = table.modified_on.max()
+                row = db(table._id > 0).select(latest, number).first()
+                table_version = "%s:%s:%s" % (tablename,
+                                              row[latest] if row else "",
+                                              row[number] if row else 0,
+                                              )
+            else:
+                row = db(table._id > 0).select(number).first()
+                table_version = "%s::%s" % (tablename,
+                                            row[number] if row else 0,
+                                            )
+
+            versions[tablename] = table_version
+            version.append(table_version)
+
+        return "|".join(version)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def sql(resource, spec):
+        """
+            Generate the SQL for a facet lookup
+
+            @param resource: the S3Resource
+            @param spec: the facet query specs (from widget.facet_query)
+
+            @return: the SQL string
+        """
+
+        key_field = spec.key
+        sql = current.db(spec.query)._select(key_field,
+                                             resource._id.count(distinct=True),
+                                             groupby = key_field,
+                                             join = spec.join,
+                                             left = spec.left,
+                                             )
+        return sql.strip().rstrip(";")
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def lookup(pending):
+        """
+            Look up facets from the database, combining all lookups with
+            the same key type into one UNION query
+
+            @param pending: dict {cache_key: (widget, key_field, sql)}
+
+            @return: dict {cache_key: (keys, counts)}
+        """
+
+        # Group the lookups by key type (UNION requires compatible types)
+        groups = {}
+        for cache_key, (widget, key_field, sql) in pending.items():
+            ftype = str(key_field.type)
+            if ftype == "id" or ftype[:9] == "reference":
+                ftype = "integer"
+            if ftype not in groups:
+                groups[ftype] = []
+            groups[ftype].append((cache_key, sql))
+
+        results = {}
+        executesql = current.db.executesql
+        for lookups in groups.values():
+
+            subqueries = []
+            for index, (cache_key, sql) in enumerate(lookups):
+                subqueries.append("SELECT %s AS facet_index,facet.* FROM (%s) facet" % \
+                                  (index, sql))
+                results[cache_key] = ([], {})
+
+            rows = executesql(" UNION ALL ".join(subqueries))
+            for index, value, number in rows:
+                keys, counts = results[lookups[index][0]]
+                keys.append(value)
+                counts[value] = int(number)
+
+        for cache_key, (keys, counts) in results.items():
+            keys.sort(key=lambda k: (k is not None, k))
+            results[cache_key] = (tuple(keys), counts)
+
+        return results
+
 # =============================================================================
 class S3HierarchyFilter(S3FilterWidget):
     """
@@ -3143,6 +3437,10 @@ class S3FilterForm(object):
             @return: a list of form rows
         """
 
+        # Look up the options for all options filters at once
+        if resource:
+            S3FilterFacets(resource, [f for f in self.widgets if f])()
+
         rows = []
         rappend = rows.append
         advanced = False
@@ -3507,6 +3805,9 @@ class S3Filter(S3Method):
                                               filter = current.response.s3.filter,
                                               )
 
+            # Look up the options for all options filters at once
+            S3FilterFacets(fresource, [w for w in filter_widgets if w])()
+
             for widget in filter_widgets:
                 if hasattr(widget, "ajax_options"):
                     opts = widget.ajax_options(fresource)
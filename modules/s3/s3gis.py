@@ -33,6 +33,8 @@
 
 __all__ = ("GIS",
            "MAP2",
+           "S3LocationBundle",
+           "S3ProxyCache",
            "S3Map",
            "S3ExportPOI",
            "S3ImportPOI",
@@ -3675,6 +3677,9 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             if "L2" in levels:
                 self.import_gadm1(ogr, "L2", countries=countries)
 
+            # Rebuild the location hierarchy bundles
+            S3LocationBundle.rebuild()
+
             current.log.debug("All done!")
 
         elif source == "gadmv1":
@@ -3691,6 +3696,9 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             if "L2" in levels:
                 self.import_gadm2(ogr, "L2", countries=countries)
 
+            # Rebuild the location hierarchy bundles
+            S3LocationBundle.rebuild()
+
             current.log.debug("All done!")
 
         else:
@@ -4778,6 +4786,10 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                             # Polygons aren't inherited
                             feature["inherited"] = False
                         update_location_tree(feature)  # all_locations is False here
+
+            # Rebuild the location hierarchy bundles
+            S3LocationBundle.rebuild()
+
             # All Done!
             return
 
@@ -6374,6 +6386,1112 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
                    plugins = plugins,
                    )
 
+# =============================================================================
+class S3LocationBundle(object):
+    """
+        Prebuilt location hierarchy bundles (id, name, level, parent and
+        bounds of all Lx locations of a country, plus the translated names)
+        to serve S3LocationSelector and gis/ldata without querying
+        gis_location for every level
+
+        - bundles are stored as gzipped JSON in static/cache/locations,
+          one per country (<L0 ID>.json.gz) plus one for all countries
+          (countries.json.gz)
+        - bundles are rebuilt after update_location_tree for the whole
+          tree and after importing admin areas, and invalidated when a
+          location (or location name) gets changed - after the change
+          has been committed, so that concurrent requests can not rebuild
+          them from the old data; invalidated bundles are rebuilt on demand
+        - each bundle carries a version (hash of its contents) to allow
+          long-lived client-side caching
+    """
+
+    # Bundles loaded in this process {name: (mtime, data)}
+    loaded = {}
+
+    COUNTRIES = "countries"
+
+    def __init__(self, name):
+        """
+            Constructor
+
+            @param name: the L0 location ID, or "countries" for the
+                         bundle of all countries
+        """
+
+        self.name = str(name)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def folder():
+        """
+            Get the folder for location bundles, create it if necessary
+
+            @return: the path to the folder
+        """
+
+        folder = os.path.join(current.request.folder, "static", "cache", "locations")
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created concurrently
+                pass
+        return folder
+
+    # -------------------------------------------------------------------------
+    @property
+    def path(self):
+        """ The path to the bundle file """
+
+        return os.path.join(self.folder(), "%s.json.gz" % self.name)
+
+    # -------------------------------------------------------------------------
+    @property
+    def version(self):
+        """ The version of the bundle (hash of its contents) """
+
+        data = self.data()
+        return data["v"] if data else None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def lookup(cls, location_id, cache=True):
+        """
+            Get the bundle for the country of a location
+
+            @param location_id: the gis_location record ID
+            @param cache: use the model cache for the path lookup
+                          (must be False when the path may have changed)
+
+            @return: the S3LocationBundle, or None if the location
+                     does not belong to any country
+        """
+
+        try:
+            location_id = int(location_id)
+        except (ValueError, TypeError):
+            return None
+
+        s3db = current.s3db
+        table = s3db.gis_location
+        row = current.db(table.id == location_id).select(table.level,
+                                                         table.path,
+                                                         cache = s3db.cache if cache else None,
+                                                         limitby = (0, 1),
+                                                         ).first()
+        if not row:
+            return None
+        if row.level == "L0":
+            return cls(location_id)
+
+        path = row.path
+        if path:
+            # The country is the first element of the path
+            root = path.split("/", 1)[0]
+            if root.isdigit():
+                return cls(root)
+
+        return None
+
+    # -------------------------------------------------------------------------
+    def data(self):
+        """
+            Get the contents of this bundle, build it if necessary
+
+            @return: the bundle contents as dict, or None if not available
+        """
+
+        name = self.name
+        path = self.path
+
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            if self.build() is None:
+                return None
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return None
+
+        loaded = self.loaded.get(name)
+        if loaded and loaded[0] == mtime:
+            return loaded[1]
+
+        import gzip
+        try:
+            with gzip.open(path, "rb") as bundle:
+                contents = json.loads(bundle.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            current.log.error("S3LocationBundle: can not read %s" % path)
+            return None
+
+        # Convert the keys back into record IDs, index children
+        locations = dict((int(k), v) for k, v in contents["d"].items())
+        children = {}
+        for location_id, location in locations.items():
+            parent = location[2]
+            if parent in children:
+                children[parent].append(location_id)
+            else:
+                children[parent] = [location_id]
+
+        data = {"v": contents["v"],
+                "d": locations,
+                "c": children,
+                "t": dict((language, dict((int(k), v) for k, v in names.items()))
+                          for language, names in contents["t"].items()),
+                "iso2": dict((int(k), v) for k, v in contents.get("iso2", {}).items()),
+                }
+
+        self.loaded[name] = (mtime, data)
+        return data
+
+    # -------------------------------------------------------------------------
+    def build(self):
+        """
+            Build this bundle from the database
+
+            @return: the bundle contents as written to the file, or None
+                     if the bundle could not be written
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.gis_location
+        query = (table.deleted == False) & \
+                (table.end_date == None) & \
+                (table.level != None)
+
+        countries = self.name == self.COUNTRIES
+        if countries:
+            query &= (table.level == "L0")
+        else:
+            try:
+                L0 = int(self.name)
+            except ValueError:
+                return None
+            query &= (table.id == L0) | (table.path.like("%s/%%" % L0))
+
+        rows = db(query).select(table.id,
+                                table.name,
+                                table.level,
+                                table.parent,
+                                table.inherited,
+                                table.lon_min,
+                                table.lat_min,
+                                table.lon_max,
+                                table.lat_max,
+                                )
+        locations = {}
+        for row in rows:
+            try:
+                level = int(row.level[1:])
+            except ValueError:
+                continue
+            if row.lon_min is not None:
+                bounds = [row.lon_min, row.lat_min, row.lon_max, row.lat_max]
+            else:
+                bounds = None
+            locations[row.id] = [row.name,
+                                 level,
+                                 row.parent,
+                                 bool(row.inherited),
+                                 bounds,
+                                 ]
+
+        # Translated names
+        ntable = s3db.gis_location_name
+        join = ntable.on((ntable.location_id == table.id) & \
+                         (ntable.deleted == False))
+        rows = db(query).select(ntable.location_id,
+                                ntable.language,
+                                ntable.name_l10n,
+                                join = join,
+                                )
+        l10n = {}
+        for row in rows:
+            language = row.language
+            if language not in l10n:
+                l10n[language] = {}
+            l10n[language][row.location_id] = row.name_l10n
+
+        contents = {"d": locations,
+                    "t": l10n,
+                    }
+
+        if countries:
+            # ISO2 codes of all countries
+            ttable = s3db.gis_location_tag
+            join = ttable.on((ttable.location_id == table.id) & \
+                             (ttable.tag == "ISO2") & \
+                             (ttable.deleted == False))
+            rows = db(query).select(ttable.location_id,
+                                    ttable.value,
+                                    join = join,
+                                    )
+            contents["iso2"] = dict((row.location_id, row.value) for row in rows)
+
+        # Version = hash of the contents
+        import hashlib
+        version = json.dumps(contents, separators=SEPARATORS, sort_keys=True)
+        contents["v"] = hashlib.md5(version.encode("utf-8")).hexdigest()[:12]
+
+        # Write atomically
+        import gzip
+        path = self.path
+        tmp = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            with gzip.open(tmp, "wb") as bundle:
+                output = json.dumps(contents, separators=SEPARATORS)
+                bundle.write(output.encode("utf-8"))
+            if os.path.exists(path) and sys.platform == "win32":
+                # Windows can not rename onto an existing file
+                os.remove(path)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            current.log.error("S3LocationBundle: can not write %s" % path)
+            return None
+
+        return contents
+
+    # -------------------------------------------------------------------------
+    def invalidate(self):
+        """
+            Remove this bundle, so that it gets rebuilt upon next access
+        """
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            # Not built yet
+            pass
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def containing(cls, location_ids):
+        """
+            Get the names of the bundles which contain locations
+
+            @param location_ids: the gis_location record IDs
+
+            @return: set of bundle names
+        """
+
+        names = set()
+        for location_id in location_ids:
+            if not location_id:
+                continue
+            bundle = cls.lookup(location_id, cache=False)
+            if bundle is None:
+                continue
+            if bundle.name == str(location_id):
+                # This is a country
+                names.add(cls.COUNTRIES)
+            names.add(bundle.name)
+
+        return names
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate_location(cls, *location_ids):
+        """
+            Invalidate the bundle(s) which contain a location, to be
+            called when a location change has been committed
+
+            @param location_ids: the gis_location record ID(s), e.g. the
+                                 location and its old and new parent when
+                                 a location gets moved to another country
+        """
+
+        if not current.deployment_settings.get_gis_location_bundles():
+            return
+
+        for name in cls.containing(location_ids):
+            cls(name).invalidate()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate_location_async(cls, *location_ids):
+        """
+            Invalidate the bundle(s) which contain a location once the
+            current transaction has been committed, to be called when a
+            location gets changed or deleted (onaccept/ondelete)
+
+            - the bundles are looked up immediately, i.e. with the path
+              before any location tree update
+            - they are removed by a task, which a worker only picks up
+              after the commit (without a worker, the task runs at once)
+
+            @param location_ids: the gis_location record ID(s)
+        """
+
+        if not current.deployment_settings.get_gis_location_bundles():
+            return
+
+        names = sorted(cls.containing(location_ids))
+        if not names:
+            return
+
+        if current.s3task.run_async("gis_invalidate_location_bundles",
+                                    args = [json.dumps(names)],
+                                    ) is False:
+            # Task not available
+            cls.invalidate_bundles(names)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate_bundles(cls, names):
+        """
+            Invalidate bundles by name
+
+            @param names: the bundle names
+        """
+
+        for name in names:
+            cls(name).invalidate()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def rebuild(cls, countries=None):
+        """
+            Rebuild the location bundles, to be called after updating
+            the location tree or importing admin areas
+
+            @param countries: list of L0 location IDs to rebuild the
+                              bundles for, None for all countries
+        """
+
+        if not current.deployment_settings.get_gis_location_bundles():
+            return
+
+        table = current.s3db.gis_location
+        query = (table.level == "L0") & \
+                (table.deleted == False)
+        if countries:
+            query &= (table.id.belongs(countries))
+        rows = current.db(query).select(table.id)
+
+        cls(cls.COUNTRIES).build()
+        for row in rows:
+            cls(row.id).build()
+
+    # -------------------------------------------------------------------------
+    def ldata(self, location_id, output_level=None, language=None):
+        """
+            Extract the location data for the gis/ldata controller
+
+            @param location_id: the parent location ID
+            @param output_level: the level to read (when reading after
+                                 a missing level), default is the level
+                                 below the parent
+            @param language: the language to translate the names into
+
+            @return: dict {id: {"n": name, "l": level, "f": parent,
+                                "b": bounds}}, or None if the parent
+                     location is not in the bundle
+        """
+
+        data = self.data()
+        if not data:
+            return None
+
+        locations = data["d"]
+        location = locations.get(location_id)
+        if location is None:
+            return None
+
+        children = data["c"]
+        names = data["t"].get(language, {}) if language else {}
+
+        if output_level:
+            # All descendants except those at the level above
+            # the output level (=individual locations with missing levels)
+            filter_level = output_level - 1
+            ids = []
+            pending = list(children.get(location_id, ()))
+            while pending:
+                child_id = pending.pop()
+                pending.extend(children.get(child_id, ()))
+                if locations[child_id][1] != filter_level:
+                    ids.append(child_id)
+        else:
+            ids = children.get(location_id, [])
+            output_level = location[1] + 1
+
+        location_dict = {}
+        for item_id in [location_id] + ids:
+            name, level, parent, inherited, bounds = locations[item_id]
+            if level == output_level:
+                # In case we're using a missing level, use the pseudo-parent
+                f = location_id
+            else:
+                # An individual location with a Missing Level
+                f = parent
+            item = {"n": names.get(item_id) or name,
+                    "l": level,
+                    "f": f,
+                    }
+            if bounds:
+                item["b"] = bounds
+            location_dict[item_id] = item
+
+        return location_dict
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def selector_locations(cls, levels, values, language=None):
+        """
+            Extract the locations to populate the Lx dropdowns of the
+            S3LocationSelector
+
+            @param levels: the exposed levels
+            @param values: the current values {Lx: location ID}
+            @param language: the language to translate the names into
+
+            @return: list of Storages with the same attributes as the
+                     gis_location Rows (names already translated), or
+                     None if the data are not available from bundles
+        """
+
+        locations = []
+
+        def extract(data, location_ids):
+            names = data["t"].get(language, {}) if language else {}
+            for location_id in location_ids:
+                name, level, parent, inherited, bounds = data["d"][location_id]
+                location = Storage(id = location_id,
+                                   name = names.get(location_id) or name,
+                                   level = "L%s" % level,
+                                   parent = parent,
+                                   inherited = inherited,
+                                   )
+                if bounds:
+                    location.update(lon_min = bounds[0],
+                                    lat_min = bounds[1],
+                                    lon_max = bounds[2],
+                                    lat_max = bounds[3],
+                                    )
+                else:
+                    location.update(lon_min = None,
+                                    lat_min = None,
+                                    lon_max = None,
+                                    lat_max = None,
+                                    )
+                locations.append(location)
+
+        if "L0" in levels:
+            data = cls(cls.COUNTRIES).data()
+            if not data:
+                return None
+            countries = current.deployment_settings.get_gis_countries()
+            if countries:
+                iso2 = data["iso2"]
+                location_ids = [k for k in data["d"] if iso2.get(k) in countries]
+            else:
+                location_ids = list(data["d"].keys())
+            extract(data, location_ids)
+
+        # Children of all selected levels which have the next level exposed
+        parents = []
+        for level in range(5):
+            parent = values.get("L%s" % level)
+            if parent and "L%s" % (level + 1) in levels:
+                parents.append(int(parent))
+        if parents:
+            bundle = cls.lookup(parents[0])
+            data = bundle.data() if bundle else None
+            if not data:
+                return None
+            children = data["c"]
+            for parent in parents:
+                if parent not in data["d"]:
+                    return None
+                extract(data, children.get(parent, ()))
+
+        return locations
+
+# =============================================================================
+class S3ProxyCache(object):
+    """
+        Disk-backed cache for responses from remote map servers (tiles,
+        feature data), used by the gis/proxy and gis/tile controllers
+
+        - responses are stored in uploads/gis_cache/proxy, one data file
+          plus one JSON metadata file per URL
+        - the total size of the cache is bounded, least recently used
+          responses get evicted first
+        - freshness follows the upstream Cache-Control/Expires headers,
+          stale responses are revalidated using ETag/Last-Modified (and
+          served stale if the upstream server can not be reached)
+        - concurrent requests for the same URL are coalesced, i.e. only
+          one of them goes upstream while the others wait for its result
+    """
+
+    # Bytes written by this process since the last eviction
+    written = 0
+
+    def __init__(self, folder=None, max_size=None, ttl=None, timeout=30):
+        """
+            Constructor
+
+            @param folder: the cache folder
+            @param max_size: the maximum total size of the cache (bytes),
+                             default see settings.gis.proxy_cache_size
+            @param ttl: the default time-to-live (seconds) for responses
+                        without upstream caching headers, default see
+                        settings.gis.proxy_cache_ttl
+            @param timeout: the timeout (seconds) for upstream requests,
+                            and for waiting on concurrent requests
+        """
+
+        settings = current.deployment_settings
+
+        if folder is None:
+            folder = os.path.join(current.request.folder,
+                                  "uploads", "gis_cache", "proxy")
+        self.folder = folder
+
+        if max_size is None:
+            max_size = settings.get_gis_proxy_cache_size() * 1024 * 1024
+        self.max_size = max_size
+
+        self.ttl = settings.get_gis_proxy_cache_ttl() if ttl is None else ttl
+        self.timeout = timeout
+
+    # -------------------------------------------------------------------------
+    def get(self, url):
+        """
+            Get the response for a URL, from cache if possible
+
+            @param url: the URL
+
+            @return: tuple (content_type, body)
+
+            @raises: IOError (or subclass) if the URL could not be fetched
+                     and there is no cached response
+        """
+
+        key = self.key(url)
+
+        cached = self.read(key)
+        if cached and self.fresh(cached[0]):
+            self.touch(key)
+            return cached[0].get("content_type"), cached[1]
+
+        locked = self.lock(key)
+        if not locked:
+            # Another request is fetching this URL => wait for its result
+            self.wait(key)
+            cached = self.read(key)
+            if cached and self.fresh(cached[0]):
+                return cached[0].get("content_type"), cached[1]
+            locked = self.lock(key)
+
+        try:
+            return self.update(url, key, cached)
+        finally:
+            if locked:
+                self.unlock(key)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def error_status(error):
+        """
+            Get the HTTP status to report to the client when an upstream
+            request has failed
+
+            @param error: the exception (HTTPError, URLError or IOError)
+
+            @return: the upstream status for client errors (4xx), 504
+                     for timeouts, otherwise 502
+        """
+
+        import socket
+
+        if isinstance(error, HTTPError):
+            code = error.code
+            return code if 400 <= code < 500 else 502
+
+        reason = getattr(error, "reason", None)
+        if isinstance(error, socket.timeout) or \
+           isinstance(reason, socket.timeout):
+            return 504
+        return 502
+
+    # -------------------------------------------------------------------------
+    def update(self, url, key, cached=None):
+        """
+            Fetch a URL from upstream and update the cache
+
+            @param url: the URL
+            @param key: the cache key
+            @param cached: the cached response as tuple (meta, body)
+
+            @return: tuple (content_type, body)
+        """
+
+        from s3compat import urllib2, urlopen
+
+        request = urllib2.Request(url)
+        if cached:
+            # Conditional request
+            meta = cached[0]
+            if meta.get("etag"):
+                request.add_header("If-None-Match", meta["etag"])
+            if meta.get("last_modified"):
+                request.add_header("If-Modified-Since", meta["last_modified"])
+
+        try:
+            response = urlopen(request, timeout=self.timeout)
+            body = response.read()
+            headers = response.info()
+            response.close()
+        except HTTPError as e:
+            if e.code == 304 and cached:
+                # Not modified => renew
+                meta, body = cached
+                expires = self.expires(e.info())
+                if expires is not None:
+                    meta["expires"] = expires
+                    self.write(key, meta)
+                self.touch(key)
+                return meta.get("content_type"), body
+            elif cached and e.code >= 500:
+                # Serve stale
+                return cached[0].get("content_type"), cached[1]
+            raise
+        except (URLError, IOError):
+            if cached:
+                # Upstream not reachable => serve stale
+                return cached[0].get("content_type"), cached[1]
+            raise
+
+        content_type = headers.get("Content-Type")
+
+        expires = self.expires(headers)
+        if expires is not None:
+            meta = {"url": url,
+                    "content_type": content_type,
+                    "etag": headers.get("ETag"),
+                    "last_modified": headers.get("Last-Modified"),
+                    "expires": expires,
+                    }
+            self.write(key, meta, body)
+
+        return content_type, body
+
+    # -------------------------------------------------------------------------
+    def expires(self, headers):
+        """
+            Determine the expiry time of a response from the upstream
+            caching headers
+
+            @param headers: the response headers
+
+            @return: the expiry time (UNIX time), or None if the response
+                     must not be stored
+        """
+
+        import time
+
+        now = time.time()
+
+        cache_control = headers.get("Cache-Control")
+        if cache_control:
+            directives = {}
+            for directive in cache_control.lower().split(","):
+                name, value = (directive.strip().split("=", 1) + [None])[:2]
+                directives[name] = value
+            if "no-store" in directives or "private" in directives:
+                return None
+            if "no-cache" in directives:
+                # Store, but always revalidate
+                return now
+            for name in ("s-maxage", "max-age"):
+                value = directives.get(name)
+                if value:
+                    try:
+                        return now + int(value.strip('"'))
+                    except ValueError:
+                        pass
+
+        expires = headers.get("Expires")
+        if expires:
+            from email.utils import mktime_tz, parsedate_tz
+            parsed = parsedate_tz(expires)
+            # Invalid dates mean "already expired"
+            return mktime_tz(parsed) if parsed else now
+
+        return now + self.ttl
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def fresh(meta):
+        """
+            Check whether a cached response is still fresh
+
+            @param meta: the metadata of the cached response
+        """
+
+        import time
+        return meta.get("expires", 0) > time.time()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def key(url):
+        """
+            Compute the cache key for a URL, normalizing the order
+            of query parameters
+
+            @param url: the URL
+        """
+
+        import hashlib
+        from s3compat import urlparse
+
+        parts = urlparse.urlsplit(url)
+        if parts.query:
+            params = sorted(urlparse.parse_qsl(parts.query, keep_blank_values=True),
+                            key = lambda param: (param[0].lower(), param[1]))
+            query = "&".join("%s=%s" % param for param in params)
+            url = urlparse.urlunsplit((parts.scheme.lower(),
+                                       parts.netloc.lower(),
+                                       parts.path,
+                                       query,
+                                       "",
+                                       ))
+        return hashlib.sha1(s3_str(url).encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    def path(self, key):
+        """
+            The path of the data file for a cache key
+
+            @param key: the cache key
+        """
+
+        return os.path.join(self.folder, key[:2], key)
+
+    # -------------------------------------------------------------------------
+    def read(self, key):
+        """
+            Read a response from the cache
+
+            @param key: the cache key
+
+            @return: tuple (meta, body), or None if not cached
+        """
+
+        path = self.path(key)
+        try:
+            with open("%s.json" % path, "rb") as f:
+                meta = json.loads(f.read().decode("utf-8"))
+            with open(path, "rb") as f:
+                body = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return meta, body
+
+    # -------------------------------------------------------------------------
+    def write(self, key, meta, body=None):
+        """
+            Write a response to the cache (atomically)
+
+            @param key: the cache key
+            @param meta: the metadata
+            @param body: the response body (None to update only the
+                         metadata)
+        """
+
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created concurrently
+                pass
+
+        items = [("%s.json" % path, json.dumps(meta).encode("utf-8"))]
+        if body is not None:
+            items.insert(0, (path, body))
+
+        for filename, contents in items:
+            tmp = "%s.%s.tmp" % (filename, os.getpid())
+            try:
+                with open(tmp, "wb") as f:
+                    f.write(contents)
+                if os.path.exists(filename) and sys.platform == "win32":
+                    os.remove(filename)
+                os.rename(tmp, filename)
+            except (IOError, OSError):
+                current.log.error("S3ProxyCache: can not write %s" % filename)
+                return
+
+        if body is not None:
+            cls = self.__class__
+            cls.written += len(body)
+            if cls.written > self.max_size / 10:
+                # Check the total size
+                cls.written = 0
+                self.evict()
+
+    # -------------------------------------------------------------------------
+    def touch(self, key):
+        """
+            Record access to a cached response (for LRU eviction)
+
+            @param key: the cache key
+        """
+
+        import time
+
+        path = self.path(key)
+        try:
+            # Limit the number of writes for frequently used responses
+            if os.path.getmtime(path) < time.time() - 60:
+                os.utime(path, None)
+        except OSError:
+            pass
+
+    # -------------------------------------------------------------------------
+    def evict(self):
+        """
+            Evict the least recently used responses until the total size
+            is below 80% of the maximum size
+
+            @return: the number of evicted responses
+        """
+
+        files = []
+        total = 0
+        for root, dirs, filenames in os.walk(self.folder):
+            for filename in filenames:
+                if "." in filename:
+                    # Metadata, temporary or lock file
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_size:
+            return 0
+
+        evicted = 0
+        limit = self.max_size * 0.8
+        for mtime, size, path in sorted(files):
+            for filename in (path, "%s.json" % path):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            evicted += 1
+            total -= size
+            if total <= limit:
+                break
+
+        return evicted
+
+    # -------------------------------------------------------------------------
+    def lock(self, key):
+        """
+            Acquire the lock to fetch a URL (across threads and processes)
+
+            @param key: the cache key
+
+            @return: True if successful, False if another request holds
+                     the lock
+        """
+
+        import errno
+        import time
+
+        path = "%s.lock" % self.path(key)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass
+
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                # Can not lock (e.g. read-only file system) => proceed anyway
+                return False
+            try:
+                stale = os.path.getmtime(path) < time.time() - self.timeout
+            except OSError:
+                # Released in the meantime
+                stale = False
+            if stale:
+                # Holder probably crashed => take over
+                os.utime(path, None)
+                return True
+            return False
+        os.close(fd)
+        return True
+
+    # -------------------------------------------------------------------------
+    def unlock(self, key):
+        """
+            Release the lock to fetch a URL
+
+            @param key: the cache key
+        """
+
+        try:
+            os.remove("%s.lock" % self.path(key))
+        except OSError:
+            pass
+
+    # -------------------------------------------------------------------------
+    def wait(self, key):
+        """
+            Wait for a concurrent request to release the lock for a URL
+
+            @param key: the cache key
+        """
+
+        import time
+
+        path = "%s.lock" % self.path(key)
+        deadline = time.time() + self.timeout
+        while os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.05)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def layer(layer_id):
+        """
+            Look up a TMS, XYZ or WMS layer
+
+            @param layer_id: the layer ID (gis_layer_entity)
+
+            @return: Storage with the layer type ("tms", "xyz" or "wms")
+                     and the layer details, or None if not found
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        for layer_type in ("tms", "xyz", "wms"):
+            table = s3db["gis_layer_%s" % layer_type]
+            fields = [table.url]
+            if layer_type == "wms":
+                fields.append(table.username)
+            else:
+                fields.append(table.img_format)
+                if layer_type == "tms":
+                    fields.append(table.layername)
+            query = (table.layer_id == layer_id) & \
+                    (table.deleted == False)
+            row = db(query).select(*fields,
+                                   cache = s3db.cache,
+                                   limitby = (0, 1)
+                                   ).first()
+            if row:
+                layer = Storage(row)
+                layer.type = layer_type
+                return layer
+
+        return None
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def tile_url(layer, z, x, y):
+        """
+            Construct the upstream URL of a TMS or XYZ tile (in the same
+            way as OpenLayers does)
+
+            @param layer: the layer (see layer())
+            @param z: the zoom level
+            @param x: the tile column
+            @param y: the tile row
+
+            @return: the URL
+        """
+
+        url = layer.url
+        if layer.type == "tms":
+            if not url.endswith("/"):
+                url = "%s/" % url
+            return "%s1.0.0/%s/%s/%s/%s.%s" % (url,
+                                                layer.layername,
+                                                z,
+                                                x,
+                                                y,
+                                                layer.img_format or "png",
+                                                )
+        else:
+            return url.replace("${z}", str(z)) \
+                      .replace("${x}", str(x)) \
+                      .replace("${y}", str(y))
+
+    # -------------------------------------------------------------------------
+    def seed(self, layer_id, bbox, zoom_min, zoom_max, max_tiles=100000):
+        """
+            Seed the cache with the tiles of a TMS or XYZ layer
+
+            @param layer_id: the layer ID
+            @param bbox: the area (lon_min, lat_min, lon_max, lat_max)
+            @param zoom_min: the minimum zoom level
+            @param zoom_max: the maximum zoom level
+            @param max_tiles: the maximum number of tiles to fetch
+
+            @return: the number of tiles fetched
+        """
+
+        import math
+
+        layer = self.layer(layer_id)
+        if not layer or layer.type not in ("tms", "xyz"):
+            current.log.error("S3ProxyCache: can only seed TMS/XYZ layers")
+            return 0
+
+        lon_min, lat_min, lon_max, lat_max = [float(c) for c in bbox]
+
+        def tile(lon, lat, z):
+            # Web Mercator tile containing a point (XYZ scheme)
+            n = 2 ** z
+            lat = max(min(lat, 85.0511), -85.0511)
+            x = int((lon + 180.0) / 360.0 * n)
+            lat_rad = math.radians(lat)
+            y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+            return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+        count = 0
+        for z in range(int(zoom_min), int(zoom_max) + 1):
+            x_min, y_min = tile(lon_min, lat_max, z)
+            x_max, y_max = tile(lon_max, lat_min, z)
+            n = 2 ** z
+            for x in range(x_min, x_max + 1):
+                for y in range(y_min, y_max + 1):
+                    if count >= max_tiles:
+                        return count
+                    if layer.type == "tms":
+                        # TMS counts rows from the bottom
+                        row = n - 1 - y
+                    else:
+                        row = y
+                    url = self.tile_url(layer, z, x, row)
+                    try:
+                        self.get(url)
+                    except (HTTPError, URLError, IOError) as e:
+                        current.log.warning("S3ProxyCache: can not fetch %s: %s" % (url, e))
+                    else:
+                        count += 1
+
+        return count
+
 # =============================================================================
 class MAP(DIV):
     """
@@ -9139,11 +10257,18 @@ class LayerTMS(Layer):
     # -------------------------------------------------------------------------
     class SubLayer(Layer.SubLayer):
         def as_dict(self):
+            if current.deployment_settings.get_gis_proxy_cache():
+                # Route tile requests through the caching proxy
+                url = "%s/" % URL(c="gis", f="tile", args=[self.layer_id])
+                url2 = url3 = None
+            else:
+                url, url2, url3 = self.url, self.url2, self.url3
+
             # Mandatory attributes
             output = {"id": self.layer_id,
                       "type": "tms",
                       "name": self.safe_name,
-                      "url": self.url,
+                      "url": url,
                       "layername": self.layername
                       }
 
@@ -9151,8 +10276,8 @@ class LayerTMS(Layer):
             self.add_attributes_if_not_default(
                 output,
                 _base = (self._base, (False,)),
-                url2 = (self.url2, (None,)),
-                url3 = (self.url3, (None,)),
+                url2 = (url2, (None,)),
+                url3 = (url3, (None,)),
                 format = (self.img_format, ("png", None)),
                 zoomLevels = (self.zoom_levels, (19,)),
                 attribution = (self.attribution, (None,)),
@@ -9230,10 +10355,16 @@ class LayerWMS(Layer):
         def as_dict(self):
             if self.queryable:
                 current.response.s3.gis.get_feature_info = True
+            if current.deployment_settings.get_gis_proxy_cache() and \
+               not self.username:
+                # Route map requests through the caching proxy
+                url = URL(c="gis", f="tile", args=[self.layer_id])
+            else:
+                url = self.url
             # Mandatory attributes
             output = {"id": self.layer_id,
                       "name": self.safe_name,
-                      "url": self.url,
+                      "url": url,
                       "layers": self.layers,
                       }
 
@@ -9288,18 +10419,26 @@ class LayerXYZ(Layer):
     # -------------------------------------------------------------------------
     class SubLayer(Layer.SubLayer):
         def as_dict(self):
+            if current.deployment_settings.get_gis_proxy_cache():
+                # Route tile requests through the caching proxy
+                url = "%s?z=${z}&x=${x}&y=${y}" % \
+                      URL(c="gis", f="tile", args=[self.layer_id])
+                url2 = url3 = None
+            else:
+                url, url2, url3 = self.url, self.url2, self.url3
+
             # Mandatory attributes
             output = {"id": self.layer_id,
                       "name": self.safe_name,
-                      "url": self.url
+                      "url": url
                       }
 
             # Attributes which are defaulted client-side if not set
             self.add_attributes_if_not_default(
                 output,
                 _base = (self._base, (False,)),
-                url2 = (self.url2, (None,)),
-                url3 = (self.url3, (None,)),
+                url2 = (url2, (None,)),
+                url3 = (url3, (None,)),
                 format = (self.img_format, ("png", None)),
                 zoomLevels = (self.zoom_levels, (19,)),
                 attribution = (self.attribution, (None,)),
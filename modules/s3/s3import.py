@@ -34,6 +34,8 @@ __all__ = ("S3Importer",
            "S3ImportItem",
            "S3Duplicate",
            "S3BulkImporter",
+           "S3BulkImportScheduler",
+           "S3BulkImportSnapshot",
            )
 
 import datetime
@@ -4136,6 +4138,8 @@ class S3BulkImporter(object):
         self.customised = []
         self.errorList = []
         self.resultList = []
+        # Per-task timing (name, seconds)
+        self.timings = []
 
     # -------------------------------------------------------------------------
     def load_descriptor(self, path):
@@ -4145,20 +4149,39 @@ class S3BulkImporter(object):
             The descriptor file is the file called tasks.cfg in path.
             The file consists of a comma separated list of:
             module, resource name, csv filename, xsl filename.
+
+            A comment line of the form:
+                #@depends: tablename[, tablename...]
+            declares that the next CSV import task must wait for all
+            earlier tasks importing into any of these tables (or for
+            all earlier tasks if "*" is given) when tasks are run in
+            parallel (see S3BulkImportScheduler).
         """
 
         source = open(os.path.join(path, "tasks.cfg"), "r")
         values = self.csv.reader(source)
+        depends = None
         for details in values:
             if details == []:
                 continue
             prefix = details[0][0].strip('" ')
             if prefix == "#": # comment
+                directive = ",".join(details).strip('" ')
+                if directive[:9] == "#@depends":
+                    tablenames = directive[9:].lstrip(":").split(",")
+                    depends = set(t.strip('" ') for t in tablenames)
+                    depends.discard("")
                 continue
             if prefix == "*": # specialist function
                 self.extract_other_import_line(path, details)
             else: # standard CSV importer
+                numtasks = len(self.tasks)
                 self.extract_csv_import_line(path, details)
+                if depends and len(self.tasks) > numtasks:
+                    # Explicit dependencies as 7th element of the task
+                    self.tasks[-1].append(depends)
+            depends = None
+        source.close()
 
     # -------------------------------------------------------------------------
     def extract_csv_import_line(self, path, details):
@@ -4377,6 +4400,7 @@ class S3BulkImporter(object):
             end = datetime.datetime.now()
             duration = end - start
             csvName = task[3][task[3].rfind("/") + 1:]
+            self.timings.append((csvName, duration.total_seconds()))
             duration = '{:.2f}'.format(duration.total_seconds())
             msg = "%s imported (%s sec)" % (csvName, duration)
             self.resultList.append(msg)
@@ -4408,6 +4432,7 @@ class S3BulkImporter(object):
                 self.errorList.append(error)
             end = datetime.datetime.now()
             duration = end - start
+            self.timings.append((fun, duration.total_seconds()))
             duration = '{:.2f}'.format(duration.total_seconds())
             msg = "%s completed (%s sec)" % (fun, duration)
             self.resultList.append(msg)
@@ -5022,17 +5047,764 @@ class S3BulkImporter(object):
         auth.rollback = False
 
     # -------------------------------------------------------------------------
-    def perform_tasks(self, path):
+    def perform_tasks(self, path, workers=1):
         """
             Load and then execute the import jobs that are listed in the
             descriptor file (tasks.cfg)
+
+            @param path: the path of the descriptor file
+            @param workers: number of worker processes to run independent
+                            CSV import tasks in parallel (1 = run all
+                            tasks sequentially in this process)
         """
 
         self.load_descriptor(path)
+
+        if workers > 1:
+            S3BulkImportScheduler(self, workers=workers).run()
+            return
+
         for task in self.tasks:
             if task[0] == 1:
                 self.execute_import_task(task)
             elif task[0] == 2:
                 self.execute_special_task(task)
 
+# =============================================================================
+class S3BulkImportScheduler(object):
+    """
+        Dependency-aware parallel execution of the tasks of a S3BulkImporter
+        (prepopulate from tasks.cfg):
+
+        - derives a dependency graph between tasks from the tables each
+          task writes (target table and resources in the transformation
+          stylesheet) and reads (foreign keys of these tables), and from
+          explicit #@depends declarations in tasks.cfg
+        - runs independent CSV import tasks concurrently in worker
+          processes (each with its own database connection)
+        - runs special tasks (*,function,...) in this process, after
+          all previous and before all subsequent tasks
+        - records per-task timing in importer.timings
+    """
+
+    # Worker script, run with web2py -S <app> -M -R
+    WORKER = os.path.join("static", "scripts", "tools", "prepopulate_worker.py")
+
+    # Marker for result lines in the worker output
+    PREFIX = "S3PREPOP:"
+
+    # Meta-fields which do not constitute a dependency
+    META = ("created_by",
+            "modified_by",
+            "owned_by_user",
+            "owned_by_group",
+            "realm_entity",
+            "approved_by",
+            )
+
+    def __init__(self, importer, workers=4):
+        """
+            Constructor
+
+            @param importer: the S3BulkImporter with the tasks loaded
+            @param workers: the maximum number of worker processes
+        """
+
+        self.importer = importer
+        self.workers = workers
+
+        self.resources = {}
+
+    # -------------------------------------------------------------------------
+    def run(self):
+        """
+            Execute all tasks of the importer
+        """
+
+        importer = self.importer
+        tasks = importer.tasks
+        if not tasks:
+            return
+
+        db = current.db
+        if self.workers < 2 or db._dbname == "sqlite":
+            # SQLite does not support concurrent writers
+            for task in tasks:
+                if task[0] == 1:
+                    importer.execute_import_task(task)
+                elif task[0] == 2:
+                    importer.execute_special_task(task)
+            return
+
+        try:
+            from queue import Queue
+        except ImportError:
+            from Queue import Queue
+
+        dependencies = self.dependencies(tasks)
+
+        pending = list(range(len(tasks)))
+        done = set()
+        running = {}
+        idle = []
+        processes = []
+        results = Queue()
+
+        # Workers must see everything done so far
+        db.commit()
+
+        try:
+            while pending or running:
+
+                ready = [i for i in pending if dependencies[i] <= done]
+                for index in ready:
+                    task = tasks[index]
+                    if task[0] != 1:
+                        # Special task (all previous tasks are done,
+                        # all subsequent tasks wait for it)
+                        pending.remove(index)
+                        importer.execute_special_task(task)
+                        db.commit()
+                        done.add(index)
+                        continue
+
+                    if idle:
+                        process = idle.pop()
+                    elif len(processes) < self.workers:
+                        process = self.start_worker(results)
+                        if process is None:
+                            # Do not try to start any more workers
+                            self.workers = len(processes)
+                        else:
+                            processes.append(process)
+                    elif running:
+                        # Wait for a worker to become available
+                        break
+                    else:
+                        process = None
+
+                    if process is None:
+                        # No workers available => run the task here
+                        pending.remove(index)
+                        importer.execute_import_task(task)
+                        done.add(index)
+                        continue
+
+                    pending.remove(index)
+                    running[process] = index
+                    self.send(process, task)
+
+                if not running:
+                    continue
+
+                # Wait for the next task to complete
+                process, result = results.get()
+                index = running.pop(process)
+                if result is None:
+                    # Worker died => retry the task here, and do not
+                    # replace the worker
+                    processes.remove(process)
+                    self.workers = len(processes)
+                    importer.execute_import_task(tasks[index])
+                else:
+                    importer.errorList.extend(result.get("errors", []))
+                    importer.resultList.extend(result.get("results", []))
+                    importer.timings.extend(tuple(t) for t in result.get("timings", []))
+                    idle.append(process)
+                done.add(index)
+        finally:
+            for process in processes:
+                try:
+                    process.stdin.close()
+                    process.wait()
+                except (IOError, OSError):
+                    pass
+
+    # -------------------------------------------------------------------------
+    def dependencies(self, tasks):
+        """
+            Determine the dependencies between tasks: a task depends on all
+            previous tasks which write tables it reads or writes, or read
+            tables it writes (i.e. the relative order of these tasks is
+            preserved), as well as on all previous tasks which write tables
+            explicitly declared with #@depends
+
+            @param tasks: the list of tasks
+
+            @return: list of sets of indices of the tasks that each task
+                     depends on
+        """
+
+        dependencies = []
+        tables = []
+
+        barrier = -1
+        for index, task in enumerate(tasks):
+
+            if task[0] != 1:
+                # Special tasks can do anything
+                dependencies.append(set(range(index)))
+                tables.append(None)
+                barrier = index
+                continue
+
+            writes, reads = self.tables(task)
+            declared = task[6] if len(task) > 6 else None
+
+            required = set() if barrier < 0 else set([barrier])
+            for i in range(barrier + 1, index):
+                w, r = tables[i]
+                if w & writes or w & reads or r & writes:
+                    required.add(i)
+                elif declared and ("*" in declared or w & declared):
+                    required.add(i)
+
+            dependencies.append(required)
+            tables.append((writes, reads))
+
+        return dependencies
+
+    # -------------------------------------------------------------------------
+    def tables(self, task):
+        """
+            Determine which tables an import task writes and reads
+
+            @param task: the import task
+
+            @return: tuple of sets of table names (writes, reads)
+        """
+
+        s3db = current.s3db
+
+        tablename = "%s_%s" % (task[1], task[2])
+        alternative = self.importer.alternateTables.get(tablename)
+        if alternative and "tablename" in alternative:
+            tablename = alternative["tablename"]
+
+        writes = set([tablename]) | self.stylesheet_resources(task[4])
+
+        reads = set()
+        supertables = set()
+        meta = self.META
+        for name in writes:
+            table = s3db.table(name)
+            if table is None:
+                continue
+            for field in table:
+                if field.name in meta:
+                    continue
+                ftype = str(field.type)
+                if ftype[:10] == "reference ":
+                    reads.add(ftype[10:].split(".", 1)[0])
+                elif ftype[:15] == "list:reference ":
+                    reads.add(ftype[15:].split(".", 1)[0])
+            super_entity = s3db.get_config(name, "super_entity")
+            if super_entity:
+                if isinstance(super_entity, (list, tuple)):
+                    supertables.update(super_entity)
+                else:
+                    supertables.add(super_entity)
+
+        # Super-entity records are created along with their instance
+        # records, so they impose no order on tasks
+        writes -= supertables
+        reads -= supertables | writes
+
+        return writes, reads
+
+    # -------------------------------------------------------------------------
+    def stylesheet_resources(self, stylesheet):
+        """
+            Find the names of all resources a transformation stylesheet
+            (and its includes) can generate
+
+            @param stylesheet: the stylesheet file path
+
+            @return: set of table names
+        """
+
+        resources = self.resources
+        if stylesheet in resources:
+            return resources[stylesheet]
+
+        import re
+        resources[stylesheet] = names = set()
+        try:
+            with open(stylesheet, "r") as f:
+                content = f.read()
+        except IOError:
+            return names
+
+        names.update(re.findall(r'<resource\s+name="([a-z0-9_]+)"', content))
+        path = os.path.dirname(stylesheet)
+        for href in re.findall(r'<xsl:(?:include|import)\s+href="([^"]+)"', content):
+            include = os.path.normpath(os.path.join(path, href))
+            names.update(self.stylesheet_resources(include))
+
+        return names
+
+    # -------------------------------------------------------------------------
+    def start_worker(self, results):
+        """
+            Start a worker process, and a thread to collect its results
+
+            @param results: the Queue to put results into, as tuples
+                            (process, result), result None if the process
+                            terminates
+
+            @return: the process, or None if it could not be started
+        """
+
+        import subprocess
+        import threading
+
+        request = current.request
+        folder = request.folder
+        web2py = os.path.normpath(os.path.join(folder, "..", ".."))
+        command = [sys.executable,
+                   os.path.join(web2py, "web2py.py"),
+                   "-S", request.application,
+                   "-M",
+                   "-R", os.path.join(folder, self.WORKER),
+                   ]
+        try:
+            process = subprocess.Popen(command,
+                                       cwd = web2py,
+                                       stdin = subprocess.PIPE,
+                                       stdout = subprocess.PIPE,
+                                       universal_newlines = True,
+                                       )
+        except OSError as e:
+            current.log.error("Could not start prepopulate worker: %s" % e)
+            return None
+
+        prefix = self.PREFIX
+        length = len(prefix)
+
+        def collect():
+            for line in iter(process.stdout.readline, ""):
+                if line[:length] == prefix:
+                    results.put((process, json.loads(line[length:])))
+            results.put((process, None))
+
+        thread = threading.Thread(target=collect)
+        thread.daemon = True
+        thread.start()
+
+        return process
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def send(process, task):
+        """
+            Send a task to a worker process
+
+            @param process: the worker process
+            @param task: the import task
+        """
+
+        task = list(task[:6])
+        process.stdin.write("%s\n" % json.dumps(task))
+        process.stdin.flush()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def serve(cls, importer, source=None, output=None):
+        """
+            Worker process main loop: read import tasks (one JSON per
+            line) from source, execute them and write the results to
+            output
+
+            @param importer: the S3BulkImporter to run the tasks
+            @param source: the input stream (default: sys.stdin)
+            @param output: the output stream (default: sys.stdout)
+        """
+
+        if source is None:
+            source = sys.stdin
+        if output is None:
+            output = sys.stdout
+
+        for line in iter(source.readline, ""):
+            line = line.strip()
+            if not line:
+                continue
+            task = json.loads(line)
+
+            importer.errorList = []
+            importer.resultList = []
+            importer.timings = []
+            try:
+                importer.execute_import_task(task)
+            except Exception as e:
+                current.db.rollback()
+                importer.errorList.append("prepopulate error: %s (task: %s)" %
+                                          (e, task[3]))
+
+            errors = [s3_str(e) if isinstance(e, basestring)
+                      else [s3_str(item) for item in e]
+                      for e in importer.errorList]
+            result = {"errors": errors,
+                      "results": importer.resultList,
+                      "timings": importer.timings,
+                      }
+            output.write("%s%s\n" % (cls.PREFIX, json.dumps(result)))
+            output.flush()
+
+# =============================================================================
+class S3BulkImportSnapshot(object):
+    """
+        Database snapshots of prepopulated templates: the first run
+        dumps the resulting database, and subsequent first runs with
+        the same template data, configuration and database schema
+        restore it instead of re-running the prepopulate
+
+        - SQLite: snapshot is a copy of all tables in a separate
+          SQLite file
+        - PostgreSQL/MySQL: snapshot is a pg_dump/mysqldump of the
+          database (tools must be installed on the server)
+    """
+
+    # Increment to invalidate all existing snapshots
+    VERSION = 1
+
+    def __init__(self, templates, folder=None):
+        """
+            Constructor
+
+            @param templates: the prepopulate templates (pop_list)
+            @param folder: the folder to store snapshots in, default
+                           <app>/databases/snapshots
+        """
+
+        if not isinstance(templates, (list, tuple)):
+            templates = [templates]
+        self.templates = ["default" if t == 1 else t for t in templates]
+
+        if not folder:
+            folder = os.path.join(current.request.folder,
+                                  "databases",
+                                  "snapshots",
+                                  )
+        self.folder = folder
+
+        self._key = None
+
+    # -------------------------------------------------------------------------
+    @property
+    def key(self):
+        """
+            The snapshot key: a hash of the template data (tasks.cfg and
+            all files referenced in it), the template configurations,
+            the database type and the database schema (=model version)
+        """
+
+        key = self._key
+        if key is None:
+
+            import hashlib
+
+            settings = current.deployment_settings
+            folder = current.request.folder
+            templates = os.path.join(folder, "modules", "templates")
+
+            h = hashlib.sha1()
+            update = lambda s: h.update(s3_str(s).encode("utf-8"))
+
+            update("%s:%s" % (self.VERSION, settings.get_database_type()))
+
+            # Template configurations
+            config = settings.get_template()
+            if not isinstance(config, (list, tuple)):
+                config = [config]
+            for name in config:
+                update(name)
+                self.hash_file(h, os.path.join(templates,
+                                               name.replace(".", os.path.sep),
+                                               "config.py",
+                                               ))
+
+            # Template data
+            for name in self.templates:
+                update(name)
+                path = os.path.join(templates, name)
+                if not os.path.exists(path):
+                    # Legacy template?
+                    path = os.path.join(folder, "private", "templates", name)
+                    if not os.path.exists(path):
+                        continue
+                self.hash_file(h, os.path.join(path, "tasks.cfg"))
+
+                importer = S3BulkImporter()
+                importer.load_descriptor(path)
+                for task in importer.tasks:
+                    if task[0] == 1:
+                        update(task[3])
+                        if task[3][:7] != "http://":
+                            self.hash_file(h, task[3])
+                        self.hash_file(h, task[4], stylesheet=True)
+                    elif task[0] == 2:
+                        update(task[1])
+                        if task[2]:
+                            self.hash_file(h, task[2])
+                        if task[3]:
+                            update(",".join(task[3]))
+
+            # Database schema
+            db = current.db
+            for tablename in sorted(db.tables):
+                table = db[tablename]
+                update(tablename)
+                for field in table:
+                    update("%s:%s" % (field.name, field.type))
+
+            key = self._key = h.hexdigest()
+
+        return key
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def hash_file(cls, h, filename, stylesheet=False):
+        """
+            Update a hash with the contents of a file
+
+            @param h: the hash object
+            @param filename: the file name
+            @param stylesheet: the file is a stylesheet, so hash its
+                               includes too
+        """
+
+        try:
+            with open(filename, "rb") as f:
+                content = f.read()
+        except IOError:
+            # Missing file (or directory)
+            h.update(b"-")
+            return
+        h.update(content)
+
+        if stylesheet:
+            import re
+            path = os.path.dirname(filename)
+            includes = re.findall(br'<xsl:(?:include|import)\s+href="([^"]+)"',
+                                  content)
+            for href in includes:
+                include = os.path.join(path, href.decode("utf-8"))
+                cls.hash_file(h, os.path.normpath(include), stylesheet=True)
+
+    # -------------------------------------------------------------------------
+    @property
+    def filename(self):
+        """
+            The file name of the snapshot for the current key
+        """
+
+        db_type = current.deployment_settings.get_database_type()
+        extension = "db" if db_type == "sqlite" else "sql"
+
+        return os.path.join(self.folder, "%s.%s" % (self.key, extension))
+
+    # -------------------------------------------------------------------------
+    def restore(self):
+        """
+            Restore the database from the snapshot
+
+            @return: True if successful, False if no snapshot available
+                     or restore failed
+        """
+
+        filename = self.filename
+        if not os.path.exists(filename):
+            return False
+
+        db = current.db
+        db.commit()
+
+        db_type = current.deployment_settings.get_database_type()
+        try:
+            if db_type == "sqlite":
+                self.sqlite_restore(filename)
+            else:
+                self.run_tool("restore", filename)
+        except Exception as e:
+            db.rollback()
+            current.log.error("Could not restore snapshot %s: %s" % (filename, e))
+            return False
+
+        db.commit()
+        return True
+
+    # -------------------------------------------------------------------------
+    def save(self):
+        """
+            Save a snapshot of the database (after prepopulate)
+
+            @return: True if successful, otherwise False
+        """
+
+        folder = self.folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        filename = self.filename
+        # Write to temporary file first so that an incomplete
+        # snapshot can never be restored
+        temp = "%s.%s" % (filename, uuid.uuid4().hex)
+
+        db = current.db
+        db.commit()
+
+        db_type = current.deployment_settings.get_database_type()
+        try:
+            if db_type == "sqlite":
+                self.sqlite_save(temp)
+            else:
+                self.run_tool("save", temp)
+            os.rename(temp, filename)
+        except Exception as e:
+            db.rollback()
+            current.log.error("Could not save snapshot %s: %s" % (filename, e))
+            if os.path.exists(temp):
+                os.remove(temp)
+            return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def sqlite_tables(schema="main"):
+        """
+            Get the names of all tables in a SQLite database
+
+            @param schema: the schema name
+        """
+
+        db = current.db
+        sql = "SELECT name FROM %s.sqlite_master WHERE type='table' " \
+              "AND name NOT LIKE 'sqlite_%%';" % schema
+        return [row[0] for row in db.executesql(sql)]
+
+    # -------------------------------------------------------------------------
+    def sqlite_save(self, filename):
+        """
+            Copy all tables into a separate SQLite database file
+
+            @param filename: the file name
+        """
+
+        db = current.db
+        executesql = db.executesql
+
+        executesql("ATTACH DATABASE '%s' AS snapshot;" % filename)
+        try:
+            for tablename in self.sqlite_tables():
+                executesql('CREATE TABLE snapshot."%s" AS SELECT * FROM main."%s";' %
+                           (tablename, tablename))
+            db.commit()
+        except:
+            db.rollback()
+            raise
+        finally:
+            executesql("DETACH DATABASE snapshot;")
+
+    # -------------------------------------------------------------------------
+    def sqlite_restore(self, filename):
+        """
+            Restore all tables from a SQLite snapshot file
+
+            @param filename: the file name
+        """
+
+        db = current.db
+        executesql = db.executesql
+
+        executesql("ATTACH DATABASE '%s' AS snapshot;" % filename)
+        try:
+            tables = set(self.sqlite_tables())
+            snapshot = [(tablename,
+                         [row[1] for row in
+                          executesql('PRAGMA snapshot.table_info("%s");' % tablename)])
+                        for tablename in self.sqlite_tables("snapshot")
+                        if tablename in tables]
+
+            # Check foreign keys only at commit (pragma only
+            # valid inside the transaction)
+            executesql("BEGIN;")
+            executesql("PRAGMA defer_foreign_keys = ON;")
+            for tablename, columns in snapshot:
+                columns = ",".join('"%s"' % c for c in columns)
+                executesql('DELETE FROM main."%s";' % tablename)
+                executesql('INSERT INTO main."%s" (%s) SELECT %s FROM snapshot."%s";' %
+                           (tablename, columns, columns, tablename))
+            db.commit()
+        except:
+            db.rollback()
+            raise
+        finally:
+            executesql("DETACH DATABASE snapshot;")
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def run_tool(method, filename):
+        """
+            Dump or restore the database with the database tools
+            (pg_dump/pg_restore, mysqldump/mysql)
+
+            @param method: "save" or "restore"
+            @param filename: the file name
+
+            @raises RuntimeError: if the tool fails
+        """
+
+        import subprocess
+
+        params = current.deployment_settings.db_params
+        db_type = params["type"]
+
+        env = dict(os.environ)
+        if db_type == "postgres":
+            env["PGPASSWORD"] = params["password"]
+            connect = ["-h", params["host"],
+                       "-p", str(params["port"]),
+                       "-U", params["username"],
+                       ]
+            if method == "save":
+                command = ["pg_dump", "-Fc", "--no-owner", "-f", filename]
+            else:
+                command = ["pg_restore", "--clean", "--if-exists",
+                           "--no-owner", "--single-transaction", filename]
+            command += connect + ["-d", params["database"]]
+            stdin = stdout = None
+        elif db_type == "mysql":
+            env["MYSQL_PWD"] = params["password"]
+            connect = ["-h", params["host"],
+                       "-P", str(params["port"]),
+                       "-u", params["username"],
+                       ]
+            if method == "save":
+                command = ["mysqldump", "--single-transaction"]
+                stdin, stdout = None, open(filename, "wb")
+            else:
+                command = ["mysql"]
+                stdin, stdout = open(filename, "rb"), None
+            command += connect + [params["database"]]
+        else:
+            raise RuntimeError("Unsupported database type: %s" % db_type)
+
+        try:
+            process = subprocess.Popen(command,
+                                       env = env,
+                                       stdin = stdin,
+                                       stdout = stdout,
+                                       stderr = subprocess.PIPE,
+                                       )
+            error = process.communicate()[1]
+        finally:
+            for f in (stdin, stdout):
+                if f is not None:
+                    f.close()
+
+        if process.returncode != 0:
+            raise RuntimeError("%s failed: %s" % (command[0], s3_str(error)))
+
 # END =========================================================================
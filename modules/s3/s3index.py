@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+
+""" S3 Database Indexes
+
+    @copyright: 2019 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3Indexes",
+           "S3IndexAdvisor",
+           )
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+from gluon import current
+
+from s3compat import basestring
+from s3dal import Expression, Field, Query, original_tablename, portalocker
+
+# =============================================================================
+class S3Indexes(object):
+    """
+        Database indexes declared by the models, like:
+
+            s3db.configure(tablename,
+                           indexes = ["name",                       # single column
+                                      ("organisation_id", "date"),  # composite
+                                      ],
+                           )
+
+        Created and verified by update(), which is run during the first
+        run, and by static/scripts/tools/indexes.py as part of upgrades.
+    """
+
+    def __init__(self, db=None):
+        """
+            Constructor
+
+            @param db: the database (defaults to current.db)
+        """
+
+        self.db = db if db is not None else current.db
+        self.engine = self.db._dbname
+
+    # -------------------------------------------------------------------------
+    def declared(self):
+        """
+            Get all indexes declared by the models
+
+            @return: list of tuples (tablename, fieldnames)
+        """
+
+        s3db = current.s3db
+        s3db.load_all_models()
+
+        indexes = []
+        for tablename in self.db.tables:
+            config = s3db.get_config(tablename, "indexes")
+            if not config:
+                continue
+            for index in config:
+                if isinstance(index, basestring):
+                    fieldnames = (index,)
+                else:
+                    fieldnames = tuple(index)
+                indexes.append((tablename, fieldnames))
+        return indexes
+
+    # -------------------------------------------------------------------------
+    def existing(self, tablename):
+        """
+            Get the existing indexes of a table from the database
+
+            @param tablename: the table name
+
+            @return: list of tuples of column names, one per index
+        """
+
+        db = self.db
+        engine = self.engine
+
+        indexes = []
+        if engine == "sqlite":
+            for index in db.executesql("PRAGMA index_list(%s);" % tablename):
+                columns = db.executesql("PRAGMA index_info(%s);" % index[1])
+                indexes.append(tuple(column[2] for column in columns))
+
+        elif engine == "postgres":
+            sql = "SELECT indexdef FROM pg_indexes WHERE tablename='%s';" % tablename
+            for index in db.executesql(sql):
+                match = re.search(r"\((.*)\)", index[0])
+                if match:
+                    columns = [c.strip().strip('"') for c in match.group(1).split(",")]
+                    indexes.append(tuple(columns))
+
+        elif engine == "mysql":
+            columns = {}
+            for row in db.executesql("SHOW INDEX FROM %s;" % tablename):
+                # Key_name, Seq_in_index, Column_name
+                columns.setdefault(row[2], []).append((row[3], row[4]))
+            for items in columns.values():
+                indexes.append(tuple(name for _, name in sorted(items)))
+
+        return indexes
+
+    # -------------------------------------------------------------------------
+    def covered(self, tablename, fieldnames, existing=None):
+        """
+            Check whether a combination of columns is covered by an existing
+            index, i.e. is a leading part of its columns
+
+            @param tablename: the table name
+            @param fieldnames: tuple of field names
+            @param existing: the existing indexes (if already known)
+
+            @return: True|False
+        """
+
+        fieldnames = tuple(fieldnames)
+        if fieldnames == (self.db[tablename]._id.name,):
+            # Primary key
+            return True
+
+        if existing is None:
+            existing = self.existing(tablename)
+
+        length = len(fieldnames)
+        for columns in existing:
+            if columns[:length] == fieldnames:
+                return True
+        return False
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def index_name(tablename, fieldnames):
+        """
+            Generate a name for an index
+
+            @param tablename: the table name
+            @param fieldnames: tuple of field names
+        """
+
+        name = "%s_%s__idx" % (tablename, "_".join(fieldnames))
+        if len(name) > 60:
+            # Longer than supported by PostgreSQL/MySQL
+            suffix = hashlib.md5(name.encode("utf-8")).hexdigest()[:8]
+            name = "%s_%s__idx" % (name[:49], suffix)
+        return name
+
+    # -------------------------------------------------------------------------
+    def statement(self, tablename, fieldnames):
+        """
+            The SQL statement to create an index
+
+            @param tablename: the table name
+            @param fieldnames: tuple of field names
+        """
+
+        return "CREATE INDEX %s ON %s (%s);" % (self.index_name(tablename, fieldnames),
+                                                tablename,
+                                                ", ".join(fieldnames),
+                                                )
+
+    # -------------------------------------------------------------------------
+    def update(self, create=True):
+        """
+            Verify all declared indexes, and create those which are missing
+
+            @param create: create missing indexes (otherwise only verify)
+
+            @return: list of tuples (tablename, fieldnames, status), with
+                     status "exists", "created", "missing", "invalid" or
+                     "failed"
+        """
+
+        db = self.db
+
+        results = []
+        existing = {}
+        for tablename, fieldnames in self.declared():
+
+            table = db[tablename]
+            if any(fn not in table.fields for fn in fieldnames):
+                current.log.error("Invalid index for %s" % tablename,
+                                  ", ".join(fieldnames))
+                results.append((tablename, fieldnames, "invalid"))
+                continue
+
+            if tablename not in existing:
+                existing[tablename] = self.existing(tablename)
+            if self.covered(tablename, fieldnames, existing[tablename]):
+                status = "exists"
+            elif not create:
+                status = "missing"
+            else:
+                try:
+                    db.executesql(self.statement(tablename, fieldnames))
+                except Exception:
+                    db.rollback()
+                    current.log.error("Could not create index for %s" % tablename,
+                                      ", ".join(fieldnames))
+                    status = "failed"
+                else:
+                    db.commit()
+                    existing[tablename].append(fieldnames)
+                    status = "created"
+            results.append((tablename, fieldnames, status))
+
+        return results
+
+# =============================================================================
+class S3IndexAdvisor(object):
+    """
+        Records which columns are used in resource filters, joins and
+        orderbys during real traffic, and recommends composite indexes
+        for the most frequent combinations which are not yet covered by
+        any index
+
+        Activated in 000_config.py:
+
+            settings.database.index_advisor = True
+
+        The statistics are collected per process and regularly merged
+        into databases/index_advisor.json, recommendations can be viewed
+        with static/scripts/tools/indexes.py
+    """
+
+    # Maximum number of columns for a recommended index
+    MAX_COLUMNS = 3
+
+    # Columns too unselective to lead an index
+    SKIP = ("deleted",)
+
+    # Number of observations after which to save the statistics
+    SAVE_INTERVAL = 100
+
+    # Per-process statistics {(tablename, columns): count}
+    observations = {}
+    pending = 0
+    lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def observe(cls, query, joins=None, orderby=None):
+        """
+            Record the columns used by a query
+
+            @param query: the filter query
+            @param joins: the joins (list of ON-expressions)
+            @param orderby: the orderby expression
+        """
+
+        candidates = cls.candidates(query, joins=joins, orderby=orderby)
+        if not candidates:
+            return
+
+        with cls.lock:
+            observations = cls.observations
+            for candidate in candidates:
+                observations[candidate] = observations.get(candidate, 0) + 1
+            cls.pending += 1
+            save = cls.pending >= cls.SAVE_INTERVAL
+
+        if save:
+            cls.save()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def candidates(cls, query, joins=None, orderby=None):
+        """
+            Determine the index candidates for a query: equality columns
+            first, then range columns, then orderby columns
+
+            @param query: the filter query
+            @param joins: the joins (list of ON-expressions)
+            @param orderby: the orderby expression
+
+            @return: list of tuples (tablename, columns)
+        """
+
+        usage = {}
+        def use(field, kind):
+            table = getattr(field, "table", None)
+            if table is None:
+                return
+            tablename = original_tablename(table)
+            if field.name == table._id.name:
+                return
+            columns = usage.get(tablename)
+            if columns is None:
+                columns = usage[tablename] = {"eq": [], "range": [], "sort": []}
+            if field.name not in columns[kind]:
+                columns[kind].append(field.name)
+
+        cls.walk(query, use)
+        if joins:
+            for join in joins:
+                if isinstance(join, Expression) and \
+                   isinstance(join.second, Query):
+                    cls.walk(join.second, use)
+        if isinstance(orderby, Expression):
+            cls.walk(orderby, use, kind="sort")
+
+        candidates = []
+        skip = cls.SKIP
+        for tablename, columns in usage.items():
+            names = []
+            for name in sorted(columns["eq"]) + columns["range"] + columns["sort"]:
+                if name not in names:
+                    names.append(name)
+            names = [name for name in names if name not in skip] + \
+                    [name for name in names if name in skip]
+            names = tuple(names[:cls.MAX_COLUMNS])
+            if names and names[0] not in skip:
+                candidates.append((tablename, names))
+        return candidates
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def walk(cls, expression, use, kind=None):
+        """
+            Find all fields used in a query or expression
+
+            @param expression: the Query or Expression
+            @param use: callback use(field, kind) for every field found
+            @param kind: the kind of use for fields in expressions
+                         ("eq", "range" or "sort")
+        """
+
+        if isinstance(expression, Field):
+            use(expression, kind or "eq")
+            return
+        if not isinstance(expression, (Query, Expression)):
+            return
+
+        op = getattr(expression.op, "__name__", "").strip("_")
+        first = expression.first
+        second = getattr(expression, "second", None)
+
+        if kind is None and isinstance(first, Field):
+            # Comparison
+            use(first, "eq" if op in ("eq", "belongs") else "range")
+            if isinstance(second, Field):
+                # Join condition
+                use(second, "eq")
+        else:
+            # Logical operator, orderby or other expression
+            cls.walk(first, use, kind=kind)
+            cls.walk(second, use, kind=kind)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def path():
+        """
+            The path of the statistics file
+        """
+
+        return os.path.join(current.request.folder,
+                            "databases",
+                            "index_advisor.json",
+                            )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def save(cls):
+        """
+            Merge the statistics of this process into the statistics file
+        """
+
+        with cls.lock:
+            observations = cls.observations
+            cls.observations = {}
+            cls.pending = 0
+        if not observations:
+            return
+
+        path = cls.path()
+        mode = "r+" if os.path.exists(path) else "w+"
+        with open(path, mode) as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            try:
+                content = f.read()
+                stats = json.loads(content) if content else {}
+            except ValueError:
+                stats = {}
+            for (tablename, columns), count in observations.items():
+                key = "%s:%s" % (tablename, ",".join(columns))
+                stats[key] = stats.get(key, 0) + count
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(stats, sort_keys=True, indent=1))
+            portalocker.unlock(f)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def load(cls):
+        """
+            Load the statistics from the statistics file
+
+            @return: dict {(tablename, columns): count}
+        """
+
+        path = cls.path()
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            try:
+                stats = json.load(f)
+            except ValueError:
+                return {}
+
+        observations = {}
+        for key, count in stats.items():
+            tablename, columns = key.split(":", 1)
+            observations[(tablename, tuple(columns.split(",")))] = count
+        return observations
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def recommend(cls, min_count=10, db=None):
+        """
+            Recommend indexes for the most frequent column combinations
+            which are not yet covered by any (existing or recommended) index
+
+            @param min_count: the minimum number of observations
+            @param db: the database (defaults to current.db)
+
+            @return: list of dicts {tablename, fieldnames, count, sql},
+                     most frequently used first
+        """
+
+        cls.save()
+
+        indexes = S3Indexes(db)
+        db = indexes.db
+
+        existing = {}
+        recommendations = []
+        stats = sorted(cls.load().items(),
+                       key = lambda item: (-item[1], -len(item[0][1])),
+                       )
+        for (tablename, fieldnames), count in stats:
+            if count < min_count:
+                break
+            if tablename not in db.tables:
+                continue
+            table = db[tablename]
+            if any(fn not in table.fields for fn in fieldnames):
+                continue
+
+            if tablename not in existing:
+                existing[tablename] = indexes.existing(tablename)
+            covering = existing[tablename] + \
+                       [r["fieldnames"] for r in recommendations
+                        if r["tablename"] == tablename]
+            if indexes.covered(tablename, fieldnames, covering):
+                continue
+
+            recommendations.append({"tablename": tablename,
+                                    "fieldnames": fieldnames,
+                                    "count": count,
+                                    "sql": indexes.statement(tablename, fieldnames),
+                                    })
+        return recommendations
+
+# END =========================================================================
@@ -920,10 +920,12 @@ class S3RecordMerger(object):
         if not permitted:
             self.raise_error("Operation not permitted", auth.permission.error)
 
-        # Load all models
+        # Load all referencing tables, and the models this table
+        # depends on (for virtual references and components)
         s3db = current.s3db
         if main:
-            s3db.load_all_models()
+            s3db.load_references(tablename)
+            s3db.load_dependencies(tablename)
         if db._lazy_tables:
             # Must roll out all lazy tables to detect dependencies
             for tn in db._LAZY_TABLES.keys():
@@ -31,7 +31,10 @@ __all__ = ("S3Model",
            #"S3DynamicModel",
            )
 
+import json
+
 from collections import OrderedDict
+from copy import deepcopy
 
 from gluon import current, IS_EMPTY_OR, IS_FLOAT_IN_RANGE, IS_INT_IN_RANGE, \
                   IS_IN_SET, IS_NOT_EMPTY, SQLFORM, TAG
@@ -61,6 +64,15 @@ SERIALIZABLE_OPTS = ("autosync",
 
 ogetattr = object.__getattribute__
 
+# Process-wide model registries (models are static within the process)
+# - names defined by the models of each module: {prefix: (names, generic, objects)}
+MODEL_REGISTRY = {}
+# - models loaded by other models: {(prefix, name): set of (prefix, name)}
+MODEL_DEPENDENCIES = {}
+# - tables referencing each table: {tablename: set of tablenames},
+#   None => True once all tables have been registered
+TABLE_REFERENCES = {}
+
 # =============================================================================
 class S3Model(object):
     """ Base class for S3 models """
@@ -105,6 +117,7 @@ class S3Model(object):
         if module is not None:
             if self.__loaded():
                 return
+            self.__dependency(module)
             self.__lock()
             try:
                 env = self.mandatory()
@@ -146,6 +159,24 @@ class S3Model(object):
             response[LOAD].append(name)
         return loaded
 
+    # -------------------------------------------------------------------------
+    def __dependency(self, module):
+        """
+            Register this model as dependency of all models that are
+            currently being loaded (see S3Model.dependencies)
+
+            @param module: the module name (prefix) of this model
+        """
+
+        loading = current.response.get(self.LOCK)
+        if loading:
+            model = (module, self.__class__.__name__)
+            for dependent in loading.values():
+                dependencies = MODEL_DEPENDENCIES.get(dependent)
+                if dependencies is None:
+                    dependencies = MODEL_DEPENDENCIES[dependent] = set()
+                dependencies.add(model)
+
     # -------------------------------------------------------------------------
     def __lock(self):
 
@@ -157,7 +188,7 @@ class S3Model(object):
         if name in response[LOCK]:
             raise RuntimeError("circular model reference deadlock in %s" % name)
         else:
-            response[LOCK][name] = True
+            response[LOCK][name] = (self.prefix, name)
         return
 
     # -------------------------------------------------------------------------
@@ -250,30 +281,19 @@ class S3Model(object):
                 pass
 
         elif hasattr(models, prefix):
-            module = models.__dict__[prefix]
+            s3models = models.__dict__[prefix].__dict__
+            names, generic, objects = cls.registry(prefix)
 
-            names = module.__all__
-            s3models = module.__dict__
-
-            if not db_only and tablename in names:
+            if not db_only and tablename in objects:
                 # A name defined at module level (e.g. a class)
                 s3db.classes[tablename] = (prefix, tablename)
                 found = s3models[tablename]
             else:
                 # A name defined in an S3Model
-                generic = []
-                loaded = False
-                for n in names:
-                    model = s3models[n]
-                    if hasattr(model, "_s3model"):
-                        if hasattr(model, "names"):
-                            if tablename in model.names:
-                                model(prefix)
-                                loaded = True
-                                break
-                        else:
-                            generic.append(n)
-                if not loaded:
+                n = names.get(tablename)
+                if n:
+                    s3models[n](prefix)
+                else:
                     for n in generic:
                         s3models[n](prefix)
 
@@ -309,27 +329,18 @@ class S3Model(object):
             prefix = name.split("_", 1)[0]
             models = current.models
             if hasattr(models, prefix):
-                module = models.__dict__[prefix]
-                loaded = False
-                generic = []
-                for n in module.__all__:
-                    model = module.__dict__[n]
-                    if type(model).__name__ == "type":
-                        if loaded:
-                            continue
-                        if hasattr(model, "names"):
-                            if name in model.names:
-                                model(prefix)
-                                loaded = True
-                                generic = []
-                            else:
-                                continue
-                        else:
-                            generic.append(n)
-                    elif n.startswith("%s_" % prefix):
+                s3models = models.__dict__[prefix].__dict__
+                names, generic, objects = cls.registry(prefix)
+                for n in objects:
+                    model = s3models[n]
+                    if type(model).__name__ != "type":
                         s3[n] = model
-                for n in generic:
-                    module.__dict__[n](prefix)
+                n = names.get(name)
+                if n:
+                    s3models[n](prefix)
+                else:
+                    for n in generic:
+                        s3models[n](prefix)
         if name in s3:
             return s3[name]
         elif isinstance(default, Exception):
@@ -409,6 +420,174 @@ class S3Model(object):
         s3.load_all_models = False
         s3.all_models_loaded = True
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def registry(cls, prefix):
+        """
+            Get the registry of names defined by the models in a module,
+            built once per process to avoid scanning all models in the
+            module for every table lookup
+
+            @param prefix: the module name
+
+            @return: tuple (names, generic, objects):
+                     names = dict {name: model class name} for all names
+                             declared by S3Models in the module,
+                     generic = list of class names of S3Models which do
+                               not declare their names,
+                     objects = set of other names exported by the module
+                               (starting with the prefix)
+        """
+
+        entry = MODEL_REGISTRY.get(prefix)
+        if entry is None:
+
+            module = current.models.__dict__[prefix]
+            s3models = module.__dict__
+
+            names = {}
+            generic = []
+            objects = set()
+
+            start = "%s_" % prefix
+            for n in module.__all__:
+                model = s3models[n]
+                if hasattr(model, "_s3model"):
+                    if hasattr(model, "names"):
+                        for name in model.names:
+                            if name not in names:
+                                names[name] = n
+                    else:
+                        generic.append(n)
+                elif n.startswith(start):
+                    objects.add(n)
+
+            entry = MODEL_REGISTRY[prefix] = (names, generic, objects)
+
+        return entry
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def dependencies(cls, tablename):
+        """
+            Get all models which were loaded by the model defining a
+            table (in this process, i.e. the table must have been loaded
+            before)
+
+            @param tablename: the table name
+
+            @return: set of tuples (prefix, model class name)
+        """
+
+        prefix = tablename.split("_", 1)[0]
+        if not hasattr(current.models, prefix):
+            return set()
+        name = cls.registry(prefix)[0].get(tablename)
+        if not name:
+            return set()
+
+        dependencies = set()
+        pending = [(prefix, name)]
+        while pending:
+            model = pending.pop()
+            for dependency in MODEL_DEPENDENCIES.get(model, ()):
+                if dependency not in dependencies:
+                    dependencies.add(dependency)
+                    pending.append(dependency)
+
+        return dependencies
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def load_dependencies(cls, tablename):
+        """
+            Load the model defining a table and all models it depends on
+            (see S3Model.dependencies), e.g. for component or virtual
+            reference declarations made in those models, rather than
+            loading all models
+
+            @param tablename: the table name
+        """
+
+        cls.table(tablename)
+
+        models = current.models.__dict__
+        for prefix, name in cls.dependencies(tablename):
+            # Loads the model unless already loaded in this request
+            models[prefix].__dict__[name](prefix)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def load_references(cls, tablename):
+        """
+            Load all tables which reference a table (e.g. to introspect
+            table._referenced_by), rather than loading all models
+
+            - the tables referencing each table are registered when all
+              models are loaded for the first time in this process, so
+              this falls back to loading all models (once)
+            - tables defined later (e.g. dynamic tables) are registered
+              when they are defined (see S3Model.register_references)
+
+            @param tablename: the table name
+        """
+
+        db = current.db
+
+        if None not in TABLE_REFERENCES:
+            cls.load_all_models()
+            if db._lazy_tables:
+                # Must roll out all lazy tables to detect references
+                for tn in list(db._LAZY_TABLES.keys()):
+                    db[tn]
+
+            register = cls.register_references
+            for table in db:
+                register(table._tablename, table)
+            # Mark as registered (even if there are no references at all)
+            TABLE_REFERENCES[None] = True
+            return
+
+        table = cls.table
+        for tn in list(TABLE_REFERENCES.get(tablename, ())):
+            # Defines the table, and rolls it out if lazy
+            table(tn)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def register_references(tablename, fields, replace=False):
+        """
+            Register the references of a table in the process-wide
+            reference map (see S3Model.load_references)
+
+            @param tablename: the name of the referencing table
+            @param fields: the fields of the table (Table or iterable
+                           of Fields)
+            @param replace: remove all previously registered references
+                            of the table (when the table gets redefined
+                            with a different schema)
+        """
+
+        if replace:
+            for referencing in TABLE_REFERENCES.values():
+                if referencing is not True:
+                    referencing.discard(tablename)
+
+        for field in fields:
+            if not isinstance(field, Field):
+                continue
+            ftype = str(field.type)
+            if ftype[:10] == "reference ":
+                rtablename = ftype[10:].split(".", 1)[0]
+            elif ftype[:15] == "list:reference ":
+                rtablename = ftype[15:].split(".", 1)[0]
+            else:
+                continue
+            if rtablename in TABLE_REFERENCES:
+                TABLE_REFERENCES[rtablename].add(tablename)
+            else:
+                TABLE_REFERENCES[rtablename] = set([tablename])
+
     # -------------------------------------------------------------------------
     @staticmethod
     def define_table(tablename, *fields, **args):
@@ -423,6 +602,7 @@ class S3Model(object):
         else:
             print(f"define_table {tablename}...creating!")
             table = db.define_table(tablename, *fields, **args)
+            S3Model.register_references(tablename, fields)
         return table
 
     # -------------------------------------------------------------------------
@@ -1743,6 +1923,18 @@ class S3DynamicModel(object):
         Class representing a dynamic table model
     """
 
+    # The s3_field attributes that make up a field definition
+    FIELD_ATTRIBUTES = ("name",
+                        "field_type",
+                        "label",
+                        "require_unique",
+                        "require_not_empty",
+                        "options",
+                        "default_value",
+                        "settings",
+                        "comments",
+                        )
+
     def __init__(self, tablename):
         """
             Constructor
@@ -1774,27 +1966,43 @@ class S3DynamicModel(object):
         # Load the table model
         s3db = current.s3db
         ttable = s3db.s3_table
-        ftable = s3db.s3_field
         query = (ttable.name == tablename) & \
-                (ttable.deleted != True) & \
-                (ftable.table_id == ttable.id)
-        rows = db(query).select(ftable.name,
-                                ftable.field_type,
-                                ftable.label,
-                                ftable.require_unique,
-                                ftable.require_not_empty,
-                                ftable.options,
-                                ftable.default_value,
-                                ftable.settings,
-                                ftable.comments,
-                                )
+                (ttable.deleted != True)
+        trow = db(query).select(ttable.id,
+                                ttable.title,
+                                ttable.settings,
+                                ttable.schema_version,
+                                limitby = (0, 1),
+                                ).first()
+        if not trow:
+            return None
+
+        version = trow.schema_version
+        if version:
+            # Field definitions for this schema version are cached
+            # per process, and migration is only needed once
+            key = "%s_schema_%s" % (tablename, version)
+            schema = current.cache.ram(key,
+                                       lambda: {"fields": self.field_definitions(trow.id),
+                                                "migrated": False,
+                                                },
+                                       time_expire = None,
+                                       )
+        else:
+            # Legacy table without schema version
+            schema = {"fields": self.field_definitions(trow.id),
+                      "migrated": False,
+                      }
+            self.update_schema_version(trow.id)
+
+        rows = schema["fields"]
         if not rows:
             return None
 
         # Instantiate the fields
         fields = []
         for row in rows:
-            field = self._field(tablename, row)
+            field = self._field(tablename, Storage(deepcopy(row)))
             if field:
                 fields.append(field)
 
@@ -1804,49 +2012,116 @@ class S3DynamicModel(object):
 
         # Define the table
         if fields:
-            # Enable migrate
-            # => is globally disabled when settings.base.migrate
-            #    is False, overriding the table parameter
-            migrate_enabled = db._migrate_enabled
-            db._migrate_enabled = True
+            migrate = not schema["migrated"]
+            if migrate:
+                # Enable migrate
+                # => is globally disabled when settings.base.migrate
+                #    is False, overriding the table parameter
+                migrate_enabled = db._migrate_enabled
+                db._migrate_enabled = True
 
             # Define the table
             db.define_table(tablename,
-                            migrate = True,
+                            migrate = migrate,
                             redefine = redefine,
                             *fields)
+            S3Model.register_references(tablename, fields, replace=True)
 
             # Instantiate table
             # => otherwise lazy_tables may prevent it
             table = db[tablename]
 
-            # Restore global migrate_enabled
-            db._migrate_enabled = migrate_enabled
+            if migrate:
+                # Restore global migrate_enabled
+                db._migrate_enabled = migrate_enabled
+                schema["migrated"] = True
 
             # Configure the table
-            self._configure(tablename)
+            self._configure(tablename, trow)
 
             return table
         else:
             return None
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def field_definitions(cls, table_id):
+        """
+            Get the field definitions of a dynamic table
+
+            @param table_id: the s3_table record ID
+
+            @return: list of dicts with the s3_field attributes
+        """
+
+        ftable = current.s3db.s3_field
+        query = (ftable.table_id == table_id)
+        rows = current.db(query).select(orderby = ftable.id,
+                                        *[ftable[fn] for fn in cls.FIELD_ATTRIBUTES]
+                                        )
+        return [row.as_dict() for row in rows]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def schema_version(cls, table_id):
+        """
+            Compute the schema version of a dynamic table, i.e. a hash
+            of its field definitions
+
+            @param table_id: the s3_table record ID
+
+            @return: the schema version (string)
+        """
+
+        import hashlib
+
+        fields = cls.field_definitions(table_id)
+        fields.sort(key = lambda f: f["name"])
+        definitions = json.dumps([[f[fn] for fn in cls.FIELD_ATTRIBUTES]
+                                  for f in fields
+                                  ],
+                                 sort_keys = True,
+                                 default = str,
+                                 )
+        return hashlib.sha1(definitions.encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update_schema_version(cls, table_id):
+        """
+            Update the schema version of a dynamic table (to be called
+            whenever its fields are changed)
+
+            @param table_id: the s3_table record ID
+        """
+
+        ttable = current.s3db.s3_table
+        current.db(ttable.id == table_id).update(
+                                schema_version = cls.schema_version(table_id),
+                                )
+
     # -------------------------------------------------------------------------
     @staticmethod
-    def _configure(tablename):
+    def _configure(tablename, row=None):
         """
             Configure the table (e.g. CRUD strings)
+
+            @param tablename: the table name
+            @param row: the s3_table Row (with title and settings),
+                        will be looked up if not provided
         """
 
         s3db = current.s3db
 
         # Load table configuration settings
-        ttable = s3db.s3_table
-        query = (ttable.name == tablename) & \
-                (ttable.deleted != True)
-        row = current.db(query).select(ttable.title,
-                                       ttable.settings,
-                                       limitby = (0, 1),
-                                       ).first()
+        if row is None:
+            ttable = s3db.s3_table
+            query = (ttable.name == tablename) & \
+                    (ttable.deleted != True)
+            row = current.db(query).select(ttable.title,
+                                           ttable.settings,
+                                           limitby = (0, 1),
+                                           ).first()
         if row:
             # Configure CRUD strings
             title = row.title
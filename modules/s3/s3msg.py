@@ -34,6 +34,7 @@
 """
 
 __all__ = ("S3Msg",
+           "S3ChannelPoller",
            "S3Compose",
            )
 
@@ -44,6 +45,7 @@ import os
 import re
 import string
 import sys
+from functools import partial
 
 try:
     from lxml import etree
@@ -53,8 +55,9 @@ except ImportError:
 
 from gluon import current, redirect
 from gluon.html import *
+from gluon.storage import Storage
 
-from s3compat import HTTPError, PY2, StringIO, urlencode, urllib2, urlopen
+from s3compat import HTTPError, PY2, StringIO, urlencode, urllib2, urlopen, urlparse
 #from .s3codec import S3Codec
 from .s3crud import S3CRUD
 from .s3datetime import s3_decode_iso_datetime
@@ -242,30 +245,41 @@ class S3Msg(object):
 
     # -------------------------------------------------------------------------
     @staticmethod
-    def parse(channel_id, function_name):
+    def parse(channel_id, function_name, worker=0, workers=1):
         """
            Parse unparsed Messages from Channel with Parser
            - called from Scheduler
+           - messages are parsed in batches (committed after each batch),
+             several workers can drain the same channel concurrently by
+             each processing a disjoint partition of the messages
 
            @param channel_id: Channel
            @param function_name: Parser
+           @param worker: the index of this worker (0..workers-1)
+           @param workers: the total number of workers for this channel
+
+           @return: the number of messages parsed
         """
 
         from .s3parser import S3Parsing
 
-        parser = S3Parsing.parser
-        stable = current.s3db.msg_parsing_status
-        query = (stable.channel_id == channel_id) & \
-                (stable.is_parsed == False)
-        messages = current.db(query).select(stable.id,
-                                            stable.message_id)
-        for message in messages:
-            # Parse the Message
-            reply_id = parser(function_name, message.message_id)
-            # Update to show that we've parsed the message & provide a link to the reply
-            message.update_record(is_parsed=True,
-                                  reply_id=reply_id)
-        return
+        batch_size = current.deployment_settings.get_msg_parser_batch_size()
+        commit = current.db.commit
+
+        total = 0
+        while True:
+            parsed = S3Parsing.parse_batch(channel_id,
+                                           function_name,
+                                           batch_size = batch_size,
+                                           worker = worker,
+                                           workers = workers,
+                                           )
+            commit()
+            total += parsed
+            if parsed < batch_size:
+                break
+
+        return total
 
     # =========================================================================
     # Outbound Messages
@@ -348,20 +362,82 @@ class S3Msg(object):
             @param recipient: "email@address", "+4412345678", "@nick"
             @param message: message body
             @param subject: message subject (Email only)
+
+            @return: the message_id of the queued message
         """
 
-        # Determine channel to send on based on format of recipient
-        if recipient.startswith("@"):
-            # Twitter
-            tablename = "msg_twitter"
-        elif "@" in recipient:
-            # Email
-            tablename = "msg_email"
-        else:
-            # SMS
-            tablename = "msg_sms"
+        message_ids = S3Msg.send_bulk([(recipient, message, subject)])
+        return message_ids[0]
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def send_bulk(messages):
+        """
+            Queue multiple messages to Addresses in the OutBox, and process
+            the OutBox asynchronously once per contact method
+            - e.g. replies of the message parser
+
+            @param messages: list of tuples (recipient, message, subject),
+                             recipient being "email@address", "+4412345678"
+                             or "@nick", subject is used for Emails only
+
+            @return: list of the message_ids of the queued messages, in
+                     the same order as messages
+        """
+
+        s3db = current.s3db
+
+        outbox = s3db.msg_outbox
+        update_super = s3db.update_super
+
+        message_ids = []
+        contact_methods = set()
+        for recipient, message, subject in messages:
+
+            # Determine channel to send on based on format of recipient
+            if recipient.startswith("@"):
+                # Twitter
+                contact_method = "TWITTER"
+                table = s3db.msg_twitter
+                data = {}
+            elif "@" in recipient:
+                # Email
+                contact_method = "EMAIL"
+                table = s3db.msg_email
+                data = {"subject": subject or "",
+                        "from_address": current.deployment_settings.get_mail_sender(),
+                        }
+            else:
+                # SMS
+                contact_method = "SMS"
+                table = s3db.msg_sms
+                data = {}
+
+            # Place the Message in the appropriate Log
+            _id = table.insert(body = message,
+                               to_address = recipient,
+                               inbound = False,
+                               **data)
+            record = {"id": _id}
+            update_super(table, record)
+            message_id = record["message_id"]
+
+            # Place the Message in the main OutBox
+            outbox.insert(message_id = message_id,
+                          address = recipient,
+                          contact_method = contact_method,
+                          system_generated = True,
+                          )
+
+            message_ids.append(message_id)
+            contact_methods.add(contact_method)
+
+        # Process OutBox async
+        run_async = current.s3task.run_async
+        for contact_method in contact_methods:
+            run_async("msg_process_outbox", args=[contact_method])
 
-        # @ToDo: Complete this
+        return message_ids
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -524,6 +600,81 @@ class S3Msg(object):
                 # task fail permanently
                 raise ValueError("No Twitter API available!")
 
+        def dispatch_to_address(address,
+                                subject,
+                                message,
+                                outbox_id,
+                                message_id,
+                                attachments = [],
+                                organisation_id = None,
+                                contact_method = contact_method,
+                                channel_id = channel_id,
+                                from_address = None,
+                                outgoing_sms_handler = outgoing_sms_handler,
+                                lookup_org = lookup_org,
+                                channels = channels):
+            """
+                Helper method to send messages to an address
+
+                @param address: the address
+                @param subject: the message subject
+                @param message: the message body
+                @param outbox_id: the outbox record ID
+                @param message_id: the message_id
+                @param organisation_id: the organisation_id (for SMS)
+                @param contact_method: the contact method
+            """
+
+            if contact_method == "EMAIL":
+                return self.send_email(address,
+                                       subject,
+                                       message,
+                                       sender = from_address,
+                                       attachments = attachments,
+                                       )
+            elif contact_method == "SMS":
+                if lookup_org:
+                    channel = channels.get(organisation_id)
+                    if not channel and \
+                        org_branches:
+                        orgs = org_parents(organisation_id)
+                        for org in orgs:
+                            channel = channels.get(org)
+                            if channel:
+                                break
+                    if not channel:
+                        # Look for an unrestricted channel
+                        channel = channels.get(None)
+                    if not channel:
+                        # We can't send this message as there is no unrestricted channel & none which matches this Org
+                        return False
+                    outgoing_sms_handler = channel["outgoing_sms_handler"]
+                    channel_id = channel["channel_id"]
+                if outgoing_sms_handler == "msg_sms_webapi_channel":
+                    return self.send_sms_via_api(address,
+                                                 message,
+                                                 message_id,
+                                                 channel_id)
+                elif outgoing_sms_handler == "msg_sms_smtp_channel":
+                    return self.send_sms_via_smtp(address,
+                                                  message,
+                                                  channel_id)
+                elif outgoing_sms_handler == "msg_sms_modem_channel":
+                    return self.send_sms_via_modem(address,
+                                                   message,
+                                                   channel_id)
+                elif outgoing_sms_handler == "msg_sms_tropo_channel":
+                    # NB This does not mean the message is sent
+                    return self.send_sms_via_tropo(outbox_id,
+                                                   message_id,
+                                                   address,
+                                                   message,
+                                                   channel_id)
+            elif contact_method == "TWITTER":
+                return self.send_tweet(message, address)
+
+            return False
+
         def dispatch_to_pe_id(pe_id,
                               subject,
                               message,
@@ -531,12 +682,7 @@ class S3Msg(object):
                               message_id,
                               attachments = [],
                               organisation_id = None,
-                              contact_method = contact_method,
-                              channel_id = channel_id,
-                              from_address = None,
-                              outgoing_sms_handler = outgoing_sms_handler,
-                              lookup_org = lookup_org,
-                              channels = channels):
+                              from_address = None):
             """
                 Helper method to send messages by pe_id
 
@@ -546,7 +692,6 @@ class S3Msg(object):
                 @param outbox_id: the outbox record ID
                 @param message_id: the message_id
                 @param organisation_id: the organisation_id (for SMS)
-                @param contact_method: the contact method
             """
 
             # Get the recipient's contact info
@@ -559,54 +704,15 @@ class S3Msg(object):
                                             limitby=(0, 1)).first()
             # Send the message
             if contact_info:
-                address = contact_info.value
-                if contact_method == "EMAIL":
-                    return self.send_email(address,
+                return dispatch_to_address(contact_info.value,
                                            subject,
                                            message,
-                                           sender = from_address,
+                                           outbox_id,
+                                           message_id,
                                            attachments = attachments,
+                                           organisation_id = organisation_id,
+                                           from_address = from_address,
                                            )
-                elif contact_method == "SMS":
-                    if lookup_org:
-                        channel = channels.get(organisation_id)
-                        if not channel and \
-                            org_branches:
-                            orgs = org_parents(organisation_id)
-                            for org in orgs:
-                                channel = channels.get(org)
-                                if channel:
-                                    break
-                        if not channel:
-                            # Look for an unrestricted channel
-                            channel = channels.get(None)
-                        if not channel:
-                            # We can't send this message as there is no unrestricted channel & none which matches this Org
-                            return False
-                        outgoing_sms_handler = channel["outgoing_sms_handler"]
-                        channel_id = channel["channel_id"]
-                    if outgoing_sms_handler == "msg_sms_webapi_channel":
-                        return self.send_sms_via_api(address,
-                                                     message,
-                                                     message_id,
-                                                     channel_id)
-                    elif outgoing_sms_handler == "msg_sms_smtp_channel":
-                        return self.send_sms_via_smtp(address,
-                                                      message,
-                                                      channel_id)
-                    elif outgoing_sms_handler == "msg_sms_modem_channel":
-                        return self.send_sms_via_modem(address,
-                                                       message,
-                                                       channel_id)
-                    elif outgoing_sms_handler == "msg_sms_tropo_channel":
-                        # NB This does not mean the message is sent
-                        return self.send_sms_via_tropo(outbox_id,
-                                                       message_id,
-                                                       address,
-                                                       message,
-                                                       channel_id)
-                elif contact_method == "TWITTER":
-                    return self.send_tweet(message, address)
 
             return False
 
@@ -622,6 +728,7 @@ class S3Msg(object):
         fields = [outbox.id,
                   outbox.message_id,
                   outbox.pe_id,
+                  outbox.address,
                   outbox.retries,
                   petable.instance_type,
                   ]
@@ -748,16 +855,32 @@ class S3Msg(object):
                 # @ToDo
                 continue
 
-            entity_type = row["pr_pentity"].instance_type
-            if not entity_type:
+            row, entity_type = row["msg_outbox"], row["pr_pentity"].instance_type
+            address = row.address
+            if not entity_type and not address:
                 current.log.warning("s3msg", "Entity type unknown")
                 continue
 
-            row = row["msg_outbox"]
             pe_id = row.pe_id
             message_id = row.message_id
 
-            if entity_type == "pr_person":
+            if address:
+                # Send the message directly to this address
+                try:
+                    status = dispatch_to_address(
+                                    address,
+                                    subject,
+                                    message,
+                                    row.id,
+                                    message_id,
+                                    organisation_id = organisation_id,
+                                    from_address = from_address,
+                                    attachments = attachments,
+                                    )
+                except:
+                    status = False
+
+            elif entity_type == "pr_person":
                 # Send the message to this person
                 try:
                     status = dispatch_to_pe_id(
@@ -1638,6 +1761,26 @@ class S3Msg(object):
         result = fn(channel_id)
         return result
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def poll_channels(tablename, channel_ids=None):
+        """
+            Poll all due Channels of a type concurrently
+            - supported for RSS and email channels, see S3ChannelPoller
+
+            @param tablename: the channel instance table name
+            @param channel_ids: poll only these channels
+
+            @return: dict {channel_id: result}
+        """
+
+        if tablename not in S3ChannelPoller.CHANNELS:
+            error = "Concurrent polling not supported for %s" % tablename
+            current.log.error(error)
+            return error
+
+        return S3ChannelPoller(tablename)(channel_ids)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def poll_email(channel_id):
@@ -1676,13 +1819,8 @@ class S3Msg(object):
         if not channel:
             return "No Such Email Channel: %s" % channel_id
 
-        import email
-        #import mimetypes
         import socket
 
-        from dateutil import parser
-        date_parse = parser.parse
-
         username = channel.username
         password = channel.password
         host = channel.server
@@ -1691,87 +1829,10 @@ class S3Msg(object):
         port = int(channel.port)
         delete = channel.delete_from_server
 
-        mtable = db.msg_email
-        minsert = mtable.insert
         stable = db.msg_channel_status
         sinsert = stable.insert
-        atable = s3db.msg_attachment
-        ainsert = atable.insert
-        dtable = db.doc_document
-        dinsert = dtable.insert
-        store = dtable.file.store
-        update_super = s3db.update_super
-        # Is this channel connected to a parser?
-        parser = s3db.msg_parser_enabled(channel_id)
-        if parser:
-            ptable = db.msg_parsing_status
-            pinsert = ptable.insert
-
-        # ---------------------------------------------------------------------
-        def parse_email(message):
-            """
-                Helper to parse the mail
-            """
-
-            # Create a Message object
-            msg = email.message_from_string(message)
-            # Parse the Headers
-            sender = msg["from"]
-            subject = msg.get("subject", "")
-            date_sent = msg.get("date", None)
-            # Store the whole raw message
-            raw = msg.as_string()
-            # Parse out the 'Body'
-            # Look for Attachments
-            attachments = []
-            # http://docs.python.org/2/library/email-examples.html
-            body = ""
-            for part in msg.walk():
-                if part.get_content_maintype() == "multipart":
-                    # multipart/* are just containers
-                    continue
-                filename = part.get_filename()
-                if not filename:
-                    # Assume this is the Message Body (plain text or HTML)
-                    if not body:
-                        # Plain text will come first
-                        body = part.get_payload(decode=True)
-                    continue
-                attachments.append((filename, part.get_payload(decode=True)))
-
-            # Store in DB
-            data = {"channel_id": channel_id,
-                    "from_address": sender,
-                    "subject": subject[:78],
-                    "body": body,
-                    "raw": raw,
-                    "inbound": True,
-                    }
-            if date_sent:
-                data["date"] = date_parse(date_sent)
-            _id = minsert(**data)
-            record = {"id": _id}
-            update_super(mtable, record)
-            message_id = record["message_id"]
-            for a in attachments:
-                # Linux ext2/3 max filename length = 255
-                # b16encode doubles length & need to leave room for doc_document.file.16charsuuid.
-                # store doesn't support unicode, so need an ascii string
-                filename = s3_unicode(a[0][:92]).encode("ascii", "ignore")
-                fp = StringIO()
-                fp.write(a[1])
-                fp.seek(0)
-                newfilename = store(fp, filename)
-                fp.close()
-                document_id = dinsert(name = filename,
-                                      file = newfilename)
-                update_super(dtable, {"id": document_id})
-                ainsert(message_id = message_id,
-                        document_id = document_id)
-            if parser:
-                pinsert(message_id = message_id,
-                        channel_id = channel_id)
 
+        messages = []
         dellist = []
         if protocol == "pop3":
             # http://docs.python.org/library/poplib.html
@@ -1813,13 +1874,17 @@ class S3Msg(object):
 
             mblist = p.list()[1]
             for item in mblist:
-                number, octets = item.split(" ")
+                number, octets = s3_str(item).split(" ")
                 # Retrieve the message (storing it in a list of lines)
                 lines = p.retr(number)[1]
-                parse_email("\n".join(lines))
+                messages.append(b"\n".join(lines))
                 if delete:
                     # Add it to the list of messages to delete later
                     dellist.append(number)
+            # Store the messages before deleting them from the server
+            S3Msg.update_email(channel_id, messages)
+            db.commit()
+
             # Iterate over the list of messages to delete
             for number in dellist:
                 p.dele(number)
@@ -1862,16 +1927,130 @@ class S3Msg(object):
                 typ, msg_data = M.fetch(number, "(RFC822)")
                 for response_part in msg_data:
                     if isinstance(response_part, tuple):
-                        parse_email(response_part[1])
+                        messages.append(response_part[1])
                         if delete:
                             # Add it to the list of messages to delete later
                             dellist.append(number)
+            # Store the messages before deleting them from the server
+            S3Msg.update_email(channel_id, messages)
+            db.commit()
+
             # Iterate over the list of messages to delete
             for number in dellist:
                 typ, response = M.store(number, "+FLAGS", r"(\Deleted)")
             M.close()
             M.logout()
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_email(channel_id, messages):
+        """
+            Store inbound emails
+
+            @param channel_id: the channel ID
+            @param messages: the raw messages (RFC822)
+
+            @return: the number of stored messages
+        """
+
+        if not messages:
+            return 0
+
+        import email
+        #import mimetypes
+
+        from dateutil import parser
+        date_parse = parser.parse
+
+        db = current.db
+        s3db = current.s3db
+
+        mtable = db.msg_email
+        atable = s3db.msg_attachment
+        ainsert = atable.insert
+        dtable = db.doc_document
+        dinsert = dtable.insert
+        store = dtable.file.store
+        update_super = s3db.update_super
+        # Is this channel connected to a parser?
+        parser = s3db.msg_parser_enabled(channel_id)
+
+        # Parse the messages
+        rows = []
+        all_attachments = []
+        for message in messages:
+            # Create a Message object
+            if isinstance(message, bytes) and not PY2:
+                msg = email.message_from_bytes(message)
+            else:
+                msg = email.message_from_string(message)
+            # Parse the Headers
+            sender = msg["from"]
+            subject = msg.get("subject", "")
+            date_sent = msg.get("date", None)
+            # Store the whole raw message
+            raw = msg.as_string()
+            # Parse out the 'Body'
+            # Look for Attachments
+            attachments = []
+            # http://docs.python.org/2/library/email-examples.html
+            body = ""
+            for part in msg.walk():
+                if part.get_content_maintype() == "multipart":
+                    # multipart/* are just containers
+                    continue
+                filename = part.get_filename()
+                if not filename:
+                    # Assume this is the Message Body (plain text or HTML)
+                    if not body:
+                        # Plain text will come first
+                        body = part.get_payload(decode=True)
+                    continue
+                attachments.append((filename, part.get_payload(decode=True)))
+
+            data = {"channel_id": channel_id,
+                    "from_address": sender,
+                    "subject": subject[:78],
+                    "body": body,
+                    "raw": raw,
+                    "inbound": True,
+                    }
+            if date_sent:
+                data["date"] = date_parse(date_sent)
+            rows.append(data)
+            all_attachments.append(attachments)
+
+        # Store in DB
+        ids = mtable.bulk_insert(rows)
+        parsing_rows = []
+        for _id, attachments in zip(ids, all_attachments):
+            record = {"id": _id}
+            update_super(mtable, record)
+            message_id = record["message_id"]
+            for a in attachments:
+                # Linux ext2/3 max filename length = 255
+                # b16encode doubles length & need to leave room for doc_document.file.16charsuuid.
+                # store doesn't support unicode, so need an ascii string
+                filename = s3_unicode(a[0][:92]).encode("ascii", "ignore")
+                fp = StringIO()
+                fp.write(a[1])
+                fp.seek(0)
+                newfilename = store(fp, filename)
+                fp.close()
+                document_id = dinsert(name = filename,
+                                      file = newfilename)
+                update_super(dtable, {"id": document_id})
+                ainsert(message_id = message_id,
+                        document_id = document_id)
+            if parser:
+                parsing_rows.append({"message_id": message_id,
+                                     "channel_id": channel_id,
+                                     })
+        if parsing_rows:
+            db.msg_parsing_status.bulk_insert(parsing_rows)
+
+        return len(ids)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def poll_mcommons(channel_id):
@@ -2059,27 +2238,14 @@ class S3Msg(object):
         if not channel:
             return "No Such RSS Channel: %s" % channel_id
 
-        # http://pythonhosted.org/feedparser
-        if PY2:
-            # Use Stable v5.2.1
-            # - current known reason is to prevent SSL: CERTIFICATE_VERIFY_FAILED
-            import feedparser521 as feedparser
-        else:
-            # Python 3.x: Requires pip install sgmllib3k
-            if sys.version_info[1] >= 7:
-                # Use 6.0.0b1 which is required for Python 3.7
-                import feedparser
-            else:
-                # Python 3.6 requires 5.2.1 with 2to3 run on it to prevent SSL: CERTIFICATE_VERIFY_FAILED
-                import feedparser5213 as feedparser
+        feedparser = S3Msg.feedparser()
 
         # Basic Authentication
         username = channel.username
         password = channel.password
         if username and password:
             # feedparser doesn't do pre-emptive authentication with urllib2.HTTPBasicAuthHandler() and throws errors on the 401
-            base64string = base64.encodestring("%s:%s" % (username, password)).replace("\n", "")
-            request_headers = {"Authorization": "Basic %s" % base64string}
+            request_headers = {"Authorization": S3Msg.basic_auth(username, password)}
         else:
             # Doesn't help to encourage servers to set correct content-type
             #request_headers = {"Accept": "application/xml"}
@@ -2111,6 +2277,68 @@ class S3Msg(object):
                                  request_headers = request_headers,
                                  response_headers = response_headers,
                                  )
+
+        return S3Msg.update_rss(channel_id, d)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def feedparser():
+        """
+            Import the appropriate version of feedparser
+
+            @return: the feedparser module
+        """
+
+        # http://pythonhosted.org/feedparser
+        if PY2:
+            # Use Stable v5.2.1
+            # - current known reason is to prevent SSL: CERTIFICATE_VERIFY_FAILED
+            import feedparser521 as feedparser
+        else:
+            # Python 3.x: Requires pip install sgmllib3k
+            if sys.version_info[1] >= 7:
+                # Use 6.0.0b1 which is required for Python 3.7
+                import feedparser
+            else:
+                # Python 3.6 requires 5.2.1 with 2to3 run on it to prevent SSL: CERTIFICATE_VERIFY_FAILED
+                import feedparser5213 as feedparser
+
+        return feedparser
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def basic_auth(username, password):
+        """
+            Encode a HTTP Basic Authorization header
+
+            @param username: the username
+            @param password: the password
+
+            @return: the header value
+        """
+
+        credentials = s3_str("%s:%s" % (username, password))
+        if not PY2:
+            credentials = credentials.encode("utf-8")
+        return "Basic %s" % s3_str(base64.b64encode(credentials))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_rss(channel_id, d):
+        """
+            Store the entries of a parsed RSS Feed
+
+            @param channel_id: the channel ID
+            @param d: the parsed feed (feedparser result)
+
+            @return: "OK" if successful, otherwise None
+        """
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db.msg_rss_channel
+        query = (table.channel_id == channel_id)
+
         if d.bozo:
             # Something doesn't seem right
             if PY2:
@@ -2139,7 +2367,6 @@ class S3Msg(object):
         gtable = db.gis_location
         ginsert = gtable.insert
         mtable = db.msg_rss
-        minsert = mtable.insert
         ltable = db.msg_rss_link
         linsert = ltable.insert
         update_super = s3db.update_super
@@ -2151,21 +2378,35 @@ class S3Msg(object):
             pinsert = ptable.insert
 
         entries = d.entries
+
+        # Look up existing entries for duplicate check
+        # (ETag just saves bandwidth, doesn't filter the contents of the feed)
+        existing = {}
         if entries:
-            # Check how many we have already to see if any are new
-            count_old = db(mtable.id > 0).count()
+            links = set(entry.get("link", None) for entry in entries)
+            rows = db(mtable.from_address.belongs(links)).select(mtable.id,
+                                                                 mtable.from_address,
+                                                                 mtable.location_id,
+                                                                 mtable.message_id,
+                                                                 orderby = mtable.id,
+                                                                 )
+            for row in rows:
+                if row.from_address not in existing:
+                    existing[row.from_address] = row
+
+        # New entries, to be inserted in bulk: [(data, links)]
+        added = []
+        added_index = {}
+
         for entry in entries:
             link = entry.get("link", None)
 
             # Check for duplicates
-            # (ETag just saves bandwidth, doesn't filter the contents of the feed)
-            exists = db(mtable.from_address == link).select(mtable.id,
-                                                            mtable.location_id,
-                                                            mtable.message_id,
-                                                            limitby=(0, 1)
-                                                            ).first()
+            exists = existing.get(link)
             if exists:
                 location_id = exists.location_id
+            elif link in added_index:
+                location_id = added[added_index[link]][0]["location_id"]
             else:
                 location_id = None
 
@@ -2232,17 +2473,18 @@ class S3Msg(object):
 
             # Get links - these can be multiple with certain type
             links = entry.get("links", [])
+            data = {"channel_id": channel_id,
+                    "title": title,
+                    "from_address": link,
+                    "body": content,
+                    "author": entry.get("author", None),
+                    "date": date_published,
+                    "location_id": location_id,
+                    "tags": tags,
+                    # @ToDo: Enclosures
+                    }
             if exists:
-                db(mtable.id == exists.id).update(channel_id = channel_id,
-                                                  title = title,
-                                                  from_address = link,
-                                                  body = content,
-                                                  author = entry.get("author", None),
-                                                  date = date_published,
-                                                  location_id = location_id,
-                                                  tags = tags,
-                                                  # @ToDo: Enclosures
-                                                  )
+                db(mtable.id == exists.id).update(**data)
                 if links:
                     query_ = (ltable.rss_id == exists.id) & (ltable.deleted != True)
                     for link_ in links:
@@ -2265,38 +2507,45 @@ class S3Msg(object):
                 if parser:
                     pinsert(message_id = exists.message_id,
                             channel_id = channel_id)
-
+            elif link in added_index:
+                # Same link repeated in the feed => the last entry wins
+                added[added_index[link]] = (data, links)
             else:
-                _id = minsert(channel_id = channel_id,
-                              title = title,
-                              from_address = link,
-                              body = content,
-                              author = entry.get("author", None),
-                              date = date_published,
-                              location_id = location_id,
-                              tags = tags,
-                              # @ToDo: Enclosures
-                              )
-                record = dict(id=_id)
+                if link is not None:
+                    added_index[link] = len(added)
+                added.append((data, links))
+
+        new = len(added)
+        if new:
+            # Insert the new entries in bulk
+            ids = mtable.bulk_insert([data for data, links in added])
+            link_rows = []
+            parsing_rows = []
+            for _id, (data, links) in zip(ids, added):
+                record = {"id": _id}
                 update_super(mtable, record)
-                for link_ in links:
-                    linsert(rss_id = _id,
-                            url = link_["url"],
-                            type = link_["type"],
-                            )
+                link_rows.extend({"rss_id": _id,
+                                  "url": link_["url"],
+                                  "type": link_["type"],
+                                  } for link_ in links)
                 if parser:
-                    pinsert(message_id = record["message_id"],
-                            channel_id = channel_id)
+                    parsing_rows.append({"message_id": record["message_id"],
+                                         "channel_id": channel_id,
+                                         })
+            if link_rows:
+                ltable.bulk_insert(link_rows)
+            if parsing_rows:
+                ptable.bulk_insert(parsing_rows)
 
         if entries:
-            # Check again to see if there were any new ones
-            count_new = db(mtable.id > 0).count()
-            if count_new == count_old:
+            if not new:
                 # No new posts?
                 # Back-off in-case the site isn't respecting ETags/Last-Modified
                 S3Msg.update_channel_status(channel_id,
                                             status="+1",
                                             period=(300, 3600))
+            else:
+                S3Msg.reset_channel_backoff(channel_id)
 
         return "OK"
 
@@ -2398,6 +2647,12 @@ class S3Msg(object):
     def update_channel_status(channel_id, status, period=None):
         """
             Update the Status for a Channel
+
+            @param channel_id: the channel ID
+            @param status: the new status, or "+n" to increment a
+                           numeric status
+            @param period: tuple (increment, maximum) in seconds to back
+                           off polling of this channel
         """
 
         db = current.db
@@ -2406,8 +2661,19 @@ class S3Msg(object):
         stable = current.s3db.msg_channel_status
         query = (stable.channel_id == channel_id)
         old_status = db(query).select(stable.status,
+                                      stable.backoff,
                                       limitby=(0, 1)
                                       ).first()
+
+        data = {}
+        if period:
+            # Back off from polling this channel (concurrent poller)
+            backoff = old_status.backoff if old_status else None
+            backoff = min((backoff or 0) + period[0], period[1])
+            data["backoff"] = backoff
+            data["next_poll"] = current.request.utcnow + \
+                                datetime.timedelta(seconds=backoff)
+
         if old_status:
             # Update
             if status and status[0] == "+":
@@ -2421,11 +2687,12 @@ class S3Msg(object):
                     new_status = old_status + int(status[1:])
             else:
                 new_status = status
-            db(query).update(status = new_status)
+            db(query).update(status = new_status, **data)
         else:
             # Initialise
             stable.insert(channel_id = channel_id,
-                          status = status)
+                          status = status,
+                          **data)
         if period:
             # Amend the frequency of the scheduled task
             ttable = db.scheduler_task
@@ -2445,6 +2712,23 @@ class S3Msg(object):
                 new_period = min(new_period, max_period)
                 db(ttable.id == exists.id).update(period=new_period)
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def reset_channel_backoff(channel_id):
+        """
+            Reset the polling back-off for a Channel (e.g. after new
+            messages have been received)
+
+            @param channel_id: the channel ID
+        """
+
+        stable = current.s3db.msg_channel_status
+        query = (stable.channel_id == channel_id) & \
+                (stable.backoff != None)
+        current.db(query).update(backoff = None,
+                                 next_poll = None,
+                                 )
+
     # -------------------------------------------------------------------------
     @staticmethod
     def twitter_search(search_id):
@@ -2614,6 +2898,519 @@ class S3Msg(object):
         else:
             return hashdef["defs"]["def"]["text"]
 
+# =============================================================================
+class S3ChannelPoller(object):
+    """
+        Concurrent poller for inbound channels
+
+        - supports RSS/CAP feed channels and email (IMAP/POP3) channels
+        - fetches the feeds/mailboxes of all due channels concurrently
+          (bounded number of worker threads, each RSS worker handling
+          all channels of one host over a single keep-alive connection)
+        - parses and stores the fetched messages in the calling thread
+          (DB connections must not be shared between threads)
+        - emails are deleted from the server (if so configured) only
+          after they have been stored
+        - channels with failing or unchanged feeds are backed off
+          (see S3Msg.update_channel_status)
+
+        NB Twilio, mCommons and Twitter channels are not supported
+           here (their client libraries handle the connections), they
+           are polled per channel by S3Msg.poll
+    """
+
+    # Supported channel types, and the fields to look up for each
+    CHANNELS = {"msg_rss_channel": ("url",
+                                    "date",
+                                    "etag",
+                                    "content_type",
+                                    "username",
+                                    "password",
+                                    ),
+                "msg_email_channel": ("server",
+                                      "protocol",
+                                      "use_ssl",
+                                      "port",
+                                      "username",
+                                      "password",
+                                      "delete_from_server",
+                                      ),
+                }
+
+    def __init__(self, tablename="msg_rss_channel", workers=None, timeout=None):
+        """
+            Constructor
+
+            @param tablename: the channel instance table name
+            @param workers: the maximum number of concurrent connections,
+                            default see settings.msg.poll_workers
+            @param timeout: the timeout for remote servers (seconds),
+                            default see settings.msg.poll_timeout
+        """
+
+        settings = current.deployment_settings
+
+        self.tablename = tablename
+        self.workers = workers or settings.get_msg_poll_workers()
+        self.timeout = timeout or settings.get_msg_poll_timeout()
+
+    # -------------------------------------------------------------------------
+    def __call__(self, channel_ids=None):
+        """
+            Poll all due channels
+
+            @param channel_ids: poll only these channels (regardless
+                                whether they are due or enabled)
+
+            @return: dict {channel_id: result}
+        """
+
+        channels = self.channels(channel_ids)
+        if not channels:
+            return {}
+
+        if self.tablename == "msg_email_channel":
+            return self.poll_email(channels)
+        else:
+            return self.poll_rss(channels)
+
+    # -------------------------------------------------------------------------
+    def channels(self, channel_ids=None):
+        """
+            Get all channels which are due to be polled
+
+            @param channel_ids: limit the selection to these channels
+
+            @return: Rows of the channel instance table
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.table(self.tablename)
+        if channel_ids:
+            query = (table.channel_id.belongs(channel_ids))
+        else:
+            query = (table.enabled == True)
+
+            # Skip channels which are backed off
+            stable = s3db.msg_channel_status
+            squery = (stable.next_poll > current.request.utcnow)
+            query &= ~(table.channel_id.belongs(db(squery)._select(stable.channel_id)))
+
+        query &= (table.deleted == False)
+
+        fields = [table[fn] for fn in self.CHANNELS[self.tablename]]
+        return db(query).select(table.channel_id, *fields)
+
+    # -------------------------------------------------------------------------
+    def run(self, jobs):
+        """
+            Run jobs in concurrent worker threads
+
+            @param jobs: list of callables returning a dict
+
+            @return: the merged results of all jobs
+        """
+
+        import threading
+
+        jobs = list(jobs)
+        lock = threading.Lock()
+        results = {}
+
+        def worker():
+            while True:
+                with lock:
+                    if not jobs:
+                        break
+                    job = jobs.pop()
+                results.update(job())
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(self.workers, len(jobs)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    # -------------------------------------------------------------------------
+    # RSS
+    # -------------------------------------------------------------------------
+    def poll_rss(self, channels):
+        """
+            Poll RSS channels
+
+            @param channels: the channels (Rows of msg_rss_channel)
+
+            @return: dict {channel_id: result}
+        """
+
+        # Fetch concurrently
+        fetched = self.fetch_all(channels)
+
+        # Parse and store serially
+        feedparser = S3Msg.feedparser()
+        update_rss = S3Msg.update_rss
+
+        results = {}
+        for channel in channels:
+            channel_id = channel.channel_id
+            status, headers, body = fetched[channel_id]
+
+            if status == 304:
+                # Not modified
+                current.db(current.s3db.msg_rss_channel.channel_id == channel_id) \
+                       .update(date = current.request.utcnow)
+                results[channel_id] = "OK"
+                continue
+
+            if status != 200:
+                if status is None:
+                    error = "ERROR: %s" % body
+                else:
+                    error = "ERROR: HTTP %s" % status
+                S3Msg.update_channel_status(channel_id,
+                                            status = error,
+                                            period = (300, 3600),
+                                            )
+                results[channel_id] = error
+                continue
+
+            if channel.content_type:
+                # Override content-type (some feeds have text/html set
+                # which feedparser refuses to parse)
+                headers["content-type"] = "application/xml"
+            try:
+                d = feedparser.parse(body, response_headers=headers)
+                etag = headers.get("etag")
+                if etag:
+                    d["etag"] = etag
+                results[channel_id] = update_rss(channel_id, d)
+            except Exception as e:
+                # Don't let one broken feed stop the others
+                error = "ERROR: %s" % e
+                current.log.error("Channel %s: %s" % (channel_id, error))
+                results[channel_id] = error
+
+        return results
+
+    # -------------------------------------------------------------------------
+    def fetch_all(self, channels):
+        """
+            Fetch the feeds of multiple channels concurrently
+
+            @param channels: the channels (Rows of msg_rss_channel)
+
+            @return: dict {channel_id: (status, headers, body)}, status
+                     being None if the request failed (body being the
+                     error message then)
+        """
+
+        # Group the requests by host
+        hosts = {}
+        for channel in channels:
+            url = channel.url
+            if not url:
+                continue
+            headers = {"Accept-Encoding": "gzip",
+                       "User-Agent": "Sahana Eden",
+                       }
+            if channel.username and channel.password:
+                headers["Authorization"] = S3Msg.basic_auth(channel.username,
+                                                            channel.password,
+                                                            )
+            if channel.etag:
+                headers["If-None-Match"] = channel.etag
+            elif channel.date:
+                from email.utils import formatdate
+                from calendar import timegm
+                modified = timegm(channel.date.utctimetuple())
+                headers["If-Modified-Since"] = formatdate(modified, usegmt=True)
+
+            parsed = urlparse.urlsplit(url)
+            host = (parsed.scheme.lower(), parsed.netloc.lower())
+            if host in hosts:
+                hosts[host].append((channel.channel_id, url, headers))
+            else:
+                hosts[host] = [(channel.channel_id, url, headers)]
+
+        results = dict((channel.channel_id, (None, {}, "No URL"))
+                       for channel in channels)
+
+        results.update(self.run(partial(self.fetch, requests)
+                                for requests in hosts.values()))
+        return results
+
+    # -------------------------------------------------------------------------
+    def fetch(self, requests):
+        """
+            Fetch multiple URLs, re-using connections (runs in a worker
+            thread, so must not access the database or current)
+
+            @param requests: list of tuples (channel_id, url, headers)
+
+            @return: dict {channel_id: (status, headers, body)}
+        """
+
+        try:
+            from http.client import HTTPConnection, HTTPSConnection, HTTPException
+        except ImportError:
+            # Python 2
+            from httplib import HTTPConnection, HTTPSConnection, HTTPException
+        import socket
+
+        timeout = self.timeout
+        connections = {}
+
+        def request(url, headers, redirects=3):
+
+            parsed = urlparse.urlsplit(url)
+            scheme = parsed.scheme.lower()
+            host = (scheme, parsed.netloc.lower())
+            path = parsed.path or "/"
+            if parsed.query:
+                path = "%s?%s" % (path, parsed.query)
+
+            for attempt in (0, 1):
+                conn = connections.get(host)
+                if conn is None:
+                    if scheme == "https":
+                        conn = HTTPSConnection(parsed.netloc, timeout=timeout)
+                    else:
+                        conn = HTTPConnection(parsed.netloc, timeout=timeout)
+                    connections[host] = conn
+                    attempt = 1
+                try:
+                    conn.request("GET", path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (HTTPException, socket.error):
+                    # Connection closed by the server => retry with a
+                    # new connection, but only once
+                    conn.close()
+                    del connections[host]
+                    if attempt:
+                        raise
+                else:
+                    break
+
+            status = response.status
+            rheaders = dict((k.lower(), v) for k, v in response.getheaders())
+
+            if status in (301, 302, 303, 307, 308) and redirects:
+                location = rheaders.get("location")
+                if location:
+                    location = urlparse.urljoin(url, location)
+                    target = urlparse.urlsplit(location)
+                    if (target.scheme.lower(), target.netloc.lower()) != host:
+                        # Don't send the credentials to another host
+                        headers = dict((k, v) for k, v in headers.items()
+                                       if k.lower() != "authorization")
+                    return request(location, headers, redirects - 1)
+
+            if rheaders.get("content-encoding") == "gzip":
+                import zlib
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                del rheaders["content-encoding"]
+
+            return status, rheaders, body
+
+        results = {}
+        for channel_id, url, headers in requests:
+            try:
+                results[channel_id] = request(url, headers)
+            except Exception as e:
+                results[channel_id] = (None, {}, str(e))
+
+        for conn in connections.values():
+            conn.close()
+
+        return results
+
+    # -------------------------------------------------------------------------
+    # Email
+    # -------------------------------------------------------------------------
+    def poll_email(self, channels):
+        """
+            Poll email channels
+
+            @param channels: the channels (Rows of msg_email_channel)
+
+            @return: dict {channel_id: result}
+        """
+
+        # Fetch concurrently (one session per mailbox)
+        fetched = self.run(partial(self.fetch_mail, channel)
+                           for channel in channels)
+
+        # Store serially
+        update_email = S3Msg.update_email
+
+        results = {}
+        delete = []
+        for channel in channels:
+            channel_id = channel.channel_id
+            error, messages = fetched[channel_id]
+
+            if error:
+                error = "ERROR: %s" % error
+                current.log.error("Channel %s: %s" % (channel_id, error))
+                S3Msg.update_channel_status(channel_id,
+                                            status = error,
+                                            period = (300, 3600),
+                                            )
+                results[channel_id] = error
+                continue
+
+            try:
+                update_email(channel_id, [message for uid, message in messages])
+            except Exception as e:
+                # Don't let one broken mailbox stop the others
+                error = "ERROR: %s" % e
+                current.log.error("Channel %s: %s" % (channel_id, error))
+                results[channel_id] = error
+                continue
+
+            if messages:
+                S3Msg.reset_channel_backoff(channel_id)
+                if channel.delete_from_server:
+                    delete.append((channel, [uid for uid, message in messages]))
+            results[channel_id] = "OK"
+
+        if delete:
+            # Commit before the messages get deleted from the servers
+            current.db.commit()
+
+            # Delete the stored messages from the servers (concurrently)
+            errors = self.run(partial(self.delete_mail, channel, uids)
+                              for channel, uids in delete)
+            for channel_id, error in errors.items():
+                if error:
+                    current.log.error("Channel %s: delete failed: %s" % \
+                                      (channel_id, error))
+
+        return results
+
+    # -------------------------------------------------------------------------
+    def connect_mail(self, channel):
+        """
+            Connect and log in to the mail server of a channel (runs in
+            a worker thread, so must not access the database or current)
+
+            @param channel: the channel (Row of msg_email_channel)
+
+            @return: tuple (protocol, session)
+        """
+
+        host = channel.server
+        port = int(channel.port)
+        ssl = channel.use_ssl
+        timeout = self.timeout
+
+        protocol = channel.protocol
+        if protocol == "pop3":
+            import poplib
+            # https://stackoverflow.com/questions/30976106/python-poplib-error-proto-line-too-long
+            poplib._MAXLINE = 20480
+            if ssl:
+                session = poplib.POP3_SSL(host, port, timeout=timeout)
+            else:
+                session = poplib.POP3(host, port, timeout=timeout)
+            try:
+                # Attempting APOP authentication...
+                session.apop(channel.username, channel.password)
+            except poplib.error_proto:
+                # Attempting standard authentication...
+                session.user(channel.username)
+                session.pass_(channel.password)
+
+        elif protocol == "imap":
+            import imaplib
+            if ssl:
+                session = imaplib.IMAP4_SSL(host, port)
+            else:
+                session = imaplib.IMAP4(host, port)
+            session.sock.settimeout(timeout)
+            session.login(channel.username, channel.password)
+            # Select inbox
+            session.select()
+
+        else:
+            raise ValueError("Unsupported protocol: %s" % protocol)
+
+        return protocol, session
+
+    # -------------------------------------------------------------------------
+    def fetch_mail(self, channel):
+        """
+            Fetch all messages from the mailbox of a channel (runs in a
+            worker thread, so must not access the database or current)
+
+            @param channel: the channel (Row of msg_email_channel)
+
+            @return: dict {channel_id: (error, [(uid, message), ...])}
+        """
+
+        messages = []
+        try:
+            protocol, session = self.connect_mail(channel)
+            if protocol == "pop3":
+                for item in session.uidl()[1]:
+                    number, uid = s3_str(item).split(" ", 1)
+                    # Retrieve the message (as a list of lines)
+                    lines = session.retr(number)[1]
+                    messages.append((uid, b"\n".join(lines)))
+                session.quit()
+            else:
+                typ, data = session.uid("SEARCH", None, "ALL")
+                for uid in data[0].split():
+                    typ, msg_data = session.uid("FETCH", uid, "(RFC822)")
+                    for response_part in msg_data:
+                        if isinstance(response_part, tuple):
+                            messages.append((s3_str(uid), response_part[1]))
+                session.logout()
+        except Exception as e:
+            return {channel.channel_id: (str(e) or e.__class__.__name__, None)}
+
+        return {channel.channel_id: (None, messages)}
+
+    # -------------------------------------------------------------------------
+    def delete_mail(self, channel, uids):
+        """
+            Delete messages from the mailbox of a channel (runs in a
+            worker thread, so must not access the database or current)
+
+            @param channel: the channel (Row of msg_email_channel)
+            @param uids: the unique IDs of the messages to delete
+
+            @return: dict {channel_id: error or None}
+        """
+
+        uids = set(uids)
+        try:
+            protocol, session = self.connect_mail(channel)
+            if protocol == "pop3":
+                # Message numbers are per session, so map by UIDL
+                for item in session.uidl()[1]:
+                    number, uid = s3_str(item).split(" ", 1)
+                    if uid in uids:
+                        session.dele(number)
+                session.quit()
+            else:
+                for uid in uids:
+                    session.uid("STORE", uid, "+FLAGS", r"(\Deleted)")
+                # Closing the mailbox expunges the deleted messages
+                session.close()
+                session.logout()
+        except Exception as e:
+            return {channel.channel_id: str(e) or e.__class__.__name__}
+
+        return {channel.channel_id: None}
+
 # =============================================================================
 class S3Compose(S3CRUD):
     """ RESTful method for messaging """
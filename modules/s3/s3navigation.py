@@ -35,17 +35,21 @@
 """
 
 __all__ = ("S3NavigationItem",
+           "S3MenuCache",
            "S3ScriptItem",
            "S3ResourceHeader",
            "s3_rheader_tabs",
            "s3_rheader_resource",
            )
 
+import hashlib
+import json
+
 from gluon import *
 from gluon.storage import Storage
 
 from s3compat import basestring, xrange
-from .s3utils import s3_str
+from .s3utils import s3_str, s3_unicode
 
 # =============================================================================
 class S3NavigationItem(object):
@@ -882,8 +886,6 @@ class S3NavigationItem(object):
             @param kwargs: override URL query vars
         """
 
-        aURL = current.auth.permission.accessible_url
-
         if not self.link:
             return None
 
@@ -905,8 +907,25 @@ class S3NavigationItem(object):
         if f is None:
             f = "index"
         f, args = self.__format(f, args, extension)
-        return aURL(c=c, f=f, p=self.p, a=a, t=self.tablename,
-                    args=args, vars=link_vars)
+
+        # Permissions for menu items depend only on the role set of
+        # the user => look up from menu cache if possible
+        permissions = S3MenuCache.permissions()
+        if permissions is not None:
+            key = "%s/%s/%s/%s/%s" % (a, c, f, self.p, self.tablename)
+            permitted = permissions.get(key)
+            if permitted is not None:
+                if not permitted:
+                    return False
+                return URL(a=a, c=c, f=f, args=args, vars=link_vars)
+
+        aURL = current.auth.permission.accessible_url
+        url = aURL(c=c, f=f, p=self.p, a=a, t=self.tablename,
+                   args=args, vars=link_vars)
+
+        if permissions is not None:
+            permissions[key] = url is not False
+        return url
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -992,8 +1011,14 @@ class S3NavigationItem(object):
             Invokes the renderer and serializes the output for the web2py
             template parser, returns a string to be written to the response
             body, uses the xml() method of the renderer output, if present.
+
+            Menus (=root items) configured with the cache option will be
+            rendered from the menu cache if possible.
         """
 
+        if self.parent is None and self.opts.cache:
+            return S3MenuCache.render(self)
+
         output = self.render()
         if output is None:
             return ""
@@ -1341,6 +1366,199 @@ class S3NavigationItem(object):
                 return item
         return None
 
+# =============================================================================
+class S3MenuCache(object):
+    """
+        Role-set keyed cache for navigation menus:
+
+        - caches the results of permission checks for navigation items
+          across requests, shared by all users with the same roles and
+          realms (=the only user-specific input of these checks)
+
+        - caches the rendered HTML of menus which opt in with the cache
+          option in the root item, e.g. MM(cache=True)(...), per user,
+          language and selected path; the cache option can also be a
+          callable receiving the menu and returning additional key
+          elements, if the menu depends on other request parameters
+
+        Both caches expire when ACLs change (ACL version = latest
+        modification of s3_permission), role changes of the user change
+        the realms and hence the key.
+    """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def permissions(cls):
+        """
+            Get the cached permissions for navigation items for the
+            current role set
+
+            @return: dict {item_key: permitted}, or None if caching is
+                     disabled or not possible (e.g. auth.override)
+        """
+
+        store = cls.store()
+        if store is None:
+            return None
+
+        permissions = store.get("permissions")
+        if permissions is None:
+            key = cls.key("menu_permissions")
+            if key is None:
+                permissions = store["permissions"] = False
+            else:
+                expire = current.deployment_settings.get_ui_menu_cache()
+                # The same dict object is returned from cache.ram, so
+                # that any permissions added later are cached as well
+                permissions = current.cache.ram(key,
+                                                lambda: {},
+                                                time_expire = expire,
+                                                )
+                store["permissions"] = permissions
+
+        return permissions if permissions is not False else None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def render(cls, menu):
+        """
+            Render a menu as HTML, using the cache if possible
+
+            @param menu: the menu (=root S3NavigationItem)
+
+            @return: the rendered menu (string)
+        """
+
+        def render():
+            output = menu.render()
+            if output is None:
+                return ""
+            elif hasattr(output, "xml"):
+                return output.xml()
+            else:
+                return str(output)
+
+        store = cls.store()
+        if store is None:
+            return render()
+
+        request = current.request
+
+        # Selected path (cheap: matching only, no permission checks)
+        branch = menu.branch(request)
+        if branch is not None:
+            selected = "/".join(str(item.pos()) for item in branch.path()[1:])
+        else:
+            selected = None
+
+        # Additional key elements
+        extra = menu.opts.cache
+        if callable(extra):
+            extra = extra(menu)
+        else:
+            extra = None
+
+        auth = current.auth
+        user_id = auth.user.id if auth.s3_logged_in() else None
+
+        key = cls.key("menu_html",
+                      menu.__class__.__name__,
+                      current.T.accepted_language,
+                      user_id,
+                      request.controller,
+                      request.function,
+                      selected,
+                      extra,
+                      )
+        if key is None:
+            return render()
+
+        return current.cache.ram(key,
+                                 render,
+                                 time_expire = current.deployment_settings \
+                                                      .get_ui_menu_cache(),
+                                 )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def store():
+        """
+            Get the per-request store of the menu cache
+
+            @return: the store (dict), or None if caching is disabled
+        """
+
+        if not current.deployment_settings.get_ui_menu_cache():
+            return None
+
+        s3 = current.response.s3
+        store = s3.menu_cache
+        if store is None:
+            store = s3.menu_cache = {}
+        return store
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def key(cls, prefix, *elements):
+        """
+            Construct a cache key for the current role set
+
+            @param prefix: the key prefix
+            @param elements: additional key elements
+
+            @return: the cache key, or None if the current permissions
+                     can not be cached (e.g. during auth.override)
+        """
+
+        auth = current.auth
+        if auth.override:
+            return None
+
+        if auth.s3_logged_in():
+            user = auth.user
+            roles = [user.realms, user.delegations]
+        else:
+            roles = "ANONYMOUS"
+
+        settings = current.deployment_settings
+        items = [settings.get_template(),
+                 settings.get_security_policy(),
+                 roles,
+                 cls.acl_version(),
+                 ]
+        items.extend(elements)
+
+        data = json.dumps(items, default=s3_unicode, sort_keys=True)
+        return "%s_%s" % (prefix, hashlib.md5(data.encode("utf-8")).hexdigest())
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def acl_version(cls):
+        """
+            Get the current ACL version (=latest modification date
+            and number of ACLs), looked up once per request
+
+            @return: the ACL version (string)
+        """
+
+        store = cls.store()
+        if store is not None and "acl_version" in store:
+            return store["acl_version"]
+
+        table = current.auth.permission.table
+        if table:
+            latest = table.modified_on.max()
+            number = table.id.count()
+            row = current.db(table.id > 0).select(latest, number).first()
+            version = "%s/%s" % (row[latest], row[number])
+        else:
+            # Security policy without ACLs
+            version = ""
+
+        if store is not None:
+            store["acl_version"] = version
+        return version
+
 # =============================================================================
 def s3_rheader_resource(r):
     """
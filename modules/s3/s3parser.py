@@ -43,42 +43,128 @@ class S3Parsing(object):
     """
 
     # -------------------------------------------------------------------------
-    @staticmethod
-    def parser(function_name, message_id, **kwargs):
+    @classmethod
+    def parser(cls, function_name, message_id, **kwargs):
         """
            1st Stage Parser
            - called by msg.parse()
 
            Sets the appropriate Authorisation level and then calls the
            parser function from the template
-        """
 
-        reply = None
-        s3db = current.s3db
+           @return: the message_id of the reply (if any)
+        """
 
         # Retrieve Message
-        table = s3db.msg_message
+        table = current.s3db.msg_message
         message = current.db(table.message_id == message_id).select(limitby=(0, 1)
                                                                     ).first()
 
-        from_address = message.from_address
-        if "<" in from_address:
-            from_address = from_address.split("<")[1].split(">")[0]
-        email = S3Parsing.is_session_alive(from_address)
-        if email:
-            current.auth.s3_impersonate(email)
-        else:
-            (email, password) = S3Parsing.parse_login(message)
-            if email and password:
-                current.auth.login_bare(email, password)
-                expiration = current.session.auth["expiration"]
-                table = s3db.msg_session
-                table.insert(email = email,
-                             expiration_time = expiration,
-                             from_address = from_address)
-                reply = "Login succesful"
-                # The message may have multiple purposes
-                #return reply
+        # Load the Parser template for this deployment
+        fn = cls.parser_function(function_name)
+        if not fn:
+            return None
+
+        reply = cls.parse_message(fn, message, **kwargs)
+        if not reply:
+            return None
+
+        # Send Reply
+        return current.msg.send(reply[0], reply[1])
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def parse_batch(cls,
+                    channel_id,
+                    function_name,
+                    batch_size = 200,
+                    worker = 0,
+                    workers = 1,
+                    **kwargs):
+        """
+            Parse a batch of unparsed messages from a Channel
+            - prefetches the messages and login sessions of the batch,
+              uses one parser instance for all messages, and queues all
+              replies in the OutBox at once
+
+            @param channel_id: the Channel
+            @param function_name: the name of the parser function
+            @param batch_size: the maximum number of messages to parse
+            @param worker: the index of this worker (0..workers-1)
+            @param workers: the total number of workers, each worker
+                            parsing only messages with
+                            msg_parsing_status.id % workers == worker
+
+            @return: the number of messages parsed
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        stable = s3db.msg_parsing_status
+        query = (stable.channel_id == channel_id) & \
+                (stable.is_parsed == False)
+        if workers > 1:
+            query &= ((stable.id % workers) == worker)
+        statuses = db(query).select(stable.id,
+                                    stable.message_id,
+                                    orderby = stable.id,
+                                    limitby = (0, batch_size),
+                                    )
+        if not statuses:
+            return 0
+
+        # Prefetch the messages
+        table = s3db.msg_message
+        rows = db(table.message_id.belongs(set(row.message_id for row in statuses))).select()
+        messages = dict((row.message_id, row) for row in rows)
+
+        # Prefetch the login sessions of the senders
+        addresses = set(cls.sender(row.from_address) for row in rows)
+        sessions = cls.sessions(addresses)
+
+        fn = cls.parser_function(function_name)
+
+        parsed = []
+        replies = []
+        for status in statuses:
+            message = messages.get(status.message_id)
+            reply = None
+            if fn and message:
+                reply = cls.parse_message(fn,
+                                          message,
+                                          sessions = sessions,
+                                          **kwargs)
+            if reply:
+                replies.append((status.id, reply))
+            else:
+                parsed.append(status.id)
+
+        # Queue all replies
+        if replies:
+            reply_ids = current.msg.send_bulk([(address, text, None)
+                                               for _, (address, text) in replies])
+            for (status_id, _), reply_id in zip(replies, reply_ids):
+                db(stable.id == status_id).update(is_parsed = True,
+                                                  reply_id = reply_id,
+                                                  )
+
+        # Mark all other messages as parsed
+        if parsed:
+            db(stable.id.belongs(parsed)).update(is_parsed = True)
+
+        return len(statuses)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def parser_function(function_name):
+        """
+            Get a parser function from the template's parser
+
+            @param function_name: the name of the function
+
+            @return: the function, or None if not found
+        """
 
         # Load the Parser template for this deployment
         template = current.deployment_settings.get_msg_parser()
@@ -88,19 +174,69 @@ class S3Parsing(object):
         mymodule = sys.modules[module_name]
         S3Parser = mymodule.S3Parser()
 
-        # Pass the message to the parser
         try:
-            fn = getattr(S3Parser, function_name)
-        except:
+            return getattr(S3Parser, function_name)
+        except AttributeError:
             current.log.error("Parser not found: %s" % function_name)
             return None
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def parse_message(cls, fn, message, sessions=None, **kwargs):
+        """
+            Authenticate the sender of a message and pass the message
+            to the parser function
+
+            @param fn: the parser function
+            @param message: the msg_message Row
+            @param sessions: prefetched login sessions (see sessions())
+
+            @return: tuple (from_address, reply), or None if no reply
+        """
+
+        reply = None
+
+        from_address = cls.sender(message.from_address)
+        email = cls.is_session_alive(from_address, sessions=sessions)
+        if email:
+            current.auth.s3_impersonate(email)
+        else:
+            (email, password) = cls.parse_login(message)
+            if email and password:
+                current.auth.login_bare(email, password)
+                expiration = current.session.auth["expiration"]
+                table = current.s3db.msg_session
+                session_id = table.insert(email = email,
+                                          expiration_time = expiration,
+                                          from_address = from_address)
+                if sessions is not None:
+                    # Make the new session available for the rest of the batch
+                    session = table[session_id]
+                    sessions.setdefault(from_address, []).append(session)
+                reply = "Login succesful"
+                # The message may have multiple purposes
+                #return reply
+
+        # Pass the message to the parser
         reply = fn(message, **kwargs) or reply
         if not reply:
             return None
 
-        # Send Reply
-        current.msg.send(from_address, reply)
+        return from_address, reply
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def sender(from_address):
+        """
+            Extract the address from a sender, e.g.
+            "John Doe <john@example.com>" => "john@example.com"
+
+            @param from_address: the from_address of the message
+        """
+
+        if from_address and "<" in from_address:
+            from_address = from_address.split("<")[1].split(">")[0]
+        return from_address
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -133,21 +269,60 @@ class S3Parsing(object):
 
     # ---------------------------------------------------------------------
     @staticmethod
-    def is_session_alive(from_address):
+    def sessions(addresses):
+        """
+            Look up the unexpired login sessions for multiple senders
+            at once (for batch parsing)
+
+            @param addresses: the sender addresses
+
+            @return: dict {from_address: [session Rows]}
+        """
+
+        sessions = {}
+
+        addresses = [address for address in addresses if address]
+        if addresses:
+            stable = current.s3db.msg_session
+            query = (stable.is_expired == False) & \
+                    (stable.from_address.belongs(addresses))
+            rows = current.db(query).select(stable.id,
+                                            stable.from_address,
+                                            stable.created_datetime,
+                                            stable.expiration_time,
+                                            stable.email,
+                                            stable.is_expired,
+                                            )
+            for row in rows:
+                sessions.setdefault(row.from_address, []).append(row)
+
+        return sessions
+
+    # ---------------------------------------------------------------------
+    @staticmethod
+    def is_session_alive(from_address, sessions=None):
         """
             Check whether there is an alive session from the same sender
+
+            @param from_address: the sender address
+            @param sessions: prefetched sessions (see sessions()),
+                             to avoid a lookup per message
         """
 
         email = None
         now = current.request.utcnow
-        stable = current.s3db.msg_session
-        query = (stable.is_expired == False) & \
-                (stable.from_address == from_address)
-        records = current.db(query).select(stable.id,
-                                           stable.created_datetime,
-                                           stable.expiration_time,
-                                           stable.email,
-                                           )
+        if sessions is not None:
+            records = [record for record in sessions.get(from_address, ())
+                       if not record.is_expired]
+        else:
+            stable = current.s3db.msg_session
+            query = (stable.is_expired == False) & \
+                    (stable.from_address == from_address)
+            records = current.db(query).select(stable.id,
+                                               stable.created_datetime,
+                                               stable.expiration_time,
+                                               stable.email,
+                                               )
         for record in records:
             time = record.created_datetime
             time = time - now
@@ -81,6 +81,11 @@ except(ImportError):
     except(ImportError):
         sys.stderr.write("S3 Debug: S3PDF: Python Image Library not installed\n")
         PILImported = False
+try:
+    import numpy
+    numpyImported = True
+except ImportError:
+    numpyImported = False
 try:
     from reportlab.pdfgen import canvas
     from reportlab.lib.fonts import tt2ps
@@ -3838,6 +3843,8 @@ class S3OCRImageParser(object):
         self.r = r
         self.request = current.request
         checkDependencies(r)
+        if not numpyImported:
+            r.error(501, current.T("NumPy not installed"))
 
     # -------------------------------------------------------------------------
     def parse(self, form_uuid, set_uuid, **kwargs):
@@ -4381,95 +4388,111 @@ class S3OCRImageParser(object):
         """
 
         image = ImageOps.grayscale(image)
-        image.convert("L")
 
-        width, height = image.size
-
-        for x in xrange(width):
-            for y in xrange(height):
-                if image.getpixel((x,y)) < 180 :
-                    image.putpixel((x,y), 0)
-                else:
-                    image.putpixel((x,y), 255)
-        return image
+        # Lookup table: black below threshold, white otherwise
+        table = [0] * threshold + [255] * (256 - threshold)
+        return image.point(table)
 
     # -------------------------------------------------------------------------
     def __findRegions(self, im):
         """
-            Return the list of regions which are found by the following algorithm.
-
-            -----------------------------------------------------------
-            Raster Scanning Algorithm for Connected Component Analysis:
-            -----------------------------------------------------------
+            Return the list of regions (4-connected components of black
+            pixels) in the image, using a scanline algorithm on a NumPy
+            view of the image:
 
-            On the first pass:
-            =================
-            1. Iterate through each element of the data by column, then by row (Raster Scanning)
-            2. If the element is not the background
-                1. Get the neighboring elements of the current element
-                2. If there are no neighbors, uniquely label the current element and continue
-                3. Otherwise, find the neighbor with the smallest label and assign it to the current element
-                4. Store the equivalence between neighboring labels
-
-            On the second pass:
-            ===================
-            1. Iterate through each element of the data by column, then by row
-            2. If the element is not the background
-               1. Relabel the element with the lowest equivalent label
-            ( source: http://en.wikipedia.org/wiki/Connected_Component_Labeling )
+            1. Find all horizontal runs of black pixels (array operations)
+            2. Merge runs in adjacent rows which overlap in at least one
+               column (union-find over runs)
+            3. Compute area and bounding box per region (array operations)
         """
 
-        width, height  = im.size
-        ImageOps.grayscale(im)
         im = im.convert("L")
-
-        regions = {}
-        pixel_region = [[0 for y in xrange(height)] for x in xrange(width)]
-        equivalences = {}
-        n_regions = 0
-
-        # First pass: find regions.
-        for x in xrange(width):
-            for y in xrange(height):
-                # Look for a black pixel
-                if im.getpixel((x, y)) == 0 : # BLACK
-                    # get the region number from north or west or create new region
-                    region_n = pixel_region[x-1][y] if x > 0 else 0
-                    region_w = pixel_region[x][y-1] if y > 0 else 0
-                    #region_nw = pixel_region[x-1][y-1] if x > 0 and y > 0 else 0
-                    #region_ne = pixel_region[x-1][y+1] if x > 0 else 0
-
-                    max_region = max(region_n, region_w)
-
-                    if max_region > 0:
-                        #a neighbour already has a region, new region is the smallest > 0
-                        new_region = min([i for i in (region_n, region_w) if i > 0])
-                        #update equivalences
-                        if max_region > new_region:
-                            if max_region in equivalences:
-                                equivalences[max_region].add(new_region)
-                            else:
-                                equivalences[max_region] = {new_region}
-                    else:
-                        n_regions += 1
-                        new_region = n_regions
-
-                    pixel_region[x][y] = new_region
-
-        # Scan image again, assigning all equivalent regions the same region value.
-        for x in xrange(width):
-            for y in xrange(height):
-                r = pixel_region[x][y]
-                if r > 0:
-                    while r in equivalences:
-                        r = min(equivalences[r])
-
-                    if r in regions:
-                        regions[r].add(x, y)
-                    else:
-                        regions[r] = self.__Region(x, y)
-
-        return list(regions.values())
+        width, height = im.size
+
+        pixels = numpy.asarray(im)
+        if pixels.shape != (height, width):
+            # Old PIL versions don't support the array interface
+            pixels = numpy.frombuffer(im.tobytes(), dtype=numpy.uint8)
+            pixels = pixels.reshape((height, width))
+
+        # Find the runs of black pixels in each row, start (inclusive)
+        # and end (exclusive) columns
+        black = numpy.zeros((height, width + 2), dtype=numpy.int8)
+        black[:, 1:-1] = (pixels == 0)
+        edges = numpy.diff(black, axis=1)
+        rows, starts = numpy.nonzero(edges == 1)
+        ends = numpy.nonzero(edges == -1)[1]
+
+        number_of_runs = len(rows)
+        if not number_of_runs:
+            return []
+
+        # Index of the first run in each row
+        first = numpy.searchsorted(rows, numpy.arange(height + 1)).tolist()
+
+        # Union-find over runs
+        parent = list(range(number_of_runs))
+
+        def find(i):
+            root = i
+            while parent[root] != root:
+                root = parent[root]
+            while parent[i] != root:
+                parent[i], i = root, parent[i]
+            return root
+
+        starts_ = starts.tolist()
+        ends_ = ends.tolist()
+        for y in xrange(1, height):
+
+            # Runs in the previous row
+            i, i_end = first[y - 1], first[y]
+            # Runs in this row
+            j, j_end = first[y], first[y + 1]
+
+            # Merge overlapping runs
+            while i < i_end and j < j_end:
+                if starts_[i] < ends_[j] and starts_[j] < ends_[i]:
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        if root_i < root_j:
+                            parent[root_j] = root_i
+                        else:
+                            parent[root_i] = root_j
+                # Advance whichever run ends first
+                if ends_[i] < ends_[j]:
+                    i += 1
+                else:
+                    j += 1
+
+        # Region of each run
+        roots = numpy.array([find(i) for i in xrange(number_of_runs)])
+        labels, index = numpy.unique(roots, return_inverse=True)
+        number_of_regions = len(labels)
+
+        # Area and bounding box of each region
+        area = numpy.bincount(index,
+                              weights = ends - starts,
+                              minlength = number_of_regions,
+                              ).astype(int)
+
+        min_x = numpy.full(number_of_regions, width, dtype=int)
+        numpy.minimum.at(min_x, index, starts)
+        max_x = numpy.full(number_of_regions, -1, dtype=int)
+        numpy.maximum.at(max_x, index, ends - 1)
+
+        min_y = numpy.full(number_of_regions, height, dtype=int)
+        numpy.minimum.at(min_y, index, rows)
+        max_y = numpy.full(number_of_regions, -1, dtype=int)
+        numpy.maximum.at(max_y, index, rows)
+
+        Region = self.__Region
+        return [Region(*bounds) for bounds in zip(min_x.tolist(),
+                                                  min_y.tolist(),
+                                                  max_x.tolist(),
+                                                  max_y.tolist(),
+                                                  area.tolist(),
+                                                  )]
 
     # -------------------------------------------------------------------------
     def __getOrientation(self, markers):
@@ -4540,26 +4563,24 @@ class S3OCRImageParser(object):
     # =========================================================================
     class __Region():
         """
+            A connected region of black pixels in the image
         """
 
-        def __init__(self, x, y):
-            """ Initialize the region """
-            self._pixels = [(x, y)]
-            self._min_x = x
-            self._max_x = x
-            self._min_y = y
-            self._max_y = y
-            self.area = 1
+        def __init__(self, min_x, min_y, max_x, max_y, area):
+            """
+                Initialize the region
 
-        # ---------------------------------------------------------------------
-        def add(self, x, y):
-            """ Add a pixel to the region """
-            self._pixels.append((x, y))
-            self.area += 1
-            self._min_x = min(self._min_x, x)
-            self._max_x = max(self._max_x, x)
-            self._min_y = min(self._min_y, y)
-            self._max_y = max(self._max_y, y)
+                @param min_x: the left edge of the bounding box
+                @param min_y: the top edge of the bounding box
+                @param max_x: the right edge of the bounding box
+                @param max_y: the bottom edge of the bounding box
+                @param area: the number of pixels in the region
+            """
+            self._min_x = min_x
+            self._max_x = max_x
+            self._min_y = min_y
+            self._max_y = max_y
+            self.area = area
 
         # ---------------------------------------------------------------------
         def centroid(self):
@@ -58,6 +58,7 @@ from s3dal import Expression, Field, Row, Rows, Table, S3DAL, VirtualCommand
 from .s3data import S3DataTable, S3DataList
 from .s3datetime import s3_format_datetime
 from .s3fields import S3Represent, s3_all_meta_field_names
+from .s3index import S3IndexAdvisor
 from .s3query import FS, S3ResourceField, S3ResourceQuery, S3Joins, S3URLQuery
 from .s3utils import s3_get_foreign_key, s3_get_last_record_id, s3_has_foreign_key, s3_remove_last_record_id, s3_str, s3_unicode
 from .s3validators import IS_ONE_OF
@@ -1485,6 +1486,7 @@ class S3Resource(object):
                    location_data=None,
                    map_data=None,
                    target=None,
+                   orderby=None,
                    **args):
         """
             Export this resource as S3XML
@@ -1521,6 +1523,8 @@ class S3Resource(object):
                                   looked-up in bulk ready for xml.gis_encode()
             @param map_data: dictionary of options which can be read by the map
             @param target: alias of component targetted (or None to target master resource)
+            @param orderby: order of the master records (default: by
+                            modified_on if msince is requested)
             @param args: dict of arguments to pass to the XSLT stylesheet
         """
 
@@ -1551,6 +1555,7 @@ class S3Resource(object):
                                 location_data = location_data,
                                 map_data = map_data,
                                 target = target,
+                                orderby = orderby,
                                 )
 
         # XSLT transformation
@@ -1595,6 +1600,7 @@ class S3Resource(object):
                     location_data=None,
                     map_data=None,
                     target=None,
+                    orderby=None,
                     ):
         """
             Export the resource as element tree
@@ -1624,6 +1630,8 @@ class S3Resource(object):
                                   looked-up in bulk ready for xml.gis_encode()
             @param target: alias of component targetted (or None to target master resource)
             @param map_data: dictionary of options which can be read by the map
+            @param orderby: order of the master records (default: by
+                            modified_on if msince is requested)
         """
 
         xml = current.xml
@@ -1658,10 +1666,9 @@ class S3Resource(object):
             [add_filter(q) for a in queries for q in queries[a]]
 
         # Order by modified_on if msince is requested
-        if msince is not None and "modified_on" in table.fields:
+        if orderby is None and \
+           msince is not None and "modified_on" in table.fields:
             orderby = "%s ASC" % table["modified_on"]
-        else:
-            orderby = None
 
         # Construct the record base URL
         prefix = self.prefix
@@ -5447,6 +5454,13 @@ class S3ResourceData(object):
                                        aqueries = aqueries,
                                        )
 
+        # Record column usage for index recommendations
+        if current.deployment_settings.get_database_index_advisor():
+            S3IndexAdvisor.observe(query,
+                                   joins = filter_ijoins + filter_ljoins,
+                                   orderby = orderby,
+                                   )
+
         # Virtual fields filter
         vfilter = resource.get_filter()
 
@@ -42,6 +42,7 @@ from gluon.storage import Storage
 
 from s3compat import CLASS_TYPES, StringIO, basestring, urlopen
 from .s3datetime import s3_parse_datetime
+from .s3export import S3ExportJob
 from .s3resource import S3Resource
 from .s3utils import s3_get_extension, s3_keep_messages, s3_remove_last_record_id, s3_store_last_record_id, s3_str
 
@@ -666,6 +667,10 @@ class S3Request(object):
             if self.method and self.custom_action:
                 handler = self.custom_action
             elif http == "GET":
+                if S3ExportJob.applicable(self):
+                    # Large export => run as background job
+                    # (redirects to the job status page if successful)
+                    S3ExportJob.submit(self, **attr)
                 handler = self.__GET()
             elif http == "PUT":
                 handler = self.__PUT()
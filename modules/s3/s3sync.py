@@ -255,6 +255,8 @@ class S3Sync(S3Method):
         msince = vars_get("msince", None)
         if msince is not None:
             msince = s3_parse_datetime(msince)
+        # Paged pull: cursor after the previous page (empty for first page)
+        cursor = vars_get("mcursor", None)
 
         # Sync filters from peer
         filters = {}
@@ -288,6 +290,7 @@ class S3Sync(S3Method):
                                     msince = msince,
                                     filters = filters,
                                     mixed = mixed,
+                                    cursor = cursor,
                                     )
         except NotImplementedError:
             r.error(405, "Synchronization method not supported for repository")
@@ -1114,6 +1117,7 @@ class S3SyncBaseAdapter(object):
              filters=None,
              mixed=False,
              pretty_print=False,
+             cursor=None,
              ):
         """
             Respond to an incoming pull from the peer repository
@@ -1125,6 +1129,8 @@ class S3SyncBaseAdapter(object):
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
             @param pretty_print: make the output human-readable
+            @param cursor: the paging cursor for a paged pull (empty string
+                           for the first page, None for an unpaged pull)
 
             @return: a dict {status, remote, message, response}, with:
                         - status....the outcome of the operation
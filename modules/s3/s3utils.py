@@ -335,6 +335,17 @@ def s3_dev_toolbar():
             return None
         return key
 
+    # SQL profile of this request (if enabled)
+    profile = getattr(current, "sql_profile", None)
+    if profile is not None:
+        sql_profile = [BUTTON("sql profile",
+                              _onclick="$('#sql-profile-%s').slideToggle().removeClass('hide')" % u),
+                       DIV(profile.html(), backtotop,
+                           _class="hide", _id="sql-profile-%s" % u),
+                       ]
+    else:
+        sql_profile = []
+
     return DIV(
         #BUTTON("design", _onclick="document.location='%s'" % admin),
         BUTTON("request",
@@ -357,6 +368,7 @@ def s3_dev_toolbar():
             _class="hide", _id="db-tables-%s" % u),
         DIV(BEAUTIFY(dbstats), backtotop,
             _class="hide", _id="db-stats-%s" % u),
+        *sql_profile,
         _id="totop-%s" % u
     )
 
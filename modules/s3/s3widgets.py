@@ -5200,7 +5200,18 @@ class S3LocationSelector(S3Selector):
         else:
             translate = settings.get_L10n_translate_gis_location()
 
-        if query is None:
+        locations = None
+        if query is not None and settings.get_gis_location_bundles():
+            # Read from the prebuilt location hierarchy bundles
+            from .s3gis import S3LocationBundle
+            locations = S3LocationBundle.selector_locations(levels,
+                                                            values,
+                                                            language if translate else None,
+                                                            )
+        if locations is not None:
+            # Names are already translated
+            translate = False
+        elif query is None:
             locations = []
             if levels != []:
                 # Misconfigured (e.g. no default for a hidden Lx level)
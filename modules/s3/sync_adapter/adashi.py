@@ -178,7 +178,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
-             pretty_print=False):
+             pretty_print=False,
+             cursor=None):
         """
             Respond to an incoming pull from a peer repository
 
@@ -189,6 +190,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
             @param pretty_print: make the output human-readable
+            @param cursor: the paging cursor (not supported, ignored)
         """
 
         if not resource or mixed:
@@ -31,6 +31,7 @@ import datetime
 import json
 import sys
 import traceback
+import zlib
 
 try:
     from lxml import etree
@@ -40,8 +41,9 @@ except ImportError:
 
 from gluon import current
 
-from s3compat import HTTPError, URLError, urllib2, urllib_quote
+from s3compat import BytesIO, HTTPError, URLError, urllib2, urllib_quote
 from ..s3datetime import s3_encode_iso_datetime
+from ..s3query import S3URLQuery
 from ..s3sync import S3SyncBaseAdapter, S3SyncDataArchive
 from ..s3validators import JSONERRORS
 
@@ -51,6 +53,9 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         Sahana Eden Synchronization Adapter (default sync adapter)
     """
 
+    # Response header for the cursor of the next page in paged pulls
+    CURSOR_HEADER = "X-Sync-Cursor"
+
     # -------------------------------------------------------------------------
     def register(self):
         """
@@ -161,25 +166,33 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             Fetch updates from the peer repository and import them
             into the local database (active pull)
 
+            Peers which support paging send the updates in pages; each
+            page is imported and committed, and its cursor stored in
+            the task (pull_cursor), before the next page is requested -
+            so that an interrupted pull resumes after the last page
+            that has been imported successfully. Once all pages have
+            been imported, the task's last_pull is set to the snapshot
+            date/time in the cursor, i.e. to when the peer sent the
+            first page.
+
             @param task: the synchronization task (sync_task Row)
             @param onconflict: callback for automatic conflict resolution
 
             @return: tuple (error, mtime), with error=None if successful,
                      else error=message, and mtime=modification timestamp
-                     of the youngest record sent
+                     of the youngest record sent (None if last_pull has
+                     been set from the snapshot)
         """
 
-        xml = current.xml
         debug = current.log.debug
 
         repository = self.repository
-        config = repository.config
         log = repository.log
 
         # Verify that the target resource exists
         resource_name = task.resource_name
         try:
-            resource = current.s3db.resource(resource_name)
+            current.s3db.resource(resource_name)
         except AttributeError:
             # Target resource is not defined
             debug("Undefined resource %s - sync task ignored" % resource_name)
@@ -193,6 +206,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         output = None
         response = None
         result = log.SUCCESS
+        message = ""
 
         use_archived = False
 
@@ -210,177 +224,105 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 else:
                     use_archived = True
 
-        if response is None:
-
+        if use_archived:
+            url = cursor = None
+        else:
             debug("S3Sync: pull %s from %s" % (resource_name, repository.url))
+            url = self._pull_url(task)
+            cursor = task.pull_cursor or ""
+            if cursor:
+                debug("...resume after %s" % cursor)
 
-            # Construct the URL
-            url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
-                  (repository.url, resource_name, config.uuid)
-            if last_pull and task.update_policy not in ("THIS", "OTHER"):
-                url += "&msince=%s" % s3_encode_iso_datetime(last_pull)
-            if task.components is False: # Allow None to remain the old default of 'Include Components'
-                url += "&mcomponents=None"
-            url += "&include_deleted=True"
-
-            # Add sync filters to URL
-            filters = current.sync.get_filters(task.id)
-            for tablename in filters:
-                prefix = "~" if not tablename or tablename == resource_name \
-                                else tablename
-                for k, v in filters[tablename].items():
-                    vlist = v if type(v) is list else [v]
-                    for value in vlist:
-                        urlfilter = "[%s]%s=%s" % (prefix, k, urllib_quote(value))
-                        url += "&%s" % urlfilter
-
-            debug("...pull from URL %s" % url)
-
-            # Execute the request
-            remote = False
-            action = "fetch"
-            response = None
-            output = None
-
-            opener = self._http_opener(url)
-            try:
-                f = opener.open(url)
-
-            except HTTPError as e:
-                result = log.ERROR
-                remote = True # Peer error
-                code = e.code
-                message = e.read()
-                try:
-                    # Sahana-Eden would send a JSON message,
-                    # try to extract the actual error message:
-                    message_json = json.loads(message)
-                except JSONERRORS:
-                    pass
-                else:
-                    message = message_json.get("message", message)
-                # Prefix as peer error and strip XML markup from the message
-                # @todo: better method to do this?
-                message = "<message>%s</message>" % message
-                try:
-                    markup = etree.XML(message)
-                    message = markup.xpath(".//text()")
-                    if message:
-                        message = " ".join(message)
-                    else:
-                        message = ""
-                except etree.XMLSyntaxError:
-                    pass
-                output = xml.json_message(False, code, message, tree=None)
+        mtime = None
+        snapshot = None
+        count = 0
+        pages = 0
+        warnings = []
+        while True:
+
+            if url:
+                if cursor:
+                    try:
+                        snapshot = self._parse_cursor(cursor)[0]
+                    except ValueError:
+                        # Peer with a different cursor format
+                        snapshot = None
+
+                # Fetch the next page
+                page_url = "%s&mcursor=%s" % (url, urllib_quote(cursor))
+                debug("...pull from URL %s" % page_url)
+
+                action = "fetch"
+                response, next_cursor, error = self._fetch(page_url)
+                if error:
+                    result, remote, message, output = error
+                    break
+            else:
+                next_cursor = None
 
-            except URLError as e:
-                # URL Error (network error)
+            if not response:
+                # No data received from peer
                 result = log.ERROR
                 remote = True
-                message = "Peer repository unavailable (%s)" % e.reason
-                output = xml.json_message(False, 400, message)
-
-            except:
-                result = log.FATAL
-                message = sys.exc_info()[1]
-                output = xml.json_message(False, 400, message)
-
-            else:
-                result = log.SUCCESS
-                response = f
-
-        # Process the response
-        mtime = None
-        if response:
-
-            # Get import strategy and update policy
-            strategy = task.strategy
-            update_policy = task.update_policy
-            conflict_policy = task.conflict_policy
-
-            success = True
-            message = ""
-            action = "import"
+                message = "No data received from peer"
+                mtime = None
+                break
 
             # Import the data
-            if onconflict:
-                onconflict_callback = lambda item: onconflict(item,
-                                                              repository,
-                                                              resource,
-                                                              )
-            else:
-                onconflict_callback = None
-            count = 0
-            try:
-                success = resource.import_xml(response,
-                                              ignore_errors = True,
-                                              strategy = strategy,
-                                              update_policy = update_policy,
-                                              conflict_policy = conflict_policy,
-                                              last_sync = last_pull,
-                                              onconflict = onconflict_callback,
-                                              )
-                count = resource.import_count
-
-            except IOError as e:
-                result = log.FATAL
-                message = "%s" % e
-                output = xml.json_message(False, 400, message)
-
-            except:
-                # If we end up here, an uncaught error during import
-                # has occured which indicates a code defect! We log it
-                # and continue here, however - in order to maintain a
-                # valid sync status, so that developers can restart
-                # the process more easily after fixing the defect.
-                result = log.FATAL
-                message = "Uncaught Exception During Import: %s" % \
-                          traceback.format_exc()
-                output = xml.json_message(False, 500, sys.exc_info()[1])
-
-            mtime = resource.mtime
-
-            # Log all validation errors
-            if resource.error_tree is not None:
+            action = "import"
+            result, message, output, page_count, page_mtime = \
+                self._import(task, response, onconflict)
+            if output is not None:
+                # Import failed => resume with this page next time
+                mtime = None
+                break
+            if message:
+                # Validation errors
+                warnings.append(message)
+
+            pages += 1
+            count += page_count
+            if page_mtime and (not mtime or page_mtime > mtime):
+                mtime = page_mtime
+
+            if url:
+                # Commit this page, store the cursor for resumption
+                if next_cursor and next_cursor == cursor:
+                    # Peer does not advance => restart next time
+                    task.update_record(pull_cursor = None)
+                    current.db.commit()
+                    result = log.ERROR
+                    remote = True
+                    message = "Peer repository sent the same page twice"
+                    output = current.xml.json_message(False, 400, message)
+                    mtime = None
+                    break
+                cursor = next_cursor
+                task.update_record(pull_cursor = cursor)
+                current.db.commit()
+
+            if not cursor:
+                break
+
+        if output is None and result in (log.SUCCESS, log.WARNING):
+            if warnings:
                 result = log.WARNING
-                message = "%s" % resource.error
-                for element in resource.error_tree.findall("resource"):
-                    for field in element.findall("data[@error]"):
-                        error_msg = field.get("error", None)
-                        if error_msg:
-                            msg = "(UID: %s) %s.%s=%s: %s" % \
-                                   (element.get("uuid", None),
-                                    element.get("name", None),
-                                    field.get("field", None),
-                                    field.get("value", field.text),
-                                    field.get("error", None))
-                            message = "%s, %s" % (message, msg)
-
-            # Check for failure
-            if not success:
-                result = log.FATAL
-                if not message:
-                    message = "%s" % resource.error
-                output = xml.json_message(False, 400, message)
+                message = ", ".join(warnings)
+            elif not count:
+                message = "No data to import (already up-to-date)"
+            else:
+                # Report success
+                message = "Data imported successfully (%s records%s)" % \
+                          (count,
+                           ", from archive" if use_archived else
+                           ", %s pages" % pages if pages > 1 else "",
+                           )
+            if snapshot:
+                # Records modified since the first page (or their
+                # components) are pulled again next time
+                task.update_record(last_pull = snapshot)
                 mtime = None
 
-            # ...or report success
-            elif not message:
-                if not count:
-                    message = "No data to import (already up-to-date)"
-                else:
-                    message = "Data imported successfully (%s records%%s)" % count
-                    if use_archived:
-                        message = message % ", from archive"
-                    else:
-                        message = message % ""
-
-        elif result == log.SUCCESS:
-            # No data received from peer
-            result = log.ERROR
-            remote = True
-            message = "No data received from peer"
-
         # Log the operation
         log.write(repository_id = repository.id,
                   resource_name = task.resource_name,
@@ -395,6 +337,221 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         debug("S3Sync: pull %s: %s" % (result, message))
         return (output, mtime)
 
+    # -------------------------------------------------------------------------
+    def _pull_url(self, task):
+        """
+            Construct the URL to pull data for a task from the peer
+            repository (without the paging cursor)
+
+            @param task: the synchronization task (sync_task Row)
+
+            @return: the URL
+        """
+
+        repository = self.repository
+        resource_name = task.resource_name
+        last_pull = task.last_pull
+
+        url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
+              (repository.url, resource_name, repository.config.uuid)
+        if last_pull and task.update_policy not in ("THIS", "OTHER"):
+            url += "&msince=%s" % s3_encode_iso_datetime(last_pull)
+        if task.components is False: # Allow None to remain the old default of 'Include Components'
+            url += "&mcomponents=None"
+        url += "&include_deleted=True"
+
+        # Add sync filters to URL
+        filters = current.sync.get_filters(task.id)
+        for tablename in filters:
+            prefix = "~" if not tablename or tablename == resource_name \
+                            else tablename
+            for k, v in filters[tablename].items():
+                vlist = v if type(v) is list else [v]
+                for value in vlist:
+                    urlfilter = "[%s]%s=%s" % (prefix, k, urllib_quote(value))
+                    url += "&%s" % urlfilter
+
+        return url
+
+    # -------------------------------------------------------------------------
+    def _fetch(self, url):
+        """
+            Fetch a page of data from the peer repository
+
+            @param url: the URL
+
+            @return: tuple (response, cursor, error), with
+                        - response...the data (file-like object)
+                        - cursor.....the cursor for the next page, None if
+                                     this is the last (or the only) page
+                        - error......tuple (result, remote, message, output)
+                                     if the request failed, otherwise None
+        """
+
+        xml = current.xml
+        log = self.repository.log
+
+        # Execute the request
+        opener = self._http_opener(url,
+                                   headers = [("Accept-Encoding", "gzip"),
+                                              ],
+                                   )
+        try:
+            f = opener.open(url)
+
+        except HTTPError as e:
+            code = e.code
+            message = e.read()
+            try:
+                # Sahana-Eden would send a JSON message,
+                # try to extract the actual error message:
+                message_json = json.loads(message)
+            except JSONERRORS:
+                pass
+            else:
+                message = message_json.get("message", message)
+            # Prefix as peer error and strip XML markup from the message
+            # @todo: better method to do this?
+            message = "<message>%s</message>" % message
+            try:
+                markup = etree.XML(message)
+                message = markup.xpath(".//text()")
+                if message:
+                    message = " ".join(message)
+                else:
+                    message = ""
+            except etree.XMLSyntaxError:
+                pass
+            output = xml.json_message(False, code, message, tree=None)
+            # Peer error
+            return None, None, (log.ERROR, True, message, output)
+
+        except URLError as e:
+            # URL Error (network error)
+            message = "Peer repository unavailable (%s)" % e.reason
+            output = xml.json_message(False, 400, message)
+            return None, None, (log.ERROR, True, message, output)
+
+        except:
+            message = sys.exc_info()[1]
+            output = xml.json_message(False, 400, message)
+            return None, None, (log.FATAL, False, message, output)
+
+        info = f.info()
+        cursor = info.get(self.CURSOR_HEADER) or None
+
+        if info.get("Content-Encoding") == "gzip":
+            # Read the complete page, so that a broken transfer fails
+            # here rather than half-way through the import
+            try:
+                data = zlib.decompress(f.read(), 16 + zlib.MAX_WBITS)
+            except Exception:
+                message = "Incomplete data received from peer (%s)" % \
+                          sys.exc_info()[1]
+                output = xml.json_message(False, 400, message)
+                return None, None, (log.ERROR, True, message, output)
+            response = BytesIO(data) if data else None
+        else:
+            response = f
+
+        return response, cursor, None
+
+    # -------------------------------------------------------------------------
+    def _import(self, task, source, onconflict=None):
+        """
+            Import data pulled from the peer repository
+
+            @param task: the synchronization task (sync_task Row)
+            @param source: the data (file-like object)
+            @param onconflict: callback for automatic conflict resolution
+
+            @return: tuple (result, message, output, count, mtime), with
+                        - result....the log result
+                        - message...the log message (empty if successful
+                                    without warnings)
+                        - output....the error message if the import
+                                    failed, otherwise None
+                        - count.....the number of records imported
+                        - mtime.....the modification timestamp of the
+                                    youngest record imported
+        """
+
+        xml = current.xml
+
+        repository = self.repository
+        log = repository.log
+
+        resource = current.s3db.resource(task.resource_name)
+
+        result = log.SUCCESS
+        message = ""
+        output = None
+
+        # Import the data
+        if onconflict:
+            onconflict_callback = lambda item: onconflict(item,
+                                                          repository,
+                                                          resource,
+                                                          )
+        else:
+            onconflict_callback = None
+        success = True
+        count = 0
+        try:
+            success = resource.import_xml(source,
+                                          ignore_errors = True,
+                                          strategy = task.strategy,
+                                          update_policy = task.update_policy,
+                                          conflict_policy = task.conflict_policy,
+                                          last_sync = task.last_pull,
+                                          onconflict = onconflict_callback,
+                                          )
+            count = resource.import_count
+
+        except IOError as e:
+            result = log.FATAL
+            message = "%s" % e
+            output = xml.json_message(False, 400, message)
+
+        except:
+            # If we end up here, an uncaught error during import
+            # has occured which indicates a code defect! We log it
+            # and continue here, however - in order to maintain a
+            # valid sync status, so that developers can restart
+            # the process more easily after fixing the defect.
+            result = log.FATAL
+            message = "Uncaught Exception During Import: %s" % \
+                      traceback.format_exc()
+            output = xml.json_message(False, 500, sys.exc_info()[1])
+
+        mtime = resource.mtime
+
+        # Log all validation errors
+        if resource.error_tree is not None:
+            result = log.WARNING
+            message = "%s" % resource.error
+            for element in resource.error_tree.findall("resource"):
+                for field in element.findall("data[@error]"):
+                    error_msg = field.get("error", None)
+                    if error_msg:
+                        msg = "(UID: %s) %s.%s=%s: %s" % \
+                               (element.get("uuid", None),
+                                element.get("name", None),
+                                field.get("field", None),
+                                field.get("value", field.text),
+                                field.get("error", None))
+                        message = "%s, %s" % (message, msg)
+
+        # Check for failure
+        if not success:
+            result = log.FATAL
+            if not message:
+                message = "%s" % resource.error
+            output = xml.json_message(False, 400, message)
+            mtime = None
+
+        return result, message, output, count, mtime
+
     # -------------------------------------------------------------------------
     def push(self, task):
         """
@@ -529,10 +686,29 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
-             pretty_print=False):
+             pretty_print=False,
+             cursor=None):
         """
             Respond to an incoming pull from the peer repository
 
+            With a cursor, the master records are sent in pages (of the
+            sync.page_size setting) ordered by (modified_on, id) - records
+            updated while the peer is paging through them move to the end
+            and are sent again in a later page. Records without modified_on
+            are sent first, ordered by id, as DBMS differ in where they sort
+            NULLs. The cursor for the next page is returned in the
+            CURSOR_HEADER response header, which is omitted for the last page.
+
+            The cursor also carries the date/time of the first page (the
+            snapshot), from which the peer continues with its next pull -
+            so that component updates of records in earlier pages are not
+            lost.
+
+            For incremental pulls (msince), the master records are
+            filtered by modification date in the database, so that the
+            pages only contain records which have changed (or which have
+            changed components).
+
             @param resource: the resource to be synchronized
             @param start: index of the first record to send
             @param limit: maximum number of records to send
@@ -540,6 +716,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
             @param pretty_print: make the output human-readable
+            @param cursor: the cursor after which to continue a paged pull,
+                           empty string for the first page
 
             @return: a dict {status, remote, message, response}, with:
                         - status....the outcome of the operation
@@ -555,12 +733,121 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                     "response": current.xml.json_message(False, 400, msg),
                     }
 
+        xml = current.xml
+        MTIME = xml.MTIME
+
+        table = resource.table
+        orderby = None
+        page_size = None
+        if cursor is not None:
+            page_size = current.deployment_settings.get_sync_page_size()
+        next_cursor = None
+        if page_size:
+            # Paged pull
+            db = current.db
+            has_mtime = MTIME in table.fields
+
+            if cursor:
+                try:
+                    snapshot, mtime, record_id = self._parse_cursor(cursor)
+                except ValueError:
+                    msg = "Invalid paging cursor: %s" % cursor
+                    return {"status": self.log.FATAL,
+                            "message": msg,
+                            "response": xml.json_message(False, 400, msg),
+                            }
+            else:
+                snapshot, mtime, record_id = current.request.utcnow, None, 0
+
+            # Incremental pull: filter the master records in the database
+            components = None
+            if msince and has_mtime:
+                components = self._delta_components(resource)
+                if components:
+                    resource.add_filter(self._delta_query(resource,
+                                                          components,
+                                                          msince,
+                                                          ))
+
+            by_id = not has_mtime
+            if mtime:
+                resource.add_filter(self._after_query(table, mtime, record_id))
+            elif msince and has_mtime and not components:
+                # The master record alone decides whether it is sent
+                # => start from msince (no records without modified_on)
+                resource.add_filter(self._after_query(table, msince, 0))
+            elif has_mtime:
+                # Records without modified_on first, if there are any left
+                query = self._after_query(table, None, record_id)
+                if db(query).select(table._id, limitby=(0, 1)).first():
+                    resource.add_filter(query)
+                    by_id = True
+                else:
+                    resource.add_filter(table[MTIME] != None)
+            elif record_id:
+                resource.add_filter(self._after_query(table, None, record_id))
+
+            # Master filters, so that they apply to the look-ahead
+            tablename = resource.tablename
+            if xml.filter_mci and xml.MCI in table.fields:
+                resource.add_filter(table[xml.MCI] >= 0)
+            if filters and tablename in filters:
+                queries = S3URLQuery.parse(resource, filters[tablename])
+                for alias in queries:
+                    for query in queries[alias]:
+                        resource.add_filter(query)
+                filters = dict(filters)
+                del filters[tablename]
+
+            orderby = [table._id]
+            if not by_id:
+                orderby.insert(0, table[MTIME])
+
+            # Look ahead by one record to detect the last page
+            pkey = table._id.name
+            fields = [pkey, MTIME] if has_mtime else [pkey]
+            rows = resource.select(fields,
+                                   limit = page_size + 1,
+                                   orderby = orderby,
+                                   virtual = False,
+                                   as_rows = True,
+                                   )
+            page = []
+            seen = set()
+            for row in rows:
+                if tablename in row:
+                    row = row[tablename]
+                if row[pkey] not in seen:
+                    seen.add(row[pkey])
+                    page.append(row)
+            if len(page) > page_size:
+                # More records to send => cursor after the last one
+                last_row = page[page_size - 1]
+                next_cursor = self._cursor(snapshot,
+                                           last_row[MTIME] if has_mtime else None,
+                                           last_row[pkey],
+                                           )
+            elif by_id and has_mtime:
+                # Continue with the records which have a modified_on
+                maximum = table._id.max()
+                row = db(table[MTIME] == None).select(maximum).first()
+                next_cursor = self._cursor(snapshot,
+                                           None,
+                                           max(row[maximum] or 0, record_id),
+                                           )
+
+            # Export only the records of this page
+            record_ids = [row[pkey] for row in page[:page_size]]
+            resource.add_filter(table._id.belongs(record_ids))
+            start = limit = None
+
         # Export the data as S3XML
         output = resource.export_xml(start = start,
                                      limit = limit,
                                      filters = filters,
                                      msince = msince,
                                      pretty_print = pretty_print,
+                                     orderby = orderby,
                                      )
         count = resource.results
         msg = "Data sent to peer (%s records)" % count
@@ -574,11 +861,152 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         headers = current.response.headers
         headers["Content-Type"] = "text/xml"
 
+        if next_cursor:
+            # More records to send => cursor for the next page
+            headers[self.CURSOR_HEADER] = next_cursor
+
+        # Compress the output if the peer accepts it
+        accept_encoding = current.request.env.http_accept_encoding or ""
+        if output and "gzip" in accept_encoding:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            output = compressor.compress(output) + compressor.flush()
+            headers["Content-Encoding"] = "gzip"
+
         return {"status": self.log.SUCCESS,
                 "message": msg,
                 "response": output,
                 }
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _cursor(snapshot, mtime, record_id):
+        """
+            Encode the paging cursor after a record
+
+            @param snapshot: the date/time of the first page
+            @param mtime: the modified_on of the record (or None)
+            @param record_id: the record ID
+
+            @return: the cursor as string "<snapshot>|<modified_on>|<id>"
+                     (with empty modified_on for records without)
+        """
+
+        return "%s|%s|%s" % (snapshot.isoformat(),
+                             mtime.isoformat() if mtime else "",
+                             record_id,
+                             )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _parse_cursor(cursor):
+        """
+            Decode a paging cursor
+
+            @param cursor: the cursor (as returned by _cursor)
+
+            @return: tuple (snapshot, mtime, record_id), with mtime=None
+                     for a position among the records without modified_on
+
+            @raises ValueError: for invalid cursors
+        """
+
+        snapshot, mtime, record_id = cursor.split("|")
+
+        values = []
+        for value in (snapshot, mtime):
+            if value:
+                dtfmt = "%Y-%m-%dT%H:%M:%S.%f" if "." in value else \
+                        "%Y-%m-%dT%H:%M:%S"
+                value = datetime.datetime.strptime(value, dtfmt)
+            else:
+                value = None
+            values.append(value)
+        if values[0] is None:
+            raise ValueError("Cursor without snapshot")
+
+        return values[0], values[1], int(record_id)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _after_query(table, mtime, record_id):
+        """
+            Construct a query for the records after a position in the
+            (modified_on, id) order
+
+            @param table: the master table
+            @param mtime: the modified_on of the position, None for a
+                          position among the records without modified_on
+                          (which are ordered by id only)
+            @param record_id: the record ID of the position
+
+            @return: the query
+        """
+
+        MTIME = current.xml.MTIME
+
+        after = table._id > record_id
+        if MTIME in table.fields:
+            field = table[MTIME]
+            if mtime:
+                # Range condition first, so the DBMS can use an index
+                after = (field >= mtime) & ((field > mtime) | after)
+            else:
+                after = (field == None) & after
+        return after
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _delta_components(resource):
+        """
+            Get the components which decide, alongside the master record,
+            whether a master record is sent in an incremental pull
+
+            @param resource: the master resource
+
+            @return: list of component (or link) resources
+        """
+
+        MTIME = current.xml.MTIME
+
+        components = []
+        for alias in resource.components_to_export(resource.tablename, []):
+            component = resource.components.get(alias)
+            if not component:
+                continue
+            c = component.link if component.link is not None else component
+            # Components without modified_on are not sent in
+            # incremental pulls (see S3Resource.export_tree)
+            if MTIME in c.fields:
+                components.append(c)
+        return components
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _delta_query(resource, components, msince):
+        """
+            Construct a query for the master records which have been
+            modified since a date/time, or which have components that
+            have been modified since then
+
+            @param resource: the master resource
+            @param components: the components (from _delta_components)
+            @param msince: the date/time
+
+            @return: the query
+        """
+
+        MTIME = current.xml.MTIME
+
+        db = current.db
+        table = resource.table
+
+        query = (table[MTIME] >= msince)
+        for c in components:
+            ctable = c.table
+            changed = db(ctable[MTIME] >= msince)._select(ctable[c.fkey])
+            query |= table[c.pkey].belongs(changed)
+        return query
+
     # -------------------------------------------------------------------------
     def receive(self,
                 source,
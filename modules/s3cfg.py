@@ -164,6 +164,7 @@ class S3Config(Storage):
         self.base.prepopulate_demo = ["default/users"]
         self.br = Storage()
         self.cap = Storage()
+        self.climate = Storage()
         self.cms = Storage()
         self.cr = Storage()
         # nEden: this must be replaced sometime? Because we're getting values from it. Probably easiest to find in debug
@@ -1027,6 +1028,24 @@ class S3Config(Storage):
         """For demo sites, which additional options to add to the list """
         return self.base.get("prepopulate_demo", 0)
 
+    def get_base_prepopulate_snapshot(self):
+        """
+            Whether to save a snapshot of the database after prepopulate,
+            and restore it in subsequent first runs with the same template
+            data, configuration and database schema:
+            - True to store snapshots in <app>/databases/snapshots, or
+              the path of a folder to store snapshots in
+        """
+        return self.base.get("prepopulate_snapshot", False)
+
+    def get_base_prepopulate_workers(self):
+        """
+            Number of worker processes to run independent prepopulate
+            import tasks in parallel (1 = sequential)
+            - not used with SQLite
+        """
+        return self.base.get("prepopulate_workers", 1)
+
     def get_base_guided_tour(self):
         """ Whether the guided tours are enabled """
         return self.base.get("guided_tour", False)
@@ -1178,6 +1197,30 @@ class S3Config(Storage):
         """
         return self.log.get("caller_info", False)
 
+    def get_log_sql_profile(self):
+        """
+            True to record all SQL statements per request, with duration,
+            row count and call site (see S3SQLProfiler), viewable in
+            admin/sql_profile and the developer toolbar - adds overhead,
+            so use for diagnostics only
+        """
+        return self.log.get("sql_profile", False)
+
+    def get_log_sql_slow(self):
+        """
+            Minimum duration (seconds) of SQL statements to be logged
+            as slow queries by the SQL profiler
+        """
+        return self.log.get("sql_slow", 0.5)
+
+    def get_log_sql_repeat(self):
+        """
+            Minimum number of executions of the same SQL statement from
+            the same call site during a request for the SQL profiler to
+            flag it as potential N+1 problem
+        """
+        return self.log.get("sql_repeat", 10)
+
     # -------------------------------------------------------------------------
     # Database settings
     #
@@ -1243,6 +1286,13 @@ class S3Config(Storage):
             airegex = False
         return airegex
 
+    def get_database_index_advisor(self):
+        """
+            Record which columns are used in resource queries, in order
+            to recommend missing indexes (see S3IndexAdvisor)
+        """
+        return self.database.get("index_advisor", False)
+
     # -------------------------------------------------------------------------
     # Finance settings
     def get_fin_currency_writable(self):
@@ -1362,6 +1412,38 @@ class S3Config(Storage):
         """
         return self.gis.get("countries", [])
 
+    def get_gis_proxy_cache(self):
+        """
+            Cache responses of remote map servers in gis/proxy, and
+            route TMS/XYZ/WMS layers through the cache (gis/tile)
+        """
+        return self.gis.get("proxy_cache", False)
+
+    def get_gis_proxy_cache_size(self):
+        """
+            Maximum total size of the proxy cache (in MB)
+        """
+        return self.gis.get("proxy_cache_size", 500)
+
+    def get_gis_proxy_cache_ttl(self):
+        """
+            Time-to-live (seconds) for cached responses of remote map
+            servers which do not specify an expiry themselves
+        """
+        return self.gis.get("proxy_cache_ttl", 86400)
+
+    def get_gis_location_bundles(self):
+        """
+            Use prebuilt location hierarchy bundles (static/cache/locations)
+            for the S3LocationSelector and gis/ldata rather than querying
+            the database for every level
+
+            NB bundles are invalidated when locations or location names
+               change (including moves to another country, which invalidate
+               the bundles of both the old and the new country)
+        """
+        return self.gis.get("location_bundles", False)
+
     def get_gis_display_l0(self):
         return self.gis.get("display_L0", False)
     def get_gis_display_l1(self):
@@ -1975,6 +2057,16 @@ class S3Config(Storage):
         """
         return self.base.get("pdf_max_rows", 1000)
 
+    def get_pdf_card_workers(self):
+        """
+            Number of processes to render PDF cards (e.g. ID cards) in
+            parallel, chunks of pages are rendered separately and then
+            concatenated into one document
+                - requires pypdf (or PyPDF2) and os.fork
+                - None or 1 to render all cards in-process
+        """
+        return self.base.get("pdf_card_workers", None)
+
     # -------------------------------------------------------------------------
     # XLS Export Settings
     #
@@ -1987,6 +2079,19 @@ class S3Config(Storage):
         """
         return self.base.get("xls_title_row", False)
 
+    # -------------------------------------------------------------------------
+    # Export Jobs
+    #
+    def get_base_export_job_threshold(self):
+        """
+            Minimum number of records for an export (XLS, XLSX, PDF, XML
+            or SHP) to be run as background job rather than inside the
+            request (see S3ExportJob)
+                - None to never run exports as background jobs
+                - requires a running scheduler worker
+        """
+        return self.base.get("export_job_threshold", None)
+
     # -------------------------------------------------------------------------
     # UI Settings
     #
@@ -2149,6 +2254,22 @@ class S3Config(Storage):
         return self.ui.get("calendar_clear_icon", False)
 
     # -------------------------------------------------------------------------
+    def get_ui_menu_cache(self):
+        """
+            Cache the permission checks for navigation items (and the
+            rendered HTML of menus which opt in with cache=True) for this
+            number of seconds, per role set and ACL version; False to
+            disable the menu cache
+
+            NB cached entries are invalidated by any change of the ACLs
+               (modification, addition or removal of s3_permission records,
+               i.e. a new ACL version) and by changes of the user's roles
+               or realms (=new key); other inputs to menus (e.g. settings
+               or data shown in menu labels) are not tracked, and would
+               only show after expiry
+        """
+        return self.ui.get("menu_cache", False)
+
     def get_ui_auto_keyvalue(self):
         """
             Should crud_form & list_fields automatically display all Keys in KeyValue tables?
@@ -2614,6 +2735,30 @@ class S3Config(Storage):
         """
         return self.mail.get("limit")
 
+    # -------------------------------------------------------------------------
+    # Polling
+    def get_msg_poll_concurrent(self):
+        """
+            Poll all RSS channels and all email channels with a single
+            scheduled task per channel type, fetching the feeds/mailboxes
+            concurrently (rather than one task per channel)
+        """
+        return self.msg.get("poll_concurrent", False)
+
+    def get_msg_poll_workers(self):
+        """
+            Maximum number of concurrent connections for the concurrent
+            channel poller (one connection per remote host)
+        """
+        return self.msg.get("poll_workers", 10)
+
+    def get_msg_poll_timeout(self):
+        """
+            Timeout (seconds) for remote servers in the concurrent
+            channel poller
+        """
+        return self.msg.get("poll_timeout", 30)
+
     # -------------------------------------------------------------------------
     # Parser
     def get_msg_parser(self):
@@ -2622,6 +2767,20 @@ class S3Config(Storage):
         """
         return self.msg.get("parser", "default")
 
+    def get_msg_parser_batch_size(self):
+        """
+            Number of inbound messages to parse per batch (i.e. per
+            bulk lookup and per transaction)
+        """
+        return self.msg.get("parser_batch_size", 200)
+
+    def get_msg_parser_workers(self):
+        """
+            Number of scheduler tasks to parse the messages of a channel
+            concurrently (each task handling a disjoint partition)
+        """
+        return self.msg.get("parser_workers", 1)
+
     # -------------------------------------------------------------------------
     # Notifications
     def get_msg_notify_subject(self):
@@ -2714,6 +2873,19 @@ class S3Config(Storage):
         """
         return self.search.get("dates_auto_range", False)
 
+    def get_search_filter_facets_cache(self):
+        """
+            Cache the options looked up for options filters (and the
+            number of matching records per option) for this number of
+            seconds, per filter state; False to disable the cache
+
+            NB cached options expire anyway when records are added,
+               modified or deleted in any of the tables involved in the
+               lookup (the filtered table, the look-up table and any
+               joined tables)
+        """
+        return self.search.get("filter_facets_cache", False)
+
     # Filter Manager Widget
     def get_search_filter_manager(self):
         """ Enable the filter manager widget """
@@ -2794,6 +2966,15 @@ class S3Config(Storage):
 
         return self.sync.get("data_repository", False)
 
+    def get_sync_page_size(self):
+        """
+            Maximum number of master records per page when peers pull
+            from this site in pages (peers resume after the last page
+            they could import), 0 or None to send all records at once
+        """
+
+        return self.sync.get("page_size", 500)
+
     # =========================================================================
     # Modules
 
@@ -3263,6 +3444,24 @@ class S3Config(Storage):
 
         return self.cap.get("area_default", ["geocode", "polygon"])
 
+    # -------------------------------------------------------------------------
+    # Climate: Climate Data Portal
+    #
+    def get_climate_array_backend(self):
+        """
+            Evaluate map overlay and chart expressions with the in-memory
+            array backend (requires NumPy) rather than by SQL queries
+            through R
+        """
+        return self.climate.get("array_backend", False)
+
+    def get_climate_array_cache_time(self):
+        """
+            Time (in seconds) to keep sample tables loaded for the array
+            backend, before they are reloaded from the database
+        """
+        return self.climate.get("array_cache_time", 3600)
+
     # -------------------------------------------------------------------------
     # CMS: Content Management System
     #
@@ -364,9 +364,12 @@ class S3LocationModel(S3Model):
                        context = {"location": "parent",
                                   },
                        deduplicate = self.gis_location_duplicate,
+                       # Search field
+                       indexes = ("name",),
                        list_fields = list_fields,
                        list_orderby = "gis_location.name",
                        onaccept = self.gis_location_onaccept,
+                       ondelete = self.gis_location_ondelete,
                        onvalidation = self.gis_location_onvalidation,
                        )
 
@@ -456,6 +459,18 @@ class S3LocationModel(S3Model):
         form_vars_get = form.vars.get
         location_id = form_vars_get("id")
 
+        # Invalidate the location hierarchy bundles of both the old and the
+        # new country of the location after commit, looked up before the
+        # location tree update replaces the path, and including the old and
+        # new parent (skip during prepop, rebuilt when updating the tree)
+        if not current.gis.disable_update_location_tree:
+            location_ids = [location_id, form_vars_get("parent")]
+            record = getattr(form, "record", None)
+            if record and hasattr(record, "get"):
+                # Original record (interactive update)
+                location_ids.append(record.get("parent"))
+            S3LocationBundle.invalidate_location_async(*location_ids)
+
         if form_vars_get("path") and current.response.s3.bulk:
             # Don't import path from foreign sources as IDs won't match
             db = current.db
@@ -472,6 +487,15 @@ class S3LocationModel(S3Model):
                                      args = [feature],
                                      )
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_location_ondelete(row):
+        """
+            On Delete for GIS Locations
+        """
+
+        S3LocationBundle.invalidate_location_async(row.id)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def gis_location_onvalidation(form):
@@ -1260,6 +1284,8 @@ class S3LocationNameModel(S3Model):
                                                        "language",
                                                        ),
                                             ),
+                  onaccept = self.gis_location_name_onaccept,
+                  ondelete = self.gis_location_name_ondelete,
                   )
 
         # ---------------------------------------------------------------------
@@ -1293,6 +1319,45 @@ class S3LocationNameModel(S3Model):
         # Pass names back to global scope (s3.*)
         return {}
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_location_name_onaccept(form):
+        """
+            Local name has been created/updated
+            - invalidate the location hierarchy bundle
+        """
+
+        form_vars = form.vars
+        location_id = form_vars.get("location_id")
+        if not location_id:
+            table = current.s3db.gis_location_name
+            row = current.db(table.id == form_vars.id).select(table.location_id,
+                                                              limitby = (0, 1),
+                                                              ).first()
+            if not row:
+                return
+            location_id = row.location_id
+
+        S3LocationBundle.invalidate_location_async(location_id)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def gis_location_name_ondelete(row):
+        """
+            Local name has been deleted
+            - invalidate the location hierarchy bundle
+        """
+
+        table = current.s3db.gis_location_name
+        record = current.db(table.id == row.id).select(table.deleted_fk,
+                                                       limitby = (0, 1),
+                                                       ).first()
+        if record and record.deleted_fk:
+            deleted_fk = json.loads(record.deleted_fk)
+            location_id = deleted_fk.get("location_id")
+            if location_id:
+                S3LocationBundle.invalidate_location_async(location_id)
+
 # =============================================================================
 class S3LocationTagModel(S3Model):
     """
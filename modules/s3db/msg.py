@@ -159,6 +159,15 @@ class S3ChannelModel(S3Model):
                            #represent = s3_yes_no_represent,
                            represent = lambda v: v or current.messages["NONE"],
                            ),
+                     # Back-off for the concurrent poller
+                     Field("backoff", "integer",
+                           readable = False,
+                           writable = False,
+                           ),
+                     Field("next_poll", "datetime",
+                           readable = False,
+                           writable = False,
+                           ),
                      *s3_meta_fields())
 
         # ---------------------------------------------------------------------
@@ -206,8 +215,17 @@ class S3ChannelModel(S3Model):
 
         # Do we have an existing Task?
         ttable = db.scheduler_task
-        args = '["%s", %s]' % (tablename, channel_id)
-        query = ((ttable.function_name == "msg_poll") & \
+        if tablename in S3ChannelPoller.CHANNELS and \
+           current.deployment_settings.get_msg_poll_concurrent():
+            # All channels of this type are polled by a single task
+            function_name = "msg_poll_channels"
+            args = '["%s"]' % tablename
+            task_args = [tablename]
+        else:
+            function_name = "msg_poll"
+            args = '["%s", %s]' % (tablename, channel_id)
+            task_args = [tablename, channel_id]
+        query = ((ttable.function_name == function_name) & \
                  (ttable.args == args) & \
                  (ttable.status.belongs(["RUNNING", "QUEUED", "ALLOCATED"])))
         exists = db(query).select(ttable.id,
@@ -215,8 +233,8 @@ class S3ChannelModel(S3Model):
         if exists:
             return "Channel already enabled"
         else:
-            current.s3task.schedule_task("msg_poll",
-                                         args = [tablename, channel_id],
+            current.s3task.schedule_task(function_name,
+                                         args = task_args,
                                          period = 300,  # seconds
                                          timeout = 300, # seconds
                                          repeats = 0    # unlimited
@@ -270,6 +288,11 @@ class S3ChannelModel(S3Model):
         for parser in parsers:
             s3db.msg_parser_disable(parser.id)
 
+        if tablename in S3ChannelPoller.CHANNELS and \
+           current.deployment_settings.get_msg_poll_concurrent():
+            # Shared task, which skips disabled channels
+            return "Channel disabled"
+
         # Do we have an existing Task?
         ttable = db.scheduler_task
         args = '["%s", %s]' % (tablename, channel_id)
@@ -1328,21 +1351,30 @@ class S3ParsingModel(S3Model):
 
         # Do we have an existing Task?
         ttable = db.scheduler_task
-        args = '[%s, "%s"]' % (channel_id, function_name)
+        args = '[%s, "%s"' % (channel_id, function_name)
         query = ((ttable.function_name == "msg_parse") & \
-                 (ttable.args == args) & \
+                 ((ttable.args == "%s]" % args) | \
+                  (ttable.args.like("%s,%%" % args))) & \
                  (ttable.status.belongs(["RUNNING", "QUEUED", "ALLOCATED"])))
         exists = db(query).select(ttable.id,
                                   limitby=(0, 1)).first()
         if exists:
             return "Parser already enabled"
         else:
-            current.s3task.schedule_task("msg_parse",
-                                         args = [channel_id, function_name],
-                                         period = 300,  # seconds
-                                         timeout = 300, # seconds
-                                         repeats = 0    # unlimited
-                                         )
+            # Schedule one task per worker, each parsing a disjoint
+            # partition of the incoming messages
+            workers = current.deployment_settings.get_msg_parser_workers()
+            for worker in range(workers):
+                if workers > 1:
+                    task_args = [channel_id, function_name, worker, workers]
+                else:
+                    task_args = [channel_id, function_name]
+                current.s3task.schedule_task("msg_parse",
+                                             args = task_args,
+                                             period = 300,  # seconds
+                                             timeout = 300, # seconds
+                                             repeats = 0    # unlimited
+                                             )
             return "Parser enabled"
 
     # -------------------------------------------------------------------------
@@ -1384,9 +1416,10 @@ class S3ParsingModel(S3Model):
 
         # Do we have an existing Task?
         ttable = db.scheduler_task
-        args = '[%s, "%s"]' % (record.channel_id, record.function_name)
+        args = '[%s, "%s"' % (record.channel_id, record.function_name)
         query = ((ttable.function_name == "msg_parse") & \
-                 (ttable.args == args) & \
+                 ((ttable.args == "%s]" % args) | \
+                  (ttable.args.like("%s,%%" % args))) & \
                  (ttable.status.belongs(["RUNNING", "QUEUED", "ALLOCATED"])))
         exists = db(query).select(ttable.id,
                                   limitby=(0, 1)).first()
@@ -955,6 +955,11 @@ class PRPersonModel(S3Model):
                        crud_form = crud_form,
                        deduplicate = self.person_duplicate,
                        filter_widgets = filter_widgets,
+                       # Search fields
+                       indexes = ("first_name",
+                                  "middle_name",
+                                  "last_name",
+                                  ),
                        list_fields = ["id",
                                       "first_name",
                                       "middle_name",
@@ -29,10 +29,13 @@
 
 __all__ = ("S3HierarchyModel",
            "S3DashboardModel",
+           "S3ExportJobModel",
            "S3DynamicTablesModel",
            "s3_table_rheader",
            )
 
+import json
+import os
 import random
 
 from gluon import *
@@ -169,6 +172,50 @@ class S3DashboardModel(S3Model):
                     (table.deleted != True)
             db(query).update(active = False)
 
+# =============================================================================
+class S3ExportJobModel(S3Model):
+    """ Model for background export jobs (see S3ExportJob) """
+
+    names = ("s3_export_job",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Export Job
+        #
+        tablename = "s3_export_job"
+        self.define_table(tablename,
+                          Field("tablename", length=64),
+                          Field("representation", length=16),
+                          # Snapshot of the request
+                          Field("request", "json"),
+                          Field("status", length=16,
+                                default = "QUEUED",
+                                ),
+                          Field("task_id", "integer"),
+                          Field("file", "upload",
+                                autodelete = True,
+                                uploadfolder = os.path.join(current.request.folder,
+                                                            "uploads",
+                                                            "exports",
+                                                            ),
+                                ),
+                          Field("filename"),
+                          Field("error", "text"),
+                          *s3_meta_fields())
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
+    # -------------------------------------------------------------------------
+    def defaults(self):
+        """ Safe defaults if module is disabled """
+
+        return {}
+
 # =============================================================================
 class S3DynamicTablesModel(S3Model):
     """ Model for dynamic tables """
@@ -232,6 +279,12 @@ class S3DynamicTablesModel(S3Model):
                                                            ),
                                          ),
                            ),
+                     # Hash of the field definitions, updated whenever
+                     # fields are written (see S3DynamicModel)
+                     Field("schema_version", length=40,
+                           readable = False,
+                           writable = False,
+                           ),
                      # Link this table to a certain master key
                      self.auth_masterkey_id(),
                      #s3_comments(),
@@ -364,7 +417,10 @@ class S3DynamicTablesModel(S3Model):
                                                                  ),
                                                ),
                                  ),
-                     *s3_meta_fields())
+                     *s3_meta_fields(),
+                     on_define = lambda table: \
+                                 [self.s3_field_set_after_write(table)]
+                     )
 
         # Table configuration
         self.configure(tablename,
@@ -454,6 +510,85 @@ class S3DynamicTablesModel(S3Model):
             # => set a new default for subsequent writes
             field.default = "%s_%s" % (DYNAMIC_PREFIX, cls.s3_table_random_name())
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def s3_field_set_after_write(cls, table):
+        """
+            Set functions to call after write (including hard deletes)
+
+            @param table: the table (s3_field)
+        """
+
+        update_version = cls.s3_field_update_schema_version
+        table_ids = cls.s3_field_table_ids
+
+        table._after_insert.append(lambda data, record_id: \
+                                   update_version(table_id=data.get("table_id")))
+        table._after_update.append(lambda s, data: update_version(s=s))
+
+        # Hard delete: the affected tables must be looked up before
+        # the fields are deleted, but the version updated afterwards
+        def before_delete(s):
+            s._s3_table_ids = table_ids(s)
+        table._before_delete.append(before_delete)
+        table._after_delete.append(lambda s: \
+                                   update_version(table_ids=getattr(s, "_s3_table_ids", None)))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def s3_field_table_ids(s):
+        """
+            Get the dynamic tables a Set of s3_field records belongs to
+
+            @param s: the Set of s3_field records
+
+            @returns: set of s3_table record IDs
+        """
+
+        table_ids = set()
+
+        table = current.s3db.s3_field
+        rows = s.select(table.table_id,
+                        table.deleted_fk,
+                        )
+        for row in rows:
+            if row.table_id:
+                table_ids.add(row.table_id)
+            elif row.deleted_fk:
+                # Archived
+                deleted_fk = json.loads(row.deleted_fk)
+                table_id = deleted_fk.get("table_id")
+                if table_id:
+                    table_ids.add(table_id)
+
+        return table_ids
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def s3_field_update_schema_version(cls, s=None, table_id=None, table_ids=None):
+        """
+            Update the schema version of the dynamic tables after
+            their fields have been written (=> triggers migration
+            and refreshes cached field definitions, see S3DynamicModel)
+
+            @param s: the Set of s3_field records that have been updated
+            @param table_id: the s3_table record ID (after insert)
+            @param table_ids: the s3_table record IDs (after delete)
+
+            @returns: nothing (otherwise insert/update/delete will not work)
+        """
+
+        table_ids = set(table_ids) if table_ids else set()
+        if table_id:
+            table_ids.add(table_id)
+
+        if s is not None:
+            table_ids |= cls.s3_field_table_ids(s)
+
+        from ..s3.s3model import S3DynamicModel
+        for table_id in table_ids:
+            S3DynamicModel.update_schema_version(table_id)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def s3_table_name_represent(c="default", f="table"):
@@ -76,6 +76,7 @@ __all__ = ("S3SurveyTemplateModel",
            "survey_DataMatrixBuilder",
            "survey_getMatrix",
            "survey_S3AnalysisPriority",
+           "survey_SeriesAnalysis",
            "survey_question_type",
            "survey_analysis_type",
            "survey_T",
@@ -83,6 +84,8 @@ __all__ = ("S3SurveyTemplateModel",
 
 import json
 
+from collections import Counter
+
 from gluon import *
 from gluon.storage import Storage
 from gluon.sqlhtml import *
@@ -1895,17 +1898,16 @@ $('#chart_btn').click(function(){
 
         T = current.T
 
-        get_answers = survey_getAllAnswersForQuestionInSeries
+        analysis = survey_SeriesAnalysis(series_id)
         gqstn = survey_getQuestionFromName(label_question, series_id)
         gqstn_id = gqstn["qstn_id"]
-        ganswers = get_answers(gqstn_id, series_id)
+        ganswers = None
         data_list = []
         legend_labels = []
         for numeric_question in numeric_question_list:
             if numeric_question == "Count":
                 # get the count of replies for the label question
-                gqstn_type = gqstn["type"]
-                analysis_tool = survey_analysis_type[gqstn_type](gqstn_id, ganswers)
+                analysis_tool = analysis.analysis_tool(gqstn_id)
                 mapdict = analysis_tool.uniqueCount()
                 label = list(mapdict.keys())
                 data = list(mapdict.values())
@@ -1913,17 +1915,20 @@ $('#chart_btn').click(function(){
             else:
                 qstn = survey_getQuestionFromCode(numeric_question, series_id)
                 qstn_id = qstn["qstn_id"]
-                qstn_type = qstn["type"]
-                answers = get_answers(qstn_id, series_id)
-                analysis_tool = survey_analysis_type[qstn_type](qstn_id, answers)
-                label = analysis_tool.qstnWidget.fullName()
+                label = analysis.question(qstn_id)["name"]
                 if len(label) > 20:
                     label = "%s..." % label[0:20]
                 legend_labels.append(label)
-                grouped = analysis_tool.groupData(ganswers)
-                aggregate = "Sum"
-                filtered = analysis_tool.filter(aggregate, grouped)
-                (label, data) = analysis_tool.splitGroupedData(filtered)
+                if analysis.question_type(qstn_id) == "Numeric":
+                    (label, data) = analysis.grouped_sum(qstn_id, gqstn_id)
+                else:
+                    analysis_tool = analysis.analysis_tool(qstn_id)
+                    if ganswers is None:
+                        ganswers = analysis.answers(gqstn_id)
+                    grouped = analysis_tool.groupData(ganswers)
+                    aggregate = "Sum"
+                    filtered = analysis_tool.filter(aggregate, grouped)
+                    (label, data) = analysis_tool.splitGroupedData(filtered)
             if data != []:
                 data_list.append(data)
 
@@ -2346,13 +2351,12 @@ def buildSeriesSummary(series_id, posn_offset):
             )
     header = THEAD(hr)
 
-    questions = survey_getAllQuestionsForSeries(series_id)
+    analysis = survey_SeriesAnalysis(series_id)
     body = TBODY()
-    for question in questions:
+    for question in analysis.questions:
         if question["type"] == "Grid":
             continue
         question_id = question["qstn_id"]
-        widget_object = survey_getWidgetFromQuestion(question_id)
         br = TR()
         posn = int(question["posn"])+posn_offset
         br.append(TD(INPUT(_id="select%s" % posn,
@@ -2360,21 +2364,14 @@ def buildSeriesSummary(series_id, posn_offset):
                            _class="bulkcheckbox",
                            )))
         br.append(posn) # add an offset to make all id's +ve
-        br.append(widget_object.fullName())
-        #br.append(question["name"])
-        qtype = widget_object.type_represent()
-        answers = survey_getAllAnswersForQuestionInSeries(question_id,
-                                                          series_id)
-        analysis_tool = survey_analysis_type[question["type"]](question_id,
-                                                               answers)
-        chart = analysis_tool.chartButton(series_id)
+        br.append(question["name"])
+        chart = analysis.chart_button(question_id)
         cell = TD()
-        cell.append(qtype)
+        cell.append(analysis.type_represent(question_id))
         if chart:
             cell.append(chart)
         br.append(cell)
-        analysis_tool.count()
-        br.append(analysis_tool.summary())
+        br.append(analysis.summary(question_id))
 
         body.append(br)
 
@@ -6370,6 +6367,505 @@ survey_analysis_type = {"String": analysis_stringType,
                         #"Rating": analysis_ratingType,
                         }
 
+# =============================================================================
+class survey_SeriesAnalysis(object):
+    """
+        Columnar analysis of all questions in a survey series
+
+        Loads all answers of the series with a single query into
+        per-question columns and computes the statistics for all
+        questions in one pass, rather than querying the answers and
+        instantiating a widget and an analysis object per question.
+
+        The statistics are cached per series, and recomputed only
+        when completes get added, updated or removed.
+    """
+
+    # Question types summarised as option counts
+    OPTION_TYPES = ("Option", "YesNo", "YesNoDontKnow", "OptionOther")
+
+    # Question types which need database lookups for their analysis,
+    # these are delegated to the respective S3AbstractAnalysis
+    DELEGATED_TYPES = ("Location", "Link")
+
+    # Question types without chart
+    NO_CHART_TYPES = ("String", "Text", "Date", "Time", "Grid")
+
+    # Minimum number of valid answers for a histogram
+    HIST_CUTOFF = 10
+
+    def __init__(self, series_id):
+        """
+            Constructor
+
+            @param series_id: the survey_series record ID
+        """
+
+        self.series_id = series_id
+
+        self._questions = None
+        self._lookup = None
+        self._columns = None
+        self._metadata = None
+        self._stats = None
+        self._widgets = {}
+
+    # -------------------------------------------------------------------------
+    @property
+    def questions(self):
+        """
+            The questions of the series template, in order of their
+            position (see survey_getAllQuestionsForSeries)
+        """
+
+        questions = self._questions
+        if questions is None:
+            questions = survey_getAllQuestionsForSeries(self.series_id)
+            self._questions = questions
+            self._lookup = dict((q["qstn_id"], q) for q in questions)
+        return questions
+
+    # -------------------------------------------------------------------------
+    def question(self, question_id):
+        """
+            Look up a question of the series template
+
+            @param question_id: the survey_question record ID
+
+            @return: the question dict, or None if the question is not
+                     part of the series template
+        """
+
+        if self._lookup is None:
+            self.questions
+        return self._lookup.get(question_id)
+
+    # -------------------------------------------------------------------------
+    @property
+    def version(self):
+        """
+            Version key for the answers of this series, changes whenever
+            completes or answers get added, updated or removed
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.survey_complete
+        count = table.id.count()
+        last = table.id.max()
+        modified = table.modified_on.max()
+        row = db(table.series_id == self.series_id).select(count,
+                                                           last,
+                                                           modified,
+                                                           ).first()
+        version = "%s:%s:%s" % (row[count], row[last], row[modified])
+
+        # Answers can be edited without touching their complete
+        atable = s3db.survey_answer
+        count = atable.id.count()
+        modified = atable.modified_on.max()
+        query = (atable.complete_id == table.id) & \
+                (table.series_id == self.series_id)
+        row = db(query).select(count, modified).first()
+        return "%s:%s:%s" % (version, row[count], row[modified])
+
+    # -------------------------------------------------------------------------
+    @property
+    def columns(self):
+        """
+            All answers of the series as per-question columns
+
+            @return: dict {question_id: (answer_ids, complete_ids, values)}
+        """
+
+        columns = self._columns
+        if columns is None:
+
+            db = current.db
+            s3db = current.s3db
+
+            ctable = s3db.survey_complete
+            atable = s3db.survey_answer
+
+            query = (atable.complete_id == ctable.id) & \
+                    (ctable.series_id == self.series_id)
+            sql = db(query)._select(atable.id,
+                                    atable.question_id,
+                                    atable.complete_id,
+                                    atable.value,
+                                    orderby = atable.id,
+                                    )
+
+            # Raw tuples rather than Rows: this can be a very large set
+            columns = {}
+            for answer_id, question_id, complete_id, value in db.executesql(sql):
+                column = columns.get(question_id)
+                if column is None:
+                    column = columns[question_id] = ([], [], [])
+                column[0].append(answer_id)
+                column[1].append(complete_id)
+                column[2].append(value)
+
+            self._columns = columns
+        return columns
+
+    # -------------------------------------------------------------------------
+    def metadata(self, question_id):
+        """
+            The metadata of a question, loaded for all questions of the
+            series template at once
+
+            @param question_id: the survey_question record ID
+
+            @return: dict {descriptor: value}
+        """
+
+        metadata = self._metadata
+        if metadata is None:
+
+            question_ids = [q["qstn_id"] for q in self.questions]
+
+            metadata = {}
+            if question_ids:
+                table = current.s3db.survey_question_metadata
+                query = table.question_id.belongs(question_ids)
+                rows = current.db(query).select(table.question_id,
+                                                table.descriptor,
+                                                table.value,
+                                                )
+                for row in rows:
+                    # Remove any double quotes as the widgets do
+                    item = metadata.setdefault(row.question_id, {})
+                    item[row.descriptor] = row.value.strip('"')
+
+            self._metadata = metadata
+        return metadata.get(question_id, {})
+
+    # -------------------------------------------------------------------------
+    def answers(self, question_id):
+        """
+            All answers for a question in this series, in the same format
+            as survey_getAllAnswersForQuestionInSeries, e.g. to feed an
+            S3AbstractAnalysis
+
+            @param question_id: the survey_question record ID
+        """
+
+        column = self.columns.get(question_id)
+        if not column:
+            return []
+        return [{"answer_id": answer_id,
+                 "complete_id": complete_id,
+                 "value": value,
+                 } for answer_id, complete_id, value in zip(*column)]
+
+    # -------------------------------------------------------------------------
+    def analysis_tool(self, question_id):
+        """
+            Instantiate the S3AbstractAnalysis for a question, for analyses
+            which are not covered by this class
+
+            @param question_id: the survey_question record ID
+        """
+
+        question = self.question(question_id)
+        return survey_analysis_type[question["type"]](question_id,
+                                                      self.answers(question_id))
+
+    # -------------------------------------------------------------------------
+    def stats(self, question_id):
+        """
+            The statistics for a question
+
+            @param question_id: the survey_question record ID
+
+            @return: dict, see statistics()
+        """
+
+        stats = self._stats
+        if stats is None:
+
+            cache = current.cache.ram
+            key = "survey_series_analysis_%s" % self.series_id
+
+            version = self.version
+            cached = cache(key, lambda: None, time_expire=None)
+            if cached and cached[0] == version:
+                stats = cached[1]
+            else:
+                stats = self.analyse()
+                # Replace the outdated entry
+                cache(key, lambda: (version, stats), time_expire=0)
+
+            self._stats = stats
+
+        result = stats.get(question_id)
+        if result is None:
+            result = self.statistics(self.question_type(question_id), [])
+        return result
+
+    # -------------------------------------------------------------------------
+    def question_type(self, question_id):
+        """
+            The type by which to analyse a question, i.e. the real type
+            of grid children
+
+            @param question_id: the survey_question record ID
+        """
+
+        question = self.question(question_id)
+        if question is None:
+            return None
+        qtype = question["type"]
+        if qtype == "GridChild":
+            qtype = self.metadata(question_id).get("Type")
+        return qtype
+
+    # -------------------------------------------------------------------------
+    def analyse(self):
+        """
+            Compute the statistics for all questions of the series
+
+            @return: dict {question_id: statistics}
+        """
+
+        columns = self.columns
+        statistics = self.statistics
+
+        results = {}
+        for question in self.questions:
+            question_id = question["qstn_id"]
+            column = columns.get(question_id)
+            values = column[2] if column else []
+            results[question_id] = statistics(self.question_type(question_id),
+                                              values)
+        return results
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def statistics(cls, qtype, values):
+        """
+            Compute the statistics for a column of answers
+
+            @param qtype: the question type
+            @param values: the raw answer values
+
+            @return: dict with the items
+                        - type: the question type
+                        - replies: the number of answers
+                        - valid: the number of valid answers
+                        - sum, average, max, min: for numeric questions
+                        - counts: {option: count} for option questions
+        """
+
+        stats = {"type": qtype,
+                 "replies": len(values),
+                 }
+
+        values = [value for value in values if value is not None]
+
+        if qtype == "Numeric":
+            numbers = []
+            append = numbers.append
+            for value in values:
+                try:
+                    append(float(value))
+                except ValueError:
+                    continue
+            valid = len(numbers)
+            if valid:
+                total = sum(numbers)
+                stats.update(sum = total,
+                             average = total / float(valid),
+                             max = max(numbers),
+                             min = min(numbers),
+                             )
+            else:
+                stats.update(sum=None, average=None, max=None, min=None)
+
+        elif qtype in cls.OPTION_TYPES:
+            valid = len(values)
+            stats["counts"] = dict(Counter(values))
+
+        elif qtype == "MultiOption":
+            counts = Counter()
+            for value in values:
+                counts.update(json2list(value))
+            valid = len(values)
+            stats["counts"] = dict(counts)
+
+        else:
+            valid = len(values)
+
+        stats["valid"] = valid
+        return stats
+
+    # -------------------------------------------------------------------------
+    def widget(self, qtype):
+        """
+            An unbound question widget for a question type, e.g. to access
+            the type description or formatters
+
+            @param qtype: the question type
+        """
+
+        widgets = self._widgets
+        widget = widgets.get(qtype)
+        if widget is None:
+            widget = widgets[qtype] = survey_question_type[qtype]()
+        return widget
+
+    # -------------------------------------------------------------------------
+    def type_represent(self, question_id):
+        """
+            Display the type of a question (see
+            S3QuestionTypeAbstractWidget.type_represent)
+
+            @param question_id: the survey_question record ID
+        """
+
+        qtype = self.question(question_id)["type"]
+        if qtype == "GridChild":
+            description = self.metadata(question_id).get("Type")
+        else:
+            description = self.widget(qtype).typeDescription
+        return DIV(description, _class="surveyWidgetType")
+
+    # -------------------------------------------------------------------------
+    def chart_button(self, question_id):
+        """
+            Button to open the chart for a question, if appropriate
+            (see S3AbstractAnalysis.chartButton)
+
+            @param question_id: the survey_question record ID
+        """
+
+        stats = self.stats(question_id)
+        qtype = stats["type"]
+
+        if qtype in self.DELEGATED_TYPES:
+            return self.analysis_tool(question_id).chartButton(self.series_id)
+
+        if qtype not in survey_analysis_type or \
+           qtype in self.NO_CHART_TYPES or \
+           not stats["valid"]:
+            return None
+        if qtype == "Numeric":
+            # At the moment only draw charts for integers
+            if self.metadata(question_id).get("Format", "n") != "n" or \
+               stats["valid"] < self.HIST_CUTOFF:
+                return None
+
+        # Charts for grid children are drawn by the GridChild analysis
+        chart_type = self.question(question_id)["type"]
+        src = URL(f="completed_chart",
+                  vars={"question_id": question_id,
+                        "series_id" : self.series_id,
+                        "type" : chart_type,
+                        }
+                  )
+        link = A(current.T("Chart"), _href=src, _target="blank",
+                 _class="action-btn")
+        return DIV(link, _class="surveyChart%sWidget" % chart_type)
+
+    # -------------------------------------------------------------------------
+    def summary(self, question_id):
+        """
+            Summary table for a question (see S3AbstractAnalysis.count
+            and S3AbstractAnalysis.summary)
+
+            @param question_id: the survey_question record ID
+        """
+
+        T = current.T
+
+        stats = self.stats(question_id)
+        qtype = stats["type"]
+
+        if qtype in self.DELEGATED_TYPES:
+            analysis_tool = self.analysis_tool(question_id)
+            analysis_tool.count()
+            return analysis_tool.summary()
+
+        result = [(T("Replies"), stats["replies"])]
+        append = result.append
+
+        if qtype == "Numeric":
+            append((T("Valid"), stats["valid"]))
+            fmt = self.widget("Numeric").formattedAnswer
+            number_format = self.metadata(question_id).get("Format", "n")
+            for label, key in ((T("Total"), "sum"),
+                               (T("Average"), "average"),
+                               (T("Maximum"), "max"),
+                               (T("Minimum"), "min"),
+                               ):
+                value = stats[key]
+                if value is not None:
+                    append((label, fmt(value, number_format)))
+
+        elif qtype in ("YesNo", "YesNoDontKnow"):
+            counts = stats["counts"]
+            valid = stats["valid"]
+            options = [("Yes", T("Yes")), ("No", T("No"))]
+            if qtype == "YesNoDontKnow":
+                options.append(("Don't Know", T("Don't Know")))
+            for option, label in options:
+                if option in counts:
+                    value = "%3.1f%%" % round((100.0 * counts[option]) / valid, 1)
+                elif valid:
+                    value = T("0%")
+                else:
+                    # No replies so can't give a percentage
+                    value = ""
+                append((label, value))
+
+        elif qtype in self.OPTION_TYPES:
+            valid = stats["valid"]
+            for option, count in stats["counts"].items():
+                append((T(option), "%3.1f%%" % round((100.0 * count) / valid, 1)))
+
+        elif qtype == "MultiOption":
+            valid = stats["valid"]
+            for option, count in stats["counts"].items():
+                append((T(option), "%.1f%%" % ((100.0 * count) / valid)))
+
+        return TABLE([TR(TD(B(label)), TD(value)) for label, value in result])
+
+    # -------------------------------------------------------------------------
+    def grouped_sum(self, question_id, group_question_id):
+        """
+            Sum up the numeric answers for a question, grouped by the
+            answers to another question (see S3AbstractAnalysis.groupData
+            and S3NumericAnalysis.filter)
+
+            @param question_id: the survey_question record ID of the
+                                numeric question
+            @param group_question_id: the survey_question record ID of
+                                      the question to group by
+
+            @return: tuple (groups, totals)
+        """
+
+        columns = self.columns
+
+        column = columns.get(question_id)
+        values = dict(zip(column[1], column[2])) if column else {}
+
+        totals = {}
+        column = columns.get(group_question_id)
+        if column:
+            for complete_id, group in zip(column[1], column[2]):
+                total = totals.get(group, 0)
+                if complete_id in values:
+                    try:
+                        total += float(values[complete_id])
+                    except (TypeError, ValueError):
+                        pass
+                totals[group] = total
+
+        return list(totals.keys()), list(totals.values())
+
 # =============================================================================
 class survey_S3AnalysisPriority():
     """ @todo: docstring """
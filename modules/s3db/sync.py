@@ -1067,6 +1067,11 @@ class SyncTaskModel(S3Model):
                            writable = False,
                            represent = s3_datetime_represent,
                            ),
+                     # Checkpoint of an incomplete paged pull
+                     Field("pull_cursor",
+                           readable = False,
+                           writable = False,
+                           ),
                      Field("last_push", "datetime",
                            label = T("Last push on"),
                            readable = True,
@@ -27,11 +27,19 @@
     OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import datetime
 import logging
+import os
+import re
 import sys
+import time
+
+from collections import deque
 
 from gluon import current
 
+from s3compat import basestring
+
 # =============================================================================
 class S3Log(object):
     """
@@ -359,4 +367,365 @@ class S3LogRecorder(object):
         if on:
             self.listen()
 
+# =============================================================================
+class S3SQLProfiler(object):
+    """
+        Opt-in SQL profiler, records all SQL statements executed during
+        a request with duration, row count and the originating call site
+
+        Activated in 000_config.py:
+
+            settings.log.sql_profile = True
+
+        Set up per request in models/00_db.py, then:
+
+            - current.sql_profile is the profile of the current request
+            - the rolling log of slow queries, and the profiles of the
+              most recent requests can be viewed in admin/sql_profile
+            - in debug mode, the developer toolbar shows the profile
+              of the current request
+    """
+
+    # Maximum number of statements to record per request (beyond that,
+    # statements are only counted)
+    MAX_STATEMENTS = 2000
+
+    # Rolling logs, shared by all requests of this process
+    slow_queries = deque(maxlen=100)
+    recent = deque(maxlen=20)
+
+    # Patterns for statement fingerprints
+    FINGERPRINT = ((re.compile(r"'(?:[^']|'')*'"), "?"),
+                   (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+                   (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?)"),
+                   (re.compile(r"\s+"), " "),
+                   )
+
+    def __init__(self, url=None, slow=0.5, repeat=10):
+        """
+            Constructor
+
+            @param url: the URL of the request
+            @param slow: the minimum duration (seconds) of slow queries
+            @param repeat: the minimum number of executions of the same
+                           statement from the same call site to flag it
+                           as a potential N+1 problem
+        """
+
+        self.url = url
+        self.start = datetime.datetime.utcnow()
+        self.slow = slow
+        self.repeat = repeat
+
+        self.statements = []
+        self.count = 0
+        self.duration = 0.0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setup(cls, db):
+        """
+            Start profiling the current request (if enabled)
+
+            @param db: the DAL instance
+        """
+
+        settings = current.deployment_settings
+        if not settings.get_log_sql_profile():
+            current.sql_profile = None
+            return
+
+        handlers = getattr(db, "execution_handlers", None)
+        if handlers is None:
+            # pyDAL version without execution handlers
+            current.log.warning("SQL profiler not supported by this DAL")
+            current.sql_profile = None
+            return
+        if S3SQLProfileHandler not in handlers:
+            handlers.append(S3SQLProfileHandler)
+
+        profile = cls(url = current.request.url,
+                      slow = settings.get_log_sql_slow(),
+                      repeat = settings.get_log_sql_repeat(),
+                      )
+        cls.recent.append(profile)
+        current.sql_profile = profile
+
+    # -------------------------------------------------------------------------
+    def record(self, sql, duration, rowcount=None):
+        """
+            Record an executed statement
+
+            @param sql: the SQL
+            @param duration: the duration of the execution (seconds)
+            @param rowcount: the number of rows returned or affected,
+                             if reported by the driver
+        """
+
+        self.count += 1
+        self.duration += duration
+
+        slow = duration >= self.slow
+        if len(self.statements) >= self.MAX_STATEMENTS and not slow:
+            return
+
+        if rowcount is not None and rowcount < 0:
+            rowcount = None
+        entry = {"sql": sql,
+                 "fingerprint": self.fingerprint(sql),
+                 "duration": duration,
+                 "rows": rowcount,
+                 "site": self.call_site(),
+                 }
+        if len(self.statements) < self.MAX_STATEMENTS:
+            self.statements.append(entry)
+
+        if slow:
+            entry = dict(entry, url=self.url, time=datetime.datetime.utcnow())
+            self.slow_queries.append(entry)
+            current.log.warning("Slow query (%.3fs) from %s" % \
+                                (duration, self.site_represent(entry["site"])),
+                                sql)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def fingerprint(cls, sql):
+        """
+            Reduce a SQL statement to its structure, i.e. without literals
+
+            @param sql: the SQL
+
+            @return: the fingerprint (str)
+        """
+
+        for pattern, replacement in cls.FINGERPRINT:
+            sql = pattern.sub(replacement, sql)
+        return sql.strip()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def call_site():
+        """
+            Find the S3 call site of the current statement
+
+            @return: dict with the items
+                        - caller: (filename, lineno, function) of the
+                                  innermost application frame
+                        - resource: the tablename of the nearest resource,
+                                    represent or method instance
+                        - method: the S3Request method
+                        - representation: the S3Request representation
+        """
+
+        site = {"caller": None,
+                "resource": None,
+                "method": None,
+                "representation": None,
+                }
+
+        frame = sys._getframe(1)
+        depth = 0
+        while frame is not None and depth < 100:
+            filename = frame.f_code.co_filename
+            if site["caller"] is None and \
+               "pydal" not in filename and \
+               "s3log" not in filename and \
+               os.sep + "gluon" + os.sep not in filename:
+                site["caller"] = (filename,
+                                  frame.f_lineno,
+                                  frame.f_code.co_name,
+                                  )
+
+            f_locals = frame.f_locals
+            if site["resource"] is None:
+                instance = f_locals.get("self")
+                tablename = getattr(instance, "tablename", None)
+                if tablename and isinstance(tablename, basestring):
+                    site["resource"] = "%s.%s" % (tablename,
+                                                  type(instance).__name__)
+
+            r = f_locals.get("r")
+            if r is not None and type(r).__name__ == "S3Request":
+                site["method"] = r.method
+                site["representation"] = r.representation
+                break
+
+            frame = frame.f_back
+            depth += 1
+
+        if site["representation"] is None:
+            site["representation"] = current.request.extension
+
+        return site
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def site_represent(site):
+        """
+            Represent a call site as string
+
+            @param site: the call site dict (see call_site)
+        """
+
+        caller = site["caller"]
+        if caller:
+            caller = "%s:%s %s" % caller
+        else:
+            caller = "-"
+        details = [item for item in (site["resource"],
+                                     site["method"],
+                                     site["representation"],
+                                     ) if item]
+        if details:
+            return "%s (%s)" % (caller, ", ".join(details))
+        return caller
+
+    # -------------------------------------------------------------------------
+    def summary(self):
+        """
+            Summarise the statements of this request
+
+            @return: dict with the items
+                        - count: number of statements
+                        - duration: total duration (seconds)
+                        - statements: list of dicts with the items
+                                      fingerprint, count, duration, rows and
+                                      sites, ordered by total duration
+                        - repeated: the subset of statements executed at
+                                    least <repeat> times from the same
+                                    call site (potential N+1 problems)
+        """
+
+        site_represent = self.site_represent
+
+        groups = {}
+        for entry in self.statements:
+            fingerprint = entry["fingerprint"]
+            group = groups.get(fingerprint)
+            if group is None:
+                group = groups[fingerprint] = {"fingerprint": fingerprint,
+                                               "count": 0,
+                                               "duration": 0.0,
+                                               "rows": 0,
+                                               "sites": {},
+                                               }
+            group["count"] += 1
+            group["duration"] += entry["duration"]
+            if entry["rows"]:
+                group["rows"] += entry["rows"]
+            site = site_represent(entry["site"])
+            group["sites"][site] = group["sites"].get(site, 0) + 1
+
+        statements = sorted(groups.values(),
+                            key = lambda group: group["duration"],
+                            reverse = True,
+                            )
+        repeated = [group for group in statements
+                    if max(group["sites"].values()) >= self.repeat]
+
+        return {"count": self.count,
+                "duration": self.duration,
+                "statements": statements,
+                "repeated": repeated,
+                }
+
+    # -------------------------------------------------------------------------
+    def html(self):
+        """
+            Render the summary of this request as HTML
+
+            @return: a DIV
+        """
+
+        from gluon import DIV, H4, PRE, TABLE, TD, TH, TR
+
+        summary = self.summary()
+        repeated = set(group["fingerprint"] for group in summary["repeated"])
+
+        header = TR(TH("Count"), TH("Time"), TH("Rows"), TH("Statement"), TH("Call Sites"))
+        rows = [header]
+        for group in summary["statements"]:
+            sites = ["%s x %s" % (count, site)
+                     for site, count in group["sites"].items()]
+            rows.append(TR(TD(group["count"]),
+                           TD("%.2fms" % (group["duration"] * 1000)),
+                           TD(group["rows"]),
+                           TD(PRE(group["fingerprint"])),
+                           TD(PRE("\n".join(sites))),
+                           _class = "sql-repeated" \
+                                    if group["fingerprint"] in repeated else None,
+                           ))
+
+        title = "%s: %s statements, %.2fms, %s repeated" % \
+                (self.url,
+                 summary["count"],
+                 summary["duration"] * 1000,
+                 len(repeated),
+                 )
+        return DIV(H4(title), TABLE(*rows), _class="sql-profile")
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def slow_html(cls):
+        """
+            Render the rolling slow query log as HTML
+
+            @return: a TABLE
+        """
+
+        from gluon import PRE, TABLE, TD, TH, TR
+
+        rows = [TR(TH("Time"), TH("Duration"), TH("URL"), TH("Statement"), TH("Call Site"))]
+        for entry in reversed(cls.slow_queries):
+            rows.append(TR(TD(entry["time"].strftime("%Y-%m-%d %H:%M:%S")),
+                           TD("%.2fms" % (entry["duration"] * 1000)),
+                           TD(entry["url"]),
+                           TD(PRE(entry["sql"])),
+                           TD(PRE(cls.site_represent(entry["site"]))),
+                           ))
+        return TABLE(*rows, _class="sql-slow-queries")
+
+# =============================================================================
+class S3SQLProfileHandler(object):
+    """
+        DAL execution handler to feed statements into the SQL profile
+        of the current request, see S3SQLProfiler
+    """
+
+    def __init__(self, adapter):
+        """
+            Constructor
+
+            @param adapter: the DAL adapter
+        """
+
+        self.adapter = adapter
+        self.start = None
+
+    # -------------------------------------------------------------------------
+    def before_execute(self, command):
+        """
+            Called before the execution of a statement
+
+            @param command: the SQL
+        """
+
+        self.start = time.time()
+
+    # -------------------------------------------------------------------------
+    def after_execute(self, command):
+        """
+            Called after the execution of a statement
+
+            @param command: the SQL
+        """
+
+        duration = time.time() - self.start
+
+        profile = getattr(current, "sql_profile", None)
+        if profile is not None:
+            cursor = getattr(self.adapter, "cursor", None)
+            rowcount = getattr(cursor, "rowcount", None)
+            profile.record(command, duration, rowcount)
+
 # END =========================================================================
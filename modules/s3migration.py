@@ -146,6 +146,7 @@ class S3Migration(object):
 
         (db_type, db_string, pool_size) = settings.get_database_string()
         self.db_engine = db_type
+        self.db_string = db_string
 
         # Get a handle to the database
         self.db = DAL(db_string,
@@ -155,6 +156,9 @@ class S3Migration(object):
                       migrate_enabled=True,
                       )
 
+        # Folder for the backup database (removed by post)
+        self.backup_folder = "%s/databases/backup" % folder
+
     # -------------------------------------------------------------------------
     def prep(self, moves=None,
                    news=None,
@@ -222,134 +226,303 @@ class S3Migration(object):
         self.db.commit()
 
     # -------------------------------------------------------------------------
-    def backup(self):
+    def backup(self, chunk_size=10000, workers=4):
         """
-            Backup the database to a local SQLite database
-
-            @ToDo: Option to use a temporary DB in Postgres/MySQL as this takes
-                   too long for a large DB
+            Backup the tables and columns which the migration touches
+            to a local SQLite database
+
+            - tables are copied in chunks ordered by primary key, using
+              bulk inserts, and the progress is committed with each chunk,
+              so that an interrupted backup resumes where it left off
+            - independent tables are read in parallel, each reader using
+              its own database connection
+            - a complete backup with the same scope is reused when
+              re-running prep after a failure; the backup is removed when
+              post has completed, so the next migration starts afresh
+              (remove the databases/backup folder to enforce a fresh
+              backup after a failed migration)
+
+            @param chunk_size: the number of rows per chunk
+            @param workers: the number of parallel readers
         """
 
-        moves = self.moves
-        news = self.news
-        strints = self.strints
-        strbools = self.strbools
-        if not moves and not news and not strbools and not strints:
+        tables = self.backup_tables()
+        if not tables:
             # Nothing to backup
             return
 
-        import os
+        import hashlib
+        import json
 
         db = self.db
-        folder = "%s/databases/backup" % current.request.folder
-
-        # Create clean folder for the backup
-        if os.path.exists(folder):
-            shutil.rmtree(folder)
-            import time
-            time.sleep(1)
-        os.mkdir(folder)
+        folder = self.backup_folder
+
+        # Scope of the backup
+        scope = json.dumps(sorted((tn, sorted(fn)) for tn, fn in tables.items()))
+        signature = hashlib.sha1(scope.encode("utf-8")).hexdigest()
+
+        # Resume previous backup with the same scope?
+        signature_file = os.path.join(folder, "backup.sig")
+        resume = False
+        if os.path.exists(signature_file):
+            with open(signature_file, "r") as f:
+                resume = f.read().strip() == signature
+        if not resume:
+            # Create clean folder for the backup
+            if os.path.exists(folder):
+                shutil.rmtree(folder)
+                import time
+                time.sleep(1)
+            os.mkdir(folder)
 
         # Setup backup database
         db_bak = DAL("sqlite://backup.db", folder=folder, adapter_args={"foreign_keys": False})
 
-        # Copy Table structure
-        skip = []
-        for tablename in db.tables:
-            if tablename == "gis_location":
-                table = db[tablename]
-                fields = [table[field] for field in table.fields if field != "the_geom"]
-                try:
-                    db_bak.define_table(tablename, *fields)
-                except KeyError:
-                    # Can't resolve reference yet
-                    # Cleanup
-                    del db_bak[tablename]
-                    # Try later
-                    skip.append(tablename)
-            else:
-                try:
-                    db_bak.define_table(tablename, db[tablename])
-                except KeyError:
-                    # Can't resolve reference yet
-                    # Cleanup
-                    del db_bak[tablename]
-                    # Try later
-                    skip.append(tablename)
-        while skip:
-            _skip = []
-            for tablename in skip:
-                if tablename == "gis_location":
-                    table = db[tablename]
-                    fields = [table[field] for field in table.fields if field != "the_geom"]
-                    try:
-                        db_bak.define_table(tablename, *fields)
-                    except KeyError:
-                        # Can't resolve reference yet
-                        # Cleanup
-                        del db_bak[tablename]
-                        # Try later
-                        _skip.append(tablename)
-                    except:
-                        import sys
-                        sys.stderr.write("Skipping %s: %s\n" % (tablename, sys.exc_info()[1]))
-                else:
-                    try:
-                        db_bak.define_table(tablename, db[tablename])
-                    except KeyError:
-                        # Can't resolve reference yet
-                        # Cleanup
-                        del db_bak[tablename]
-                        # Try later
-                        _skip.append(tablename)
-                    except:
-                        import sys
-                        sys.stderr.write("Skipping %s: %s\n" % (tablename, sys.exc_info()[1]))
-            skip = _skip
+        # Copy Table structure (only the required columns, and without
+        # foreign keys, so that the order of definition doesn't matter)
+        for tablename, fieldnames in tables.items():
+            table = db[tablename]
+            fields = [self.backup_field(table[fn]) for fn in table.fields if fn in fieldnames]
+            db_bak.define_table(tablename, *fields)
+
+        progress = db_bak.define_table("migration_backup",
+                                       Field("tablename", length=128),
+                                       Field("last_id", "bigint"),
+                                       Field("done", "boolean"),
+                                       )
+        if not resume:
+            db_bak.commit()
+            with open(signature_file, "w") as f:
+                f.write(signature)
+
+        # Which tables remain to be copied, and from which key onwards?
+        status = {}
+        for row in db_bak(progress.id > 0).select(progress.tablename,
+                                                 progress.last_id,
+                                                 progress.done,
+                                                 ):
+            status[row.tablename] = (row.last_id, row.done)
+        pending = []
+        for tablename in sorted(tables):
+            last_id, done = status.get(tablename, (0, False))
+            if done:
+                continue
+            if tablename not in status:
+                progress.insert(tablename = tablename,
+                                last_id = 0,
+                                done = False,
+                                )
+            pending.append((tablename, tables[tablename], last_id))
+        db_bak.commit()
+
+        # Copy Data
+        for tablename, records, last_id, done in self.backup_chunks(pending,
+                                                                    chunk_size,
+                                                                    workers,
+                                                                    ):
+            if records:
+                db_bak[tablename].bulk_insert(records)
+            db_bak(progress.tablename == tablename).update(last_id = last_id,
+                                                           done = done,
+                                                           )
+            # Commit each chunk together with the progress
+            db_bak.commit()
+
+        # Pass handle back to other functions
+        self.db_bak = db_bak
+
+    # -------------------------------------------------------------------------
+    def backup_tables(self):
+        """
+            Determine which tables and columns the migration touches
+
+            @return: dict {tablename: set of fieldnames}
+        """
+
+        db = self.db
+
+        moves = self.moves
+        news = self.news
+        strints = self.strints
+        strbools = self.strbools
+
+        tables = {}
+        def add(tablename, *fieldnames):
+            if tablename not in db.tables:
+                return
+            table = db[tablename]
+            names = tables.get(tablename)
+            if names is None:
+                names = tables[tablename] = {table._id.name}
+            for fieldname in fieldnames:
+                if isinstance(fieldname, (tuple, list)):
+                    fieldname = fieldname[0]
+                if fieldname in table.fields:
+                    names.add(fieldname)
 
-        # Which tables do we need to backup?
-        tables = []
         if moves:
             for tablename in moves:
-                tables.append(tablename)
+                fieldname, new_tablename, link_fieldname = moves[tablename]
+                add(tablename, fieldname, link_fieldname)
         if news:
             for tablename in news:
                 new = news[tablename]
-                for t in new["tables"]:
-                    tables.append(t)
-                for s in new["supers"]:
-                    tables.append(s)
+                lookup_field = new["lookup_field"]
+                _tables = new["tables"]
+                for t in _tables:
+                    add(t, lookup_field, "deleted", *_tables[t])
+                supers = new["supers"]
+                for s in supers:
                     stable = db[s]
-                    rows = db(stable._id > 0).select(stable.instance_type)
+                    superkey = stable._id.name
+                    add(s, "instance_type", "deleted")
+                    rows = db(stable._id > 0).select(stable.instance_type,
+                                                     distinct = True,
+                                                     )
                     instance_types = {r.instance_type for r in rows}
                     for t in instance_types:
-                        tables.append(t)
+                        add(t, superkey, lookup_field, *supers[s])
         if strbools:
-            for tablename, fieldname in strints:
-                tables.append(tablename)
+            for tablename, fieldname in strbools:
+                add(tablename, fieldname)
         if strints:
             for tablename, fieldname in strints:
-                tables.append(tablename)
+                add(tablename, fieldname)
 
-        # Remove duplicates
-        tables = set(tables)
+        return tables
 
-        # Copy Data
-        import csv
-        csv.field_size_limit(2**20 * 100)  # 100 megs
-        for tablename in tables:
-            filename = "%s/%s.csv" % (folder, tablename)
-            file = open(filename, "w")
-            rows = db(db[tablename].id > 0).select()
-            rows.export_to_csv_file(file)
-            file.close()
-            file = open(filename, "r")
-            db_bak[tablename].import_from_csv_file(file, unique="uuid2") # uuid2 designed to not hit!
-            file.close()
-            db_bak.commit()
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def backup_field(field):
+        """
+            Clone a field for the backup database, with references
+            reduced to plain integers
 
-        # Pass handle back to other functions
-        self.db_bak = db_bak
+            @param field: the Field
+
+            @return: the Field for the backup table
+        """
+
+        ftype = field.type
+        if ftype.startswith("reference"):
+            ftype = "integer"
+        elif ftype.startswith("big-reference"):
+            ftype = "bigint"
+        elif ftype.startswith("list:reference"):
+            ftype = "list:integer"
+        elif ftype.startswith(("geometry", "geography")):
+            # Not supported by SQLite
+            ftype = "text"
+
+        return Field(field.name, ftype, length=field.length)
+
+    # -------------------------------------------------------------------------
+    def backup_chunks(self, tables, chunk_size, workers):
+        """
+            Read the tables to backup in chunks
+
+            @param tables: list of tuples (tablename, fieldnames, last_id)
+            @param chunk_size: the number of rows per chunk
+            @param workers: the number of parallel readers
+
+            @return: generator of tuples (tablename, records, last_id, done)
+        """
+
+        read = self.read_chunks
+
+        if workers < 2 or len(tables) < 2:
+            for tablename, fieldnames, last_id in tables:
+                for chunk in read(self.db, tablename, fieldnames, last_id, chunk_size):
+                    yield chunk
+            return
+
+        import threading
+        try:
+            from queue import Queue, Empty
+        except ImportError:
+            # Python 2
+            from Queue import Queue, Empty
+
+        tasks = Queue()
+        for task in tables:
+            tasks.put(task)
+
+        # Bounded, so readers don't run too far ahead of the writer
+        chunks = Queue(maxsize = 2 * workers)
+
+        db_string = self.db_string
+        db_folder = self.db._folder
+
+        def reader():
+            db = None
+            try:
+                db = DAL(db_string,
+                         folder = db_folder,
+                         auto_import = True,
+                         migrate_enabled = False,
+                         )
+                while True:
+                    try:
+                        tablename, fieldnames, last_id = tasks.get_nowait()
+                    except Empty:
+                        break
+                    for chunk in read(db, tablename, fieldnames, last_id, chunk_size):
+                        chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                if db is not None:
+                    db.close()
+                chunks.put(None)
+
+        readers = []
+        for i in range(min(workers, len(tables))):
+            thread = threading.Thread(target=reader)
+            thread.daemon = True
+            thread.start()
+            readers.append(thread)
+
+        active = len(readers)
+        while active:
+            chunk = chunks.get()
+            if chunk is None:
+                active -= 1
+            elif isinstance(chunk, Exception):
+                raise chunk
+            else:
+                yield chunk
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def read_chunks(db, tablename, fieldnames, last_id, chunk_size):
+        """
+            Read a table in chunks ordered by primary key
+
+            @param db: the database to read from
+            @param tablename: the table name
+            @param fieldnames: the names of the fields to read
+            @param last_id: read records with a primary key greater than this
+            @param chunk_size: the number of rows per chunk
+
+            @return: generator of tuples (tablename, records, last_id, done)
+        """
+
+        table = db[tablename]
+        key = table._id
+        fields = [table[fn] for fn in table.fields if fn in fieldnames]
+
+        while True:
+            rows = db(key > last_id).select(orderby = key,
+                                            limitby = (0, chunk_size),
+                                            cacheable = True,
+                                            *fields)
+            records = [row.as_dict() for row in rows]
+            if records:
+                last_id = records[-1][key.name]
+            done = len(records) < chunk_size
+            yield (tablename, records, last_id, done)
+            if done:
+                break
 
     # -------------------------------------------------------------------------
     def pull(self, version=None):
@@ -555,7 +728,7 @@ class S3Migration(object):
         # @ToDo: Do prepops of new tables
 
         # Restore data from backup
-        folder = "%s/databases/backup" % current.request.folder
+        folder = self.backup_folder
         db_bak = DAL("sqlite://backup.db",
                      folder=folder,
                      auto_import=True,
@@ -696,6 +869,16 @@ class S3Migration(object):
 
         db.commit()
 
+        # Migration complete => remove the backup, so that it doesn't
+        # get reused by the next migration with the same scope
+        db_bak.close()
+        if getattr(self, "db_bak", None) is not None:
+            # Handle from backup()
+            self.db_bak.close()
+            self.db_bak = None
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def to_bool(value):
@@ -1122,37 +1305,72 @@ class S3Migration(object):
     def update_field_by_mapping(db,
                                 tablename,
                                 field_to_update,
-                                mapping_function):
+                                mapping_function,
+                                chunk_size=10000,
+                                start=0):
         """
             Update the values of an existing field according to the mappings given through the mapping_function
             - currently unused
+            - rows are processed in chunks of primary key ranges, and all rows of a chunk
+              which map to the same value are updated with a single query
+            - each chunk is committed, so an interrupted update can be restarted after the
+              last reported key
 
             @param db               : database instance
             @param tablename        : name of the original table in which the new unique field id added
             @param field_to_update  : name of the field to be updated according to the mapping
             @param mapping_function : class instance containing the mapping functions
+            @param chunk_size       : size of the primary key ranges to process at a time
+            @param start            : restart after this primary key
         """
 
-        fields = mapping_function.fields(db)
         table = db[tablename]
-        if table["id"] not in fields:
-            fields.append(table["id"])
-        rows = db(mapping_function.query(db)).select(*fields)
-        if rows:
-            try:
-                rows[0][tablename]["id"]
-                row_single_layer = False
-            except KeyError:
-                row_single_layer = True
-        dict_update = {}
-        for row in rows:
-            if not row_single_layer:
-                row_id = row[tablename]["id"]
-            else:
-                row_id = row["id"]
-            changed_value = mapping_function.mapping(row)
-            dict_update[field_to_update] = changed_value
-            db(table["id"] == row_id).update(**dict_update)
+        key = table._id
+        fields = mapping_function.fields(db)
+        if str(key) not in [str(field) for field in fields]:
+            fields.append(key)
+
+        query = mapping_function.query(db)
+        maximum = key.max()
+        row = db(query).select(maximum).first()
+        end = row[maximum] if row else None
+        if not end:
+            return
+
+        row_single_layer = None
+        while start < end:
+            stop = start + chunk_size
+            rows = db(query & (key > start) & (key <= stop)).select(*fields)
+
+            # Map the rows
+            values = {}
+            for row in rows:
+                if row_single_layer is None:
+                    try:
+                        row[tablename][key.name]
+                        row_single_layer = False
+                    except KeyError:
+                        row_single_layer = True
+                if not row_single_layer:
+                    row_id = row[tablename][key.name]
+                else:
+                    row_id = row[key.name]
+                values[row_id] = mapping_function.mapping(row)
+
+            # Update all rows with the same new value at once
+            groups = {}
+            for row_id, value in values.items():
+                try:
+                    groups.setdefault(value, []).append(row_id)
+                except TypeError:
+                    # Unhashable value
+                    db(key == row_id).update(**{field_to_update: value})
+            for value, row_ids in groups.items():
+                db(key.belongs(row_ids)).update(**{field_to_update: value})
+
+            db.commit()
+            S3Migration._progress(tablename, min(stop, end), end)
+            start = stop
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1202,35 +1420,103 @@ class S3Migration(object):
                         new_field)
 
     # -------------------------------------------------------------------------
-    @staticmethod
-    def _fill_the_new_table(tablename_new,
+    def _fill_the_new_table(self,
+                            tablename_new,
                             new_list_field,
                             list_field_name,
                             table_old_id_field,
-                            tablename_old):
+                            tablename_old,
+                            chunk_size=10000):
         """
             This function is used in the list_field_to_reference migration.
             For each value in the list field for each record in the original table,
             they create one record in the new table that points back to the original record.
 
+            The original table is processed in chunks of id ranges, with multi-row inserts,
+            and each chunk is committed. If interrupted, this function restarts after the
+            last original record found in the new table.
+
             @param tablename_new      : name of the new table to which the list field needs to migrated
             @param new_list_field     : name of the field in the new table which will hold the content of the list field
             @param list_field_name    : name of the list field in the original table
             @param table_old_id_field : name of the id field in the original table
             @param tablename_old      : name of the original table
+            @param chunk_size         : size of the id ranges to process at a time
         """
 
-        db = current.db
+        db = self.db
 
-        update_dict = {}
         table_old = db[tablename_old]
         table_new = db[tablename_new]
-        for row in db().select(table_old[table_old_id_field],
-                               table_old[list_field_name]):
-            for element in row[list_field_name]:
-                update_dict[new_list_field] = element
-                update_dict["%s_%s" % (tablename_old, table_old_id_field)] = row[table_old_id_field]
-                table_new.insert(**update_dict)
+        old_id = table_old[table_old_id_field]
+        link_fieldname = "%s_%s" % (tablename_old, table_old_id_field)
+        link = table_new[link_fieldname]
+
+        # Restart after the last original record already in the new table
+        maximum = link.max()
+        start = db(link != None).select(maximum).first()[maximum] or 0
+
+        maximum = old_id.max()
+        end = db(old_id != None).select(maximum).first()[maximum] or 0
+
+        columns = (link_fieldname, new_list_field)
+        while start < end:
+            stop = start + chunk_size
+            query = (old_id > start) & (old_id <= stop)
+            values = []
+            for row in db(query).select(old_id, table_old[list_field_name]):
+                elements = row[list_field_name]
+                if elements:
+                    record_id = row[table_old_id_field]
+                    values.extend((record_id, element) for element in elements)
+            if values:
+                self._insert_rows(tablename_new, columns, values)
+            db.commit()
+            self._progress(tablename_new, min(stop, end), end)
+            start = stop
+
+    # -------------------------------------------------------------------------
+    def _insert_rows(self, tablename, fieldnames, rows):
+        """
+            Insert multiple rows into a table with multi-row INSERT statements
+
+            @param tablename  : name of the table
+            @param fieldnames : names of the columns
+            @param rows       : list of tuples with the values in column order
+        """
+
+        if self.db_engine == "sqlite":
+            placeholder = "?"
+        else:
+            placeholder = "%s"
+        row = "(%s)" % ",".join([placeholder] * len(fieldnames))
+
+        # Stay below the maximum number of variables per statement in SQLite
+        batch_size = max(1, 900 // len(fieldnames))
+
+        executesql = self.db.executesql
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            sql = "INSERT INTO %(tablename)s (%(fieldnames)s) VALUES %(rows)s;" % \
+                dict(tablename = tablename,
+                     fieldnames = ",".join(fieldnames),
+                     rows = ",".join([row] * len(batch)),
+                     )
+            executesql(sql, placeholders=[value for values in batch for value in values])
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _progress(label, position, total):
+        """
+            Report the progress of a data migration
+
+            @param label    : label for the migration step (e.g. the table name)
+            @param position : the position reached
+            @param total    : the total to reach
+        """
+
+        import sys
+        sys.stderr.write("%s: %s/%s\n" % (label, position, total))
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -1270,12 +1556,9 @@ class S3Migration(object):
             @param db : database instance
         """
 
-        dict_update = {}
-        field_old = db[tablename][fieldname_old]
-        for row in db().select(field_old):
-            dict_update[fieldname_new] = row[fieldname_old]
-            query = (field_old == row[fieldname_old])
-            db(query).update(**dict_update)
+        table = db[tablename]
+        # Single UPDATE ... SET new = old
+        db(table._id > 0).update(**{fieldname_new: table[fieldname_old]})
 
     # -------------------------------------------------------------------------
     @staticmethod
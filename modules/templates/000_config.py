@@ -43,6 +43,9 @@ settings.base.template = "default"
 #settings.database.password = "password"
 # Uncomment to use a different pool size
 #settings.database.pool_size = 30
+# Uncomment to record column usage in queries, for index recommendations
+# (see static/scripts/tools/indexes.py)
+#settings.database.index_advisor = True
 # Do we have a spatial DB available? (currently supports PostGIS. Spatialite to come.)
 #settings.gis.spatialdb = True
 
@@ -76,6 +79,12 @@ settings.base.debug = False
 #settings.log.logfile = None
 # Uncomment to get detailed caller information
 #settings.log.caller_info = True
+# Uncomment to profile SQL statements per request (view in admin/sql_profile)
+#settings.log.sql_profile = True
+# Minimum duration (seconds) of SQL statements to log as slow queries
+#settings.log.sql_slow = 0.5
+# Minimum number of repeated statements from the same call site to flag as N+1
+#settings.log.sql_repeat = 10
 
 # Uncomment to use Content Delivery Networks to speed up Internet-facing sites
 #settings.base.cdn = True
@@ -250,6 +259,14 @@ settings.import_template()
 # Production instances should set this before prepopulate is run
 #settings.base.prepopulate_demo = 0
 
+# Run independent prepopulate import tasks in parallel worker processes
+# (not with SQLite)
+#settings.base.prepopulate_workers = 4
+
+# Restore the database from a snapshot if the template data have not
+# changed since the last first run (e.g. for CI/test instances)
+#settings.base.prepopulate_snapshot = True
+
 # After 1st_run, set this for Production to save 1x DAL hit/request
 #settings.base.prepopulate = 0
 
@@ -158,13 +158,15 @@ class IDCardLayout(S3PDFCardLayout):
             # Get the profile picture
             pictures = common.get("pictures")
             if pictures:
-                picture = pictures.get(raw["pr_person.pe_id"])
+                pe_id = raw["pr_person.pe_id"]
+                picture = pictures.get(pe_id)
                 if picture:
                     self.draw_image(picture, RIGHT, TOP,
                                     width = 60,
                                     height = 55,
                                     valign = "middle",
                                     halign = "center",
+                                    key = pe_id,
                                     )
 
             # Center fields in reverse order so that vertical positions
@@ -219,7 +221,8 @@ class IDCardLayout(S3PDFCardLayout):
                                              raw["pr_person.last_name"] or "",
                                              )
                 self.draw_qrcode(identity, CENTER, MIDDLE,
-                                 size=60, halign="center", valign="center")
+                                 size=60, halign="center", valign="center",
+                                 key=raw["pr_person.pe_id"])
             # Barcode
             if code:
                 self.draw_barcode(s3_str(code), CENTER, BOTTOM,
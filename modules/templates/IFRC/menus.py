@@ -26,8 +26,8 @@ class S3MainMenu(default.S3MainMenu):
     def menu(cls):
         """ Compose Menu """
 
-        # Modules menus
-        main_menu = MM()(
+        # Modules menus (rendered from cache)
+        main_menu = MM(cache=True)(
             cls.menu_modules(),
         )
 
@@ -208,13 +208,15 @@ class IDCardLayout(S3PDFCardLayout):
             # Get the profile picture
             pictures = common.get("pictures")
             if pictures:
-                picture = pictures.get(raw["pr_person.pe_id"])
+                pe_id = raw["pr_person.pe_id"]
+                picture = pictures.get(pe_id)
                 if picture:
                     self.draw_image(picture, RIGHT, TOP,
                                     width = 60,
                                     height = 55,
                                     valign = "middle",
                                     halign = "center",
+                                    key = pe_id,
                                     )
 
             # Center fields in reverse order so that vertical positions
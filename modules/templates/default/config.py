@@ -237,10 +237,17 @@ def config(settings):
     #settings.ui.pdf_logo = "static/img/mylogo.png"
     # Maximum number of records in PDF exports (None for unlimited)
     #settings.base.pdf_max_rows = 1000
+    # Number of processes to render PDF cards (e.g. ID cards) in parallel
+    #settings.base.pdf_card_workers = 4
 
     #Uncomment to add a title row to XLS exports
     #settings.base.xls_title_row = True
 
+    # Uncomment to run exports of more than this number of records as
+    # background jobs (requires a scheduler worker), the user can download
+    # the file from a status page once the job is completed
+    #settings.base.export_job_threshold = 5000
+
     # GIS (Map) settings
     # Size of the Embedded Map
     # Change this if-required for your theme
@@ -257,6 +264,8 @@ def config(settings):
     #settings.gis.map_selector = False
     # Show LatLon boxes in the Location Selector
     #settings.gis.latlon_selector = True
+    # Uncomment to use prebuilt location hierarchy bundles in the Location Selector
+    #settings.gis.location_bundles = True
     # Use Building Names as a separate field in Street Addresses?
     #settings.gis.building_name = False
     # Use a non-default fillColor for Clustered points
@@ -414,6 +423,8 @@ def config(settings):
     #settings.ui.autocomplete_delay = 800
     #settings.ui.autocomplete_min_chars = 2
     #settings.ui.filter_auto_submit = 800
+    # Cache menu permission checks (and opted-in menu HTML) for this number of seconds
+    #settings.ui.menu_cache = 3600
     #settings.ui.report_auto_submit = 800
     # Enable this for a UN-style deployment
     #settings.ui.cluster = True
@@ -447,6 +458,8 @@ def config(settings):
     #settings.ui.datatables_pagingType = "bootstrap"
     # Uncomment to restrict the export formats available
     #settings.ui.export_formats = ("kml", "pdf", "rss", "xls", "xml")
+    # Uncomment to offer the XLSX format (no row limit), using the XLS icon
+    #settings.ui.export_formats = ("kml", "pdf", "rss", "xls", ("xlsx", "export_xls"), "xml")
     # Uncomment to change the label/class of FilterForm clear buttons
     #settings.ui.filter_clear = "Clear"
     # Uncomment to include an Interim Save button on CRUD forms
@@ -481,6 +494,8 @@ def config(settings):
     # Sync
     # Uncomment if this deployment exposes public data sets
     #settings.sync.data_repository = True
+    # Maximum number of records per page for peers pulling from this site
+    #settings.sync.page_size = 500
 
     # -------------------------------------------------------------------------
     # Asset
@@ -596,6 +611,13 @@ def config(settings):
     # Disable tracking of effort (=hours spent) for assistance measures
     #settings.br.assistance_track_effort = False
 
+    # -------------------------------------------------------------------------
+    # Climate Data Portal
+    # Uncomment to evaluate map overlays and charts with the in-memory array backend (requires NumPy)
+    #settings.climate.array_backend = True
+    # How long to keep sample tables loaded for the array backend (seconds)
+    #settings.climate.array_cache_time = 3600
+
     # -------------------------------------------------------------------------
     # CMS
     # Uncomment this to hide CMS from module index pages
@@ -1172,6 +1194,8 @@ def config(settings):
     # -------------------------------------------------------------------------
     # Filter Manager
     #settings.search.filter_manager = False
+    # Cache options filter lookups (and option counts) for this number of seconds
+    #settings.search.filter_facets_cache = 300
 
     # if you want to have videos appearing in /default/video
     #settings.base.youtube_id = [dict(id = "introduction",
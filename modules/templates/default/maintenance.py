@@ -28,6 +28,10 @@ class Daily():
         table = s3db.sync_log
         db(table.timestmp < month_past).delete()
 
+        # Cleanup cached card images
+        from s3.codecs.card import S3PDFCardLayout
+        S3PDFCardLayout.cache_cleanup(days=28)
+
         # Cleanup Sessions
         osjoin = os.path.join
         osstat = os.stat
@@ -49,6 +49,28 @@ from s3.s3fields import S3Represent
 from s3.s3parser import S3Parsing
 from s3.s3utils import soundex
 
+# Keywords for search_resource, equivalent keywords in one list
+PRIMARY_KEYWORDS = ("get", "give", "show")
+CONTACT_KEYWORDS = ("email", "mobile", "facility", "clinical",
+                    "security", "phone", "status", "hospital",
+                    "person", "organisation")
+
+def phonetic_lookup(keywords):
+    """
+        Build a lookup table {soundex: keyword}, so that each word of
+        a message needs to be encoded only once
+        - where keywords sound alike, the first one takes precedence
+    """
+
+    lookup = {}
+    for keyword in keywords:
+        lookup.setdefault(soundex(keyword), keyword)
+    return lookup
+
+KEYWORDS = phonetic_lookup(PRIMARY_KEYWORDS + CONTACT_KEYWORDS)
+SOUNDEX_YES = soundex("Yes")
+SOUNDEX_NO = soundex("No")
+
 # =============================================================================
 class S3Parser(object):
     """
@@ -258,22 +280,13 @@ class S3Parser(object):
             - helper function for search_resource, etc
         """
 
-        # Equivalent keywords in one list
-        primary_keywords = ["get", "give", "show"]
-        contact_keywords = ["email", "mobile", "facility", "clinical",
-                            "security", "phone", "status", "hospital",
-                            "person", "organisation"]
+        lookup = KEYWORDS.get
 
-        pkeywords = primary_keywords + contact_keywords
         keywords = message_body.split(" ")
         pquery = []
         name = ""
         for word in keywords:
-            match = None
-            for key in pkeywords:
-                if soundex(key) == soundex(word):
-                    match = key
-                    break
+            match = lookup(soundex(word))
             if match:
                 pquery.append(match)
             else:
@@ -541,11 +554,11 @@ class S3Parser(object):
                 if "SI#" in word and not ireport:
                     report = word.split("#")[1]
                     report_id = int(report)
-                elif (soundex(word) == soundex("Yes")) and report_id \
+                elif (soundex(word) == SOUNDEX_YES) and report_id \
                                                         and not comments:
                     response = True
                     comments = True
-                elif soundex(word) == soundex("No") and report_id \
+                elif soundex(word) == SOUNDEX_NO and report_id \
                                                     and not comments:
                     response = False
                     comments = True
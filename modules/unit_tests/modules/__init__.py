@@ -1 +1,5 @@
+from .climate_cache_tests import *
+from .climate_import_tests import *
 from .s3layouts_tests import *
+from .s3log_tests import *
+from .s3migration_tests import *
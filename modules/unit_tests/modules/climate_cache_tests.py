@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Climate Data Portal Cache Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/modules/climate_cache_tests.py
+#
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from ClimateDataPortal.Cache import TwoStageCache
+except (ImportError, SyntaxError):
+    # ClimateDataPortal requires Python 2
+    TwoStageCache = None
+
+from unit_tests import run_suite
+
+# =============================================================================
+class TwoStageCacheTests(unittest.TestCase):
+    """ Tests for the two-stage file cache """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if TwoStageCache is None:
+            self.skipTest("ClimateDataPortal not available")
+
+        self.folder = tempfile.mkdtemp()
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def generator(size, calls=None, delay=0):
+        """
+            Get a generator function writing a file of a given size
+
+            @param size: the file size (bytes)
+            @param calls: list to record the calls in
+            @param delay: time to take for the generation (seconds)
+        """
+
+        def generate(path):
+            if calls is not None:
+                calls.append(path)
+            if delay:
+                time.sleep(delay)
+            with open(path, "wb") as generated:
+                generated.write(b"x" * size)
+        return generate
+
+    # -------------------------------------------------------------------------
+    def age(self, cache, file_name, seconds):
+        """
+            Set the last access time of a cached file into the past
+
+            @param cache: the TwoStageCache
+            @param file_name: the file name
+            @param seconds: the age (seconds)
+        """
+
+        mtime = time.time() - seconds
+        os.utime(cache.path(file_name), (mtime, mtime))
+
+    # -------------------------------------------------------------------------
+    def testEvictionOrder(self):
+        """ Test that the least recently accessed files are evicted first """
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        cache = TwoStageCache(self.folder, 300, max_memory_item_size=0)
+        generate = self.generator(100)
+
+        for age, file_name in enumerate(("c.png", "b.png", "a.png")):
+            cache.retrieve(file_name, generate)
+            self.age(cache, file_name, 100 * (age + 1))
+
+        # Access the oldest file => becomes the most recent
+        cache.retrieve("a.png", generate)
+
+        # Exceed the budget => least recently accessed file is evicted
+        cache.retrieve("d.png", generate)
+        assertTrue(os.path.exists(cache.path("a.png")))
+        assertFalse(os.path.exists(cache.path("b.png")))
+        assertTrue(os.path.exists(cache.path("c.png")))
+        assertTrue(os.path.exists(cache.path("d.png")))
+
+        self.assertEqual(cache.stats()["disk_evictions"], 1)
+
+    # -------------------------------------------------------------------------
+    def testMemoryFirst(self):
+        """ Test that files in the memory tier are served without disk access """
+
+        assertEqual = self.assertEqual
+
+        cache = TwoStageCache(self.folder, 300)
+        generate = self.generator(100)
+
+        path = cache.retrieve("a.png", generate)
+        cache.open(path).close()
+        self.age(cache, "a.png", 500)
+        mtime = os.stat(path).st_mtime
+
+        # Served from memory => disk file not touched, counted once
+        path = cache.retrieve("a.png", generate)
+        assertEqual(cache.open(path).read(), b"x" * 100)
+        assertEqual(os.stat(path).st_mtime, mtime)
+
+        stats = cache.stats()
+        assertEqual(stats["misses"], 1)
+        assertEqual(stats["memory_hits"], 1)
+        assertEqual(stats["disk_hits"], 0)
+
+        # Files in memory are evicted from disk last (despite their age)
+        for age, file_name in ((50, "b.png"), (20, "c.png")):
+            cache.retrieve(file_name, generate)
+            self.age(cache, file_name, age)
+        cache.retrieve("d.png", generate)
+        self.assertTrue(os.path.exists(cache.path("a.png")))
+        self.assertFalse(os.path.exists(cache.path("b.png")))
+
+    # -------------------------------------------------------------------------
+    def testByteBudget(self):
+        """ Test that the disk tier stays within its byte budget """
+
+        cache = TwoStageCache(self.folder, 1000, max_memory_item_size=0)
+
+        for i in range(30):
+            cache.retrieve("%s.png" % i, self.generator(90 + i))
+
+            total = cache.scan()[0]
+            self.assertTrue(total <= 1000)
+            self.assertEqual(cache.stats()["disk_size"], total)
+
+        # Most recent file is always retained
+        self.assertTrue(os.path.exists(cache.path("29.png")))
+
+        # Files larger than the budget are not retained
+        path = cache.retrieve("large.png", self.generator(2000))
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(cache.scan()[0] <= 1000)
+
+    # -------------------------------------------------------------------------
+    def testConcurrentGeneration(self):
+        """ Test that concurrent requests for the same key generate only once """
+
+        assertEqual = self.assertEqual
+
+        cache = TwoStageCache(self.folder, 10000)
+        calls = []
+        generate = self.generator(100, calls=calls, delay=0.2)
+
+        paths = []
+        def request():
+            paths.append(cache.retrieve("a.png", generate))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assertEqual(len(calls), 1)
+        assertEqual(paths, [cache.path("a.png")] * 8)
+        assertEqual(os.path.getsize(cache.path("a.png")), 100)
+
+        stats = cache.stats()
+        assertEqual(stats["misses"], 1)
+        assertEqual(stats["disk_hits"], 7)
+        assertEqual(stats["disk_size"], 100)
+
+        # No temporary files left behind
+        assertEqual(sorted(name for name in os.listdir(self.folder)
+                           if name != "locks"),
+                    ["a.png"])
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        TwoStageCacheTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#
+# Climate Data Portal Import Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/modules/climate_import_tests.py
+#
+import unittest
+
+from gluon import current
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from ClimateDataPortal import get_or_create_places, undefined_values
+    from ClimateDataPortal.InsertChunksWithoutCheckingForExistingReadings import \
+        InsertChunksWithoutCheckingForExistingReadings
+except (ImportError, SyntaxError):
+    # ClimateDataPortal requires Python 2
+    InsertChunksWithoutCheckingForExistingReadings = None
+
+from unit_tests import run_suite
+
+# =============================================================================
+class ReadingsTable(object):
+    """ Temporary table with the layout of a sample table """
+
+    table_name = "climate_test_readings"
+
+    def __init__(self, db):
+
+        self.db = db
+
+    # -------------------------------------------------------------------------
+    def create(self):
+
+        self.db.executesql("""
+            CREATE TABLE %s
+            (
+              place_id integer NOT NULL,
+              time_period smallint NOT NULL,
+              value double precision NOT NULL,
+              PRIMARY KEY (place_id, time_period)
+            );""" % self.table_name)
+
+    # -------------------------------------------------------------------------
+    def drop(self):
+
+        self.db.executesql("DROP TABLE IF EXISTS %s;" % self.table_name)
+
+    # -------------------------------------------------------------------------
+    def insert_values(self, values):
+
+        self.db.executesql(
+            "INSERT INTO %s (time_period, place_id, value) VALUES %s;" % (
+                self.table_name,
+                ",".join(values),
+            ))
+
+    # -------------------------------------------------------------------------
+    def readings(self):
+        """ Get all readings as list of (time_period, place_id, value) """
+
+        return [tuple(row) for row in self.db.executesql(
+            "SELECT time_period, place_id, value FROM %s "
+            "ORDER BY time_period, place_id;" % self.table_name
+        )]
+
+# =============================================================================
+class ChunkedWriterTests(unittest.TestCase):
+    """ Tests for InsertChunksWithoutCheckingForExistingReadings """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if numpy is None:
+            self.skipTest("NumPy not installed")
+        if InsertChunksWithoutCheckingForExistingReadings is None:
+            self.skipTest("ClimateDataPortal not available")
+
+        self.table = ReadingsTable(current.db)
+        self.table.create()
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        db = current.db
+        db.rollback()
+        self.table.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def writer(self, use_copy):
+        """
+            Get a writer with a small chunk size
+
+            @param use_copy: whether to use COPY rather than INSERT
+        """
+
+        writer = InsertChunksWithoutCheckingForExistingReadings(self.table)
+        writer.chunk_size = 7
+        if use_copy:
+            if not writer.use_copy:
+                self.skipTest("COPY requires PostgreSQL with psycopg2")
+        else:
+            writer.use_copy = False
+        return writer
+
+    # -------------------------------------------------------------------------
+    def write(self, use_copy):
+        """
+            Write readings in several chunks, and verify the result
+
+            @param use_copy: whether to use COPY rather than INSERT
+        """
+
+        assertEqual = self.assertEqual
+
+        writer = self.writer(use_copy)
+
+        # Arrays of a whole time step, spanning chunk boundaries
+        expected = []
+        for time_period in range(3):
+            place_ids = numpy.arange(1, 11, dtype=numpy.int64)
+            values = place_ids * 1.5 + time_period
+            writer.add_readings(time_period, place_ids, values)
+            expected.extend(zip([time_period] * 10,
+                                place_ids.tolist(),
+                                values.tolist(),
+                                ))
+
+        # Lists and single readings
+        writer.add_readings(3, [1, 2], [0.1, -273.15])
+        writer(4, 1, numpy.float32(2.5))
+        expected.extend([(3, 1, 0.1), (3, 2, -273.15), (4, 1, 2.5)])
+
+        # Incomplete chunk is not written before done()
+        assertEqual(writer.count, 30)
+        assertEqual(len(self.table.readings()), 30)
+
+        writer.done()
+        assertEqual(writer.count, 33)
+        assertEqual(writer.chunk, [])
+        assertEqual(self.table.readings(), sorted(expected))
+
+        # done() without pending readings writes nothing
+        writer.done()
+        assertEqual(writer.count, 33)
+
+    # -------------------------------------------------------------------------
+    def testMultiRowInsert(self):
+        """ Test writing readings in chunks with multi-row INSERTs """
+
+        self.write(use_copy=False)
+
+    # -------------------------------------------------------------------------
+    def testCopy(self):
+        """ Test writing readings in chunks with COPY """
+
+        self.write(use_copy=True)
+
+    # -------------------------------------------------------------------------
+    def testUndefinedValues(self):
+        """ Test that missing data markers are masked before writing """
+
+        assertEqual = self.assertEqual
+
+        # As read from a float32 NetCDF variable
+        values = numpy.array([[-99.9, 12.5, numpy.nan],
+                              [1e9, -1e9, 0.0],
+                              [-99.8, 99.9, -100.0],
+                              ], dtype=numpy.float32).astype(numpy.float64)
+        place_ids = numpy.arange(1, 10, dtype=numpy.int64).reshape(3, 3)
+
+        defined = ~undefined_values(values)
+        assertEqual(defined.tolist(), [[False, True, False],
+                                       [False, False, True],
+                                       [True, True, True],
+                                       ])
+
+        writer = self.writer(use_copy=False)
+        writer.add_readings(0, place_ids[defined], values[defined] + 273.15)
+        writer.done()
+
+        readings = self.table.readings()
+        assertEqual([place_id for _, place_id, _ in readings], [2, 6, 7, 8, 9])
+        for (_, place_id, value), expected in zip(readings,
+                                                  values[defined] + 273.15):
+            self.assertAlmostEqual(value, expected)
+
+# =============================================================================
+class PlaceResolutionTests(unittest.TestCase):
+    """ Tests for bulk resolution of grid places """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if numpy is None:
+            self.skipTest("NumPy not installed")
+        if InsertChunksWithoutCheckingForExistingReadings is None:
+            self.skipTest("ClimateDataPortal not available")
+
+        # Grid outside of any imported data
+        self.latitudes = numpy.array([-89.75, -89.5, -89.25],
+                                     dtype=numpy.float32)
+        self.longitudes = numpy.array([-179.75, -179.5], dtype=numpy.float32)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        db = current.db
+        table = current.s3db.climate_place
+        db((table.latitude < -89) & (table.longitude < -179)).delete()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def testGetOrCreatePlaces(self):
+        """ Test that places are created once, and looked up afterwards """
+
+        assertEqual = self.assertEqual
+        latitudes = self.latitudes
+        longitudes = self.longitudes
+
+        # Unknown places are not created on request
+        place_ids = get_or_create_places(latitudes, longitudes, create=False)
+        assertEqual(place_ids.shape, (3, 2))
+        assertEqual(place_ids.tolist(), [[0, 0]] * 3)
+
+        place_ids = get_or_create_places(latitudes, longitudes)
+        assertEqual(place_ids.shape, (3, 2))
+        self.assertTrue((place_ids > 0).all())
+        assertEqual(len(set(place_ids.flatten().tolist())), 6)
+
+        # Places created with the float32 coordinates of the grid
+        table = current.s3db.climate_place
+        row = current.db(table.id == int(place_ids[1][0])).select(
+                                                    table.latitude,
+                                                    table.longitude,
+                                                    limitby = (0, 1),
+                                                    ).first()
+        self.assertAlmostEqual(row.latitude, -89.5)
+        self.assertAlmostEqual(row.longitude, -179.75)
+
+        # Second import finds the existing places
+        assertEqual(get_or_create_places(latitudes, longitudes).tolist(),
+                    place_ids.tolist())
+        assertEqual(get_or_create_places(latitudes[1:], longitudes,
+                                         create=False).tolist(),
+                    place_ids[1:].tolist())
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        ChunkedWriterTests,
+        PlaceResolutionTests,
+    )
+
+# END ========================================================================
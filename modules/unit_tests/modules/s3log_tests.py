@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Log Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/modules/s3log_tests.py
+#
+import unittest
+
+from gluon import current
+from s3log import S3SQLProfiler
+
+from unit_tests import run_suite
+
+# =============================================================================
+class SQLProfilerTests(unittest.TestCase):
+    """ SQL Profiler Tests """
+
+    # -------------------------------------------------------------------------
+    def testFingerprint(self):
+        """ Test statement fingerprints """
+
+        fingerprint = S3SQLProfiler.fingerprint
+
+        a = fingerprint("SELECT org_organisation.name FROM org_organisation WHERE (org_organisation.id = 4);")
+        b = fingerprint("SELECT org_organisation.name  FROM org_organisation WHERE (org_organisation.id = 17);")
+        self.assertEqual(a, b)
+
+        a = fingerprint("SELECT * FROM pr_person WHERE (pr_person.id IN (1,2,3)) AND (pr_person.first_name = 'O''Brien');")
+        b = fingerprint("SELECT * FROM pr_person WHERE (pr_person.id IN (5)) AND (pr_person.first_name = 'Jane');")
+        self.assertEqual(a, b)
+
+    # -------------------------------------------------------------------------
+    def testSummary(self):
+        """ Test request summary and detection of repeated statements """
+
+        profile = S3SQLProfiler(url="/test", slow=100, repeat=3)
+
+        for i in range(3):
+            profile.record("SELECT * FROM org_site WHERE (org_site.id = %s);" % i, 0.001, 1)
+        profile.record("SELECT * FROM org_office;", 0.002, 5)
+
+        summary = profile.summary()
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(len(summary["statements"]), 2)
+
+        repeated = summary["repeated"]
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0]["count"], 3)
+        self.assertEqual(repeated[0]["rows"], 3)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        SQLProfilerTests,
+    )
+
+# END ========================================================================
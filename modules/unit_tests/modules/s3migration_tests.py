@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+#
+# Migration Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/modules/s3migration_tests.py
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from gluon import current, DAL, Field
+from s3migration import S3Migration
+
+from unit_tests import run_suite
+
+# =============================================================================
+class MigrationBackupTests(unittest.TestCase):
+    """ Tests for the migration backup """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        folder = self.folder = tempfile.mkdtemp()
+
+        db_string = "sqlite://storage.db"
+        db = self.db = DAL(db_string, folder=folder)
+        db.define_table("migration_test",
+                        Field("value"),
+                        )
+
+        # Migration without the web2py environment (S3Migration.__init__
+        # would read the database settings from 000_config.py)
+        migration = self.migration = S3Migration.__new__(S3Migration)
+        migration.db = db
+        migration.db_string = db_string
+        migration.backup_folder = os.path.join(folder, "backup")
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        self.db.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    def migrate(self):
+        """
+            Run a migration converting migration_test.value from string
+            to integer (with the field being emptied by the schema change)
+        """
+
+        db = self.db
+        migration = self.migration
+        table = db.migration_test
+
+        strints = [("migration_test", "value")]
+
+        # Prep
+        migration.moves = migration.news = migration.strbools = None
+        migration.strints = strints
+        migration.backup()
+
+        # Schema change
+        db(table.id > 0).update(value=None)
+        db.commit()
+
+        # Post
+        migration.post(strints=strints)
+
+    # -------------------------------------------------------------------------
+    def testMigrateTwice(self):
+        """ Test that a second migration doesn't reuse the first backup """
+
+        assertEqual = self.assertEqual
+
+        db = self.db
+        table = db.migration_test
+
+        ids = [table.insert(value="1"), table.insert(value="2")]
+        db.commit()
+
+        # First migration
+        self.migrate()
+        values = [int(db.migration_test[record_id].value) for record_id in ids]
+        assertEqual(values, [1, 2])
+
+        # Backup removed after post
+        self.assertFalse(os.path.exists(self.migration.backup_folder))
+
+        # Data change, then a second migration with the same scope
+        db(table.id == ids[0]).update(value="5")
+        db(table.id == ids[1]).update(value="6")
+        db.commit()
+
+        self.migrate()
+        values = [int(db.migration_test[record_id].value) for record_id in ids]
+        assertEqual(values, [5, 6])
+
+# =============================================================================
+class ParityMapping(object):
+    """ Mapping function for update_field_by_mapping """
+
+    def fields(self, db):
+        return [db.migration_test.value]
+
+    def query(self, db):
+        return db.migration_test.id > 0
+
+    def mapping(self, row):
+        return "even" if row.value % 2 == 0 else "odd"
+
+# =============================================================================
+class MigrationDataTests(unittest.TestCase):
+    """ Tests for the chunked data migration helpers """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        folder = self.folder = tempfile.mkdtemp()
+
+        db_string = "sqlite://storage.db"
+        db = self.db = DAL(db_string, folder=folder)
+        db.define_table("migration_test",
+                        Field("value", "integer"),
+                        Field("mapped"),
+                        )
+        db.define_table("migration_list",
+                        Field("items", "list:integer"),
+                        )
+
+        migration = self.migration = S3Migration.__new__(S3Migration)
+        migration.db = db
+        migration.db_string = db_string
+        migration.db_engine = "sqlite"
+
+        # Record the progress reports rather than writing them to stderr
+        progress = self.progress = []
+        self._progress = S3Migration.__dict__["_progress"]
+        S3Migration._progress = staticmethod(
+            lambda label, position, total: progress.append(position)
+            )
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        S3Migration._progress = self._progress
+
+        self.db.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    def testUpdateFieldByMapping(self):
+        """ Test a mapping spanning several chunks """
+
+        db = self.db
+        table = db.migration_test
+
+        for value in range(1, 26):
+            table.insert(value=value)
+        db.commit()
+
+        S3Migration.update_field_by_mapping(db,
+                                            "migration_test",
+                                            "mapped",
+                                            ParityMapping(),
+                                            chunk_size = 10,
+                                            )
+
+        # Three chunks, the last one incomplete
+        self.assertEqual(self.progress, [10, 20, 25])
+
+        rows = db(table.id > 0).select(table.value, table.mapped)
+        self.assertEqual(len(rows), 25)
+        for row in rows:
+            self.assertEqual(row.mapped, ParityMapping().mapping(row))
+
+    # -------------------------------------------------------------------------
+    def testUpdateFieldByMappingRestart(self):
+        """ Test restarting a mapping after a primary key """
+
+        db = self.db
+        table = db.migration_test
+
+        ids = [table.insert(value=value) for value in range(1, 26)]
+        db.commit()
+
+        S3Migration.update_field_by_mapping(db,
+                                            "migration_test",
+                                            "mapped",
+                                            ParityMapping(),
+                                            chunk_size = 10,
+                                            start = ids[19],
+                                            )
+        self.assertEqual(self.progress, [25])
+
+        rows = db(table.id > 0).select(table.id,
+                                       table.value,
+                                       table.mapped,
+                                       orderby = table.id,
+                                       )
+        for row in rows:
+            if row.id > ids[19]:
+                self.assertEqual(row.mapped, ParityMapping().mapping(row))
+            else:
+                self.assertEqual(row.mapped, None)
+
+    # -------------------------------------------------------------------------
+    def testFillNewTable(self):
+        """ Test moving list field values into a new table """
+
+        assertEqual = self.assertEqual
+
+        db = self.db
+        migration = self.migration
+        table = db.migration_list
+
+        # 1000 values, not a multiple of the INSERT batch size
+        expected = set()
+        for index in range(100):
+            items = [index * 10 + i for i in range(10)]
+            record_id = table.insert(items=items)
+            expected.update((record_id, item) for item in items)
+        table.insert(items=[])
+        db.commit()
+
+        migration._create_new_table("migration_list_item",
+                                    "item",
+                                    "items",
+                                    "id",
+                                    "migration_list",
+                                    )
+        migration._fill_the_new_table("migration_list_item",
+                                      "item",
+                                      "items",
+                                      "id",
+                                      "migration_list",
+                                      chunk_size = 30,
+                                      )
+
+        new_table = db.migration_list_item
+        link = new_table.migration_list_id
+
+        def contents():
+            rows = db(new_table.id > 0).select(link, new_table.item)
+            return [(row.migration_list_id, row.item) for row in rows]
+
+        result = contents()
+        assertEqual(len(result), 1000)
+        assertEqual(set(result), expected)
+        assertEqual(self.progress, [30, 60, 90, 101])
+
+        # Interrupted after the first chunks => restarts after the last
+        # original record in the new table, without duplicates
+        ids = sorted(record_id for record_id, _ in expected)
+        db(link > ids[44]).delete()
+        db.commit()
+        del self.progress[:]
+        migration._fill_the_new_table("migration_list_item",
+                                      "item",
+                                      "items",
+                                      "id",
+                                      "migration_list",
+                                      chunk_size = 30,
+                                      )
+        result = contents()
+        assertEqual(len(result), 1000)
+        assertEqual(set(result), expected)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        MigrationBackupTests,
+        MigrationDataTests,
+    )
+
+# END ========================================================================
@@ -11,9 +11,12 @@ from .s3gis import *
 from .s3grouped import *
 from .s3hierarchy import *
 from .s3import import *
+from .s3index import *
 from .s3model import *
 from .s3msg import *
 from .s3navigation import *
+from .s3pdf import *
+from .s3pdfcard import *
 from .s3query import *
 from .s3resource import *
 from .s3rest import *
@@ -44,6 +44,8 @@
 # your enviroment is likely to be completely unacceptable.
 #
 import sys
+import threading
+import time
 import timeit
 import unittest
 
@@ -52,6 +54,80 @@ from unit_tests import run_suite
 def info(msg):
     sys.stdout.write("%s\n" % msg)
 
+# =============================================================================
+class PeakRSS(object):
+    """
+        Context manager to measure the peak resident set size (RSS) of
+        this process while running some code, relative to the RSS before:
+
+        - samples the RSS with psutil in a background thread, if available
+        - otherwise uses the growth of the maximum RSS (resource.getrusage),
+          which only shows peaks above any earlier peak of the process
+    """
+
+    def __init__(self, interval=0.01):
+
+        self.interval = interval
+
+        self.method = None
+        self.peak = None
+
+    # -------------------------------------------------------------------------
+    def __enter__(self):
+
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+
+        if psutil:
+            self.method = "psutil"
+            process = psutil.Process()
+            self.rss = lambda: process.memory_info().rss
+
+            self.baseline = self.maximum = self.rss()
+            self.running = True
+            self.thread = threading.Thread(target=self.sample)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.method = "getrusage"
+            self.thread = None
+            self.baseline = self.maxrss()
+
+        return self
+
+    # -------------------------------------------------------------------------
+    def __exit__(self, *args):
+
+        if self.thread:
+            self.running = False
+            self.thread.join()
+            maximum = max(self.maximum, self.rss())
+        else:
+            maximum = self.maxrss()
+
+        self.peak = (maximum - self.baseline) / 1048576.0
+
+    # -------------------------------------------------------------------------
+    def sample(self):
+        """ Sample the RSS until stopped """
+
+        while self.running:
+            self.maximum = max(self.maximum, self.rss())
+            time.sleep(self.interval)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def maxrss():
+        """ The maximum RSS of this process so far (in bytes) """
+
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Kilobytes on Linux, bytes on macOS
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
 # =============================================================================
 #@unittest.skip("Comment or remove this line in modules/unit_tests/eden/benchmark.py to activate this test")
 class S3PerformanceTests(unittest.TestCase):
@@ -283,6 +359,93 @@ class S3PerformanceTests(unittest.TestCase):
 
         current.auth.override = False
 
+    def testXLSXExportMemory(self):
+        """ XLSX export memory consumption (must not grow with rows) """
+
+        try:
+            import openpyxl
+        except ImportError:
+            info("\nXLSX export memory: skipped (requires openpyxl)")
+            return
+        try:
+            import psutil
+        except ImportError:
+            try:
+                import resource
+            except ImportError:
+                info("\nXLSX export memory: skipped (requires psutil or resource)")
+                return
+
+        from s3 import FS
+        from s3.codecs.xlsx import S3XLSX
+
+        db = current.db
+        s3db = current.s3db
+
+        current.auth.override = True
+
+        table = s3db.org_organisation
+        marker = "XLSX Export Benchmark"
+        query = (FS("comments") == marker)
+
+        # Repeating names, so that the primary key decides the order
+        # of records with equal names across batch boundaries
+        def add(offset, number):
+            for chunk in range(offset, offset + number, 50000):
+                end = min(chunk + 50000, offset + number)
+                table.bulk_insert([{"name": "Organisation %02d" % (i % 100),
+                                    "acronym": "O%s" % (i % 10),
+                                    "comments": marker,
+                                    }
+                                   for i in range(chunk, end)])
+
+        list_fields = ["name", "acronym", "comments"]
+        s3db.configure("org_organisation",
+                       list_fields = list_fields,
+                       orderby = "org_organisation.name",
+                       )
+
+        info("")
+        peak = []
+        codec = S3XLSX()
+        try:
+            total = 0
+            for number in (10000, 100000, 1000000):
+                add(total, number - total)
+                total = number
+
+                resource = s3db.resource("org_organisation", filter=query)
+
+                with PeakRSS() as rss:
+                    start = timeit.default_timer()
+                    output = codec.encode(resource,
+                                          list_fields = list_fields,
+                                          as_stream = True,
+                                          )
+                    duration = timeit.default_timer() - start
+                peak.append(rss.peak)
+
+                info("S3XLSX.encode %s records = %.1f sec, peak RSS +%.1f MB (%s)" % \
+                     (number, duration, peak[-1], rss.method))
+
+                # Verify that all records have been exported exactly once
+                output.seek(0)
+                book = openpyxl.load_workbook(output, read_only=True)
+                exported = 0
+                for sheet in book.worksheets:
+                    for row in sheet.iter_rows(values_only=True):
+                        if row and row[-1] == marker:
+                            exported += 1
+                output.close()
+                self.assertEqual(exported, number)
+        finally:
+            db.rollback()
+            current.auth.override = False
+
+        # Peak RSS must stay flat while the number of rows grows 100x
+        # (allowing for some noise, e.g. from the allocator)
+        self.assertTrue(peak[-1] < 2 * peak[0] + 16)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -6,7 +6,9 @@
 import unittest
 
 from gluon import *
+from gluon.storage import Storage
 from s3.s3filter import *
+from s3.s3query import FS
 
 from unit_tests import run_suite
 
@@ -128,11 +130,204 @@ class S3FilterWidgetTests(unittest.TestCase):
         self.assertTrue("2" in values)
         self.assertTrue("3" in values)
 
+# =============================================================================
+class S3FilterFacetsTests(unittest.TestCase):
+    """ Tests for the options filter facet engine """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        s3db = current.s3db
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.facets_cache = settings.get_search_filter_facets_cache()
+        settings.search.filter_facets_cache = False
+        current.response.s3.filter_facets = None
+
+        otable = s3db.org_organisation
+        org_ids = []
+        for name in ("FacetTestOrg1", "FacetTestOrg2", "FacetTestOrg3"):
+            org = Storage(name=name)
+            org["id"] = otable.insert(**org)
+            s3db.update_super(otable, org)
+            org_ids.append(org["id"])
+        self.org_ids = org_ids
+
+        # Two offices for the first org, one for the second, none for the third
+        ftable = s3db.org_office
+        for index, org_id in enumerate((org_ids[0], org_ids[0], org_ids[1])):
+            office = Storage(name="FacetTestOffice%s" % index,
+                             organisation_id = org_id,
+                             )
+            office["id"] = ftable.insert(**office)
+            s3db.update_super(ftable, office)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        current.deployment_settings.search.filter_facets_cache = self.facets_cache
+        current.response.s3.filter_facets = None
+
+    # -------------------------------------------------------------------------
+    def testReverseLookup(self):
+        """ Test reverse lookup of foreign key options with counts """
+
+        resource = current.s3db.resource("org_office",
+                                         filter = FS("name").like("FacetTestOffice%"),
+                                         )
+        widget = S3OptionsFilter("organisation_id")
+
+        facet = S3FilterFacets(resource, [widget]).get(widget)
+        self.assertNotEqual(facet, None)
+
+        keys, counts = facet
+        org_ids = self.org_ids
+        self.assertEqual(len(keys), 2)
+        self.assertTrue(org_ids[0] in keys)
+        self.assertTrue(org_ids[1] in keys)
+        self.assertFalse(org_ids[2] in keys)
+        self.assertEqual(counts[org_ids[0]], 2)
+        self.assertEqual(counts[org_ids[1]], 1)
+
+    # -------------------------------------------------------------------------
+    def testMultipleWidgets(self):
+        """ Test facet lookup for multiple widgets at once """
+
+        resource = current.s3db.resource("org_office",
+                                         filter = FS("name").like("FacetTestOffice%"),
+                                         )
+        org_filter = S3OptionsFilter("organisation_id")
+        name_filter = S3OptionsFilter("name")
+        fixed_filter = S3OptionsFilter("name", options={"A": "A"})
+
+        facets = S3FilterFacets(resource, [org_filter,
+                                           name_filter,
+                                           fixed_filter,
+                                           ])()
+
+        # Fixed options can not be looked up
+        self.assertFalse(fixed_filter in facets)
+
+        keys, counts = facets[org_filter]
+        self.assertEqual(len(keys), 2)
+
+        keys, counts = facets[name_filter]
+        self.assertEqual(keys, ("FacetTestOffice0",
+                                "FacetTestOffice1",
+                                "FacetTestOffice2",
+                                ))
+        self.assertEqual(counts["FacetTestOffice1"], 1)
+
+    # -------------------------------------------------------------------------
+    def testOptionCounts(self):
+        """ Test option labels with counts """
+
+        resource = current.s3db.resource("org_office",
+                                         filter = FS("name").like("FacetTestOffice%"),
+                                         )
+        widget = S3OptionsFilter("organisation_id",
+                                 counts = True,
+                                 represent = lambda v: "Org%s" % v,
+                                 )
+
+        ftype, options, noopt = widget._options(resource)
+        options = dict(options)
+
+        org_id = self.org_ids[0]
+        self.assertEqual(options[org_id], "Org%s (2)" % org_id)
+
+    # -------------------------------------------------------------------------
+    def testVersion(self):
+        """ Test that the facet version covers look-up tables and deletes """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        resource = s3db.resource("org_office",
+                                 filter = FS("name").like("FacetTestOffice%"),
+                                 )
+        widget = S3OptionsFilter("organisation_id")
+
+        # Look-up table is involved in the lookup
+        spec = widget.facet_query(resource)
+        self.assertTrue("org_office" in spec.tables)
+        self.assertTrue("org_organisation" in spec.tables)
+
+        version = S3FilterFacets.version(spec.tables, {})
+
+        # Version is stable
+        assertEqual(S3FilterFacets.version(spec.tables, {}), version)
+
+        # Hard delete in the look-up table changes the version
+        otable = s3db.org_organisation
+        db(otable.id == self.org_ids[2]).delete()
+        assertNotEqual(S3FilterFacets.version(spec.tables, {}), version)
+        version = S3FilterFacets.version(spec.tables, {})
+
+        # Hard delete in the filtered table changes the version
+        ftable = s3db.org_office
+        db(ftable.name == "FacetTestOffice2").delete()
+        assertNotEqual(S3FilterFacets.version(spec.tables, {}), version)
+
+    # -------------------------------------------------------------------------
+    def testCache(self):
+        """ Test that facets are cached by data version if enabled """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+        store = {}
+
+        def lookup():
+            current.response.s3.filter_facets = store
+            resource = s3db.resource("org_office",
+                                     filter = FS("name").like("FacetTestOffice%"),
+                                     )
+            widget = S3OptionsFilter("organisation_id")
+            return S3FilterFacets(resource, [widget]).get(widget)
+
+        # No version lookups without cache
+        keys, counts = lookup()
+        assertEqual(counts[self.org_ids[0]], 2)
+        self.assertFalse("versions" in store)
+
+        # Cached with version
+        current.deployment_settings.search.filter_facets_cache = 60
+        store.clear()
+        keys, counts = lookup()
+        assertEqual(counts[self.org_ids[0]], 2)
+        self.assertTrue("versions" in store)
+
+        # New data version => looked up again
+        ftable = s3db.org_office
+        db(ftable.name == "FacetTestOffice1").delete()
+        store.clear()
+        keys, counts = lookup()
+        assertEqual(counts[self.org_ids[0]], 1)
+
+    # -------------------------------------------------------------------------
+    def testCacheDefault(self):
+        """ Test that the facet cache is opt-in """
+
+        settings = current.deployment_settings
+        settings.search.pop("filter_facets_cache", None)
+        self.assertFalse(settings.get_search_filter_facets_cache())
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         S3FilterWidgetTests,
+        S3FilterFacetsTests,
     )
 
 # END ========================================================================
@@ -5,6 +5,7 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3gis.py
 
+import os
 import unittest
 import datetime
 from gluon import *
@@ -773,6 +774,359 @@ class S3LocationTreeTests(unittest.TestCase):
         current.auth.override = False
         current.db.rollback()
 
+# =============================================================================
+class S3LocationBundleTests(unittest.TestCase):
+    """ Tests for prebuilt location hierarchy bundles """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.gis_location
+        L0 = table.insert(name = "Bundle Country",
+                          level = "L0",
+                          lon_min = 10.0,
+                          lat_min = 20.0,
+                          lon_max = 30.0,
+                          lat_max = 40.0,
+                          )
+        table[L0].update_record(path = str(L0))
+        L1 = table.insert(name = "Bundle L1",
+                          level = "L1",
+                          parent = L0,
+                          )
+        table[L1].update_record(path = "%s/%s" % (L0, L1))
+        L3 = table.insert(name = "Bundle L3",
+                          level = "L3",
+                          parent = L1,
+                          )
+        table[L3].update_record(path = "%s/%s/%s" % (L0, L1, L3))
+
+        self.ids = (L0, L1, L3)
+        self.bundle = S3LocationBundle(L0)
+
+        settings = current.deployment_settings
+        self.location_bundles = settings.get_gis_location_bundles()
+        settings.gis.location_bundles = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        self.bundle.invalidate()
+
+        current.deployment_settings.gis.location_bundles = self.location_bundles
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testLookup(self):
+        """ Test looking up the bundle for a location """
+
+        L0, L1, L3 = self.ids
+
+        bundle = S3LocationBundle.lookup(L3)
+        self.assertEqual(bundle.name, str(L0))
+
+        self.assertIsNone(S3LocationBundle.lookup("invalid"))
+
+    # -------------------------------------------------------------------------
+    def testMoveInvalidation(self):
+        """ Test that moving a location invalidates both countries """
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        L0, L1, L3 = self.ids
+
+        table = current.s3db.gis_location
+        other = table.insert(name = "Bundle Other Country",
+                             level = "L0",
+                             )
+        table[other].update_record(path = str(other))
+
+        old_bundle = self.bundle
+        new_bundle = S3LocationBundle(other)
+        try:
+            old_bundle.build()
+            new_bundle.build()
+            assertTrue(os.path.exists(old_bundle.path))
+            assertTrue(os.path.exists(new_bundle.path))
+
+            # Move the L1 to the other country: the tree update has already
+            # replaced the path, the original record has the old parent
+            table[L1].update_record(parent = other,
+                                    path = "%s/%s" % (other, L1),
+                                    )
+            # Ids as passed by gis_location_onaccept: the location, its
+            # new parent and the parent of the original record
+            S3LocationBundle.invalidate_location(L1, other, L0)
+
+            assertFalse(os.path.exists(old_bundle.path))
+            assertFalse(os.path.exists(new_bundle.path))
+        finally:
+            new_bundle.invalidate()
+
+    # -------------------------------------------------------------------------
+    def testInvalidateAsync(self):
+        """ Test invalidation of bundles by a task """
+
+        if current.s3task._is_alive():
+            self.skipTest("Worker alive, task would run after commit")
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        L0, L1, L3 = self.ids
+        bundle = self.bundle
+        countries = S3LocationBundle(S3LocationBundle.COUNTRIES)
+
+        self.assertEqual(S3LocationBundle.containing([L3]), set([str(L0)]))
+
+        bundle.build()
+        countries.build()
+        S3LocationBundle.invalidate_location_async(L3)
+        assertFalse(os.path.exists(bundle.path))
+        assertTrue(os.path.exists(countries.path))
+
+        # Changing the country also invalidates the bundle of all countries
+        bundle.build()
+        S3LocationBundle.invalidate_location_async(L0)
+        assertFalse(os.path.exists(bundle.path))
+        assertFalse(os.path.exists(countries.path))
+
+    # -------------------------------------------------------------------------
+    def testLData(self):
+        """ Test extraction of location data for gis/ldata """
+
+        assertEqual = self.assertEqual
+
+        L0, L1, L3 = self.ids
+        bundle = self.bundle
+
+        self.assertIsNotNone(bundle.version)
+
+        # Children of the L0
+        data = bundle.ldata(L0)
+        assertEqual(set(data.keys()), {L0, L1})
+        assertEqual(data[L1], {"n": "Bundle L1", "l": 1, "f": L0})
+        assertEqual(data[L0]["b"], [10.0, 20.0, 30.0, 40.0])
+
+        # L3 after missing L2
+        data = bundle.ldata(L1, output_level=3)
+        assertEqual(set(data.keys()), {L1, L3})
+        assertEqual(data[L3], {"n": "Bundle L3", "l": 3, "f": L1})
+
+        # Location not in bundle
+        self.assertIsNone(bundle.ldata(-1))
+
+    # -------------------------------------------------------------------------
+    def testSelectorLocations(self):
+        """ Test extraction of locations for the S3LocationSelector """
+
+        L0, L1, L3 = self.ids
+
+        locations = S3LocationBundle.selector_locations(["L1", "L2", "L3"],
+                                                        {"L0": L0, "L1": L1},
+                                                        )
+        ids = set(location.id for location in locations)
+        self.assertEqual(ids, {L1, L3})
+
+        for location in locations:
+            if location.id == L3:
+                self.assertEqual(location.level, "L3")
+                self.assertEqual(location.parent, L1)
+
+# =============================================================================
+class S3ProxyCacheTests(unittest.TestCase):
+    """ Tests for the caching map server proxy """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+            from socketserver import ThreadingMixIn
+        except ImportError:
+            # Python 2
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+            from SocketServer import ThreadingMixIn
+        import threading
+        import time
+
+        requests = cls.requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Local stand-in for a remote tile server """
+
+            def do_GET(self):
+                requests.append(self.path)
+                # Slow server, to test request coalescing
+                time.sleep(0.2)
+                if "missing" in self.path or "broken" in self.path:
+                    self.send_response(404 if "missing" in self.path else 500)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if "timeout" in self.path:
+                    time.sleep(2)
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.send_header("Cache-Control", "max-age=3600")
+                    self.end_headers()
+                    return
+                body = b"x" * 100
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("ETag", '"v1"')
+                if "expired" in self.path:
+                    self.send_header("Cache-Control", "max-age=0")
+                elif "private" in self.path:
+                    self.send_header("Cache-Control", "private")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = cls.server = Server(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        cls.url = "http://127.0.0.1:%s" % server.server_port
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        import tempfile
+
+        self.folder = tempfile.mkdtemp()
+        self.cache = S3ProxyCache(folder = self.folder,
+                                  max_size = 10000,
+                                  ttl = 3600,
+                                  timeout = 5,
+                                  )
+        del self.requests[:]
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        import shutil
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    # -------------------------------------------------------------------------
+    def testCaching(self):
+        """ Test caching of responses """
+
+        assertEqual = self.assertEqual
+
+        cache = self.cache
+        url = self.url
+
+        content_type, body = cache.get("%s/tile?b=1&a=2" % url)
+        assertEqual(content_type, "image/png")
+        assertEqual(len(body), 100)
+
+        # Same URL with different parameter order served from cache
+        cache.get("%s/tile?a=2&b=1" % url)
+        assertEqual(self.requests, ["/tile?b=1&a=2"])
+
+        # Expired response gets revalidated
+        cache.get("%s/expired" % url)
+        cache.get("%s/expired" % url)
+        assertEqual(self.requests[1:], ["/expired", "/expired"])
+
+        # ...and is fresh after the 304 (max-age=3600)
+        cache.get("%s/expired" % url)
+        assertEqual(len(self.requests), 3)
+
+        # Private responses are not stored
+        cache.get("%s/private" % url)
+        cache.get("%s/private" % url)
+        assertEqual(len(self.requests), 5)
+
+    # -------------------------------------------------------------------------
+    def testErrorStatus(self):
+        """ Test the status reported for failed upstream requests """
+
+        assertEqual = self.assertEqual
+
+        cache = S3ProxyCache(folder = self.folder,
+                             max_size = 10000,
+                             ttl = 3600,
+                             timeout = 1,
+                             )
+        url = self.url
+
+        for path, status in (("missing", 404),  # passed through
+                             ("broken", 502),   # upstream server error
+                             ("timeout", 504),  # upstream timeout
+                             ):
+            try:
+                cache.get("%s/%s" % (url, path))
+            except IOError as e:
+                assertEqual(S3ProxyCache.error_status(e), status)
+            else:
+                self.fail("%s: no exception raised" % path)
+
+        # Unreachable host
+        try:
+            cache.get("http://127.0.0.1:1/tile")
+        except IOError as e:
+            assertEqual(S3ProxyCache.error_status(e), 502)
+        else:
+            self.fail("unreachable: no exception raised")
+
+    # -------------------------------------------------------------------------
+    def testCoalescing(self):
+        """ Test coalescing of concurrent requests for the same URL """
+
+        import threading
+
+        url = "%s/tile?z=1" % self.url
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get(url)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(self.requests, ["/tile?z=1"])
+
+    # -------------------------------------------------------------------------
+    def testEviction(self):
+        """ Test LRU eviction when exceeding the maximum size """
+
+        cache = self.cache
+        cache.max_size = 500
+
+        # Writing responses triggers eviction
+        for i in range(6):
+            cache.get("%s/tile?i=%s" % (self.url, i))
+
+        # The most recent response is still cached
+        cache.get("%s/tile?i=5" % self.url)
+        self.assertEqual(len(self.requests), 6)
+
+        # The oldest response has been evicted
+        self.assertEqual(cache.read(cache.key("%s/tile?i=0" % self.url)), None)
+
 # =============================================================================
 class S3NoGisConfigTests(unittest.TestCase):
     """
@@ -815,6 +1169,8 @@ if __name__ == "__main__":
 
     run_suite(
         S3LocationTreeTests,
+        S3LocationBundleTests,
+        S3ProxyCacheTests,
         S3NoGisConfigTests,
         )
 
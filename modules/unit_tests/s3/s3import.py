@@ -13,7 +13,8 @@ from gluon import *
 from gluon.storage import Storage
 from lxml import etree
 
-from s3 import S3Duplicate, S3ImportItem, S3ImportJob, s3_meta_fields
+from s3 import S3BulkImporter, S3BulkImportScheduler, S3BulkImportSnapshot, \
+               S3Duplicate, S3ImportItem, S3ImportJob, s3_meta_fields
 from s3.s3import import S3ObjectReferences
 
 from unit_tests import run_suite
@@ -1058,6 +1059,117 @@ class ObjectReferencesImportTests(unittest.TestCase):
         self.assertIn("referenced_id", obj)
         self.assertEqual(obj["referenced_id"], record_id)
 
+# =============================================================================
+class BulkImportSchedulerTests(unittest.TestCase):
+    """ Tests for dependency-aware parallel prepopulate """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        import os
+        self.xsl = os.path.join(current.request.folder,
+                                "static", "formats", "s3csv")
+
+    # -------------------------------------------------------------------------
+    def task(self, prefix, name, depends=None):
+        """ Construct a CSV import task """
+
+        import os
+        xsl = os.path.join(self.xsl, prefix, "%s.xsl" % name)
+        task = [1, prefix, name, "%s.csv" % name, xsl, None]
+        if depends:
+            task.append(depends)
+        return task
+
+    # -------------------------------------------------------------------------
+    def testDependencies(self):
+        """ Test derivation of task dependencies """
+
+        task = self.task
+
+        tasks = [task("gis", "projection"),
+                 task("gis", "marker"),
+                 task("org", "facility_type"),
+                 task("gis", "config"),
+                 (2, "import_role", None, None),
+                 task("org", "facility_type"),
+                 task("gis", "marker", depends=set(["org_facility_type"])),
+                 ]
+
+        scheduler = S3BulkImportScheduler(S3BulkImporter())
+        dependencies = scheduler.dependencies(tasks)
+
+        assertEqual = self.assertEqual
+
+        # Independent tasks
+        assertEqual(dependencies[0], set())
+        assertEqual(dependencies[1], set())
+        assertEqual(dependencies[2], set())
+
+        # Config references projection and marker
+        assertEqual(dependencies[3], set([0, 1]))
+
+        # Special tasks depend on all previous tasks
+        assertEqual(dependencies[4], set([0, 1, 2, 3]))
+
+        # All subsequent tasks depend on the special task
+        assertEqual(dependencies[5], set([4]))
+
+        # Explicit dependency
+        assertEqual(dependencies[6], set([4, 5]))
+
+    # -------------------------------------------------------------------------
+    def testDependsDirective(self):
+        """ Test parsing of #@depends directives in tasks.cfg """
+
+        import os
+        import shutil
+        import tempfile
+
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, "tasks.cfg"), "w") as cfg:
+                cfg.write("gis,marker,gis_marker.csv,marker.xsl\n"
+                          "#@depends: gis_marker, gis_projection\n"
+                          "gis,config,gis_config.csv,config.xsl\n"
+                          "gis,projection,gis_projection.csv,projection.xsl\n")
+
+            importer = S3BulkImporter()
+            importer.load_descriptor(path)
+        finally:
+            shutil.rmtree(path)
+
+        tasks = importer.tasks
+        self.assertEqual(len(tasks), 3)
+        self.assertEqual(len(tasks[0]), 6)
+        self.assertEqual(tasks[1][6], set(["gis_marker", "gis_projection"]))
+        self.assertEqual(len(tasks[2]), 6)
+
+# =============================================================================
+class BulkImportSnapshotTests(unittest.TestCase):
+    """ Tests for prepopulate database snapshots """
+
+    # -------------------------------------------------------------------------
+    def testKey(self):
+        """ Test snapshot keys """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        snapshot = S3BulkImportSnapshot(["default/base"])
+        key = snapshot.key
+        assertEqual(len(key), 40)
+
+        # Same templates => same key
+        assertEqual(S3BulkImportSnapshot("default/base").key, key)
+
+        # Different templates => different key
+        other = S3BulkImportSnapshot(["default/base", "default/users"])
+        assertNotEqual(other.key, key)
+
+        # Key is part of the file name
+        self.assertIn(key, snapshot.filename)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -1071,6 +1183,8 @@ if __name__ == "__main__":
         MtimeImportTests,
         ObjectReferencesTests,
         ObjectReferencesImportTests,
+        BulkImportSchedulerTests,
+        BulkImportSnapshotTests,
         )
 
 # END ========================================================================
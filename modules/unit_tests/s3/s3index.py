@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# S3Indexes Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3index.py
+#
+import unittest
+
+from gluon import *
+from s3.s3index import S3Indexes, S3IndexAdvisor
+
+from unit_tests import run_suite
+
+# =============================================================================
+class S3IndexesTests(unittest.TestCase):
+    """ Tests for model-declared indexes """
+
+    # -------------------------------------------------------------------------
+    def testDeclared(self):
+        """ Test collection of declared indexes """
+
+        declared = S3Indexes().declared()
+        self.assertTrue(("pr_person", ("first_name",)) in declared)
+        self.assertTrue(("gis_location", ("name",)) in declared)
+
+    # -------------------------------------------------------------------------
+    def testCovered(self):
+        """ Test detection of indexes covering a column combination """
+
+        indexes = S3Indexes()
+        existing = [("organisation_id", "date")]
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        assertTrue(indexes.covered("pr_person", ("id",), []))
+        assertTrue(indexes.covered("pr_person", ("organisation_id",), existing))
+        assertTrue(indexes.covered("pr_person", ("organisation_id", "date"), existing))
+        assertFalse(indexes.covered("pr_person", ("date",), existing))
+        assertFalse(indexes.covered("pr_person", ("date", "organisation_id"), existing))
+
+    # -------------------------------------------------------------------------
+    def testIndexName(self):
+        """ Test generation of index names """
+
+        name = S3Indexes.index_name("pr_person", ("first_name",))
+        self.assertEqual(name, "pr_person_first_name__idx")
+
+        name = S3Indexes.index_name("org_organisation_organisation_type",
+                                    ("organisation_id", "organisation_type_id"))
+        self.assertTrue(len(name) <= 60)
+        self.assertNotEqual(name,
+                            S3Indexes.index_name("org_organisation_organisation_type",
+                                                 ("organisation_type_id", "organisation_id")))
+
+# =============================================================================
+class S3IndexAdvisorTests(unittest.TestCase):
+    """ Tests for the index advisor """
+
+    # -------------------------------------------------------------------------
+    def testCandidates(self):
+        """ Test extraction of index candidates from queries """
+
+        table = current.s3db.pr_person
+
+        query = (table.last_name == "Doe") & \
+                (table.date_of_birth > "1980-01-01") & \
+                (table.deleted == False)
+        candidates = S3IndexAdvisor.candidates(query, orderby=table.first_name)
+        self.assertEqual(candidates,
+                         [("pr_person", ("last_name", "date_of_birth", "first_name"))])
+
+    # -------------------------------------------------------------------------
+    def testJoins(self):
+        """ Test extraction of join columns """
+
+        s3db = current.s3db
+
+        ptable = s3db.pr_person
+        ctable = s3db.pr_contact
+
+        join = ctable.on(ctable.pe_id == ptable.pe_id)
+        query = (ptable.id > 0) & (ctable.contact_method == "EMAIL")
+
+        candidates = dict(S3IndexAdvisor.candidates(query, joins=[join]))
+        self.assertEqual(candidates["pr_contact"], ("contact_method", "pe_id"))
+        self.assertEqual(candidates["pr_person"], ("pe_id",))
+
+    # -------------------------------------------------------------------------
+    def testPrimaryKeyOnly(self):
+        """ Test that primary key lookups are not recorded """
+
+        table = current.s3db.pr_person
+
+        query = (table.id == 1) & (table.deleted == False)
+        self.assertEqual(S3IndexAdvisor.candidates(query), [])
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        S3IndexesTests,
+        S3IndexAdvisorTests,
+    )
+
+# END ========================================================================
@@ -11,9 +11,10 @@ import unittest
 from gluon import current, IS_EMPTY_OR, IS_FLOAT_IN_RANGE, IS_INT_IN_RANGE, IS_IN_SET, IS_NOT_EMPTY
 from gluon.languages import lazyT
 from gluon.storage import Storage
+from s3dal import Field
 
 from s3.s3fields import s3_meta_fields
-from s3.s3model import DYNAMIC_PREFIX, S3DynamicModel
+from s3.s3model import DYNAMIC_PREFIX, S3DynamicModel, S3Model, TABLE_REFERENCES
 from s3.s3validators import IS_NOT_ONE_OF, IS_ONE_OF, IS_UTC_DATE, IS_UTC_DATETIME
 
 from unit_tests import run_suite
@@ -23,6 +24,108 @@ class S3ModelTests(unittest.TestCase):
 
     pass
 
+# =============================================================================
+class S3ModelRegistryTests(unittest.TestCase):
+    """ Tests for the model registry """
+
+    # -------------------------------------------------------------------------
+    def testRegistry(self):
+        """ Test the registry of names defined by models """
+
+        names, generic, objects = S3Model.registry("org")
+
+        # Names declared by models
+        self.assertEqual(names.get("org_organisation"), "S3OrganisationModel")
+        self.assertEqual(names.get("org_organisation_name"), "S3OrganisationNameModel")
+
+        # Module-level names
+        self.assertIn("org_organisation_logo", objects)
+        self.assertNotIn("org_organisation", objects)
+
+        # Registry is built only once
+        self.assertIs(S3Model.registry("org")[0], names)
+
+    # -------------------------------------------------------------------------
+    def testTableLookup(self):
+        """ Test table lookup via the registry """
+
+        s3db = current.s3db
+
+        table = s3db.table("org_organisation_name")
+        self.assertEqual(table._tablename, "org_organisation_name")
+
+        self.assertIsNone(s3db.table("org_nonexistent"))
+
+        # Module-level object
+        self.assertTrue(callable(s3db.table("org_organisation_logo")))
+
+    # -------------------------------------------------------------------------
+    def testDependencies(self):
+        """ Test model dependencies """
+
+        current.s3db.table("org_organisation")
+
+        dependencies = S3Model.dependencies("org_organisation")
+        self.assertTrue(isinstance(dependencies, set))
+        self.assertNotIn(("org", "S3OrganisationModel"), dependencies)
+
+        self.assertEqual(S3Model.dependencies("org_nonexistent"), set())
+
+    # -------------------------------------------------------------------------
+    def testLoadReferences(self):
+        """ Test loading of referencing tables """
+
+        s3db = current.s3db
+
+        # Run twice: with and without registered references
+        for i in range(2):
+            s3db.load_references("org_organisation")
+
+            table = s3db.org_organisation
+            referencing = set(f.tablename for f in table._referenced_by)
+            self.assertIn("org_office", referencing)
+
+    # -------------------------------------------------------------------------
+    def testRegisterReferences(self):
+        """ Test registration of references of newly defined tables """
+
+        assertIn = self.assertIn
+        assertNotIn = self.assertNotIn
+
+        tablename = "%s_registry_test" % DYNAMIC_PREFIX
+        try:
+            S3Model.register_references(tablename,
+                                        [Field("organisation_id", "reference org_organisation"),
+                                         Field("office_ids", "list:reference org_office"),
+                                         Field("name"),
+                                         ])
+            assertIn(tablename, TABLE_REFERENCES["org_organisation"])
+            assertIn(tablename, TABLE_REFERENCES["org_office"])
+
+            # Redefined with a different schema
+            S3Model.register_references(tablename,
+                                        [Field("site_id", "reference org_site")],
+                                        replace = True,
+                                        )
+            assertNotIn(tablename, TABLE_REFERENCES["org_organisation"])
+            assertNotIn(tablename, TABLE_REFERENCES["org_office"])
+            assertIn(tablename, TABLE_REFERENCES["org_site"])
+        finally:
+            S3Model.register_references(tablename, [], replace=True)
+
+    # -------------------------------------------------------------------------
+    def testLoadDependencies(self):
+        """ Test loading of the models a table depends on """
+
+        s3db = current.s3db
+
+        s3db.load_dependencies("org_organisation")
+
+        loaded = current.response[S3Model.LOAD]
+        self.assertIn("S3OrganisationModel", loaded)
+        for prefix, name in S3Model.dependencies("org_organisation"):
+            self.assertIn(name, loaded)
+
 # =============================================================================
 class S3SuperEntityTests(unittest.TestCase):
 
@@ -344,6 +447,77 @@ class S3DynamicModelTests(unittest.TestCase):
         # Verify that meta-fields have automatically been added
         assertIn("uuid", fields)
 
+    # -------------------------------------------------------------------------
+    def testSchemaVersion(self):
+        """ Test schema versioning of dynamic tables """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        ttable = s3db.s3_table
+        ftable = s3db.s3_field
+
+        query = (ttable.name == self.TABLENAME)
+        row = db(query).select(ttable.id,
+                               ttable.schema_version,
+                               limitby = (0, 1),
+                               ).first()
+        table_id = row.id
+
+        # Schema version has been set when fields were written
+        version = row.schema_version
+        assertEqual(len(version), 40)
+        assertEqual(version, S3DynamicModel.schema_version(table_id))
+
+        # Adding a field changes the version
+        field_id = ftable.insert(table_id = table_id,
+                                 name = "version_test",
+                                 field_type = "string",
+                                 )
+        row = db(ttable.id == table_id).select(ttable.schema_version,
+                                               limitby = (0, 1),
+                                               ).first()
+        assertNotEqual(row.schema_version, version)
+
+        # Removing it again (hard delete) restores the previous version
+        settings = current.deployment_settings
+        archive_not_delete = settings.get_security_archive_not_delete()
+        settings.security.archive_not_delete = False
+        try:
+            resource = s3db.resource("s3_field", id=field_id)
+            # cascade=True to prevent commit
+            resource.delete(cascade=True)
+        finally:
+            settings.security.archive_not_delete = archive_not_delete
+        self.assertTrue(db(ftable.id == field_id).isempty())
+        row = db(ttable.id == table_id).select(ttable.schema_version,
+                                               limitby = (0, 1),
+                                               ).first()
+        assertEqual(row.schema_version, version)
+
+        # Archiving a field changes the version, too
+        field_id = ftable.insert(table_id = table_id,
+                                 name = "version_test",
+                                 field_type = "string",
+                                 )
+        resource = s3db.resource("s3_field", id=field_id)
+        resource.delete(cascade=True)
+        row = db(ttable.id == table_id).select(ttable.schema_version,
+                                               limitby = (0, 1),
+                                               ).first()
+        assertEqual(row.schema_version, version)
+
+        # Field definitions are cached per schema version
+        S3DynamicModel(self.TABLENAME)
+        key = "%s_schema_%s" % (self.TABLENAME, version)
+        schema = current.cache.ram(key, lambda: None, time_expire=None)
+        self.assertTrue(schema["migrated"])
+        names = [f["name"] for f in schema["fields"]]
+        assertEqual(names, ["name", "some_number"])
+
     # -------------------------------------------------------------------------
     def testStringFieldConstruction(self):
         """
@@ -1092,6 +1266,7 @@ if __name__ == "__main__":
 
     run_suite(
         #S3ModelTests,
+        S3ModelRegistryTests,
         S3SuperEntityTests,
         S3DynamicModelTests,
         S3DynamicComponentTests,
@@ -11,6 +11,7 @@ from lxml import etree
 from gluon import *
 from gluon.storage import Storage
 from s3 import *
+from s3.s3parser import S3Parsing
 
 from unit_tests import run_suite
 
@@ -161,6 +162,19 @@ class S3OutboxTests(unittest.TestCase):
         self.assertTrue("test1@example.com" in self.sent)
         self.assertTrue("test2@example.com" in self.sent)
 
+    # -------------------------------------------------------------------------
+    def testProcessEmailToAddress(self):
+        """ Test processing emails to addresses """
+
+        outbox = current.s3db.msg_outbox
+        outbox.insert(address = "test1@example.com",
+                      message_id = self.message_id)
+
+        msg = current.msg
+        msg.send_email = self.send_email
+        msg.process_outbox()
+        self.assertEqual(self.sent, ["test1@example.com"])
+
     # -------------------------------------------------------------------------
     def testProcessEmailToGroup(self):
         """ Test processing emails to groups """
@@ -369,11 +383,475 @@ class S3OutboxTests(unittest.TestCase):
         else:
             return False
 
+# =============================================================================
+class S3ParsingTests(unittest.TestCase):
+    """ Batch parsing tests """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        db = current.db
+        s3db = current.s3db
+
+        # Backup normal methods
+        self.parser_function = S3Parsing.parser_function
+        self.send_bulk = current.msg.send_bulk
+
+        # Insert test messages
+        table = s3db.msg_sms
+        stable = s3db.msg_parsing_status
+        self.status_ids = []
+        self.message_ids = []
+        for i in range(5):
+            sms_id = table.insert(body = "Test %s" % i,
+                                  from_address = "+1234567%s" % (i % 2),
+                                  inbound = True,
+                                  )
+            record = {"id": sms_id}
+            s3db.update_super(table, record)
+            self.message_ids.append(record["message_id"])
+            self.status_ids.append(stable.insert(message_id = record["message_id"],
+                                                 channel_id = None,
+                                                 ))
+
+        self.parsed = []
+        self.queued = []
+
+        S3Parsing.parser_function = staticmethod(lambda function_name: self.parse)
+        current.msg.send_bulk = self.queue
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+        # Restore normal methods
+        S3Parsing.parser_function = self.parser_function
+        current.msg.send_bulk = self.send_bulk
+
+    # -------------------------------------------------------------------------
+    def testParseBatch(self):
+        """ Test parsing of a batch of messages """
+
+        assertEqual = self.assertEqual
+
+        parsed = S3Parsing.parse_batch(None, "parse_test", batch_size=3)
+        assertEqual(parsed, 3)
+        assertEqual(len(self.parsed), 3)
+
+        # Replies queued at once
+        assertEqual(len(self.queued), 1)
+        assertEqual(self.queued[0], [("+12345670", "Reply to Test 0", None),
+                                     ("+12345670", "Reply to Test 2", None),
+                                     ])
+
+        # Status updated
+        stable = current.s3db.msg_parsing_status
+        rows = current.db(stable.id.belongs(self.status_ids)).select(stable.id,
+                                                                    stable.is_parsed,
+                                                                    stable.reply_id,
+                                                                    orderby = stable.id,
+                                                                    )
+        assertEqual([row.is_parsed for row in rows], [True, True, True, False, False])
+        assertEqual(rows[0].reply_id, self.message_ids[-1])
+        assertEqual(rows[1].reply_id, None)
+
+        # Remaining messages
+        parsed = S3Parsing.parse_batch(None, "parse_test", batch_size=3)
+        assertEqual(parsed, 2)
+
+    # -------------------------------------------------------------------------
+    def testParseBatchWorkers(self):
+        """ Test that concurrent workers parse disjoint partitions """
+
+        parsed = S3Parsing.parse_batch(None, "parse_test", worker=0, workers=2)
+        parsed += S3Parsing.parse_batch(None, "parse_test", worker=1, workers=2)
+        self.assertEqual(parsed, 5)
+
+        # Each message parsed exactly once
+        self.assertEqual(len(self.parsed), len(set(self.parsed)))
+
+    # -------------------------------------------------------------------------
+    def parse(self, message, **kwargs):
+        """ Dummy parser function, replying to every other sender """
+
+        self.parsed.append(message.message_id)
+        if message.from_address == "+12345670":
+            return "Reply to %s" % message.body
+        return None
+
+    # -------------------------------------------------------------------------
+    def queue(self, messages):
+        """ Dummy bulk send, pretending the last message is the reply """
+
+        self.queued.append(messages)
+        return [self.message_ids[-1]] * len(messages)
+
+# =============================================================================
+class S3ChannelPollerTests(unittest.TestCase):
+    """ Tests for concurrent polling of RSS channels """
+
+    FEED = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0">
+    <channel>
+        <title>Test Feed</title>
+        <item>
+            <title>Item 1</title>
+            <link>http://example.com/pollertest/1</link>
+            <description>First item</description>
+        </item>
+        <item>
+            <title>Item 2</title>
+            <link>http://example.com/pollertest/2</link>
+            <description>Second item</description>
+        </item>
+    </channel>
+</rss>"""
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+        except ImportError:
+            # Python 2
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        import threading
+
+        feed = cls.FEED
+        requests = cls.requests = []
+        auth = cls.auth = []
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Local stand-in for a remote feed server """
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                requests.append((self.path, self.client_address))
+                auth.append((self.path, self.headers.get("Authorization")))
+                if self.path == "/redirect":
+                    # Redirect to another host (same server)
+                    location = "http://localhost:%s/feed" % \
+                               self.server.server_port
+                    status, headers, body = 302, {"Location": location}, b""
+                elif self.path != "/feed":
+                    status, headers, body = 404, {}, b""
+                elif self.headers.get("If-None-Match") == '"v1"':
+                    status, headers, body = 304, {}, b""
+                else:
+                    status, headers, body = 200, {"ETag": '"v1"'}, feed
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/rss+xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = cls.server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        cls.url = "http://127.0.0.1:%s" % server.server_port
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        s3db = current.s3db
+
+        table = s3db.msg_rss_channel
+        channel_ids = []
+        for name, path in (("PollerTestFeed", "/feed"),
+                           ("PollerTestMissing", "/missing"),
+                           ):
+            record = {"id": table.insert(name = name,
+                                         url = self.url + path,
+                                         enabled = True,
+                                         )}
+            s3db.update_super(table, record)
+            channel_ids.append(record["channel_id"])
+
+        self.channel_ids = channel_ids
+        del self.requests[:]
+        del self.auth[:]
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testPoll(self):
+        """ Test concurrent polling with connection re-use and ETags """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        feed_id, missing_id = self.channel_ids
+        poller = S3ChannelPoller(workers=2, timeout=5)
+
+        results = poller(self.channel_ids)
+        assertEqual(results[feed_id], "OK")
+        self.assertTrue(results[missing_id].startswith("ERROR"))
+
+        # Entries stored
+        mtable = s3db.msg_rss
+        query = (mtable.channel_id == feed_id)
+        assertEqual(db(query).count(), 2)
+
+        # ETag stored
+        table = s3db.msg_rss_channel
+        channel = db(table.channel_id == feed_id).select(table.etag,
+                                                         limitby = (0, 1),
+                                                         ).first()
+        assertEqual(channel.etag, '"v1"')
+
+        # Failing channel backed off
+        stable = s3db.msg_channel_status
+        status = db(stable.channel_id == missing_id).select(stable.backoff,
+                                                            stable.next_poll,
+                                                            limitby = (0, 1),
+                                                            ).first()
+        assertEqual(status.backoff, 300)
+        self.assertTrue(status.next_poll > current.request.utcnow)
+        due = [row.channel_id for row in poller.channels()]
+        self.assertTrue(feed_id in due)
+        self.assertFalse(missing_id in due)
+
+        # Both channels share a host, so one connection is used
+        assertEqual(len(set(client for path, client in self.requests)), 1)
+
+        # Not modified
+        results = poller([feed_id])
+        assertEqual(results[feed_id], "OK")
+        assertEqual(db(query).count(), 2)
+
+    # -------------------------------------------------------------------------
+    def testRedirectAuth(self):
+        """ Test that credentials are not forwarded to another host """
+
+        assertEqual = self.assertEqual
+
+        s3db = current.s3db
+
+        table = s3db.msg_rss_channel
+        record = {"id": table.insert(name = "PollerTestRedirect",
+                                     url = self.url + "/redirect",
+                                     username = "user",
+                                     password = "secret",
+                                     enabled = True,
+                                     )}
+        s3db.update_super(table, record)
+        channel_id = record["channel_id"]
+
+        poller = S3ChannelPoller(workers=1, timeout=5)
+        results = poller([channel_id])
+        assertEqual(results[channel_id], "OK")
+
+        assertEqual(len(self.auth), 2)
+        (path1, auth1), (path2, auth2) = self.auth
+        assertEqual(path1, "/redirect")
+        self.assertTrue(auth1.startswith("Basic "))
+        assertEqual(path2, "/feed")
+        assertEqual(auth2, None)
+
+# =============================================================================
+class S3EmailPollerTests(unittest.TestCase):
+    """ Tests for concurrent polling of email channels """
+
+    MESSAGES = (("101", b"From: sender@example.com\r\n"
+                        b"Subject: Poller Test 1\r\n"
+                        b"\r\n"
+                        b"First message\r\n"),
+                ("102", b"From: sender@example.com\r\n"
+                        b"Subject: Poller Test 2\r\n"
+                        b"\r\n"
+                        b"Second message\r\n"),
+                )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        try:
+            import socketserver
+        except ImportError:
+            # Python 2
+            import SocketServer as socketserver
+        import threading
+
+        messages = cls.MESSAGES
+        deleted = cls.deleted = set()
+
+        class Handler(socketserver.StreamRequestHandler):
+            """ Local stand-in for a remote IMAP server """
+
+            def reply(self, line):
+                self.wfile.write(line.encode("utf-8") + b"\r\n")
+
+            def handle(self):
+
+                reply = self.reply
+                reply("* OK IMAP4rev1 Service Ready")
+                flagged = set()
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        break
+                    tag, command = line.decode("utf-8").strip().split(" ", 1)
+                    args = command.split(" ")
+                    command = args.pop(0).upper()
+                    if command == "UID":
+                        command = "UID %s" % args.pop(0).upper()
+
+                    if command == "CAPABILITY":
+                        reply("* CAPABILITY IMAP4rev1")
+                    elif command == "LOGIN":
+                        if args[1].strip('"') != "secret":
+                            reply("%s NO LOGIN failed" % tag)
+                            continue
+                    elif command == "SELECT":
+                        reply("* %s EXISTS" % len(messages))
+                    elif command == "UID SEARCH":
+                        reply("* SEARCH %s" % " ".join(uid for uid, msg in messages))
+                    elif command == "UID FETCH":
+                        for number, (uid, msg) in enumerate(messages):
+                            if uid == args[0]:
+                                reply("* %s FETCH (UID %s RFC822 {%s}" % \
+                                      (number + 1, uid, len(msg)))
+                                self.wfile.write(msg)
+                                reply(")")
+                    elif command == "UID STORE":
+                        flagged.add(args[0])
+                    elif command == "CLOSE":
+                        # Expunge
+                        deleted.update(flagged)
+                    elif command == "LOGOUT":
+                        reply("* BYE")
+                        reply("%s OK LOGOUT completed" % tag)
+                        break
+                    reply("%s OK %s completed" % (tag, command))
+
+        server = cls.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0),
+                                                              Handler,
+                                                              )
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        cls.port = server.server_address[1]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        s3db = current.s3db
+
+        table = s3db.msg_email_channel
+        channel_ids = []
+        for name, password in (("PollerTestMailbox", "secret"),
+                               ("PollerTestLoginFailed", "wrong"),
+                               ):
+            record = {"id": table.insert(name = name,
+                                         server = "127.0.0.1",
+                                         protocol = "imap",
+                                         use_ssl = False,
+                                         port = self.port,
+                                         username = "user",
+                                         password = password,
+                                         delete_from_server = False,
+                                         enabled = True,
+                                         )}
+            s3db.update_super(table, record)
+            channel_ids.append(record["channel_id"])
+
+        self.channel_ids = channel_ids
+        self.deleted.clear()
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testPoll(self):
+        """ Test concurrent polling of IMAP mailboxes """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        mailbox_id, failed_id = self.channel_ids
+        poller = S3ChannelPoller("msg_email_channel", workers=2, timeout=5)
+
+        results = poller(self.channel_ids)
+        assertEqual(results[mailbox_id], "OK")
+        self.assertTrue(results[failed_id].startswith("ERROR"))
+
+        # Messages stored
+        mtable = s3db.msg_email
+        rows = db(mtable.channel_id == mailbox_id).select(mtable.subject,
+                                                          mtable.inbound,
+                                                          mtable.message_id,
+                                                          orderby = mtable.id,
+                                                          )
+        assertEqual([row.subject for row in rows],
+                    ["Poller Test 1", "Poller Test 2"])
+        self.assertTrue(all(row.inbound and row.message_id for row in rows))
+
+        # Not deleted from the server
+        assertEqual(self.deleted, set())
+
+        # Failing channel backed off
+        stable = s3db.msg_channel_status
+        status = db(stable.channel_id == failed_id).select(stable.backoff,
+                                                           limitby = (0, 1),
+                                                           ).first()
+        assertEqual(status.backoff, 300)
+
+    # -------------------------------------------------------------------------
+    def testDelete(self):
+        """ Test deletion of stored messages from the server """
+
+        mailbox_id = self.channel_ids[0]
+        poller = S3ChannelPoller("msg_email_channel", workers=2, timeout=5)
+        channel = poller.channels([mailbox_id]).first()
+
+        result = poller.delete_mail(channel, ["102"])
+        self.assertEqual(result, {mailbox_id: None})
+        self.assertEqual(self.deleted, set(["102"]))
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         S3OutboxTests,
+        S3ParsingTests,
+        S3ChannelPollerTests,
+        S3EmailPollerTests,
     )
 
 # END ========================================================================
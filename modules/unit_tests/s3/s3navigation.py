@@ -7,7 +7,8 @@
 #
 import unittest
 
-from s3 import S3NavigationItem as M
+from gluon import current
+from s3 import S3MenuCache, S3NavigationItem as M
 
 from unit_tests import run_suite
 
@@ -204,11 +205,127 @@ class SelectTests(unittest.TestCase):
         assertIsNone(items["a21"].selected)
         assertTrue(items["a22"].selected)
 
+# =============================================================================
+class MenuCacheTests(unittest.TestCase):
+    """ Tests for the navigation menu cache """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        settings = current.deployment_settings
+        self.menu_cache = settings.get_ui_menu_cache()
+        settings.ui.menu_cache = 60
+
+        current.response.s3.menu_cache = None
+
+        # Start with an empty permission cache
+        key = S3MenuCache.key("menu_permissions")
+        if key:
+            current.cache.ram(key, None)
+
+        # Count the actual permission checks
+        permission = current.auth.permission
+        self.accessible_url = permission.accessible_url
+        self.checks = checks = []
+        def accessible_url(*args, **kwargs):
+            checks.append(kwargs.get("f"))
+            return self.accessible_url(*args, **kwargs)
+        permission.accessible_url = accessible_url
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+
+        current.auth.permission.accessible_url = self.accessible_url
+        current.deployment_settings.ui.menu_cache = self.menu_cache
+        current.response.s3.menu_cache = None
+
+    # -------------------------------------------------------------------------
+    def testPermissionCache(self):
+        """ Test that permissions of menu items are checked only once """
+
+        assertEqual = self.assertEqual
+
+        item = M("Test", c="default", f="about")
+        url = item.accessible_url()
+        assertEqual(len(self.checks), 1)
+
+        # Same permission => looked up from cache
+        other = M("Test", c="default", f="about", vars={"test": "1"})
+        other_url = other.accessible_url()
+        assertEqual(len(self.checks), 1)
+        if url is False:
+            assertEqual(other_url, False)
+        else:
+            self.assertTrue("test=1" in other_url)
+
+        # Permission-cache must survive the end of the request
+        current.response.s3.menu_cache = None
+        item.accessible_url()
+        assertEqual(len(self.checks), 1)
+
+        # Different item => must be checked
+        M("Test", c="default", f="contact").accessible_url()
+        assertEqual(len(self.checks), 2)
+
+    # -------------------------------------------------------------------------
+    def testInvalidation(self):
+        """ Test that ACL changes invalidate cached permissions """
+
+        assertEqual = self.assertEqual
+
+        auth = current.auth
+
+        item = M("Test", c="default", f="about")
+        item.accessible_url()
+        assertEqual(len(self.checks), 1)
+
+        item.accessible_url()
+        assertEqual(len(self.checks), 1)
+
+        # Changing an ACL resets the store and changes the ACL version
+        version = S3MenuCache.acl_version()
+        auth.permission.update_acl(auth.get_system_roles().AUTHENTICATED,
+                                   c = "default",
+                                   f = "menucachetest",
+                                   uacl = auth.permission.READ,
+                                   oacl = auth.permission.READ,
+                                   )
+        self.assertEqual(current.response.s3.menu_cache, None)
+        self.assertNotEqual(S3MenuCache.acl_version(), version)
+
+        # => permission checked again
+        item.accessible_url()
+        assertEqual(len(self.checks), 2)
+
+    # -------------------------------------------------------------------------
+    def testDefault(self):
+        """ Test that the menu cache is opt-in """
+
+        settings = current.deployment_settings
+        settings.ui.pop("menu_cache", None)
+        self.assertFalse(settings.get_ui_menu_cache())
+        self.assertEqual(S3MenuCache.store(), None)
+        self.assertEqual(S3MenuCache.permissions(), None)
+
+    # -------------------------------------------------------------------------
+    def testOverride(self):
+        """ Test that permissions are not cached during auth.override """
+
+        auth = current.auth
+        auth.override = True
+        try:
+            self.assertEqual(S3MenuCache.permissions(), None)
+        finally:
+            auth.override = False
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         SelectTests,
+        MenuCacheTests,
     )
 
 # END ========================================================================
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# S3PDF Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3pdf.py
+#
+import unittest
+
+from gluon import *
+from s3.s3pdf import S3OCRImageParser
+
+from unit_tests import run_suite
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+
+# =============================================================================
+class S3OCRImageParserTests(unittest.TestCase):
+    """ Tests for the OCR image pipeline (binarisation, markers, orientation) """
+
+    # Marker positions (lower left corners) on an A4 OCR form, in points,
+    # as rendered by S3OCRLayout
+    MARKERS = ((10, 10), (576, 10), (10, 822), (293, 10),
+               (10, 416), (576, 822), (576, 416))
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if Image is None:
+            self.skipTest("PIL not installed")
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy not installed")
+
+        # Instantiate without request (only the image methods are tested)
+        parser = S3OCRImageParser.__new__(S3OCRImageParser)
+
+        self.binary = parser._S3OCRImageParser__convertImage2binary
+        self.regions = parser._S3OCRImageParser__findRegions
+        self.markers = parser._S3OCRImageParser__getMarkers
+        self.orientation = parser._S3OCRImageParser__getOrientation
+
+    # -------------------------------------------------------------------------
+    def page(self, dpi=150, angle=0):
+        """
+            Render a synthetic scanned form page
+
+            @param dpi: the scan resolution
+            @param angle: the skew angle of the scan (degrees)
+        """
+
+        scale = dpi / 72.0
+        width, height = int(596 * scale), int(842 * scale)
+
+        image = Image.new("RGB", (width, height), (255, 255, 255))
+        draw = ImageDraw.Draw(image)
+
+        # Markers (reportlab coordinates are from the bottom)
+        for x, y in self.MARKERS:
+            x0, y0 = x * scale, (842 - y - 10) * scale
+            draw.rectangle([x0, y0, x0 + 10 * scale, y0 + 10 * scale],
+                           fill = (0, 0, 0),
+                           )
+
+        # Some text and boxes in grey and black
+        for i in range(40):
+            x, y = 60 + (i % 4) * 120, 60 + (i // 4) * 60
+            draw.text((x * scale, y * scale), "Field %s" % i, fill=(90, 90, 90))
+            draw.rectangle([x * scale, (y + 15) * scale,
+                            (x + 15) * scale, (y + 30) * scale],
+                           outline = (0, 0, 0),
+                           )
+
+        if angle:
+            image = image.rotate(angle, fillcolor=(255, 255, 255))
+        return image
+
+    # -------------------------------------------------------------------------
+    def testBinary(self):
+        """ Test binarisation of a scanned page """
+
+        image = Image.new("RGB", (4, 1))
+        image.putdata([(0, 0, 0), (179, 179, 179), (180, 180, 180), (255, 255, 255)])
+
+        binary = self.binary(image)
+        self.assertEqual(binary.mode, "L")
+        self.assertEqual(list(binary.getdata()), [0, 0, 255, 255])
+
+    # -------------------------------------------------------------------------
+    def testRegions(self):
+        """ Test detection of connected regions """
+
+        image = Image.new("L", (20, 10), 255)
+        draw = ImageDraw.Draw(image)
+
+        # A comb shape (joined only at the bottom) and a separate dot
+        for x in (1, 3, 5, 7):
+            draw.line([x, 0, x, 8], fill=0)
+        draw.line([1, 8, 7, 8], fill=0)
+        draw.point((15, 5), fill=0)
+
+        regions = sorted(self.regions(image), key=lambda r: r.area)
+        self.assertEqual(len(regions), 2)
+
+        dot, comb = regions
+        self.assertEqual(dot.area, 1)
+        self.assertEqual(dot.box(), [(15, 5), (15, 5)])
+        self.assertEqual(comb.area, 4 * 9 + 3)
+        self.assertEqual(comb.box(), [(1, 0), (7, 8)])
+
+        # Diagonal neighbours are not connected
+        image = Image.new("L", (3, 3), 255)
+        image.putpixel((0, 0), 0)
+        image.putpixel((1, 1), 0)
+        self.assertEqual(len(self.regions(image)), 2)
+
+        # Blank page
+        image = Image.new("L", (3, 3), 255)
+        self.assertEqual(self.regions(image), [])
+
+    # -------------------------------------------------------------------------
+    def testMarkers(self):
+        """ Test detection of the form markers """
+
+        dpi = 150
+        scale = dpi / 72.0
+
+        markers = self.markers(self.binary(self.page(dpi=dpi)))
+        self.assertEqual(len(markers), 7)
+
+        # Marker centers in image coordinates
+        expected = sorted(((x + 5) * scale, (842 - y - 5) * scale)
+                          for x, y in self.MARKERS)
+        for (x, y), (ex, ey) in zip(sorted(markers), expected):
+            self.assertTrue(abs(x - ex) <= 1)
+            self.assertTrue(abs(y - ey) <= 1)
+
+        # Top left marker first
+        x, y = markers[0]
+        self.assertTrue(abs(x - 15 * scale) <= 1)
+        self.assertTrue(abs(y - 15 * scale) <= 1)
+
+    # -------------------------------------------------------------------------
+    def testOrientation(self):
+        """ Test detection of the page orientation """
+
+        orientation = self.orientation
+
+        markers = self.markers(self.binary(self.page()))
+        self.assertEqual(orientation(markers), 0)
+
+        for angle in (1.5, -0.7):
+            markers = self.markers(self.binary(self.page(angle=angle)))
+            self.assertTrue(abs(orientation(markers) + angle) < 0.2)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        S3OCRImageParserTests,
+    )
+
+# END ========================================================================
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# S3PDFCard Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3pdfcard.py
+#
+import os
+import time
+import unittest
+
+from gluon import *
+from s3.codecs.card import PDFMERGE, REPORTLAB, S3PDFCard, S3PDFCardLayout, S3PDFCardTemplate
+
+from unit_tests import run_suite
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        PdfReader = None
+
+# =============================================================================
+class LabelCardLayout(S3PDFCardLayout):
+    """ Single-sided test layout, renders the item label """
+
+    doublesided = False
+
+    def draw(self):
+
+        self.canv.drawString(10, 10, self.item["label"])
+
+# =============================================================================
+class S3PDFCardRenderTests(unittest.TestCase):
+    """ Tests for parallel rendering of PDF cards """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if not REPORTLAB:
+            self.skipTest("ReportLab not installed")
+        if not PDFMERGE or PdfReader is None:
+            self.skipTest("pypdf not installed")
+        if not hasattr(os, "fork"):
+            self.skipTest("Parallel rendering requires os.fork")
+
+        self.items = [{"label": "Card %03d" % i} for i in range(25)]
+
+    # -------------------------------------------------------------------------
+    def pages(self, output):
+        """
+            Get the text of all pages of a PDF document
+
+            @param output: the PDF document (BytesIO)
+        """
+
+        reader = PdfReader(output)
+        return [page.extract_text().strip() for page in reader.pages]
+
+    # -------------------------------------------------------------------------
+    def render(self, workers):
+        """
+            Render the test items with render_parallel
+
+            @param workers: the number of worker processes
+        """
+
+        cardsize = LabelCardLayout.cardsize
+        doc = S3PDFCardTemplate(cardsize, cardsize, title="Test Cards")
+
+        return S3PDFCard().render_parallel(doc,
+                                           LabelCardLayout,
+                                           None,
+                                           self.items,
+                                           workers = workers,
+                                           )
+
+    # -------------------------------------------------------------------------
+    def testPageOrder(self):
+        """ Test that the merged PDF has the pages in the order of the items """
+
+        expected = [item["label"] for item in self.items]
+
+        pages = self.pages(self.render(workers=3))
+        self.assertEqual(pages, expected)
+
+        # Same result as in-process rendering
+        output = S3PDFCard().encode(self.items,
+                                    layout = LabelCardLayout,
+                                    workers = 1,
+                                    )
+        self.assertEqual(self.pages(output), expected)
+
+    # -------------------------------------------------------------------------
+    def testSingleWorker(self):
+        """ Test parallel rendering with a single worker process """
+
+        pages = self.pages(self.render(workers=1))
+        self.assertEqual(pages, [item["label"] for item in self.items])
+
+    # -------------------------------------------------------------------------
+    def testTitle(self):
+        """ Test that the merged PDF retains the document title """
+
+        reader = PdfReader(self.render(workers=2))
+        self.assertEqual(reader.metadata.title, "Test Cards")
+
+# =============================================================================
+class S3PDFCardCacheTests(unittest.TestCase):
+    """ Tests for the card image cache """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        if not REPORTLAB:
+            self.skipTest("ReportLab not installed")
+
+        folder = S3PDFCardLayout.cache_folder()
+        if not folder:
+            self.skipTest("Card image cache folder not writable")
+        self.folder = folder
+        self.paths = []
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    # -------------------------------------------------------------------------
+    def add(self, name, age=0):
+        """
+            Add a file to the cache folder
+
+            @param name: the file name
+            @param age: the age of the file (in days)
+        """
+
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as cached:
+            cached.write(b"test")
+        if age:
+            mtime = time.time() - age * 86400
+            os.utime(path, (mtime, mtime))
+        self.paths.append(path)
+        return path
+
+    # -------------------------------------------------------------------------
+    def testCacheExpiry(self):
+        """ Test that cached images expire after the given number of days """
+
+        expired = self.add("img_test_expired.jpg", age=30)
+        recent = self.add("img_test_recent.jpg", age=3)
+
+        self.assertTrue(S3PDFCardLayout.cache_cleanup(days=28) >= 1)
+        self.assertFalse(os.path.exists(expired))
+        self.assertTrue(os.path.exists(recent))
+
+        self.assertTrue(S3PDFCardLayout.cache_cleanup(days=1) >= 1)
+        self.assertFalse(os.path.exists(recent))
+
+    # -------------------------------------------------------------------------
+    def testImageResolution(self):
+        """ Test that QR codes are only cached if the layout opts in """
+
+        try:
+            from PIL import Image
+        except ImportError:
+            self.skipTest("PIL not installed")
+
+        # Default: vector QR codes, no cached images
+        layout = S3PDFCardLayout(None, {})
+        self.assertEqual(layout.image_resolution, None)
+        self.assertEqual(layout.qrcode_image("TEST", 60, key="test"), None)
+
+        # Opt-in: cached bitmap, re-used for re-prints
+        class CachingLayout(S3PDFCardLayout):
+            image_resolution = 150
+
+        layout = CachingLayout(None, {})
+        path = layout.qrcode_image("TEST", 60, key="test")
+        self.assertNotEqual(path, None)
+        self.paths.append(path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(layout.qrcode_image("TEST", 60, key="test"), path)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        S3PDFCardRenderTests,
+        S3PDFCardCacheTests,
+    )
+
+# END ========================================================================
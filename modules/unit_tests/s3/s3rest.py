@@ -9,6 +9,8 @@ import unittest
 from gluon import *
 from gluon.storage import Storage
 
+from s3.s3export import S3ExportJob
+from s3.s3query import FS
 from s3.s3rest import S3Request
 from s3compat import StringIO
 
@@ -484,12 +486,143 @@ class URLBuilderTests(unittest.TestCase):
         self.assertEqual(r.url(method="deduplicate", target=0, vars={}),
                          "/%s/pr/person/deduplicate.xml" % a)
 
+# =============================================================================
+class ExportJobTests(unittest.TestCase):
+    """ Tests for the request snapshot of background export jobs """
+
+    # -------------------------------------------------------------------------
+    def testSnapshotVars(self):
+        """ Test snapshot of URL and prep filters """
+
+        assertEqual = self.assertEqual
+
+        r = S3Request(prefix = "org",
+                      name = "organisation",
+                      extension = "xls",
+                      http = "GET",
+                      get_vars = {"~.name__like": "Red*",
+                                  "export_job": "1",
+                                  },
+                      )
+
+        # Filter added during prep
+        r.resource.add_filter(FS("acronym") == "RC")
+
+        get_vars = S3ExportJob.snapshot_vars(r)
+        assertEqual(get_vars.get("~.name__like"), "Red*")
+        assertEqual(get_vars.get("~.acronym"), "RC")
+        self.assertNotIn("export_job", get_vars)
+
+    # -------------------------------------------------------------------------
+    def testSnapshotMergeFilters(self):
+        """ Test that prep filters are combined with URL filters of the same key """
+
+        assertEqual = self.assertEqual
+
+        r = S3Request(prefix = "org",
+                      name = "organisation",
+                      extension = "xls",
+                      http = "GET",
+                      get_vars = {"~.name__like": "Red*"},
+                      )
+
+        # Filters with the same key added during prep
+        r.resource.add_filter((FS("name").like("*Cross")) &
+                              (FS("name").like("*Red*")))
+
+        get_vars = S3ExportJob.snapshot_vars(r)
+        assertEqual(get_vars.get("~.name__like"), ["Red*", "*Cross", "*Red*"])
+
+        # Re-constructed request must apply all filters
+        resource = current.s3db.resource("org_organisation", vars=get_vars)
+        rfilter = resource.rfilter
+        assertEqual(len(rfilter.filters), 1)
+        url_vars = S3ExportJob.serialize_filters(resource, rfilter.filters)
+        assertEqual(sorted(url_vars), [("~.name__like", "*Cross"),
+                                       ("~.name__like", "*Red*"),
+                                       ("~.name__like", "Red*"),
+                                       ])
+
+    # -------------------------------------------------------------------------
+    def testSnapshotORFilter(self):
+        """ Test that prep filters which can not be serialized prevent a snapshot """
+
+        assertEqual = self.assertEqual
+
+        def snapshot(query):
+            r = S3Request(prefix = "org",
+                          name = "organisation",
+                          extension = "xls",
+                          http = "GET",
+                          get_vars = {},
+                          )
+            r.resource.add_filter(query)
+            return S3ExportJob.snapshot_vars(r)
+
+        # OR over two fields with different operators
+        query = (FS("name").like("Red*")) | (FS("acronym") == "RC")
+        assertEqual(snapshot(query), None)
+
+        # Same, as part of an AND
+        query = (FS("name").like("*Cross")) & \
+                ((FS("name").like("Red*")) | (FS("acronym") == None))
+        assertEqual(snapshot(query), None)
+
+        # Comparison of two fields
+        assertEqual(snapshot(FS("name") == FS("acronym")), None)
+
+        # OR over two fields with the same operator and value
+        get_vars = snapshot((FS("name") == "RC") | (FS("acronym") == "RC"))
+        self.assertNotEqual(get_vars, None)
+        assertEqual([get_vars[key] for key in get_vars if "|" in key], ["RC"])
+
+    # -------------------------------------------------------------------------
+    def testSnapshotDALFilter(self):
+        """ Test that DAL filters prevent a snapshot """
+
+        r = S3Request(prefix = "org",
+                      name = "organisation",
+                      extension = "xls",
+                      http = "GET",
+                      get_vars = {},
+                      )
+
+        table = r.resource.table
+        r.resource.add_filter(table.acronym == "RC")
+
+        self.assertEqual(S3ExportJob.snapshot_vars(r), None)
+
+    # -------------------------------------------------------------------------
+    def testApplicable(self):
+        """ Test which requests can be run as export jobs """
+
+        assertFalse = self.assertFalse
+
+        # Interactive request
+        r = S3Request(prefix = "org",
+                      name = "organisation",
+                      extension = "html",
+                      http = "GET",
+                      get_vars = {"export_job": "1"},
+                      )
+        assertFalse(S3ExportJob.applicable(r))
+
+        # Export explicitly requested inside the request
+        r = S3Request(prefix = "org",
+                      name = "organisation",
+                      extension = "xls",
+                      http = "GET",
+                      get_vars = {"export_job": "0"},
+                      )
+        assertFalse(S3ExportJob.applicable(r))
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         POSTFilterTests,
         URLBuilderTests,
+        ExportJobTests,
     )
 
 # END ========================================================================
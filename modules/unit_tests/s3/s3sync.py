@@ -5,15 +5,17 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3sync.py
 #
+import datetime
 import json
 import unittest
 
 from gluon import current
+from gluon.storage import Storage
 from lxml import etree
 
 from unit_tests import run_suite
 
-from s3 import S3SyncDataArchive
+from s3 import S3SyncDataArchive, S3SyncRepository
 from s3compat import PY2
 
 # =============================================================================
@@ -463,6 +465,420 @@ class DataArchiveTests(unittest.TestCase):
         extracted = archive.extract("test2.xml").read()
         assertEqual(extracted, xmlstr2)
 
+# =============================================================================
+class PagedPullTests(unittest.TestCase):
+    """ Tests for paged pulls with the Eden adapter """
+
+    # Cursors of the stub peer, with the date/time of the first page
+    SNAPSHOT = datetime.datetime(2020, 1, 1, 12, 0, 0)
+    C1 = "2020-01-01T12:00:00|2020-01-01T11:00:00|2"
+    C2 = "2020-01-01T12:00:00|2020-01-01T11:30:00|4"
+
+    # Pages of the stub peer: cursor => (page number, next cursor)
+    PAGES = {"": (1, C1),
+             C1: (2, C2),
+             C2: (3, None),
+             }
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        try:
+            from http.server import HTTPServer, BaseHTTPRequestHandler
+        except ImportError:
+            # Python 2
+            from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        import threading
+        import zlib
+
+        from s3compat import urlparse
+
+        pages = cls.PAGES
+        requests = cls.requests = []
+        failures = cls.failures = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Local stand-in for a peer repository """
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = urlparse.parse_qs(urlparse.urlparse(self.path).query,
+                                          keep_blank_values = True,
+                                          )
+                cursor = query.get("mcursor", [None])[0]
+                requests.append(cursor)
+
+                headers = {}
+                if cursor in failures:
+                    failures.discard(cursor)
+                    status, body = 503, b"Service Unavailable"
+                elif cursor not in pages:
+                    status, body = 400, b"Invalid cursor"
+                else:
+                    status = 200
+                    number, next_cursor = pages[cursor]
+                    body = b"".join(
+                        b"""<resource name="org_organisation" uuid="TESTPAGEDPULL%d">
+<data field="name">TestPagedPull%d</data>
+</resource>""" % (i, i) for i in (2 * number - 1, 2 * number))
+                    body = b"<s3xml>%s</s3xml>" % body
+                    if next_cursor:
+                        headers["X-Sync-Cursor"] = next_cursor
+                    if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                        compressor = zlib.compressobj(6,
+                                                      zlib.DEFLATED,
+                                                      16 + zlib.MAX_WBITS,
+                                                      )
+                        body = compressor.compress(body) + compressor.flush()
+                        headers["Content-Encoding"] = "gzip"
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = cls.server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        cls.url = "http://127.0.0.1:%s" % server.server_port
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        s3db = current.s3db
+
+        # Pulls commit page by page, so these are cleaned up explicitly
+        rtable = s3db.sync_repository
+        self.repository_id = rtable.insert(name = "PagedPullTestPeer",
+                                           url = self.url,
+                                           apitype = "eden",
+                                           )
+        ttable = s3db.sync_task
+        self.task_id = ttable.insert(repository_id = self.repository_id,
+                                     resource_name = "org_organisation",
+                                     mode = 1,
+                                     )
+
+        del self.requests[:]
+        self.failures.clear()
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        db = current.db
+        s3db = current.s3db
+
+        otable = s3db.org_organisation
+        db(otable.uuid.like("TESTPAGEDPULL%")).delete()
+        db(s3db.sync_log.repository_id == self.repository_id).delete()
+        db(s3db.sync_task.id == self.task_id).delete()
+        db(s3db.sync_repository.id == self.repository_id).delete()
+        db.commit()
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def pull(self):
+        """ Pull from the stub peer, return the error and the task """
+
+        db = current.db
+        s3db = current.s3db
+
+        rtable = s3db.sync_repository
+        repository = db(rtable.id == self.repository_id).select(limitby = (0, 1),
+                                                                ).first()
+        ttable = s3db.sync_task
+        task = db(ttable.id == self.task_id).select(limitby = (0, 1),
+                                                    ).first()
+
+        error, mtime = S3SyncRepository(repository).pull(task)
+
+        task = db(ttable.id == self.task_id).select(limitby = (0, 1),
+                                                    ).first()
+        return error, task
+
+    # -------------------------------------------------------------------------
+    def imported(self):
+        """ Get the names of the imported records """
+
+        table = current.s3db.org_organisation
+        query = table.uuid.like("TESTPAGEDPULL%")
+        rows = current.db(query).select(table.name, orderby=table.name)
+        return [row.name for row in rows]
+
+    # -------------------------------------------------------------------------
+    def testPagedPull(self):
+        """ Test page-by-page import """
+
+        assertEqual = self.assertEqual
+
+        error, task = self.pull()
+        assertEqual(error, None)
+        assertEqual(self.requests, ["", self.C1, self.C2])
+        assertEqual(task.pull_cursor, None)
+        assertEqual(self.imported(),
+                    ["TestPagedPull%s" % i for i in range(1, 7)])
+
+        # Next pull continues from the first page
+        assertEqual(task.last_pull, self.SNAPSHOT)
+
+    # -------------------------------------------------------------------------
+    def testResume(self):
+        """ Test resumption of an interrupted pull after the last good page """
+
+        assertEqual = self.assertEqual
+
+        # Third page fails
+        self.failures.add(self.C2)
+        error, task = self.pull()
+        self.assertNotEqual(error, None)
+        assertEqual(self.requests, ["", self.C1, self.C2])
+
+        # First two pages committed and checkpointed
+        assertEqual(task.pull_cursor, self.C2)
+        assertEqual(task.last_pull, None)
+        assertEqual(self.imported(),
+                    ["TestPagedPull%s" % i for i in range(1, 5)])
+
+        # Resume with the third page
+        del self.requests[:]
+        error, task = self.pull()
+        assertEqual(error, None)
+        assertEqual(self.requests, [self.C2])
+        assertEqual(task.pull_cursor, None)
+        assertEqual(task.last_pull, self.SNAPSHOT)
+        assertEqual(self.imported(),
+                    ["TestPagedPull%s" % i for i in range(1, 7)])
+
+# =============================================================================
+class PagedSendTests(unittest.TestCase):
+    """ Tests for paged responses to pulls with the Eden adapter """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.page_size = settings.sync.get("page_size")
+        settings.sync.page_size = 2
+
+        # Records with identical modified_on are ordered by id
+        table = current.s3db.org_organisation
+        self.uids = ["TESTPAGEDSEND%s" % i for i in range(1, 6)]
+        for uid in self.uids:
+            table.insert(uuid = uid, name = uid)
+
+        repository = Storage(id = None,
+                             name = "unknown",
+                             apitype = "eden",
+                             )
+        self.connector = S3SyncRepository(repository)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        settings = current.deployment_settings
+        if self.page_size is None:
+            settings.sync.pop("page_size", None)
+        else:
+            settings.sync.page_size = self.page_size
+
+        response = current.response
+        response.headers.pop("X-Sync-Cursor", None)
+        response.headers.pop("Content-Encoding", None)
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testPagedSend(self):
+        """ Test paging through a resource by cursor """
+
+        self.assertEqual(self.pull(),
+                         [self.uids[0:2], self.uids[2:4], self.uids[4:]])
+
+    # -------------------------------------------------------------------------
+    def pull(self, msince=None, cursor=""):
+        """
+            Page through the test records like a peer
+
+            @param msince: minimum modification date/time of the records
+            @param cursor: the cursor to start from
+
+            @return: list of pages (lists of UUIDs)
+        """
+
+        pages = []
+        while cursor is not None:
+            page, cursor = self.page(cursor, msince=msince)
+            pages.append(page)
+        return pages
+
+    # -------------------------------------------------------------------------
+    def page(self, cursor, msince=None):
+        """
+            Request a single page like a peer
+
+            @param cursor: the cursor
+            @param msince: minimum modification date/time of the records
+
+            @return: tuple (UUIDs, cursor for the next page)
+        """
+
+        headers = current.response.headers
+        headers.pop("X-Sync-Cursor", None)
+
+        resource = current.s3db.resource("org_organisation",
+                                         uid = self.uids,
+                                         )
+        result = self.connector.send(resource,
+                                     msince = msince,
+                                     cursor = cursor,
+                                     )
+        tree = etree.fromstring(result["response"])
+        return ([element.get("uuid") for element in tree.findall("resource")],
+                headers.get("X-Sync-Cursor"),
+                )
+
+    # -------------------------------------------------------------------------
+    def testExactPages(self):
+        """ Test that a full last page ends the pull """
+
+        current.db(current.s3db.org_organisation.uuid == self.uids[4]).delete()
+
+        self.assertEqual(self.pull(), [self.uids[0:2], self.uids[2:4]])
+
+    # -------------------------------------------------------------------------
+    def testIncrementalSend(self):
+        """ Test paging through the records modified since a date/time """
+
+        db = current.db
+        s3db = current.s3db
+
+        now = current.request.utcnow
+        msince = now - datetime.timedelta(hours=1)
+
+        # Unchanged records
+        table = s3db.org_organisation
+        old = now - datetime.timedelta(days=2)
+        db(table.uuid.belongs(self.uids[0:2] + self.uids[3:4])).update(
+                                                        modified_on = old,
+                                                        )
+
+        # Only the master record decides
+        query = table.uuid.belongs(self.uids) & \
+                self.connector._after_query(table, msince, 0)
+        rows = db(query).select(table.uuid, orderby=table.id)
+        self.assertEqual([row.uuid for row in rows],
+                         [self.uids[2], self.uids[4]])
+
+        # Unchanged record with a changed component
+        organisation = db(table.uuid == self.uids[0]).select(table.id,
+                                                             limitby = (0, 1),
+                                                             ).first()
+        s3db.org_organisation_tag.insert(organisation_id = organisation.id,
+                                         tag = "TESTPAGEDSEND",
+                                         value = "changed",
+                                         )
+
+        pages = self.pull(msince=msince)
+        self.assertEqual(pages, [[self.uids[0], self.uids[2]], [self.uids[4]]])
+
+    # -------------------------------------------------------------------------
+    def testComponentUpdateBetweenPages(self):
+        """
+            Test that component updates during a paged pull are sent
+            with the next pull from the snapshot
+        """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        # Unchanged records
+        now = current.request.utcnow
+        table = s3db.org_organisation
+        db(table.uuid.belongs(self.uids)).update(
+                        modified_on = now - datetime.timedelta(days=1),
+                        )
+
+        page, cursor = self.page("")
+        assertEqual(page, self.uids[0:2])
+        snapshot = self.connector._parse_cursor(cursor)[0]
+        assertEqual(snapshot, now)
+
+        # Component of a sent record updated before the next page
+        organisation = db(table.uuid == self.uids[0]).select(table.id,
+                                                             limitby = (0, 1),
+                                                             ).first()
+        s3db.org_organisation_tag.insert(organisation_id = organisation.id,
+                                         tag = "TESTPAGEDSEND",
+                                         value = "changed",
+                                         modified_on = snapshot + \
+                                                datetime.timedelta(seconds=1),
+                                         )
+
+        # Remaining pages carry the same snapshot
+        pages = []
+        while cursor is not None:
+            page, cursor = self.page(cursor)
+            pages.append(page)
+            if cursor:
+                assertEqual(self.connector._parse_cursor(cursor)[0], snapshot)
+        assertEqual(pages, [self.uids[2:4], self.uids[4:]])
+
+        # Next pull from the snapshot
+        assertEqual(self.pull(msince=snapshot), [[self.uids[0]]])
+
+    # -------------------------------------------------------------------------
+    def testNullModifiedOn(self):
+        """ Test that records without modified_on are sent first, once """
+
+        table = current.s3db.org_organisation
+        current.db(table.uuid.belongs((self.uids[1], self.uids[3]))).update(
+                                                        modified_on = None,
+                                                        )
+
+        uids = self.uids
+        self.assertEqual(self.pull(), [[uids[1], uids[3]],
+                                       [uids[0], uids[2]],
+                                       [uids[4]],
+                                       ])
+
+    # -------------------------------------------------------------------------
+    def testUnpagedSend(self):
+        """ Test that pulls without cursor are not paged """
+
+        headers = current.response.headers
+
+        resource = current.s3db.resource("org_organisation",
+                                         uid = self.uids,
+                                         )
+        result = self.connector.send(resource)
+        tree = etree.fromstring(result["response"])
+        self.assertEqual(len(tree.findall("resource")), 5)
+        self.assertFalse("X-Sync-Cursor" in headers)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -474,6 +890,8 @@ if __name__ == "__main__":
         ImportMergeWithExistingDuplicate,
         ImportMergeWithoutExistingRecords,
         DataArchiveTests,
+        PagedPullTests,
+        PagedSendTests,
         )
 
 # END ========================================================================
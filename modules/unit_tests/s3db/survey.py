@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Survey Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3db/survey.py
+#
+import datetime
+import unittest
+
+from gluon import *
+from unit_tests import run_suite
+
+from s3db.survey import survey_SeriesAnalysis
+
+# =============================================================================
+class SurveySeriesAnalysisTests(unittest.TestCase):
+    """ Tests for the columnar survey series analysis """
+
+    # -------------------------------------------------------------------------
+    def testNumericStatistics(self):
+        """ Test statistics for numeric questions """
+
+        stats = survey_SeriesAnalysis.statistics("Numeric",
+                                                 ["1", "2.5", None, "x", "4"])
+        self.assertEqual(stats["replies"], 5)
+        self.assertEqual(stats["valid"], 3)
+        self.assertEqual(stats["sum"], 7.5)
+        self.assertEqual(stats["average"], 2.5)
+        self.assertEqual(stats["max"], 4.0)
+        self.assertEqual(stats["min"], 1.0)
+
+        stats = survey_SeriesAnalysis.statistics("Numeric", [])
+        self.assertEqual(stats["replies"], 0)
+        self.assertEqual(stats["valid"], 0)
+        self.assertEqual(stats["sum"], None)
+
+    # -------------------------------------------------------------------------
+    def testOptionStatistics(self):
+        """ Test statistics for option questions """
+
+        stats = survey_SeriesAnalysis.statistics("YesNo",
+                                                 ["Yes", "No", "Yes", None])
+        self.assertEqual(stats["replies"], 4)
+        self.assertEqual(stats["valid"], 3)
+        self.assertEqual(stats["counts"], {"Yes": 2, "No": 1})
+
+        stats = survey_SeriesAnalysis.statistics("MultiOption",
+                                                 ['["a", "b"]', "a,c", ""])
+        self.assertEqual(stats["valid"], 3)
+        self.assertEqual(stats["counts"], {"a": 2, "b": 1, "c": 1})
+
+    # -------------------------------------------------------------------------
+    def testSummary(self):
+        """ Test the summary table for numeric and multi-option questions """
+
+        analysis = survey_SeriesAnalysis(None)
+        analysis.metadata = lambda question_id: {}
+
+        def summary(stats):
+            analysis.stats = lambda question_id: stats
+            table = analysis.summary(1)
+            return [(str(row[0][0][0]), str(row[1][0])) for row in table]
+
+        # Zero values are included
+        stats = survey_SeriesAnalysis.statistics("Numeric", ["0", "0"])
+        rows = dict(summary(stats))
+        self.assertEqual(rows["Total"], "0")
+        self.assertEqual(rows["Average"], "0")
+        self.assertEqual(rows["Maximum"], "0")
+        self.assertEqual(rows["Minimum"], "0")
+
+        # ...but not missing values
+        stats = survey_SeriesAnalysis.statistics("Numeric", [])
+        self.assertFalse("Total" in dict(summary(stats)))
+
+        # Percentages with one decimal place
+        stats = survey_SeriesAnalysis.statistics("MultiOption",
+                                                 ['["a", "b"]', "b", "c"])
+        rows = dict(summary(stats))
+        self.assertEqual(rows["a"], "33.3%")
+        self.assertEqual(rows["b"], "66.7%")
+
+    # -------------------------------------------------------------------------
+    def testGroupedSum(self):
+        """ Test grouping of numeric answers by another question """
+
+        analysis = survey_SeriesAnalysis(None)
+        analysis._columns = {1: ([1, 2, 3], [10, 11, 12], ["5", "x", "7"]),
+                             2: ([4, 5, 6, 7], [10, 11, 12, 13], ["A", "B", "A", "C"]),
+                             }
+
+        groups, totals = analysis.grouped_sum(1, 2)
+        self.assertEqual(dict(zip(groups, totals)), {"A": 12.0, "B": 0, "C": 0})
+
+    # -------------------------------------------------------------------------
+    def testVersion(self):
+        """ Test that the cache version changes with answers """
+
+        db = current.db
+        s3db = current.s3db
+
+        assertNotEqual = self.assertNotEqual
+
+        current.auth.override = True
+        try:
+            series_id = s3db.survey_series.insert(name = "TestSeriesVersion")
+            complete_id = s3db.survey_complete.insert(series_id = series_id)
+            atable = s3db.survey_answer
+            answer_id = atable.insert(complete_id = complete_id,
+                                      value = "1",
+                                      )
+
+            analysis = survey_SeriesAnalysis(series_id)
+            version = analysis.version
+
+            # Answer edited without touching its complete
+            modified_on = current.request.utcnow + datetime.timedelta(minutes=1)
+            db(atable.id == answer_id).update(value = "2",
+                                              modified_on = modified_on,
+                                              )
+            assertNotEqual(analysis.version, version)
+            version = analysis.version
+
+            # Answer removed
+            db(atable.id == answer_id).delete()
+            assertNotEqual(analysis.version, version)
+        finally:
+            db.rollback()
+            current.auth.override = False
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        SurveySeriesAnalysisTests,
+    )
+
+# END ========================================================================
@@ -9,31 +9,23 @@
 #
 # - normally run from fabfile.py as part of the upgrade cycle for instances
 #
+# - creates the indexes declared by the models (s3db.configure(tablename, indexes=...)),
+#   and reports the indexes recommended by the index advisor if enabled with:
+#   settings.database.index_advisor = True
+#
+
+# Indexes declared by the models
+for tablename, fieldnames, status in s3base.S3Indexes(db).update():
+    print("%-10s %s (%s)" % (status, tablename, ", ".join(fieldnames)))
 
-tablename = "pr_person"
-field = "first_name"
-try:
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
-except:
-    # Index already present
-    pass
-field = "middle_name"
-try:
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
-except:
-    # Index already present
-    pass
-field = "last_name"
-try:
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
-except:
-    # Index already present
-    pass
+# Recommendations from the index advisor
+if settings.get_database_index_advisor():
+    recommendations = s3base.S3IndexAdvisor.recommend(db=db)
+    if recommendations:
+        print("\nRecommended indexes (number of queries):")
+        for recommendation in recommendations:
+            print("%(sql)s -- %(count)s" % recommendation)
+    else:
+        print("\nNo indexes recommended")
 
-tablename = "gis_location"
-field = "name"
-try:
-    db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
-except:
-    # Index already present
-    pass
+db.commit()
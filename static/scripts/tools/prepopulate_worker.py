@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Prepopulate worker process for parallel import of tasks.cfg
+# (started by S3BulkImportScheduler, reads import tasks from stdin)
+#
+# Needs to be run in the web2py environment
+# python web2py.py -S eden -M -R applications/eden/static/scripts/tools/prepopulate_worker.py
+
+import sys
+
+from s3 import S3BulkImporter, S3BulkImportScheduler
+
+# Same environment as in zzz_1st_run
+auth.override = True
+gis.disable_update_location_tree = True
+settings.pr.import_update_requires_email = False
+s3db.configure("auth_user",
+               onaccept = lambda form: auth.s3_approve_user(form.vars),
+               )
+s3.asset_import = True
+if not request.env.request_method:
+    request.env.request_method = "GET"
+
+# Route any diagnostic output away from the result stream
+output = sys.stdout
+sys.stdout = sys.stderr
+
+S3BulkImportScheduler.serve(S3BulkImporter(), output=output)
+
+db.commit()
+
+# END =========================================================================